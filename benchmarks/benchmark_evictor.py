@@ -0,0 +1,111 @@
+"""Benchmark the block evictor used by automatic prefix caching."""
+import argparse
+import random
+import time
+
+from vllm.block import PhysicalTokenBlock
+from vllm.core.evictor import EvictionPolicy, make_evictor
+from vllm.utils import Device
+
+
+def main(args: argparse.Namespace):
+    print(args)
+    random.seed(args.seed)
+
+    evictor = make_evictor(EvictionPolicy[args.eviction_policy])
+    now = 0.0
+
+    def make_block(block_hash: int) -> PhysicalTokenBlock:
+        block = PhysicalTokenBlock(device=Device.GPU,
+                                   block_number=block_hash,
+                                   block_size=args.block_size,
+                                   block_hash=block_hash,
+                                   num_hashed_tokens=args.block_size *
+                                   random.randint(1, 64))
+        block.last_accessed = now
+        return block
+
+    # Fill the pool with freed blocks, as after a burst of finished requests.
+    start_time = time.perf_counter()
+    for block_hash in range(args.num_blocks):
+        evictor.add(make_block(block_hash))
+        if block_hash % args.blocks_per_step == 0:
+            now += 1.0
+    elapsed = time.perf_counter() - start_time
+    print(f"Filled {args.num_blocks} blocks in {elapsed:.3f} s "
+          f"({elapsed / args.num_blocks * 1e6:.3f} us/add)")
+
+    # Mix of the operations the block allocator issues under prefix caching:
+    # evict for new blocks, remove on prefix cache hits, and add when the
+    # blocks are freed again with a newer access time.
+    free_hashes = list(range(args.num_blocks))
+    next_hash = args.num_blocks
+    latencies = {"add": 0.0, "remove": 0.0, "evict": 0.0}
+    counts = {"add": 0, "remove": 0, "evict": 0}
+    in_use = []
+    for i in range(args.num_ops):
+        if i % args.blocks_per_step == 0:
+            now += 1.0
+        op = random.random()
+        if op < args.hit_rate and free_hashes:
+            idx = random.randrange(len(free_hashes))
+            free_hashes[idx], free_hashes[-1] = (free_hashes[-1],
+                                                 free_hashes[idx])
+            block_hash = free_hashes.pop()
+            if block_hash not in evictor:
+                continue
+            start_time = time.perf_counter()
+            block = evictor.remove(block_hash)
+            latencies["remove"] += time.perf_counter() - start_time
+            counts["remove"] += 1
+            in_use.append(block)
+        elif op < 0.5 + args.hit_rate / 2 or not in_use:
+            start_time = time.perf_counter()
+            block = evictor.evict()
+            latencies["evict"] += time.perf_counter() - start_time
+            counts["evict"] += 1
+            block.block_hash = next_hash
+            next_hash += 1
+            in_use.append(block)
+        else:
+            idx = random.randrange(len(in_use))
+            in_use[idx], in_use[-1] = in_use[-1], in_use[idx]
+            block = in_use.pop()
+            block.last_accessed = now
+            start_time = time.perf_counter()
+            evictor.add(block)
+            latencies["add"] += time.perf_counter() - start_time
+            counts["add"] += 1
+            free_hashes.append(block.block_hash)
+
+    for op, latency in latencies.items():
+        if counts[op] == 0:
+            continue
+        print(f"{op:>6}: {counts[op]:>8} ops, "
+              f"{latency / counts[op] * 1e6:.3f} us/op")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the evictor of the prefix caching block "
+        "allocator.")
+    parser.add_argument("--eviction-policy",
+                        type=str,
+                        choices=[policy.name for policy in EvictionPolicy],
+                        default="LRU")
+    parser.add_argument("--num-blocks", type=int, default=1_000_000)
+    parser.add_argument("--num-ops", type=int, default=1_000_000)
+    parser.add_argument("--block-size", type=int, default=16)
+    parser.add_argument("--blocks-per-step",
+                        type=int,
+                        default=256,
+                        help="Number of operations that share the same "
+                        "access timestamp.")
+    parser.add_argument("--hit-rate",
+                        type=float,
+                        default=0.3,
+                        help="Fraction of operations that are prefix cache "
+                        "hits on a freed block.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args)
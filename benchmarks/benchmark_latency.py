@@ -2,7 +2,7 @@
 import argparse
 import time
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import numpy as np
 import torch
@@ -11,6 +11,53 @@ from tqdm import tqdm
 from vllm import LLM, SamplingParams
 
 
+def track_gpu_busy(llm: LLM) -> List[Tuple[float, float]]:
+    """Record the (start, end) time of the model execution of each step.
+
+    The start is taken once the inputs of the driver worker are prepared,
+    and the end once the sampled tokens are back on the host, so the gap
+    between the end of one step and the start of the next approximates the
+    time the GPU sits idle while the engine does host-side work.
+    """
+    model_runner = llm.llm_engine.model_executor.driver_worker.model_runner
+    prepare_input_tensors = model_runner.prepare_input_tensors
+    execute_model = model_runner.execute_model
+    intervals: List[Tuple[float, float]] = []
+    start_times: List[float] = []
+
+    def timed_prepare_input_tensors(*args, **kwargs):
+        outputs = prepare_input_tensors(*args, **kwargs)
+        start_times.append(time.perf_counter())
+        return outputs
+
+    def timed_execute_model(*args, **kwargs):
+        output = execute_model(*args, **kwargs)
+        if start_times:
+            intervals.append((start_times.pop(), time.perf_counter()))
+        return output
+
+    model_runner.prepare_input_tensors = timed_prepare_input_tensors
+    model_runner.execute_model = timed_execute_model
+    return intervals
+
+
+def report_gpu_idle(intervals: List[Tuple[float, float]]) -> None:
+    if len(intervals) < 2:
+        return
+    busy = [end - start for start, end in intervals]
+    # Idle gaps longer than a step between generate() calls are not part of
+    # the engine loop.
+    idle = [
+        max(0.0, next_start - end)
+        for (_, end), (next_start, _) in zip(intervals, intervals[1:])
+    ]
+    idle = [t for t in idle if t < 10 * max(busy)]
+    step = np.mean(busy) + np.mean(idle)
+    print(f'Avg step time: {step * 1000:.3f} ms, '
+          f'avg GPU idle per step: {np.mean(idle) * 1000:.3f} ms '
+          f'({np.mean(idle) / step * 100:.1f}% idle)')
+
+
 def main(args: argparse.Namespace):
     print(args)
 
@@ -27,6 +74,7 @@ def main(args: argparse.Namespace):
               device=args.device,
               ray_workers_use_nsight=args.ray_workers_use_nsight,
               enable_chunked_prefill=args.enable_chunked_prefill,
+              enable_pipelined_step=args.enable_pipelined_step,
               download_dir=args.download_dir,
               block_size=args.block_size)
 
@@ -80,10 +128,12 @@ def main(args: argparse.Namespace):
         return
 
     # Benchmark.
+    gpu_busy_intervals = (track_gpu_busy(llm) if args.report_gpu_idle else [])
     latencies = []
     for _ in tqdm(range(args.num_iters), desc="Profiling iterations"):
         latencies.append(run_to_completion(profile_dir=None))
     print(f'Avg latency: {np.mean(latencies)} seconds')
+    report_gpu_idle(gpu_busy_intervals)
 
 
 if __name__ == '__main__':
@@ -157,6 +207,15 @@ if __name__ == '__main__':
         default=False,
         help='If True, the prefill requests can be chunked based on the '
         'max_num_batched_tokens')
+    parser.add_argument(
+        '--enable-pipelined-step',
+        action='store_true',
+        help='overlap the output processing of a step with the model '
+        'execution of the next step')
+    parser.add_argument(
+        '--report-gpu-idle',
+        action='store_true',
+        help='report the time the GPU is idle between engine steps')
     parser.add_argument(
         "--ray-workers-use-nsight",
         action='store_true',
@@ -0,0 +1,184 @@
+"""Benchmark the latency of the broadcast of the metadata of decoding steps
+from the driver worker to the other workers."""
+import argparse
+import socket
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+import torch.distributed
+import torch.multiprocessing as mp
+
+from vllm.model_executor.parallel_utils.communication_op import (
+    broadcast_tensor_dict)
+from vllm.model_executor.parallel_utils.metadata_channel import MetadataChannel
+
+
+def get_open_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+
+def make_steps(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Returns the inputs of decoding steps, like ModelRunner prepares
+    them."""
+    rng = np.random.default_rng(args.seed)
+    batch_size = args.batch_size
+    block_size = args.block_size
+    seq_lens = rng.integers(1, args.max_context_len // 2, batch_size)
+    block_tables = [
+        list(range(i * args.max_blocks, i * args.max_blocks + n))
+        for i, n in enumerate((seq_lens + block_size - 1) // block_size)
+    ]
+    next_block = batch_size * args.max_blocks
+    steps = []
+    for step in range(args.num_steps):
+        if step % args.replace_interval == 0:
+            # A sequence finishes and a new one takes its place.
+            i = int(rng.integers(batch_size))
+            seq_lens[i] = 1
+            block_tables[i] = [next_block]
+            next_block += 1
+        for i in range(batch_size):
+            seq_lens[i] = min(seq_lens[i] + 1, args.max_blocks * block_size)
+            if len(block_tables[i]) * block_size < seq_lens[i]:
+                block_tables[i].append(next_block)
+                next_block += 1
+        positions = seq_lens - 1
+        table = np.zeros((batch_size, args.max_blocks), dtype=np.int32)
+        for i, block_table in enumerate(block_tables):
+            table[i, :len(block_table)] = block_table
+        slots = (table[np.arange(batch_size), positions // block_size] *
+                 block_size + positions % block_size)
+        steps.append({
+            "input_tokens": rng.integers(32000, size=batch_size),
+            "input_positions": positions.copy(),
+            "selected_token_indices": np.arange(batch_size),
+            "lora_requests": set(),
+            "lora_mapping": None,
+            "multi_modal_input": None,
+            "is_prompt": False,
+            "slot_mapping": slots,
+            "prompt_lens": None,
+            "prompt_lens_tensor": None,
+            "num_prompt_tokens": 0,
+            "num_generation_tokens": batch_size,
+            "max_subquery_len": None,
+            "max_context_len": int(seq_lens.max()),
+            "max_prompt_len": None,
+            "subquery_start_loc": None,
+            "seq_start_loc": None,
+            "context_lens": seq_lens.astype(np.int32),
+            "block_tables": table,
+            "use_cuda_graph": True,
+            "kv_cache_dtype": "auto",
+        })
+    return steps
+
+
+def run_worker(rank: int, tp_size: int, port: int,
+               args: argparse.Namespace) -> None:
+    if args.backend == "nccl":
+        torch.cuda.set_device(rank)
+        device = torch.device("cuda", rank)
+    else:
+        device = torch.device("cpu")
+    torch.distributed.init_process_group(backend=args.backend,
+                                         init_method=f"tcp://localhost:{port}",
+                                         world_size=tp_size,
+                                         rank=rank)
+
+    steps = make_steps(args) if rank == 0 else [None] * args.num_steps
+    # The data of Worker.execute_model.
+    worker_data = {
+        "num_seq_groups": args.batch_size,
+        "blocks_to_swap_in": {},
+        "blocks_to_swap_out": {},
+        "blocks_to_copy": {},
+        "num_steps": 1,
+    }
+    if rank == 0:
+        # The tensors are on the device, except for the new channel.
+        device_steps = [{
+            key: (torch.from_numpy(value).to(device) if isinstance(
+                value, np.ndarray) else value)
+            for key, value in step.items()
+        } for step in steps]
+    else:
+        worker_data = None
+        device_steps = steps
+
+    def run_old(i: int) -> None:
+        broadcast_tensor_dict(worker_data, src=0)
+        broadcast_tensor_dict(device_steps[i], src=0)
+
+    worker_channel = MetadataChannel()
+    input_channel = MetadataChannel(delta_keys=["block_tables"])
+
+    def run_new(i: int) -> None:
+        worker_channel.broadcast(worker_data)
+        input_channel.broadcast(steps[i])
+
+    results = {}
+    for name, run_step in [("broadcast_tensor_dict", run_old),
+                           ("MetadataChannel", run_new)]:
+        for i in range(args.num_warmup):
+            run_step(i)
+        if args.backend == "nccl":
+            torch.cuda.synchronize()
+        torch.distributed.barrier()
+        start_time = time.perf_counter()
+        for i in range(args.num_steps):
+            run_step(i)
+        if args.backend == "nccl":
+            torch.cuda.synchronize()
+        elapsed = torch.tensor([time.perf_counter() - start_time],
+                               device=device)
+        # The slowest worker determines the latency of the step.
+        torch.distributed.all_reduce(elapsed,
+                                     op=torch.distributed.ReduceOp.MAX)
+        results[name] = elapsed.item() / args.num_steps
+
+    if rank == 0:
+        old_latency = results["broadcast_tensor_dict"]
+        new_latency = results["MetadataChannel"]
+        print(f"TP={tp_size}: broadcast_tensor_dict "
+              f"{old_latency * 1e6:.1f} us/step, MetadataChannel "
+              f"{new_latency * 1e6:.1f} us/step "
+              f"({old_latency / new_latency:.2f}x)")
+    torch.distributed.destroy_process_group()
+
+
+def main(args: argparse.Namespace):
+    print(args)
+    for tp_size in args.tp_sizes:
+        mp.spawn(run_worker,
+                 args=(tp_size, get_open_port(), args),
+                 nprocs=tp_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the per-step broadcast of the metadata of "
+        "decoding steps against the tensor parallel size.")
+    parser.add_argument("--tp-sizes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--backend",
+                        type=str,
+                        choices=["gloo", "nccl"],
+                        default="gloo")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--block-size", type=int, default=16)
+    parser.add_argument("--max-context-len", type=int, default=4096)
+    parser.add_argument("--replace-interval",
+                        type=int,
+                        default=4,
+                        help="Number of steps between the replacements of a "
+                        "finished sequence by a new one.")
+    parser.add_argument("--num-steps", type=int, default=200)
+    parser.add_argument("--num-warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.max_blocks = args.max_context_len // args.block_size
+    main(args)
@@ -0,0 +1,63 @@
+"""Benchmark the host memory and the GC time of the sequences of the engine."""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from vllm.sequence import Logprob, Sequence
+
+
+def main(args: argparse.Namespace):
+    print(args)
+    random.seed(args.seed)
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    seqs = []
+    for seq_id in range(args.num_seqs):
+        prompt_token_ids = [
+            random.randrange(args.vocab_size) for _ in range(args.input_len)
+        ]
+        seqs.append(
+            Sequence(seq_id, "", prompt_token_ids, block_size=args.block_size))
+    # Decode the sequences in lockstep, like the engine does.
+    for _ in range(args.output_len):
+        for seq in seqs:
+            token_id = random.randrange(args.vocab_size)
+            seq.append_token_id(token_id, {token_id: Logprob(-1.0)})
+    elapsed = time.perf_counter() - start_time
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    num_tokens = args.num_seqs * (args.input_len + args.output_len)
+    print(f"Built {args.num_seqs} sequences in {elapsed:.3f} s")
+    print(f"Memory: {memory / 2**20:.1f} MiB "
+          f"({memory / args.num_seqs / 2**10:.2f} KiB/seq, "
+          f"{memory / num_tokens:.1f} B/token)")
+
+    # A full collection traverses every object of the sequences.
+    start_time = time.perf_counter()
+    gc.collect()
+    elapsed = time.perf_counter() - start_time
+    print(f"Full GC: {elapsed * 1e3:.1f} ms")
+
+    # The token ids are read by the block manager and the detokenizer on
+    # every step.
+    start_time = time.perf_counter()
+    for seq in seqs:
+        seq.get_token_ids()
+    elapsed = time.perf_counter() - start_time
+    print(f"get_token_ids: {elapsed / args.num_seqs * 1e6:.3f} us/seq")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the memory of the sequences of the engine.")
+    parser.add_argument("--num-seqs", type=int, default=10_000)
+    parser.add_argument("--input-len", type=int, default=512)
+    parser.add_argument("--output-len", type=int, default=256)
+    parser.add_argument("--block-size", type=int, default=16)
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,126 @@
+"""Benchmark the loading time and the peak host memory of a tensor parallel
+worker that loads a safetensors checkpoint."""
+import argparse
+import glob
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import torch
+from safetensors.torch import safe_open, save_file
+
+from vllm.model_executor.weight_utils import hf_model_weights_iterator
+
+
+def save_dummy_checkpoint(path: str, args: argparse.Namespace) -> None:
+    hidden_size = args.hidden_size
+    layers_per_file = max(args.num_layers // args.num_files, 1)
+    for start in range(0, args.num_layers, layers_per_file):
+        tensors = {}
+        for i in range(start, min(start + layers_per_file, args.num_layers)):
+            prefix = f"model.layers.{i}"
+            tensors[f"{prefix}.self_attn.qkv_proj.weight"] = torch.randn(
+                3 * hidden_size, hidden_size, dtype=torch.float16)
+            tensors[f"{prefix}.mlp.gate_up_proj.weight"] = torch.randn(
+                8 * hidden_size, hidden_size, dtype=torch.float16)
+            tensors[f"{prefix}.input_layernorm.weight"] = torch.randn(
+                hidden_size, dtype=torch.float16)
+        save_file(tensors, os.path.join(path,
+                                        f"model-{start:05d}.safetensors"))
+
+
+def serial_weights_iterator(path: str):
+    # The loader used before the memory-mapped one.
+    for st_file in sorted(glob.glob(os.path.join(path, "*.safetensors"))):
+        with safe_open(st_file, framework="pt") as f:
+            for name in f.keys():  # noqa: SIM118
+                yield name, f.get_tensor(name)
+
+
+def get_peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def main(args: argparse.Namespace):
+    print(args)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.model
+        if path is None:
+            # Write the checkpoint in another process, so that its memory is
+            # not counted.
+            path = tmp_dir
+            process = multiprocessing.get_context("spawn").Process(
+                target=save_dummy_checkpoint, args=(path, args))
+            process.start()
+            process.join()
+        st_files = glob.glob(os.path.join(path, "*.safetensors"))
+        total_bytes = sum(os.path.getsize(f) for f in st_files)
+
+        if not args.warm_cache:
+            # Evict the files from the page cache to read them from the disk.
+            for st_file in st_files:
+                fd = os.open(st_file, os.O_RDONLY)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                os.close(fd)
+
+        if args.loader == "mmap":
+            weights = hf_model_weights_iterator(path,
+                                                load_format="safetensors",
+                                                max_workers=args.max_workers)
+        else:
+            weights = serial_weights_iterator(path)
+
+        base_rss = get_peak_rss_mib()
+        loaded_bytes = 0
+        start_time = time.perf_counter()
+        for _, loaded_weight in weights:
+            # Copy the shard of the worker, like the column parallel layers.
+            shard_size = loaded_weight.shape[0] // args.tp_size
+            loaded_weight = loaded_weight.narrow(0, args.tp_rank * shard_size,
+                                                 shard_size)
+            param = torch.empty_like(loaded_weight, device=args.device)
+            param.copy_(loaded_weight)
+            loaded_bytes += param.numel() * param.element_size()
+            del param, loaded_weight
+        if args.device == "cuda":
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start_time
+
+    print(f"Loaded {loaded_bytes / 2**30:.2f} GiB of "
+          f"{total_bytes / 2**30:.2f} GiB in {elapsed:.3f} s "
+          f"({loaded_bytes / 2**30 / elapsed:.2f} GiB/s)")
+    print(f"Peak RSS: {get_peak_rss_mib():.1f} MiB "
+          f"(+{get_peak_rss_mib() - base_rss:.1f} MiB while loading)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the loading of the weights of a worker.")
+    parser.add_argument("--model",
+                        type=str,
+                        default=None,
+                        help="A local directory with safetensors files. A "
+                        "dummy checkpoint is written if it is not set.")
+    parser.add_argument("--loader",
+                        type=str,
+                        choices=["mmap", "serial"],
+                        default="mmap")
+    parser.add_argument("--tp-size", type=int, default=1)
+    parser.add_argument("--tp-rank", type=int, default=0)
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--device",
+                        type=str,
+                        choices=["cpu", "cuda"],
+                        default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--warm-cache",
+                        action="store_true",
+                        help="Do not evict the files from the page cache.")
+    parser.add_argument("--num-layers", type=int, default=32)
+    parser.add_argument("--hidden-size", type=int, default=2048)
+    parser.add_argument("--num-files", type=int, default=4)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,88 @@
+"""Benchmark the latency of the method calls of the driver to the Ray workers
+on its node, with Ray calls and with the shared memory transport."""
+import argparse
+import time
+
+import ray
+
+from vllm.engine.ray_utils import RayWorkerVllm
+from vllm.executor.shm_transport import ShmTransport
+
+
+class DummyWorker:
+    """A CPU-only worker whose steps take no time, like the workers that are
+    not the driver, which only return None."""
+
+    def __init__(self, output_size: int) -> None:
+        self.output = b"x" * output_size if output_size else None
+
+    def execute_model(self):
+        return self.output
+
+
+def main(args: argparse.Namespace):
+    print(args)
+    ray.init(num_cpus=max(args.tp_sizes), include_dashboard=False)
+    for tp_size in args.tp_sizes:
+        output_size = args.output_size
+        workers = [
+            ray.remote(num_cpus=0)(RayWorkerVllm).remote()
+            for _ in range(tp_size - 1)
+        ]
+        ray.get([
+            worker.init_worker.remote(
+                lambda output_size=output_size: DummyWorker(output_size))
+            for worker in workers
+        ])
+
+        def run_ray(workers=workers) -> None:
+            ray.get([
+                worker.execute_method.remote("execute_model")
+                for worker in workers
+            ])
+
+        def time_steps(run_step) -> float:
+            for _ in range(args.num_warmup):
+                run_step()
+            start_time = time.perf_counter()
+            for _ in range(args.num_steps):
+                run_step()
+            return (time.perf_counter() - start_time) / args.num_steps
+
+        ray_latency = time_steps(run_ray)
+        # The workers do not take Ray calls once they serve the transport.
+        transport = ShmTransport(len(workers))
+
+        def run_shm(transport=transport) -> None:
+            transport.recv(transport.send("execute_model", (), {}))
+
+        loops = [
+            worker.run_shm_loop.remote(transport.handle, rank)
+            for rank, worker in enumerate(workers)
+        ]
+        shm_latency = time_steps(run_shm)
+
+        transport.close()
+        ray.get(loops)
+        for worker in workers:
+            ray.kill(worker)
+        print(f"TP={tp_size}: Ray {ray_latency * 1e6:.1f} us/step, "
+              f"shared memory {shm_latency * 1e6:.1f} us/step "
+              f"({ray_latency / shm_latency:.2f}x)")
+    ray.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the per-step latency of the calls of the "
+        "driver to the workers against the tensor parallel size.")
+    parser.add_argument("--tp-sizes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--output-size",
+                        type=int,
+                        default=0,
+                        help="Size in bytes of the output of the workers. "
+                        "The workers return None if 0.")
+    parser.add_argument("--num-steps", type=int, default=1000)
+    parser.add_argument("--num-warmup", type=int, default=100)
+    args = parser.parse_args()
+    main(args)
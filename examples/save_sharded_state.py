@@ -0,0 +1,58 @@
+"""
+Saves each worker's model state dict directly to a checkpoint, which
+enables a fast load path for large tensor-parallel models where each worker
+only needs to read its own shard rather than the entire checkpoint.
+
+Example usage:
+
+python save_sharded_state.py \
+    --model /path/to/load \
+    --quantization awq \
+    --tensor-parallel-size 8 \
+    --output /path/to/save
+
+Then, the model can be loaded with
+
+llm = LLM(
+    model="/path/to/save",
+    load_format="sharded",
+    quantization="awq",
+    tensor_parallel_size=8,
+)
+"""
+import argparse
+import dataclasses
+import os
+import shutil
+
+from vllm import LLM, EngineArgs
+
+parser = argparse.ArgumentParser()
+EngineArgs.add_cli_args(parser)
+parser.add_argument("--output",
+                    "-o",
+                    required=True,
+                    type=str,
+                    help="path to output checkpoint")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    engine_args = EngineArgs.from_cli_args(args)
+    if not os.path.isdir(engine_args.model):
+        raise ValueError("The model must be a local directory, which holds "
+                         "the config and the tokenizer of the checkpoint.")
+    # Prepare output directory.
+    os.makedirs(args.output, exist_ok=True)
+    # Create the LLM, which loads and shards the weights.
+    llm = LLM(**dataclasses.asdict(engine_args))
+    # Dump the weights of each worker.
+    llm.llm_engine.save_sharded_state(args.output)
+    # Copy the metadata files, e.g. the config and the tokenizer.
+    for file in os.listdir(engine_args.model):
+        if os.path.splitext(file)[1] not in (".bin", ".pt", ".safetensors"):
+            if os.path.isdir(os.path.join(engine_args.model, file)):
+                shutil.copytree(os.path.join(engine_args.model, file),
+                                os.path.join(args.output, file),
+                                dirs_exist_ok=True)
+            else:
+                shutil.copy(os.path.join(engine_args.model, file), args.output)
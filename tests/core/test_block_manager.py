@@ -365,3 +365,165 @@ def test_sliding_window_multi_seq():
 
     # assert all blocks are free now
     assert block_manager.get_num_free_gpu_blocks() == num_gpu_blocks
+
+
+def test_cpu_prefix_caching():
+    block_size = 4
+    num_gpu_blocks = 2
+    num_cpu_blocks = 4
+    block_manager = BlockSpaceManagerV1(block_size,
+                                        num_gpu_blocks,
+                                        num_cpu_blocks,
+                                        watermark=0,
+                                        enable_caching=True,
+                                        enable_cpu_caching=True)
+
+    def create_seq_group(request_id: int, token_ids: List[int]):
+        seq = Sequence(request_id, "", token_ids, block_size)
+        return seq, SequenceGroup(str(request_id), [seq], SamplingParams(),
+                                  time.time(), None)
+
+    # Compute a prompt of two blocks. Only the first block is marked as
+    # computed, as the last full block is excluded.
+    prompt_tokens = list(range(2 * block_size))
+    seq_a, seq_group_a = create_seq_group(0, prompt_tokens)
+    block_manager.allocate(seq_group_a)
+    block_manager.mark_blocks_as_computed(seq_group_a)
+    first_gpu_block = block_manager.get_block_table(seq_a)[0]
+    block_manager.free(seq_a)
+    assert block_manager.get_prefix_cache_swaps() == ({}, {})
+
+    # Another prompt evicts both blocks, and only the computed one is copied
+    # to the CPU.
+    seq_b, seq_group_b = create_seq_group(
+        1, list(range(100, 100 + 2 * block_size)))
+    block_manager.allocate(seq_group_b)
+    swap_in, swap_out = block_manager.get_prefix_cache_swaps()
+    assert swap_in == {}
+    assert list(swap_out.keys()) == [first_gpu_block]
+    cpu_block = swap_out[first_gpu_block]
+    assert block_manager.get_num_free_cpu_blocks() == num_cpu_blocks
+    block_manager.free(seq_b)
+
+    # The same prefix swaps the block back in and reuses it as computed.
+    seq_c, seq_group_c = create_seq_group(2, prompt_tokens)
+    block_manager.allocate(seq_group_c)
+    swap_in, swap_out = block_manager.get_prefix_cache_swaps()
+    gpu_block = block_manager.get_block_table(seq_c)[0]
+    assert swap_in == {cpu_block: gpu_block}
+    assert block_manager.get_common_computed_block_ids([seq_c]) == [gpu_block]
+    # The evicted blocks of the other prompt were never computed.
+    assert swap_out == {}
+
+
+def test_cpu_prefix_caching_pins_cpu_blocks():
+    block_size = 4
+    num_gpu_blocks = 2
+    num_cpu_blocks = 1
+    block_manager = BlockSpaceManagerV1(block_size,
+                                        num_gpu_blocks,
+                                        num_cpu_blocks,
+                                        watermark=0,
+                                        enable_caching=True,
+                                        enable_cpu_caching=True)
+
+    def allocate_computed(request_id: int) -> int:
+        token_ids = list(range(request_id * 100,
+                               request_id * 100 + block_size))
+        seq = Sequence(request_id, "", token_ids, block_size)
+        seq_group = SequenceGroup(str(request_id), [seq], SamplingParams(),
+                                  time.time(), None)
+        block_manager.allocate(seq_group)
+        block = block_manager.block_tables[seq.seq_id][0]
+        block.computed = True
+        block_manager.free(seq)
+        return block.block_number
+
+    first_gpu_block = allocate_computed(0)
+    allocate_computed(1)
+    # The only CPU block is the destination of a pending copy, so the second
+    # eviction in the same step must not reuse it.
+    third_gpu_block = allocate_computed(2)
+    allocate_computed(3)
+    assert block_manager.get_prefix_cache_swaps() == ({}, {first_gpu_block: 0})
+
+    # Once the copies are handed out, the CPU block can be reused.
+    allocate_computed(4)
+    assert block_manager.get_prefix_cache_swaps() == ({}, {third_gpu_block: 0})
+
+
+def test_cpu_prefix_cache_save_and_load(tmp_path):
+    block_size = 4
+    num_gpu_blocks = 2
+    num_cpu_blocks = 4
+    index_path = str(tmp_path / "block_index.json")
+
+    def create_block_manager():
+        return BlockSpaceManagerV1(block_size,
+                                   num_gpu_blocks,
+                                   num_cpu_blocks,
+                                   watermark=0,
+                                   enable_caching=True,
+                                   enable_cpu_caching=True)
+
+    def create_seq_group(request_id: int):
+        seq = Sequence(request_id, "", list(range(2 * block_size)), block_size)
+        return seq, SequenceGroup(str(request_id), [seq], SamplingParams(),
+                                  time.time(), None)
+
+    # Compute a prompt and move its blocks to the CPU before exiting.
+    block_manager = create_block_manager()
+    seq, seq_group = create_seq_group(0)
+    block_manager.allocate(seq_group)
+    block_manager.mark_blocks_as_computed(seq_group)
+    block_manager.free(seq)
+    swap_in, swap_out = block_manager.demote_all_blocks()
+    assert swap_in == {}
+    assert len(swap_out) == 1
+    cpu_block = next(iter(swap_out.values()))
+    block_manager.save_cpu_prefix_cache(index_path)
+
+    # A new block manager swaps the block in from the restored CPU cache.
+    block_manager = create_block_manager()
+    block_manager.load_cpu_prefix_cache(index_path)
+    assert not (tmp_path / "block_index.json").exists()
+    assert block_manager.get_num_free_cpu_blocks() == num_cpu_blocks
+    seq, seq_group = create_seq_group(1)
+    block_manager.allocate(seq_group)
+    gpu_block = block_manager.get_block_table(seq)[0]
+    assert block_manager.get_prefix_cache_swaps() == ({
+        cpu_block: gpu_block
+    }, {})
+    assert block_manager.get_common_computed_block_ids([seq]) == [gpu_block]
+
+    # Unused CPU blocks are still allocatable after the restored ones.
+    cpu_blocks = [
+        block_manager.cpu_allocator.allocate() for _ in range(num_cpu_blocks)
+    ]
+    assert sorted(block.block_number
+                  for block in cpu_blocks) == list(range(num_cpu_blocks))
+
+
+def test_cpu_prefix_cache_load_mismatch(tmp_path):
+    index_path = str(tmp_path / "block_index.json")
+    block_manager = BlockSpaceManagerV1(4,
+                                        2,
+                                        4,
+                                        watermark=0,
+                                        enable_caching=True,
+                                        enable_cpu_caching=True)
+    block = block_manager.cpu_allocator.allocate(1234, 4)
+    block.computed = True
+    block_manager.cpu_allocator.free(block)
+    block_manager.save_cpu_prefix_cache(index_path)
+
+    # An index of a CPU cache with another size is discarded.
+    block_manager = BlockSpaceManagerV1(4,
+                                        2,
+                                        8,
+                                        watermark=0,
+                                        enable_caching=True,
+                                        enable_cpu_caching=True)
+    block_manager.load_cpu_prefix_cache(index_path)
+    assert not (tmp_path / "block_index.json").exists()
+    assert not block_manager.cpu_allocator.contains_block(1234)
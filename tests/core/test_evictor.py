@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from vllm.block import PhysicalTokenBlock
+from vllm.core.evictor import EvictionPolicy, make_evictor
+from vllm.utils import Device
+
+
+def _make_block(block_hash: int, last_accessed: float,
+                num_hashed_tokens: int) -> PhysicalTokenBlock:
+    block = PhysicalTokenBlock(device=Device.GPU,
+                               block_number=block_hash,
+                               block_size=16,
+                               block_hash=block_hash,
+                               num_hashed_tokens=num_hashed_tokens)
+    block.last_accessed = last_accessed
+    return block
+
+
+def test_lru_evictor_order():
+    evictor = make_evictor(EvictionPolicy.LRU)
+    evictor.add(_make_block(0, last_accessed=2.0, num_hashed_tokens=16))
+    evictor.add(_make_block(1, last_accessed=1.0, num_hashed_tokens=16))
+    evictor.add(_make_block(2, last_accessed=1.0, num_hashed_tokens=32))
+    evictor.add(_make_block(3, last_accessed=3.0, num_hashed_tokens=16))
+    assert evictor.num_blocks == 4
+
+    # The least recently accessed block goes first. Ties are broken by
+    # evicting the block with the most hashed tokens.
+    assert [evictor.evict().block_hash for _ in range(4)] == [2, 1, 0, 3]
+    assert evictor.num_blocks == 0
+
+    with pytest.raises(ValueError):
+        evictor.evict()
+
+
+def test_lru_evictor_remove_and_readd():
+    evictor = make_evictor(EvictionPolicy.LRU)
+    blocks = [
+        _make_block(i, last_accessed=float(i), num_hashed_tokens=16)
+        for i in range(4)
+    ]
+    for block in blocks:
+        evictor.add(block)
+
+    # Bring back the oldest block, then free it again with a newer access
+    # time. Its stale position must not be used for eviction.
+    assert evictor.remove(0) is blocks[0]
+    assert 0 not in evictor
+    with pytest.raises(ValueError):
+        evictor.remove(0)
+    blocks[0].last_accessed = 10.0
+    evictor.add(blocks[0])
+    assert 0 in evictor
+
+    evicted = evictor.evict()
+    assert evicted is blocks[1]
+    assert [evictor.evict().block_hash for _ in range(3)] == [2, 3, 0]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_lru_evictor_matches_linear_scan(seed: int):
+    random.seed(seed)
+    evictor = make_evictor(EvictionPolicy.LRU)
+    # Reference model of the free blocks, scanned linearly on eviction.
+    free_blocks = {}
+    next_hash = 0
+    for _ in range(2000):
+        op = random.random()
+        if op < 0.5 or not free_blocks:
+            block = _make_block(next_hash,
+                                last_accessed=float(random.randint(0, 50)),
+                                num_hashed_tokens=16 * random.randint(1, 8))
+            next_hash += 1
+            evictor.add(block)
+            free_blocks[block.block_hash] = block
+        elif op < 0.75:
+            block_hash = random.choice(list(free_blocks))
+            assert evictor.remove(block_hash) is free_blocks.pop(block_hash)
+        else:
+            expected = min(free_blocks.values(),
+                           key=lambda b:
+                           (b.last_accessed, -b.num_hashed_tokens))
+            evicted = evictor.evict()
+            assert (evicted.last_accessed,
+                    evicted.num_hashed_tokens) == (expected.last_accessed,
+                                                   expected.num_hashed_tokens)
+            del free_blocks[evicted.block_hash]
+        assert evictor.num_blocks == len(free_blocks)
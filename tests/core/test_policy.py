@@ -0,0 +1,172 @@
+import random
+from collections import deque
+from typing import List, Optional
+
+import pytest
+
+from vllm.config import CacheConfig, SchedulerConfig
+from vllm.core.policy import PriorityPolicy, PriorityQueue
+from vllm.core.scheduler import Scheduler
+from vllm.sequence import Logprob, SequenceGroup
+
+from .utils import create_dummy_prompt
+
+
+def _create_seq_group(request_id: int,
+                      arrival_time: float,
+                      priority: int = 0,
+                      deadline: Optional[float] = None) -> SequenceGroup:
+    _, seq_group = create_dummy_prompt(str(request_id), prompt_length=4)
+    seq_group.metrics.arrival_time = arrival_time
+    seq_group.priority = priority
+    seq_group.deadline = deadline
+    return seq_group
+
+
+@pytest.mark.parametrize("seed", list(range(5)))
+def test_priority_queue(seed: int):
+    random.seed(seed)
+    policy = PriorityPolicy(aging_period=1.0)
+    queue = policy.create_queue()
+    assert isinstance(queue, PriorityQueue)
+
+    expected: List[SequenceGroup] = []
+    for i in range(100):
+        seq_group = _create_seq_group(i,
+                                      arrival_time=random.random() * 10,
+                                      priority=random.randint(0, 3))
+        queue.append(seq_group)
+        expected.append(seq_group)
+    for seq_group in random.sample(expected, 20):
+        queue.remove(seq_group)
+        expected.remove(seq_group)
+
+    expected.sort(key=policy.get_sort_key)
+    assert len(queue) == len(expected)
+    assert [queue.popleft() for _ in range(len(queue))] == expected
+    assert not queue
+
+
+def test_priority_queue_remove():
+    policy = PriorityPolicy(aging_period=1.0)
+    queue = policy.create_queue()
+    seq_groups = [
+        _create_seq_group(i, arrival_time=float(i)) for i in range(10)
+    ]
+    queue.extendleft(seq_groups)
+
+    # The first sequence group skips the removed ones.
+    queue.remove(seq_groups[0])
+    assert queue[0] is seq_groups[1]
+    with pytest.raises(ValueError):
+        queue.remove(seq_groups[0])
+    # A removed sequence group can be queued again.
+    queue.append(seq_groups[0])
+    assert queue[0] is seq_groups[0]
+
+    # Removing most of the queue drops the removed entries from the heap.
+    for seq_group in seq_groups[2:8]:
+        queue.remove(seq_group)
+    assert len(queue) == 4
+    assert set(queue) == {
+        seq_groups[0], seq_groups[1], seq_groups[8], seq_groups[9]
+    }
+    assert [queue.popleft() for _ in range(len(queue))
+            ] == [seq_groups[0], seq_groups[1], seq_groups[8], seq_groups[9]]
+
+
+@pytest.mark.parametrize("priority", [1, 3, 10])
+def test_priority_policy_starvation_bound(priority: int):
+    aging_period = 2.0
+    policy = PriorityPolicy(aging_period=aging_period)
+    queue = policy.create_queue()
+
+    # A low priority request competes with a stream of high priority ones
+    # that arrive as fast as they are served.
+    batch_seq_group = _create_seq_group(0, arrival_time=0.0, priority=priority)
+    queue.append(batch_seq_group)
+    for step in range(1000):
+        queue.append(_create_seq_group(step + 1, arrival_time=float(step)))
+        served = queue.popleft()
+        if served is batch_seq_group:
+            break
+        # Only the requests that are due before it overtake it.
+        assert served.metrics.arrival_time <= priority * aging_period
+    else:
+        raise AssertionError("The low priority request was starved.")
+    assert step <= priority * aging_period + 1
+
+
+def test_priority_policy_deadline():
+    policy = PriorityPolicy(aging_period=10.0)
+    queue = policy.create_queue()
+    interactive = _create_seq_group(0, arrival_time=1.0)
+    batch = _create_seq_group(1, arrival_time=0.0, priority=5)
+    urgent_batch = _create_seq_group(2,
+                                     arrival_time=0.0,
+                                     priority=5,
+                                     deadline=0.5)
+    for seq_group in (interactive, batch, urgent_batch):
+        queue.append(seq_group)
+    assert [queue.popleft()
+            for _ in range(3)] == [urgent_batch, interactive, batch]
+
+
+def test_priority_policy_earliest_deadline_first():
+    policy = PriorityPolicy(aging_period=10.0)
+    queue = policy.create_queue()
+    # A request with a tight deadline overtakes the more urgent ones that
+    # arrived earlier, and the earliest deadline is served first.
+    early = [_create_seq_group(i, arrival_time=float(i)) for i in range(3)]
+    late_deadline = _create_seq_group(3, arrival_time=3.0, deadline=8.0)
+    tight_deadline = _create_seq_group(4, arrival_time=4.0, deadline=5.0)
+    for seq_group in early + [late_deadline, tight_deadline]:
+        queue.append(seq_group)
+    assert [queue.popleft()
+            for _ in range(5)] == [tight_deadline, late_deadline] + early
+
+
+def test_priority_policy_priority_breaks_ties():
+    policy = PriorityPolicy(aging_period=10.0)
+    queue = policy.create_queue()
+    batch = _create_seq_group(0, arrival_time=0.0, priority=2, deadline=5.0)
+    interactive = _create_seq_group(1, arrival_time=1.0, deadline=5.0)
+    queue.append(batch)
+    queue.append(interactive)
+    assert [queue.popleft() for _ in range(2)] == [interactive, batch]
+
+    # The deques of the scheduler are sorted the same way.
+    sorted_seq_groups = policy.sort_by_priority(0.0,
+                                                deque([batch, interactive]))
+    assert list(sorted_seq_groups) == [interactive, batch]
+
+
+def test_scheduler_preempts_lowest_priority():
+    block_size = 4
+    scheduler_config = SchedulerConfig(64, 2, 16, policy="priority")
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 2
+    cache_config.num_gpu_blocks = 2
+    scheduler = Scheduler(scheduler_config, cache_config, None)
+
+    # The batch request arrives first, but is less urgent.
+    seq_a, seq_group_a = create_dummy_prompt("1", block_size)
+    seq_b, seq_group_b = create_dummy_prompt("2", block_size)
+    seq_group_a.priority = 1
+    scheduler.add_seq_group(seq_group_a)
+    scheduler.add_seq_group(seq_group_b)
+
+    _, out = scheduler.schedule()
+    assert len(out.scheduled_seq_groups) == 2
+
+    token_id = 0
+    seq_a.append_token_id(token_id, {token_id: Logprob(0.0)})
+    seq_b.append_token_id(token_id, {token_id: Logprob(0.0)})
+
+    # Only one of them can get a new block. FCFS would preempt the most
+    # recent request, but the batch request is preempted.
+    _, out = scheduler.schedule()
+    assert [s.seq_group for s in out.scheduled_seq_groups] == [seq_group_b]
+    assert seq_group_a.metrics.num_recomputes == 1
+    assert seq_group_b.metrics.num_preemptions == 0
+    assert list(scheduler.waiting) == [seq_group_a]
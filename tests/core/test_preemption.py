@@ -0,0 +1,112 @@
+import pytest
+
+from vllm.config import CacheConfig, SchedulerConfig
+from vllm.core.preemption import PreemptionCostModel
+from vllm.core.scheduler import PreemptionMode, Scheduler
+from vllm.sequence import Logprob
+
+from .utils import create_dummy_prompt
+
+
+def _create_cost_model(block_bytes: int = 1 << 20) -> PreemptionCostModel:
+    return PreemptionCostModel(num_params=10**9,
+                               num_layers=16,
+                               hidden_size=2048,
+                               block_bytes=block_bytes)
+
+
+@pytest.mark.parametrize("num_tokens", [1, 100, 4096])
+@pytest.mark.parametrize("chunk_size", [1, 64, 1000])
+def test_flops_of_chunked_prefill(num_tokens: int, chunk_size: int):
+    # Computing the tokens in chunks takes the same FLOPs as at once.
+    cost_model = _create_cost_model()
+    flops = 0
+    for start in range(0, num_tokens, chunk_size):
+        flops += cost_model.get_flops(min(chunk_size, num_tokens - start),
+                                      num_context_tokens=start)
+    assert flops == cost_model.get_flops(num_tokens)
+
+
+def test_cost_model_measurements():
+    cost_model = _create_cost_model(block_bytes=1000)
+    recompute_time = cost_model.get_recompute_time(100)
+    swap_time = cost_model.get_swap_time(10)
+
+    # The first measurement replaces the default rates.
+    cost_model.observe_forward(cost_model.get_flops(100), 2.0)
+    cost_model.observe_swap(10, 3.0)
+    assert cost_model.get_recompute_time(100) == pytest.approx(2.0)
+    assert cost_model.get_swap_time(10) == pytest.approx(6.0)
+    assert cost_model.get_recompute_time(100) != recompute_time
+    assert cost_model.get_swap_time(10) != swap_time
+
+    # The next ones are averaged.
+    cost_model.observe_swap(10, 1.0)
+    assert 2.0 < cost_model.get_swap_time(10) < 6.0
+
+    # Empty steps are ignored.
+    cost_model.observe_forward(0, 1.0)
+    cost_model.observe_swap(10, 0.0)
+    assert cost_model.get_recompute_time(100) == pytest.approx(2.0)
+
+
+@pytest.mark.parametrize("swap_seconds_per_block,expected_mode",
+                         [(1e-9, PreemptionMode.SWAP),
+                          (1.0, PreemptionMode.RECOMPUTE)])
+def test_scheduler_preemption_mode_by_cost(swap_seconds_per_block: float,
+                                           expected_mode: PreemptionMode):
+    block_size = 4
+    scheduler_config = SchedulerConfig(64, 2, 16)
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 2
+    cache_config.num_gpu_blocks = 2
+    cost_model = _create_cost_model()
+    cost_model.observe_forward(10**12, 0.01)
+    cost_model.observe_swap(1, swap_seconds_per_block)
+    scheduler = Scheduler(scheduler_config, cache_config, None, cost_model)
+
+    seq_a, seq_group_a = create_dummy_prompt("1", block_size)
+    seq_b, seq_group_b = create_dummy_prompt("2", block_size)
+    scheduler.add_seq_group(seq_group_a)
+    scheduler.add_seq_group(seq_group_b)
+    _, out = scheduler.schedule()
+    assert out.preemptions == []
+
+    token_id = 0
+    seq_a.append_token_id(token_id, {token_id: Logprob(0.0)})
+    seq_b.append_token_id(token_id, {token_id: Logprob(0.0)})
+
+    # Only one of them can get a new block, seq group b is preempted.
+    _, out = scheduler.schedule()
+    assert out.preemptions == [(expected_mode, "cost")]
+    if expected_mode == PreemptionMode.SWAP:
+        assert out.blocks_to_swap_out
+        assert list(scheduler.swapped) == [seq_group_b]
+        assert seq_group_b.metrics.num_swaps == 1
+    else:
+        assert not out.blocks_to_swap_out
+        assert list(scheduler.waiting) == [seq_group_b]
+        assert seq_group_b.metrics.num_recomputes == 1
+
+
+def test_scheduler_recomputes_without_swap_space():
+    block_size = 4
+    scheduler_config = SchedulerConfig(64, 2, 16)
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 0
+    cache_config.num_gpu_blocks = 2
+    cost_model = _create_cost_model()
+    cost_model.observe_swap(1, 1e-9)
+    scheduler = Scheduler(scheduler_config, cache_config, None, cost_model)
+
+    seq_a, seq_group_a = create_dummy_prompt("1", block_size)
+    seq_b, seq_group_b = create_dummy_prompt("2", block_size)
+    scheduler.add_seq_group(seq_group_a)
+    scheduler.add_seq_group(seq_group_b)
+    scheduler.schedule()
+
+    token_id = 0
+    seq_a.append_token_id(token_id, {token_id: Logprob(0.0)})
+    seq_b.append_token_id(token_id, {token_id: Logprob(0.0)})
+    _, out = scheduler.schedule()
+    assert out.preemptions == [(PreemptionMode.RECOMPUTE, "no_swap_space")]
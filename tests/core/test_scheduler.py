@@ -137,6 +137,59 @@ def test_scheduler_schedule_preempt_abort():
     assert scheduler.get_num_unfinished_seq_groups() == 1
 
 
+class _FakeClock:
+    """Replaces the time module of the scheduler, so that the tests set the
+    times it records."""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+def test_scheduler_request_metrics_recompute(monkeypatch):
+    block_size = 4
+    scheduler_config = SchedulerConfig(64, 2, 64)
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 0
+    cache_config.num_gpu_blocks = 2
+    scheduler = Scheduler(scheduler_config, cache_config, None)
+    clock = _FakeClock(100.0)
+    monkeypatch.setattr("vllm.core.scheduler.time", clock)
+
+    seq_a, seq_group_a = create_dummy_prompt("1", block_size)
+    seq_b, seq_group_b = create_dummy_prompt("2", block_size)
+    for seq_group in (seq_group_a, seq_group_b):
+        seq_group.metrics.arrival_time = 100.0
+        scheduler.add_seq_group(seq_group)
+
+    clock.now = 101.0
+    scheduler.schedule()
+    assert seq_group_b.metrics.time_in_queue == 1.0
+    assert seq_group_b.metrics.time_in_waiting == 1.0
+
+    # Seq group b is preempted by recomputation.
+    seq_a.append_token_id(0, {0: Logprob(0.0)})
+    seq_b.append_token_id(0, {0: Logprob(0.0)})
+    clock.now = 102.0
+    _, out = scheduler.schedule()
+    assert get_sequence_groups(out) == [seq_group_a]
+    assert seq_group_a.metrics.num_preemptions == 0
+    assert seq_group_b.metrics.num_recomputes == 1
+    assert seq_group_b.metrics.num_swaps == 0
+    # The time waiting to be recomputed is accounted once rescheduled.
+    assert seq_group_b.metrics.time_in_waiting == 1.0
+
+    scheduler.abort_seq_group("1")
+    clock.now = 105.5
+    _, out = scheduler.schedule()
+    assert get_sequence_groups(out) == [seq_group_b]
+    assert seq_group_b.metrics.time_in_waiting == 4.5
+    assert seq_group_b.metrics.time_in_swapped == 0.0
+    assert seq_group_b.metrics.num_preemptions == 1
+
+
 def test_scheduler_max_seqs():
     block_size = 4
     num_seq_group = 4
@@ -207,3 +260,196 @@ def test_scheduler_delay_factor():
     seq_group_meta, out = scheduler.schedule()
     assert out.prompt_run
     assert seq_group_meta[0].request_id == '1'
+
+
+def test_scheduler_chunked_prefill():
+    block_size = 4
+    max_model_len = 64
+    scheduler_config = SchedulerConfig(8,
+                                       2,
+                                       max_model_len,
+                                       enable_chunked_prefill=True)
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 16
+    cache_config.num_gpu_blocks = 16
+    scheduler = Scheduler(scheduler_config, cache_config, None)
+
+    # The prompt is longer than the token budget.
+    seq, seq_group = create_dummy_prompt("0",
+                                         prompt_length=20,
+                                         block_size=block_size)
+    scheduler.add_seq_group(seq_group)
+
+    for expected_chunk_size in [8, 8, 4]:
+        seq_group_meta, out = scheduler.schedule()
+        assert get_sequence_groups(out) == [seq_group]
+        assert out.num_prefill_groups == 1
+        assert out.num_batched_tokens == expected_chunk_size
+        assert seq_group_meta[0].is_prompt
+        assert seq_group_meta[0].token_chunk_size == expected_chunk_size
+        assert seq_group.is_prefill()
+        seq_group.update_num_computed_tokens(expected_chunk_size)
+    assert not seq_group.is_prefill()
+
+    # Once the whole prompt is computed, the sequence group is decoded.
+    seq.append_token_id(0, {0: Logprob(0.0)})
+    seq_group_meta, out = scheduler.schedule()
+    assert get_sequence_groups(out) == [seq_group]
+    assert out.num_prefill_groups == 0
+    assert out.num_batched_tokens == 1
+    assert not seq_group_meta[0].is_prompt
+
+
+def test_scheduler_chunked_prefill_mixed_with_decode():
+    block_size = 4
+    max_model_len = 64
+    scheduler_config = SchedulerConfig(8,
+                                       2,
+                                       max_model_len,
+                                       enable_chunked_prefill=True)
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 16
+    cache_config.num_gpu_blocks = 16
+    scheduler = Scheduler(scheduler_config, cache_config, None)
+
+    # Prefill a short prompt and move it to decoding phase.
+    seq_a, seq_group_a = create_dummy_prompt("0",
+                                             prompt_length=4,
+                                             block_size=block_size)
+    scheduler.add_seq_group(seq_group_a)
+    _, out = scheduler.schedule()
+    assert get_sequence_groups(out) == [seq_group_a]
+    seq_group_a.update_num_computed_tokens(4)
+    seq_a.append_token_id(0, {0: Logprob(0.0)})
+
+    # A long prompt arrives. It is chunked and shares the step with the
+    # decode of the running sequence group instead of stalling it.
+    _, seq_group_b = create_dummy_prompt("1",
+                                         prompt_length=16,
+                                         block_size=block_size)
+    scheduler.add_seq_group(seq_group_b)
+    seq_group_meta, out = scheduler.schedule()
+    # Prefills come before decodes.
+    assert get_sequence_groups(out) == [seq_group_b, seq_group_a]
+    assert out.num_prefill_groups == 1
+    assert not out.prompt_run
+    assert out.num_batched_tokens == 8
+    assert [s.token_chunk_size for s in out.scheduled_seq_groups] == [7, 1]
+    assert [meta.is_prompt for meta in seq_group_meta] == [True, False]
+
+
+def test_scheduler_chunked_prefill_no_prompt_logprobs_chunking():
+    block_size = 4
+    max_model_len = 64
+    scheduler_config = SchedulerConfig(8,
+                                       2,
+                                       max_model_len,
+                                       enable_chunked_prefill=True)
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 16
+    cache_config.num_gpu_blocks = 16
+    scheduler = Scheduler(scheduler_config, cache_config, None)
+
+    _, seq_group_a = create_dummy_prompt("0",
+                                         prompt_length=6,
+                                         block_size=block_size)
+    _, seq_group_b = create_dummy_prompt("1",
+                                         prompt_length=6,
+                                         block_size=block_size)
+    seq_group_b.sampling_params.prompt_logprobs = 1
+    scheduler.add_seq_group(seq_group_a)
+    scheduler.add_seq_group(seq_group_b)
+
+    # Prompt logprobs need the whole prompt in a single step, so the second
+    # prompt waits for the next step instead of being chunked.
+    _, out = scheduler.schedule()
+    assert get_sequence_groups(out) == [seq_group_a]
+    assert out.num_batched_tokens == 6
+
+
+def test_scheduler_multi_step_decode():
+    block_size = 4
+    num_decode_steps = 4
+    scheduler_config = SchedulerConfig(64,
+                                       2,
+                                       64,
+                                       use_v2_block_manager=True,
+                                       num_decode_steps=num_decode_steps)
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 0
+    cache_config.num_gpu_blocks = 16
+    scheduler = Scheduler(scheduler_config, cache_config, None)
+
+    seq_a, seq_group_a = create_dummy_prompt("0", prompt_length=4)
+    seq_b, seq_group_b = create_dummy_prompt("1", prompt_length=3)
+    seq_group_b.sampling_params.use_beam_search = True
+    scheduler.add_seq_group(seq_group_a)
+
+    # Prompts run a single step.
+    _, out = scheduler.schedule()
+    assert out.num_decode_steps == 1
+    seq_group_a.update_num_computed_tokens(4)
+    seq_a.append_token_id(0, {0: Logprob(0.0)})
+
+    # The decodes run all the steps, whose slots are reserved.
+    _, out = scheduler.schedule()
+    assert get_sequence_groups(out) == [seq_group_a]
+    assert out.num_decode_steps == num_decode_steps
+    block_table = scheduler.block_manager.get_block_table(seq_a)
+    num_slots = seq_a.get_len() + num_decode_steps - 1
+    assert len(block_table) == (num_slots + block_size - 1) // block_size
+
+    # Beam search runs a single step.
+    scheduler.add_seq_group(seq_group_b)
+    scheduler.schedule()
+    seq_group_a.update_num_computed_tokens(1)
+    seq_group_b.update_num_computed_tokens(3)
+    seq_a.append_token_id(0, {0: Logprob(0.0)})
+    seq_b.append_token_id(0, {0: Logprob(0.0)})
+    _, out = scheduler.schedule()
+    assert get_sequence_groups(out) == [seq_group_a, seq_group_b]
+    assert out.num_decode_steps == 1
+    # No slots are reserved ahead for the steps beam search does not run.
+    assert len(scheduler.block_manager.get_block_table(seq_b)) == 1
+
+
+def test_scheduler_config_multi_step_decode():
+    with pytest.raises(ValueError):
+        SchedulerConfig(64, 2, 64, num_decode_steps=0)
+    with pytest.raises(ValueError):
+        # The v1 block manager cannot reserve the slots ahead.
+        SchedulerConfig(64, 2, 64, num_decode_steps=4)
+    with pytest.raises(ValueError):
+        SchedulerConfig(64,
+                        2,
+                        64,
+                        use_v2_block_manager=True,
+                        enable_pipelined_step=True,
+                        num_decode_steps=4)
+
+
+def test_scheduler_prefix_cache_swaps():
+    block_size = 4
+    scheduler_config = SchedulerConfig(64, 2, 16)
+    cache_config = CacheConfig(block_size, 1.0, 1, "auto")
+    cache_config.num_cpu_blocks = 8
+    cache_config.num_gpu_blocks = 8
+    scheduler = Scheduler(scheduler_config, cache_config, None)
+    _, seq_group = create_dummy_prompt("0", prompt_length=block_size)
+    scheduler.add_seq_group(seq_group)
+    scheduler.schedule()
+
+    # The copies of the prefix cache are merged into the swaps of the step.
+    block_manager = scheduler.block_manager
+    block_manager.prefix_blocks_to_swap_in = {2: 5}
+    block_manager.prefix_blocks_to_swap_out = {6: 3}
+    _, out = scheduler.schedule()
+    assert out.blocks_to_swap_in == {2: 5}
+    assert out.blocks_to_swap_out == {6: 3}
+
+    # The worker swaps out first, so a swap in cannot read a CPU block that
+    # is written in the same step.
+    block_manager.prefix_blocks_to_swap_in = {3: 5}
+    block_manager.prefix_blocks_to_swap_out = {6: 3}
+    with pytest.raises(AssertionError):
+        scheduler.schedule()
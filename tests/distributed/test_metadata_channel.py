@@ -0,0 +1,128 @@
+"""Test the metadata channel on CPU with the gloo backend.
+
+Run `pytest tests/distributed/test_metadata_channel.py`.
+"""
+import socket
+
+import numpy as np
+import pytest
+import torch
+import torch.distributed
+import torch.multiprocessing as mp
+
+from vllm.model_executor.parallel_utils.metadata_channel import (
+    MetadataChannel, _diff_table)
+
+
+def _get_open_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+
+def _get_steps():
+    """Returns the metadata of a few steps, as sent by the driver."""
+    rng = np.random.default_rng(0)
+    # Block tables of decoding batches, where sequences finish, new blocks
+    # are appended and new sequences join.
+    table = rng.permutation(1000)[:48].astype(np.int32).reshape(6, 8)
+    table[:, 5:] = 0
+    tables = [table]
+    table = np.delete(table, 2, axis=0)
+    table[0, 5] = 1001
+    table[3, 5] = 1002
+    tables.append(table)
+    table = np.concatenate([table, [[1003, 1004, 0, 0, 0, 0, 0, 0]]])
+    table = table.astype(np.int32)
+    tables.append(table)
+    # Another width.
+    tables.append(table[:, :6].copy())
+    tables.append(table[::-1, :6].copy())
+
+    steps = []
+    for i, table in enumerate(tables):
+        steps.append({
+            "num_seq_groups":
+            len(table),
+            "is_prompt":
+            False,
+            "prompt_lens":
+            None,
+            "kv_cache_dtype":
+            "auto",
+            "input_tokens":
+            torch.arange(len(table)) * (i + 1),
+            "context_lens":
+            torch.full((len(table), ), i, dtype=torch.int),
+            "block_tables":
+            table,
+            "blocks_to_copy": {
+                3: [4, 5]
+            } if i % 2 else {},
+            "lora_requests":
+            set(),
+        })
+    # Prompt steps, with other keys and values that are not integers.
+    steps.insert(
+        2, {
+            "is_prompt": True,
+            "prompt_lens": [3, 5],
+            "input_tokens": torch.arange(20_000),
+            "block_tables": None,
+            "scale": 0.5,
+            "embeds": torch.arange(6, dtype=torch.float16).view(2, 3) / 4,
+            "mask": torch.tensor([True, False, True]),
+            "lora_requests": {"lora"},
+        })
+    steps.append({"num_seq_groups": 0})
+    return steps
+
+
+def _assert_equal(value, expected) -> None:
+    if isinstance(expected, (np.ndarray, torch.Tensor)):
+        expected = torch.as_tensor(expected)
+        assert value.dtype == expected.dtype
+        assert torch.equal(value, expected)
+    else:
+        assert type(value) is type(expected)
+        assert value == expected
+
+
+def _worker(rank: int, world_size: int, port: int, capacity: int) -> None:
+    torch.distributed.init_process_group(backend="gloo",
+                                         init_method=f"tcp://localhost:{port}",
+                                         world_size=world_size,
+                                         rank=rank)
+    channel = MetadataChannel(delta_keys=["block_tables"], capacity=capacity)
+    for step in _get_steps():
+        if rank == 0:
+            data = channel.broadcast(step)
+            assert data is step
+            continue
+        data = channel.broadcast()
+        assert list(data) == list(step)
+        for key, expected in step.items():
+            _assert_equal(data[key], expected)
+    torch.distributed.destroy_process_group()
+
+
+# With a capacity of 64, most steps are sent with two broadcasts.
+@pytest.mark.parametrize("world_size, capacity", [(2, 4096), (3, 64)])
+def test_metadata_channel(world_size: int, capacity: int):
+    mp.spawn(_worker,
+             args=(world_size, _get_open_port(), capacity),
+             nprocs=world_size)
+
+
+def test_diff_table():
+    table = np.arange(1, 33, dtype=np.int32).reshape(4, 8)
+    table[:, 6:] = 0
+    assert _diff_table(None, table) is None
+    assert _diff_table(table[:, :6], table) is None
+
+    new_table = table[[3, 1, 0]].copy()
+    new_table[1, 6] = 100
+    src_rows, positions, values = _diff_table(table, new_table)
+    assert src_rows.tolist() == [3, 1, 0]
+    assert positions.tolist() == [14]
+    assert values.tolist() == [100]
@@ -0,0 +1,96 @@
+"""Test the shared memory transport between the driver and the workers.
+
+Run `pytest tests/distributed/test_shm_transport.py`.
+"""
+import multiprocessing
+
+import pytest
+
+from vllm.executor.shm_transport import (ShmRingBuffer, ShmTransport,
+                                         is_shm_transport_supported,
+                                         run_worker_loop)
+
+pytestmark = pytest.mark.skipif(not is_shm_transport_supported(),
+                                reason="Requires x86_64.")
+
+# Messages that fit in a slot, fill it exactly and span several slots, with
+# the slots of 64 bytes of the tests.
+_MESSAGES = [b"a", b"", b"x" * 56, b"y" * 57, bytes(range(256)) * 4]
+
+
+def _read_messages(handle, reader: int, queue) -> None:
+    ring = ShmRingBuffer.attach(handle)
+    queue.put((reader, [ring.read(reader) for _ in _MESSAGES]))
+    ring.close()
+
+
+def test_ring_buffer():
+    ctx = multiprocessing.get_context("spawn")
+    num_readers = 2
+    ring = ShmRingBuffer(num_readers, num_slots=2, slot_size=64)
+    queue = ctx.Queue()
+    readers = [
+        ctx.Process(target=_read_messages, args=(ring.handle, i, queue))
+        for i in range(num_readers)
+    ]
+    for reader in readers:
+        reader.start()
+    for message in _MESSAGES:
+        ring.write(message)
+    results = dict(queue.get(timeout=60) for _ in readers)
+    for reader in readers:
+        reader.join()
+    ring.close()
+    assert results == {i: _MESSAGES for i in range(num_readers)}
+
+
+class _Worker:
+
+    def __init__(self, rank: int) -> None:
+        self.rank = rank
+
+    def __call__(self, method: str, *args, **kwargs):
+        if method == "fail":
+            raise ValueError(f"Worker {self.rank} failed.")
+        return method, self.rank, args, kwargs
+
+
+def _run_worker(handle, rank: int) -> None:
+    run_worker_loop(handle, rank, _Worker(rank))
+
+
+def test_shm_transport():
+    ctx = multiprocessing.get_context("spawn")
+    num_workers = 3
+    transport = ShmTransport(num_workers, num_slots=4, slot_size=128)
+    workers = [
+        ctx.Process(target=_run_worker, args=(transport.handle, rank))
+        for rank in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    call_id = transport.send("execute_model", (), {})
+    assert transport.recv(call_id) == [("execute_model", rank, (), {})
+                                       for rank in range(num_workers)]
+
+    # The results of the calls can be waited for in any order.
+    large_arg = "z" * 1000
+    first_id = transport.send("add_lora", (large_arg, ), {"lora_id": 1})
+    second_id = transport.send("list_loras", (), {})
+    assert transport.recv(second_id) == [("list_loras", rank, (), {})
+                                         for rank in range(num_workers)]
+    assert transport.recv(first_id) == [("add_lora", rank, (large_arg, ), {
+        "lora_id": 1
+    }) for rank in range(num_workers)]
+
+    with pytest.raises(ValueError, match="Worker 0 failed."):
+        transport.recv(transport.send("fail", (), {}))
+    # The workers keep serving the calls after an error.
+    call_id = transport.send("execute_model", (), {})
+    assert len(transport.recv(call_id)) == num_workers
+
+    transport.close()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
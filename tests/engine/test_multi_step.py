@@ -0,0 +1,62 @@
+"""Compare the outputs of multi-step and single-step decoding when the
+sequences stop in the middle of the decoding steps of a window.
+
+Run `pytest tests/engine/test_multi_step.py`.
+"""
+import pytest
+
+from vllm import SamplingParams
+
+MODELS = ["facebook/opt-125m"]
+NUM_DECODE_STEPS = 4
+
+
+def _generate(vllm_runner, model, prompts, sampling_params, num_decode_steps):
+    vllm_model = vllm_runner(model,
+                             use_v2_block_manager=True,
+                             num_decode_steps=num_decode_steps)
+    outputs = vllm_model.model.generate(prompts, sampling_params)
+    del vllm_model
+    return [(list(output.outputs[0].token_ids), output.outputs[0].text,
+             output.outputs[0].finish_reason) for output in outputs]
+
+
+@pytest.mark.parametrize("model", MODELS)
+@pytest.mark.parametrize("stop", ["max_tokens", "stop_token", "stop_string"])
+def test_multi_step_stop_mid_window(
+    vllm_runner,
+    example_prompts,
+    model: str,
+    stop: str,
+) -> None:
+    # 6 tokens end in the middle of the second window of 4 steps.
+    max_tokens = 6
+    greedy_outputs = _generate(vllm_runner, model, example_prompts,
+                               SamplingParams(temperature=0.0, max_tokens=16),
+                               1)
+    if stop == "max_tokens":
+        sampling_params = [
+            SamplingParams(temperature=0.0, max_tokens=max_tokens)
+        ] * len(example_prompts)
+    elif stop == "stop_token":
+        # The EOS and the stop tokens stop the sequences the same way.
+        sampling_params = [
+            SamplingParams(temperature=0.0,
+                           max_tokens=16,
+                           stop_token_ids=[token_ids[max_tokens - 1]])
+            for token_ids, _, _ in greedy_outputs
+        ]
+    else:
+        sampling_params = [
+            SamplingParams(temperature=0.0, max_tokens=16, stop=[text[-3:]])
+            for _, text, _ in greedy_outputs
+        ]
+
+    expected_outputs = _generate(vllm_runner, model, example_prompts,
+                                 sampling_params, 1)
+    multi_step_outputs = _generate(vllm_runner, model, example_prompts,
+                                   sampling_params, NUM_DECODE_STEPS)
+    for i in range(len(example_prompts)):
+        assert multi_step_outputs[i] == expected_outputs[i], (
+            f"Test{i}:\nSingle step: {expected_outputs[i]}\n"
+            f"Multi step: {multi_step_outputs[i]}")
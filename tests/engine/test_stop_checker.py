@@ -0,0 +1,79 @@
+import random
+from typing import List, Tuple
+
+import pytest
+
+from vllm.engine.stop_checker import (StopChecker, StopStringMatcher,
+                                      get_stop_checker)
+from vllm.sampling_params import SamplingParams
+from vllm.sequence import Sequence, SequenceGroup
+
+
+def _find_first_stop(stop: List[str], text: str,
+                     start: int) -> Tuple[int, int]:
+    """Reference: the stop string that ends first in text[start:], ties
+    broken by the order of the stop strings."""
+    for end in range(start + 1, len(text) + 1):
+        for index, stop_str in enumerate(stop):
+            if stop_str and text.endswith(stop_str, 0, end):
+                return index, end
+    return -1, len(text)
+
+
+@pytest.mark.parametrize("seed", list(range(20)))
+def test_stop_string_matcher(seed: int):
+    random.seed(seed)
+    alphabet = "abc\n"
+    stop = [
+        "".join(random.choices(alphabet, k=random.randint(1, 6)))
+        for _ in range(random.randint(1, 30))
+    ]
+    matcher = StopStringMatcher(tuple(stop))
+
+    for _ in range(20):
+        text = ""
+        state = 0
+        searched = 0
+        while len(text) < 100:
+            # Feed the text in chunks, as in the decoding steps.
+            text += "".join(random.choices(alphabet, k=random.randint(0, 5)))
+            if random.random() < 0.2:
+                # Stop strings are not checked before min_tokens.
+                state = matcher.advance(state, text, searched)
+                searched = len(text)
+                continue
+            state, index, end = matcher.find(state, text, searched)
+            expected_index, expected_end = _find_first_stop(
+                stop, text, searched)
+            assert (index, end) == (expected_index, expected_end)
+            if index != -1:
+                break
+            searched = len(text)
+
+
+def test_stop_string_matcher_empty_stop_string():
+    matcher = StopStringMatcher(("abc", ""))
+    assert matcher.find(0, "xyz", 1) == (0, 1, 1)
+
+
+@pytest.mark.parametrize("ignore_eos", [True, False])
+def test_stop_checker_stop_token_ids(ignore_eos: bool):
+    sampling_params = SamplingParams(stop_token_ids=[5, 7],
+                                     ignore_eos=ignore_eos)
+    stop_checker = StopChecker(sampling_params, eos_token_id=2)
+    assert stop_checker.stop_string_matcher is None
+    expected = {5, 7} if ignore_eos else {2, 5, 7}
+    assert stop_checker.stop_token_ids == expected
+
+
+def test_get_stop_checker():
+    """The stop checker of a group created without one is built on first
+    use."""
+    sampling_params = SamplingParams(stop=["abc"], stop_token_ids=[5])
+    seq = Sequence(0, "", [1], block_size=16, eos_token_id=2)
+    seq_group = SequenceGroup("0", [seq], sampling_params, arrival_time=0.0)
+    assert seq_group.stop_checker is None
+    stop_checker = get_stop_checker(seq_group)
+    assert stop_checker.stop_string_matcher.stop == ("abc", )
+    assert stop_checker.stop_token_ids == {2, 5}
+    assert get_stop_checker(seq_group) is stop_checker
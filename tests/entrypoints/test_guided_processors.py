@@ -1,11 +1,18 @@
 # This unit test should be moved to a new
 # tests/test_guided_decoding directory.
 
+import asyncio
+import time
+
 import torch
 from transformers import AutoTokenizer
 
+from vllm.model_executor import guided_decoding
+from vllm.model_executor.guided_decoding import (CompiledGuideCache,
+                                                 GuidedDecodingMode)
 from vllm.model_executor.guided_logits_processors import (JSONLogitsProcessor,
-                                                          RegexLogitsProcessor)
+                                                          RegexLogitsProcessor,
+                                                          TokenBitmaskCache)
 
 TEST_SCHEMA = {
     "type": "object",
@@ -73,3 +80,84 @@ def test_guided_logits_processors():
     json_LP(token_ids, tensor)
     assert tensor.shape == original_tensor.shape
     assert not torch.allclose(tensor, original_tensor)
+
+
+def test_token_bitmask_cache():
+    """The least recently used bitmasks are evicted past the byte budget."""
+    bitmask_bytes = 1000 * 4
+    cache = TokenBitmaskCache(3 * bitmask_bytes)
+    for state in range(3):
+        cache.put(state, torch.zeros(1000, dtype=torch.int32))
+    assert cache.num_bytes == 3 * bitmask_bytes
+    # Replacing a bitmask does not count it twice.
+    cache.put(0, torch.zeros(1000, dtype=torch.int32))
+    assert cache.num_bytes == 3 * bitmask_bytes
+
+    cache.put(3, torch.zeros(1000, dtype=torch.int32))
+    assert list(cache.cache) == [2, 0, 3]
+    cache.put(4, torch.zeros(2000, dtype=torch.int32))
+    assert list(cache.cache) == [3, 4]
+    assert cache.num_bytes == 3 * bitmask_bytes
+    cache.clear()
+    assert cache.num_bytes == 0
+
+
+def test_compiled_guide_cache(monkeypatch):
+    """Concurrent requests for a guide share one compilation, and the least
+    recently used guides are evicted past the memory budget."""
+    tokenizer = AutoTokenizer.from_pretrained('HuggingFaceH4/zephyr-7b-beta')
+    compiled = []
+
+    def get_logits_processor(guide, tokenizer, mode):
+        time.sleep(0.1)
+        compiled.append(guide)
+        return RegexLogitsProcessor(guide, tokenizer)
+
+    monkeypatch.setattr(guided_decoding, "_get_logits_processor",
+                        get_logits_processor)
+    cache = CompiledGuideCache(max_bytes=2**40)
+
+    async def get_all(guides):
+        return await asyncio.gather(
+            *(cache.get(guide, tokenizer, GuidedDecodingMode.REGEX)
+              for guide in guides))
+
+    results = asyncio.run(get_all([TEST_REGEX] * 4))
+    assert compiled == [TEST_REGEX]
+    assert all(result is results[0] for result in results)
+    assert (cache.num_misses, cache.num_hits) == (1, 3)
+
+    # Leave room for one guide only.
+    cache.max_bytes = cache.num_bytes
+    asyncio.run(get_all(["(yes|no)"]))
+    asyncio.run(get_all([TEST_REGEX]))
+    assert compiled == [TEST_REGEX, "(yes|no)", TEST_REGEX]
+
+
+def test_compiled_guide_cache_persistence(monkeypatch, tmp_path):
+    """The compiled regex FSMs are loaded from the cache directory instead
+    of being compiled again."""
+    tokenizer = AutoTokenizer.from_pretrained('HuggingFaceH4/zephyr-7b-beta')
+    cache = CompiledGuideCache(max_bytes=2**40, cache_dir=str(tmp_path))
+    compiled = asyncio.run(
+        cache.get(TEST_REGEX, tokenizer, GuidedDecodingMode.REGEX))
+
+    def get_logits_processor(guide, tokenizer, mode):
+        raise AssertionError("The guide should be loaded from disk.")
+
+    monkeypatch.setattr(guided_decoding, "_get_logits_processor",
+                        get_logits_processor)
+    cache = CompiledGuideCache(max_bytes=2**40, cache_dir=str(tmp_path))
+    loaded = asyncio.run(
+        cache.get(TEST_REGEX, tokenizer, GuidedDecodingMode.REGEX))
+    assert loaded.get_fsm_index() == compiled.get_fsm_index()
+    # The indexes are saved as arrays, which load without pickle.
+    assert [path.suffix for path in tmp_path.iterdir()] == [".npz"]
+
+    token_ids = tokenizer.encode("192.168.", add_special_tokens=False)
+    compiled.init_state()
+    loaded.init_state()
+    for i in range(len(token_ids) + 1):
+        tensor = torch.rand(32000)
+        assert torch.equal(compiled(token_ids[:i], tensor.clone()),
+                           loaded(token_ids[:i], tensor.clone()))
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+
+from vllm.entrypoints.openai import serving_engine
+from vllm.entrypoints.openai.protocol import CompletionRequest
+from vllm.entrypoints.openai.serving_completion import OpenAIServingCompletion
+from vllm.outputs import CompletionOutput, RequestOutput
+from vllm.sequence import RequestMetrics
+
+MODEL_NAME = "test-model"
+
+
+class MockEngine:
+
+    async def get_model_config(self):
+        return SimpleNamespace(max_model_len=128,
+                               tokenizer=MODEL_NAME,
+                               tokenizer_mode="auto",
+                               trust_remote_code=False)
+
+
+def _create_request_output(request_id: str,
+                           metrics: RequestMetrics) -> RequestOutput:
+    output = CompletionOutput(0, " world", [1, 2], 0.0, None, "length")
+    return RequestOutput(request_id, "Hello", [3, 4, 5], None, [output], True,
+                         metrics)
+
+
+def _create_request_metrics(num_swaps: int,
+                            num_recomputes: int) -> RequestMetrics:
+    return RequestMetrics(arrival_time=0.0,
+                          last_token_time=2.0,
+                          first_scheduled_time=0.5,
+                          first_token_time=0.75,
+                          time_in_queue=0.5,
+                          finished_time=2.0,
+                          num_swaps=num_swaps,
+                          num_recomputes=num_recomputes,
+                          time_in_waiting=1.0,
+                          time_in_swapped=0.25)
+
+
+@pytest.mark.parametrize("return_request_metrics", [False, True])
+def test_completion_usage_request_metrics(monkeypatch,
+                                          return_request_metrics: bool):
+    monkeypatch.setattr(serving_engine, "get_tokenizer",
+                        lambda *args, **kwargs: None)
+    serving_completion = OpenAIServingCompletion(
+        MockEngine(),
+        MODEL_NAME,
+        return_request_metrics=return_request_metrics)
+    request = CompletionRequest(model=MODEL_NAME,
+                                prompt=["Hello", "Hello"],
+                                max_tokens=2)
+    final_res_batch = [
+        _create_request_output("cmpl-0-0", _create_request_metrics(1, 0)),
+        _create_request_output("cmpl-0-1", _create_request_metrics(0, 2)),
+    ]
+    response = serving_completion.request_output_to_completion_response(
+        final_res_batch, request, "cmpl-0", 0, MODEL_NAME)
+
+    usage = response.usage
+    assert (usage.prompt_tokens, usage.completion_tokens) == (6, 4)
+    if not return_request_metrics:
+        assert usage.request_metrics is None
+        return
+    # The metrics are summed over the prompts of the request.
+    request_metrics = usage.request_metrics
+    assert request_metrics.time_in_queue == 1.0
+    assert request_metrics.time_in_waiting == 2.0
+    assert request_metrics.time_in_swapped == 0.5
+    assert request_metrics.prefill_time == 0.5
+    assert request_metrics.num_swaps == 1
+    assert request_metrics.num_recomputes == 2
+    assert request_metrics.num_preemptions == 3
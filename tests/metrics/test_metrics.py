@@ -1,5 +1,10 @@
+import json
+
 import pytest
 
+from vllm.engine.metrics import StatLogger, Stats, StepTracer
+from vllm.sequence import RequestMetrics
+
 MODELS = [
     "facebook/opt-125m",
 ]
@@ -68,3 +73,139 @@ def test_metric_counter_generation_tokens(
     assert vllm_generation_count == metric_count, (
         f"generation token count: {vllm_generation_count!r}\n"
         f"metric: {metric_count!r}")
+
+
+@pytest.mark.parametrize("model", MODELS)
+@pytest.mark.parametrize("dtype", ["float"])
+@pytest.mark.parametrize("max_tokens", [16])
+def test_metric_step_phase_time(
+    vllm_runner,
+    example_prompts,
+    model: str,
+    dtype: str,
+    max_tokens: int,
+) -> None:
+    vllm_model = vllm_runner(model,
+                             dtype=dtype,
+                             disable_log_stats=False,
+                             gpu_memory_utilization=0.4)
+    vllm_model.generate_greedy(example_prompts, max_tokens)
+    stat_logger = vllm_model.model.llm_engine.stat_logger
+    histogram = stat_logger.metrics.histogram_step_phase_time
+    for phase in ("schedule", "prepare", "forward", "sample", "detokenize",
+                  "process_outputs"):
+        samples = histogram.labels(**stat_logger.labels,
+                                   phase=phase).collect()[0].samples
+        count = next(sample.value for sample in samples
+                     if sample.name.endswith("_count"))
+        assert count > 0, f"phase {phase!r} is not timed"
+
+
+@pytest.mark.parametrize("model", MODELS)
+@pytest.mark.parametrize("dtype", ["float"])
+@pytest.mark.parametrize("max_tokens", [16])
+def test_step_phases_not_timed_without_stats(
+    vllm_runner,
+    example_prompts,
+    model: str,
+    dtype: str,
+    max_tokens: int,
+) -> None:
+    vllm_model = vllm_runner(model,
+                             dtype=dtype,
+                             disable_log_stats=True,
+                             gpu_memory_utilization=0.4)
+    model_runner = (
+        vllm_model.model.llm_engine.model_executor.driver_worker.model_runner)
+    execute_model = model_runner.execute_model
+    decode_phases = []
+
+    def execute_and_record(seq_group_metadata_list, *args, **kwargs):
+        output = execute_model(seq_group_metadata_list, *args, **kwargs)
+        if not seq_group_metadata_list[0].is_prompt:
+            decode_phases.append(set(output.phase_times))
+        return output
+
+    model_runner.execute_model = execute_and_record
+    vllm_model.generate_greedy(example_prompts, max_tokens)
+    # Without stats, the decode steps are not timed on the device.
+    assert decode_phases
+    assert all(phases == {"prepare"} for phases in decode_phases)
+
+
+def test_step_tracer(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = StepTracer(str(path))
+    stats = Stats(now=1.0,
+                  num_running=1,
+                  num_waiting=0,
+                  num_swapped=0,
+                  gpu_cache_usage=0.5,
+                  cpu_cache_usage=0.0,
+                  num_prompt_tokens=0,
+                  num_generation_tokens=1,
+                  time_to_first_tokens=[],
+                  time_per_output_tokens=[0.01],
+                  time_e2e_requests=[],
+                  finished_request_metrics=[],
+                  step_phase_times={"schedule": 0.001})
+    tracer.trace(stats)
+    # Every step is written out before the tracer is closed.
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == 1
+    assert records[0]["now"] == 1.0
+    assert records[0]["step_phase_times"] == {"schedule": 0.001}
+
+    tracer.close()
+    tracer.trace(stats)
+    assert len(path.read_text().splitlines()) == 1
+
+
+def _get_histogram_samples(histogram, **labels):
+    samples = histogram.labels(**labels).collect()[0].samples
+    return {
+        sample.name.rsplit("_", 1)[-1]: sample.value
+        for sample in samples if not sample.name.endswith("_bucket")
+    }
+
+
+def test_request_lifecycle_histograms():
+    stat_logger = StatLogger(local_interval=5.0,
+                             labels={"model_name": "test-model"})
+    request_metrics = RequestMetrics(arrival_time=0.0,
+                                     last_token_time=3.0,
+                                     first_scheduled_time=1.0,
+                                     first_token_time=1.5,
+                                     time_in_queue=1.0,
+                                     finished_time=3.0,
+                                     num_swaps=1,
+                                     num_recomputes=2,
+                                     time_in_waiting=1.25,
+                                     time_in_swapped=0.5)
+    stats = Stats(now=3.0,
+                  num_running=0,
+                  num_waiting=0,
+                  num_swapped=0,
+                  gpu_cache_usage=0.0,
+                  cpu_cache_usage=0.0,
+                  num_prompt_tokens=0,
+                  num_generation_tokens=1,
+                  time_to_first_tokens=[],
+                  time_per_output_tokens=[],
+                  time_e2e_requests=[3.0],
+                  finished_request_metrics=[request_metrics])
+    stat_logger.log(stats)
+
+    metrics = stat_logger.metrics
+    swap_labels = {**stat_logger.labels, "mode": "swap"}
+    recompute_labels = {**stat_logger.labels, "mode": "recompute"}
+    expected = [
+        (metrics.histogram_num_preemptions_request, swap_labels, 1),
+        (metrics.histogram_num_preemptions_request, recompute_labels, 2),
+        (metrics.histogram_time_in_waiting_request, stat_logger.labels, 1.25),
+        (metrics.histogram_time_in_swapped_request, stat_logger.labels, 0.5),
+        (metrics.histogram_prefill_time_request, stat_logger.labels, 0.5),
+    ]
+    for histogram, labels, value in expected:
+        samples = _get_histogram_samples(histogram, **labels)
+        assert samples == {"count": 1, "sum": value}
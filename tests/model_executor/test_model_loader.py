@@ -0,0 +1,94 @@
+from typing import Any, Dict
+
+import pytest
+import torch
+import torch.nn as nn
+
+from vllm.model_executor import model_loader
+from vllm.model_executor.layers.linear import UnquantizedLinearMethod
+
+
+class PackedLinearMethod(UnquantizedLinearMethod):
+    """Repacks the weight on the first forward pass, like GPTQ."""
+
+    def get_weights_state(self, weights: Dict[str, Any]) -> Dict[str, str]:
+        return {"packed": str(weights["packed"])}
+
+    def set_weights_state(self, weights: Dict[str, Any],
+                          state: Dict[str, str]) -> None:
+        weights["packed"] = state["packed"] == "True"
+
+
+class Linear(nn.Module):
+
+    def __init__(self, size: int):
+        super().__init__()
+        self.linear_method = PackedLinearMethod()
+        self.linear_weights = self.linear_method.create_weights(
+            size, size, size, size, torch.float32)
+        self.linear_weights["packed"] = False
+        self.register_parameter("weight", self.linear_weights["weight"])
+
+
+class Model(nn.Module):
+
+    def __init__(self, vocab_size: int = 16, hidden_size: int = 8):
+        super().__init__()
+        self.embed_tokens = nn.Embedding(vocab_size, hidden_size)
+        self.layers = nn.ModuleList(Linear(hidden_size) for _ in range(2))
+        self.norm = nn.LayerNorm(hidden_size)
+        self.lm_head = nn.Linear(hidden_size, vocab_size, bias=False)
+        # Tied embeddings.
+        self.lm_head.weight = self.embed_tokens.weight
+
+
+def _set_tp_rank(monkeypatch, rank: int, world_size: int) -> None:
+    monkeypatch.setattr(model_loader, "get_tensor_model_parallel_rank",
+                        lambda: rank)
+    monkeypatch.setattr(model_loader, "get_tensor_model_parallel_world_size",
+                        lambda: world_size)
+
+
+@torch.no_grad()
+def test_sharded_state(monkeypatch, tmp_path):
+    world_size = 2
+    models = []
+    for rank in range(world_size):
+        _set_tp_rank(monkeypatch, rank, world_size)
+        model = Model()
+        for param in model.parameters():
+            param.uniform_()
+        model.layers[1].linear_weights["packed"] = True
+        model_loader.save_sharded_state(model, str(tmp_path))
+        models.append(model)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "model-rank-0-of-2.safetensors", "model-rank-1-of-2.safetensors"
+    ]
+
+    for rank in range(world_size):
+        _set_tp_rank(monkeypatch, rank, world_size)
+        model = Model()
+        model_loader._load_sharded_state(model, str(tmp_path))
+        expected = models[rank].state_dict()
+        for name, tensor in model.state_dict().items():
+            assert torch.equal(tensor, expected[name])
+        assert model.lm_head.weight is model.embed_tokens.weight
+        assert not model.layers[0].linear_weights["packed"]
+        assert model.layers[1].linear_weights["packed"]
+
+
+def test_sharded_state_mismatch(monkeypatch, tmp_path):
+    _set_tp_rank(monkeypatch, 0, 1)
+    model_loader.save_sharded_state(Model(), str(tmp_path))
+    with pytest.raises(ValueError, match="shape"):
+        model_loader._load_sharded_state(Model(vocab_size=32), str(tmp_path))
+
+    model = Model()
+    model.bias = nn.Parameter(torch.zeros(1))
+    with pytest.raises(ValueError, match="Missing weights: \\['bias'\\]"):
+        model_loader._load_sharded_state(model, str(tmp_path))
+
+    # Another tensor parallel size.
+    _set_tp_rank(monkeypatch, 0, 2)
+    with pytest.raises(ValueError, match="tensor parallel size"):
+        model_loader._load_sharded_state(Model(), str(tmp_path))
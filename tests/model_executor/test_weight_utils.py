@@ -0,0 +1,98 @@
+import pytest
+import torch
+from safetensors.torch import load_file, save_file
+
+from vllm.model_executor.weight_utils import hf_model_weights_iterator
+
+
+def _save_checkpoint(path) -> dict:
+    tensors = [{
+        "embed.weight": torch.randn(32, 8, dtype=torch.bfloat16),
+        "layer.0.weight": torch.randn(16, 8),
+        "layer.0.scale": torch.tensor(0.5, dtype=torch.float16),
+        "layer.0.mask": torch.rand(4, 4) > 0.5,
+    }, {
+        "layer.1.weight":
+        torch.randint(-8, 8, (8, 16), dtype=torch.int8),
+        "layer.1.bias":
+        torch.randn(3, dtype=torch.float64),
+        "layer.1.empty":
+        torch.empty(0, 4),
+    }]
+    for i, file_tensors in enumerate(tensors):
+        save_file(file_tensors, str(path / f"model-{i}.safetensors"))
+    return {k: v for file_tensors in tensors for k, v in file_tensors.items()}
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_safetensors_weights_iterator(tmp_path, max_workers: int):
+    expected = _save_checkpoint(tmp_path)
+    weights = dict(
+        hf_model_weights_iterator(str(tmp_path),
+                                  load_format="safetensors",
+                                  max_workers=max_workers))
+    assert weights.keys() == expected.keys()
+    for name, tensor in expected.items():
+        assert weights[name].dtype == tensor.dtype
+        assert torch.equal(weights[name], tensor)
+
+
+def test_safetensors_weights_iterator_shards(tmp_path):
+    expected = _save_checkpoint(tmp_path)
+    tp_size = 4
+    for tp_rank in range(tp_size):
+        for name, loaded_weight in hf_model_weights_iterator(
+                str(tmp_path), load_format="safetensors"):
+            if name != "layer.0.weight":
+                continue
+            # Slice the shards like the weight loaders of the linear layers.
+            for dim in range(2):
+                shard_size = loaded_weight.shape[dim] // tp_size
+                start_idx = tp_rank * shard_size
+                shard = torch.empty_like(expected[name].narrow(
+                    dim, start_idx, shard_size))
+                shard.copy_(loaded_weight.narrow(dim, start_idx, shard_size))
+                assert torch.equal(
+                    shard, expected[name].narrow(dim, start_idx, shard_size))
+
+
+def test_safetensors_weights_iterator_in_place(tmp_path):
+    _save_checkpoint(tmp_path)
+    for name, loaded_weight in hf_model_weights_iterator(
+            str(tmp_path), load_format="safetensors"):
+        if name == "layer.0.weight":
+            # Some models modify the loaded weights in place.
+            loaded_weight += 1.0
+    # The files are not modified.
+    weights = load_file(str(tmp_path / "model-0.safetensors"))
+    reloaded = dict(
+        hf_model_weights_iterator(str(tmp_path), load_format="safetensors"))
+    assert torch.equal(reloaded["layer.0.weight"], weights["layer.0.weight"])
+
+
+def test_npcache_weights_iterator(tmp_path):
+    expected = [{
+        "embed.weight": torch.randn(32, 8, dtype=torch.bfloat16),
+        "layer.0.weight": torch.randn(16, 8).t(),
+        "layer.0.scale": torch.tensor(0.5, dtype=torch.float16),
+    }, {
+        "layer.1.weight":
+        torch.randint(-8, 8, (8, 16), dtype=torch.int8),
+        "layer.1.empty":
+        torch.empty(0, 4),
+    }]
+    for i, state in enumerate(expected):
+        torch.save(state, tmp_path / f"pytorch_model-{i}.bin")
+    expected = {k: v for state in expected for k, v in state.items()}
+
+    for _ in range(2):
+        # The first iteration builds the cache, the second one reuses it.
+        weights = dict(
+            hf_model_weights_iterator(str(tmp_path), load_format="npcache"))
+        assert weights.keys() == expected.keys()
+        for name, tensor in expected.items():
+            assert weights[name].dtype == tensor.dtype
+            assert torch.equal(weights[name], tensor)
+        assert sorted(p.name for p in (tmp_path / "np").iterdir()) == [
+            "weights.data", "weights.json"
+        ]
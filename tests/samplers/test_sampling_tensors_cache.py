@@ -0,0 +1,186 @@
+import random
+
+import pytest
+import torch
+
+from vllm.model_executor.layers.sampler import (_apply_penalties,
+                                                _get_penalty_counts)
+from vllm.model_executor.sampling_metadata import (SamplingMetadata,
+                                                   SamplingTensors,
+                                                   SamplingTensorsCache)
+from vllm.sampling_params import SamplingParams, SamplingType
+from vllm.sequence import SequenceData
+
+VOCAB_SIZE = 128
+
+
+def _random_sampling_params() -> SamplingParams:
+    if random.random() < 0.3:
+        return SamplingParams(temperature=0)
+    return SamplingParams(
+        temperature=random.choice([0.5, 1.0]),
+        top_p=random.choice([0.9, 1.0]),
+        top_k=random.choice([-1, 10]),
+        min_p=random.choice([0.0, 0.1]),
+        presence_penalty=random.choice([0.0, 0.5]),
+        frequency_penalty=random.choice([0.0, -0.5]),
+        repetition_penalty=random.choice([1.0, 1.2]),
+        seed=random.choice([None, 0, 1]),
+    )
+
+
+def _make_sampling_metadata(seq_groups, seq_data, num_prompts):
+    return SamplingMetadata(
+        seq_groups=seq_groups,
+        seq_data=seq_data,
+        prompt_lens=[
+            seq_data[seq_ids[0]].get_prompt_len()
+            for seq_ids, _ in seq_groups[:num_prompts]
+        ],
+        selected_token_indices=None,
+        categorized_sample_indices=None,
+    )
+
+
+def _penalized_logits(tensors: SamplingTensors, logits: torch.Tensor):
+    prompt_mask, output_bin_counts = _get_penalty_counts(tensors, VOCAB_SIZE)
+    return _apply_penalties(logits.clone(), prompt_mask, output_bin_counts,
+                            tensors.presence_penalties.clone(),
+                            tensors.frequency_penalties.clone(),
+                            tensors.repetition_penalties.clone())
+
+
+def _check_sampling_tensors(cache: SamplingTensorsCache,
+                            sampling_metadata: SamplingMetadata) -> None:
+    expected, *expected_flags = SamplingTensors.from_sampling_metadata(
+        sampling_metadata, VOCAB_SIZE, torch.device("cpu"), torch.float32)
+    actual, *actual_flags = cache.get_sampling_tensors(sampling_metadata,
+                                                       VOCAB_SIZE,
+                                                       torch.device("cpu"),
+                                                       torch.float32)
+
+    assert actual_flags == expected_flags
+    for name in ("temperatures", "top_ps", "top_ks", "min_ps",
+                 "presence_penalties", "frequency_penalties",
+                 "repetition_penalties", "sample_indices"):
+        torch.testing.assert_close(getattr(actual, name),
+                                   getattr(expected, name))
+    # The seeds of the unseeded random sampling are drawn at every step.
+    assert actual.sampling_seeds.shape == expected.sampling_seeds.shape
+    deterministic = torch.tensor([
+        sampling_params.seed is not None
+        or sampling_params.sampling_type == SamplingType.GREEDY
+        for seq_ids, sampling_params in sampling_metadata.seq_groups
+        for _ in seq_ids
+    ])
+    torch.testing.assert_close(actual.sampling_seeds[:, deterministic],
+                               expected.sampling_seeds[:, deterministic])
+    assert (actual.sampling_seeds[:, ~deterministic] != 0).all()
+    if expected_flags[0]:
+        logits = torch.randn(len(expected.temperatures), VOCAB_SIZE)
+        torch.testing.assert_close(_penalized_logits(actual, logits),
+                                   _penalized_logits(expected, logits))
+
+
+@pytest.mark.parametrize("seed", list(range(4)))
+def test_sampling_tensors_cache(seed: int):
+    """The cached sampling tensors match the ones built from scratch while
+    sequences join, decode, fork and finish."""
+    random.seed(seed)
+    torch.manual_seed(seed)
+    cache = SamplingTensorsCache()
+    # seq_ids -> sampling params of the running groups.
+    groups = []
+    seq_data = {}
+    next_seq_id = 0
+    for _ in range(50):
+        prompts = []
+        for _ in range(random.randint(0, 2)):
+            sampling_params = _random_sampling_params()
+            seq_data[next_seq_id] = SequenceData([
+                random.randrange(VOCAB_SIZE)
+                for _ in range(random.randint(1, 20))
+            ])
+            prompts.append(([next_seq_id], sampling_params))
+            next_seq_id += 1
+
+        seq_groups = prompts + groups
+        if not seq_groups:
+            continue
+        sampling_metadata = _make_sampling_metadata(seq_groups, seq_data,
+                                                    len(prompts))
+        _check_sampling_tensors(cache, sampling_metadata)
+
+        # Decode a token, fork and finish sequences.
+        groups = []
+        for seq_ids, sampling_params in seq_groups:
+            if random.random() < 0.1:
+                continue
+            for seq_id in seq_ids:
+                seq_data[seq_id].append_token_id(random.randrange(VOCAB_SIZE),
+                                                 0.0)
+            if random.random() < 0.1:
+                parent = seq_data[seq_ids[0]]
+                child = SequenceData(parent.prompt_token_ids,
+                                     parent.output_token_ids[:])
+                seq_data[next_seq_id] = child
+                seq_ids = seq_ids + [next_seq_id]
+                next_seq_id += 1
+            groups.append((seq_ids, sampling_params))
+
+
+def test_sampling_tensors_cache_params_change():
+    """The rows of a sequence are rewritten when its sampling parameters
+    change between steps, whether they are replaced or changed in place."""
+    cache = SamplingTensorsCache()
+    seq_data = {0: SequenceData([1, 2, 3])}
+    sampling_params = SamplingParams(temperature=1.0,
+                                     presence_penalty=0.5,
+                                     seed=0)
+
+    def step(sampling_params: SamplingParams) -> None:
+        _check_sampling_tensors(
+            cache,
+            _make_sampling_metadata([([0], sampling_params)], seq_data, 0))
+        seq_data[0].append_token_id(random.randrange(VOCAB_SIZE), 0.0)
+
+    step(sampling_params)
+    # Replaced by an object with other values.
+    sampling_params = SamplingParams(temperature=0.5,
+                                     top_k=10,
+                                     frequency_penalty=0.5,
+                                     seed=1)
+    step(sampling_params)
+    # Replaced by an object with the same values.
+    sampling_params = sampling_params.clone()
+    step(sampling_params)
+    # Changed in place.
+    sampling_params.top_p = 0.5
+    sampling_params.frequency_penalty = 0.0
+    sampling_params.repetition_penalty = 1.2
+    step(sampling_params)
+    # Without penalties.
+    step(SamplingParams(temperature=0))
+
+
+def test_sampling_tensors_cache_counts_rows():
+    """The vocab-sized counts are only allocated for the sequences with
+    penalties, without slack."""
+    cache = SamplingTensorsCache()
+    seq_data = {i: SequenceData([i]) for i in range(8)}
+    penalties = SamplingParams(presence_penalty=0.5)
+    no_penalties = SamplingParams()
+    seq_groups = ([([i], penalties)
+                   for i in range(5)] + [([i], no_penalties)
+                                         for i in range(5, 8)])
+    _check_sampling_tensors(cache,
+                            _make_sampling_metadata(seq_groups, seq_data, 8))
+    # Row 0 is shared by the sequences without penalties.
+    assert cache.output_bin_counts.shape == (6, VOCAB_SIZE)
+    assert cache.prompt_mask.shape == (6, VOCAB_SIZE)
+
+    # The rows of the finished sequences are reused.
+    seq_groups = [([i], penalties) for i in range(3, 8)]
+    _check_sampling_tensors(cache,
+                            _make_sampling_metadata(seq_groups, seq_data, 0))
+    assert cache.output_bin_counts.shape == (6, VOCAB_SIZE)
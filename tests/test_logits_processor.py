@@ -1,11 +1,14 @@
 import random
-from typing import Tuple
+from typing import List, Tuple
 from unittest.mock import patch
 
 import pytest
 import torch
 
-from vllm.model_executor.layers.logits_processor import LogitsProcessor
+from vllm.model_executor.layers.logits_processor import (
+    LogitsProcessor, _apply_logits_processors, apply_token_bitmasks_,
+    make_token_bitmask)
+from vllm.model_executor.sampling_metadata import SamplingMetadata
 from vllm.model_executor.utils import set_random_seed
 from vllm.sequence import SamplingParams, SequenceData, SequenceGroupMetadata
 from vllm.worker.model_runner import ModelRunner
@@ -92,3 +95,61 @@ def test_logits_processors(seed: int, device: str):
                           1e-4)
 
     del model_runner
+
+
+class AllowedTokensLogitsProcessor:
+    """Allows the tokens that are a multiple of the number of generated
+    tokens plus one."""
+
+    def get_allowed_token_bitmask(self, token_ids: List[int], vocab_size: int,
+                                  device: torch.device) -> torch.Tensor:
+        allowed = list(range(0, vocab_size, len(token_ids) + 1))
+        return make_token_bitmask(allowed, vocab_size).to(device)
+
+    def __call__(self, token_ids: List[int],
+                 logits: torch.Tensor) -> torch.Tensor:
+        bitmask = self.get_allowed_token_bitmask(token_ids, logits.shape[-1],
+                                                 logits.device)
+        apply_token_bitmasks_(logits.unsqueeze(0), [0], bitmask.unsqueeze(0))
+        return logits
+
+
+@pytest.mark.parametrize("seed", RANDOM_SEEDS[:8])
+@pytest.mark.parametrize("device", CUDA_DEVICES)
+def test_logits_processors_token_bitmask(seed: int, device: str):
+    """The bitmasks of the sequences are applied together, with the same
+    result as applying the logits processors one sequence at a time."""
+    set_random_seed(seed)
+    torch.set_default_device(device)
+    vocab_size = 1000
+
+    def add_one(token_ids, logits):
+        return logits + 1
+
+    processor_choices = [
+        None, [add_one], [AllowedTokensLogitsProcessor()],
+        [add_one, AllowedTokensLogitsProcessor()],
+        [AllowedTokensLogitsProcessor(), add_one]
+    ]
+    seq_groups = []
+    seq_data = {}
+    for i in range(random.randint(1, 64)):
+        seq_data[i] = SequenceData([1, 2, 3], [5] * random.randint(0, 20))
+        sampling_params = SamplingParams(
+            logits_processors=random.choice(processor_choices))
+        seq_groups.append(([i], sampling_params))
+    sampling_metadata = SamplingMetadata(seq_groups=seq_groups,
+                                         seq_data=seq_data,
+                                         prompt_lens=None,
+                                         selected_token_indices=None,
+                                         categorized_sample_indices=None)
+
+    logits = torch.randn(len(seq_groups), vocab_size)
+    expected = logits.clone()
+    for row, (seq_ids, sampling_params) in enumerate(seq_groups):
+        token_ids = seq_data[seq_ids[0]].output_token_ids
+        for logits_processor in sampling_params.logits_processors or []:
+            expected[row] = logits_processor(token_ids, expected[row])
+
+    actual = _apply_logits_processors(logits, sampling_metadata)
+    assert torch.equal(actual, expected)
@@ -1,7 +1,16 @@
+import copy
+import json
+import pickle
+import time
+
 import pytest
 
-from vllm.sequence import (SamplerOutput, SequenceData, SequenceGroupOutput,
-                           SequenceOutput)
+from vllm.outputs import RequestOutput
+from vllm.sampling_params import SamplingParams
+from vllm.sequence import (Logprob, SamplerOutput, Sequence, SequenceData,
+                           SequenceGroup, SequenceGroupOutput,
+                           SequenceLogprobs, SequenceOutput, SequenceStage,
+                           StepLogprobs)
 
 
 @pytest.fixture
@@ -70,3 +79,205 @@ def test_sequence_data_prefill():
     seq_data.reset_num_computed_tokens()
     assert seq_data.get_num_uncomputed_tokens() == 5
     assert seq_data.get_num_computed_tokens() == 0
+
+
+def test_sequence_data_stage():
+    seq_data = SequenceData(prompt_token_ids=[1, 2, 3, 4])
+    assert seq_data.stage == SequenceStage.PREFILL
+
+    # The prefill is chunked.
+    seq_data.update_num_computed_tokens(2)
+    assert seq_data.stage == SequenceStage.PREFILL
+    seq_data.update_num_computed_tokens(2)
+    assert seq_data.stage == SequenceStage.DECODE
+
+    # Decoding does not go back to prefill.
+    seq_data.append_token_id(1, logprob=0.0)
+    assert seq_data.stage == SequenceStage.DECODE
+
+    # Recomputation starts the prefill from the beginning.
+    seq_data.reset_num_computed_tokens()
+    assert seq_data.stage == SequenceStage.PREFILL
+
+
+def test_sequence_data_token_ids():
+    seq_data = SequenceData(prompt_token_ids=[1, 2, 3], output_token_ids=[4])
+    token_ids = seq_data.get_token_ids()
+    prompt_token_ids = seq_data.get_prompt_token_ids()
+    output_token_ids = seq_data.get_output_token_ids()
+    assert token_ids == [1, 2, 3, 4]
+    assert prompt_token_ids == [1, 2, 3]
+    assert output_token_ids == [4]
+
+    # The views behave like lists.
+    assert token_ids[-1] == 4
+    assert token_ids[1:-1] == [2, 3]
+    assert token_ids[::2] == [1, 3]
+    assert prompt_token_ids + output_token_ids == [1, 2, 3, 4]
+    assert [0] + prompt_token_ids == [0, 1, 2, 3]
+    assert list(output_token_ids) == [4]
+    assert prompt_token_ids == (1, 2, 3)
+    assert 3 in prompt_token_ids
+    with pytest.raises(IndexError):
+        output_token_ids[1]
+
+    # The views are not affected by the appended tokens.
+    seq_data.append_token_id(5, logprob=-1.0)
+    assert token_ids == [1, 2, 3, 4]
+    assert output_token_ids == [4]
+    assert seq_data.get_output_token_ids() == [4, 5]
+    assert seq_data.get_last_token_id() == 5
+    assert seq_data.get_len() == 5
+    assert seq_data.get_output_len() == 2
+
+    seq_data.output_token_ids = [6]
+    assert seq_data.get_token_ids() == [1, 2, 3, 6]
+    assert token_ids == [1, 2, 3, 4]
+
+
+def test_request_output_token_ids():
+    seq = Sequence(0, "1 2 3", [1, 2, 3], block_size=16)
+    seq.append_token_id(4, {4: Logprob(-1.0)})
+    seq_group = SequenceGroup("0", [seq], SamplingParams(), time.time())
+    output = RequestOutput.from_seq_group(seq_group)
+    # The outputs hold lists, not views of the token ids of the sequences.
+    assert isinstance(output.prompt_token_ids, list)
+    assert isinstance(output.outputs[0].token_ids, list)
+    assert json.dumps([output.prompt_token_ids,
+                       output.outputs[0].token_ids]) == "[[1, 2, 3], [4]]"
+
+
+def test_sequence_data_copy():
+    seq_data = SequenceData(prompt_token_ids=[1, 2, 3])
+    seq_data.update_num_computed_tokens(3)
+    seq_data_copy = copy.copy(seq_data)
+    seq_data_copy.append_token_id(4, logprob=-1.0)
+    assert seq_data.get_token_ids() == [1, 2, 3]
+    assert seq_data.cumulative_logprob == 0.0
+    assert seq_data_copy.get_token_ids() == [1, 2, 3, 4]
+    assert seq_data_copy.get_num_computed_tokens() == 3
+
+    # The sequence data is sent to the workers.
+    seq_data_pickled = pickle.loads(pickle.dumps(seq_data_copy))
+    assert seq_data_pickled.get_token_ids() == [1, 2, 3, 4]
+    assert seq_data_pickled.get_prompt_len() == 3
+    assert seq_data_pickled.cumulative_logprob == -1.0
+    assert seq_data_pickled.stage == SequenceStage.DECODE
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 16])
+def test_sequence_n_blocks(block_size: int):
+    seq = Sequence(0, "", list(range(5)), block_size)
+    for token_id in range(20):
+        assert seq.n_blocks == -(-seq.get_len() // block_size)
+        seq.append_token_id(token_id, {token_id: Logprob(0.0)})
+    fork = seq.fork(1)
+    assert fork.get_token_ids() == seq.get_token_ids()
+    assert fork.n_blocks == seq.n_blocks
+
+
+def test_step_logprobs():
+    step_logprobs = StepLogprobs(token_id=7,
+                                 logprob=-2.0,
+                                 rank=3,
+                                 top_token_ids=[1, 2, 7],
+                                 top_logprobs=[-0.5, -1.0, -2.0])
+    assert step_logprobs == {
+        7: Logprob(-2.0, 3),
+        1: Logprob(-0.5, 1),
+        2: Logprob(-1.0, 2),
+    }
+    assert list(step_logprobs) == [7, 1, 2]
+    assert 2 in step_logprobs and 3 not in step_logprobs
+    with pytest.raises(KeyError):
+        step_logprobs[3]
+    assert StepLogprobs(token_id=7, logprob=-2.0) == {7: Logprob(-2.0)}
+
+
+def test_sequence_logprobs():
+    requests = []
+
+    def decoder(step_requests):
+        requests.extend(step_requests)
+        return [[f"{prefix_len}:{token_id}" for token_id in token_ids]
+                for _, prefix_len, token_ids in step_requests]
+
+    seq_logprobs = SequenceLogprobs()
+    seq_logprobs.decoder = decoder
+    seq_logprobs.append(
+        5,
+        StepLogprobs(5,
+                     -1.0,
+                     2,
+                     top_token_ids=[4, 5],
+                     top_logprobs=[-0.5, -1.0]))
+    seq_logprobs.set_decoding("five", [1, 2], 1)
+    seq_logprobs.append(6, {6: Logprob(-0.1), 8: Logprob(-3.0, 4)})
+    assert not requests
+
+    assert len(seq_logprobs) == 2
+    assert seq_logprobs[0] == {
+        5: Logprob(-1.0, 2, "five"),
+        4: Logprob(-0.5, 1, "1:4"),
+    }
+    # The second step was not decoded.
+    assert seq_logprobs[-1] == {6: Logprob(-0.1), 8: Logprob(-3.0, 4)}
+    assert requests == [([1, 2], 1, [4])]
+
+    # The dicts of the steps are only built and decoded once.
+    requests.clear()
+    assert seq_logprobs[0] is seq_logprobs[0]
+    assert not requests
+
+    # The new steps of a slice are decoded in one batch.
+    seq_logprobs.append(9, StepLogprobs(9, -0.2, 1, [9, 4], [-0.2, -2.0]))
+    seq_logprobs.append(4, StepLogprobs(4, -0.3, 1, [4], [-0.3]))
+    seq_logprobs.set_decoding("four", [7, 8], 1)
+    seq_logprobs.append(2, StepLogprobs(2, -0.4, 2, [1, 2], [-0.1, -0.4]))
+    seq_logprobs.set_decoding("two", [5, 6], 2)
+    all_logprobs = seq_logprobs[:]
+    assert requests == [([5, 6], 2, [1])]
+    assert all_logprobs[0] is seq_logprobs[0]
+    assert all_logprobs[4] == {
+        2: Logprob(-0.4, 2, "two"),
+        1: Logprob(-0.1, 1, "2:1"),
+    }
+
+    # A copy shares the decoder, and is pickled as a list.
+    seq_logprobs_copy = copy.deepcopy(seq_logprobs)
+    seq_logprobs_copy.append(1, {1: Logprob(0.0)})
+    assert len(seq_logprobs) == 5
+    assert seq_logprobs_copy[:5] == seq_logprobs[:]
+    assert seq_logprobs_copy[0] is not seq_logprobs[0]
+    assert pickle.loads(pickle.dumps(seq_logprobs)) == seq_logprobs[:]
+
+
+def test_sequence_record_logprobs():
+    seq = Sequence(0, "", [1, 2], 4, record_logprobs=False)
+    seq.append_token_id(3, StepLogprobs(3, -1.0))
+    assert len(seq.output_logprobs) == 0
+    assert seq.get_cumulative_logprob() == -1.0
+
+    seq = Sequence(0, "", [1, 2], 4)
+    seq.append_token_id(3, StepLogprobs(3, -1.0))
+    assert seq.output_logprobs == [{3: Logprob(-1.0)}]
+
+
+def test_sequence_group_preemption_metrics():
+    seq = Sequence(0, "0 1 2 3", [0, 1, 2, 3], block_size=4)
+    seq_group = SequenceGroup("0", [seq], SamplingParams(), 10.0, None)
+    seq_group.maybe_set_first_scheduled_time(11.0)
+    assert seq_group.metrics.time_in_waiting == 1.0
+
+    seq_group.set_preempted_time(12.0, by_swap=True)
+    seq_group.maybe_set_resumed_time(14.0)
+    # Only the first scheduling after a preemption ends it.
+    seq_group.maybe_set_resumed_time(15.0)
+    seq_group.set_preempted_time(16.0, by_swap=False)
+    seq_group.maybe_set_resumed_time(16.5)
+
+    metrics = seq_group.metrics
+    assert (metrics.num_swaps, metrics.num_recomputes) == (1, 1)
+    assert metrics.num_preemptions == 2
+    assert metrics.time_in_swapped == 2.0
+    assert metrics.time_in_waiting == 1.5
@@ -5,7 +5,9 @@ from transformers import AutoTokenizer
 
 from vllm.sequence import Logprob, SamplingParams, Sequence, SequenceGroup
 from vllm.transformers_utils.detokenizer import (Detokenizer,
+                                                 convert_prompt_ids_to_tokens,
                                                  detokenize_incrementally)
+from vllm.transformers_utils.tokenizer import get_cached_tokenizer
 from vllm.transformers_utils.tokenizer_group import get_tokenizer_group
 
 TRUTH = [
@@ -206,3 +208,74 @@ def test_decode_prompt_logprobs(complete_sequence: str,
             logprobs[token_id + 1].decoded_token for token_id, logprobs in zip(
                 complete_sequence_token_ids, decoded_prompt_logprobs)
         ])
+
+
+def _decode_token_by_token(tokenizer, prompt_ids: List[int],
+                           token_ids: List[int],
+                           skip_special_tokens: bool) -> List[str]:
+    """Returns the text of each token, decoded one token at a time with
+    detokenize_incrementally()."""
+    prev_tokens, prefix_offset, read_offset = convert_prompt_ids_to_tokens(
+        tokenizer, prompt_ids, skip_special_tokens=skip_special_tokens)
+    all_input_ids = list(prompt_ids)
+    texts = []
+    for token_id in token_ids:
+        all_input_ids.append(token_id)
+        new_tokens, text, prefix_offset, read_offset = (
+            detokenize_incrementally(tokenizer,
+                                     all_input_ids,
+                                     prev_tokens,
+                                     prefix_offset,
+                                     read_offset,
+                                     skip_special_tokens=skip_special_tokens))
+        prev_tokens.extend(new_tokens)
+        texts.append(text)
+    return texts
+
+
+@pytest.mark.parametrize("tokenizer_name", TOKENIZERS)
+@pytest.mark.parametrize("skip_special_tokens", [True, False])
+def test_decode_sequences_batched(tokenizer_name: str,
+                                  detokenizer: Detokenizer,
+                                  skip_special_tokens: bool):
+    """Verify decoding sequences in a batch matches decoding their tokens one
+    by one with detokenize_incrementally(), including special tokens and
+    tokens added to the vocab."""
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    tokenizer.add_tokens(["<added_token>"])
+    added_token_id = tokenizer.convert_tokens_to_ids("<added_token>")
+    # The token is added before the length of the tokenizer is cached.
+    tokenizer = get_cached_tokenizer(tokenizer)
+    detokenizer.tokenizer_group.tokenizer = tokenizer
+    seqs = [create_sequence() for _ in TRUTH]
+    sampling_params = SamplingParams(skip_special_tokens=skip_special_tokens)
+    all_token_ids = []
+    for truth in TRUTH:
+        token_ids = tokenizer(truth, add_special_tokens=False)["input_ids"]
+        all_token_ids.append(token_ids[:3] + [tokenizer.eos_token_id] +
+                             token_ids[3:] + [added_token_id] + token_ids[:3])
+    expected_texts = [
+        _decode_token_by_token(tokenizer, seq.get_token_ids(), token_ids,
+                               skip_special_tokens)
+        for seq, token_ids in zip(seqs, all_token_ids)
+    ]
+
+    for i in range(max(len(token_ids) for token_ids in all_token_ids)):
+        batch = []
+        expected_step_texts = []
+        for seq, token_ids, texts in zip(seqs, all_token_ids, expected_texts):
+            if i >= len(token_ids):
+                continue
+            seq.append_token_id(token_ids[i], {token_ids[i]: Logprob(0.0)})
+            batch.append((seq, sampling_params))
+            expected_step_texts.append(texts[i])
+        prev_texts = [seq.output_text for seq, _ in batch]
+        new_char_counts = detokenizer.decode_sequences_inplace(batch)
+        assert [
+            seq.output_text[len(prev_text):]
+            for (seq, _), prev_text in zip(batch, prev_texts)
+        ] == expected_step_texts
+        assert new_char_counts == [len(text) for text in expected_step_texts]
+
+    for seq, texts in zip(seqs, expected_texts):
+        assert seq.output_text == "".join(texts)
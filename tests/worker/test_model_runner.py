@@ -1,9 +1,12 @@
+import random
+
 import pytest
 import torch
 
 from vllm.config import ModelConfig
 from vllm.sequence import SamplingParams, SequenceData, SequenceGroupMetadata
-from vllm.worker.model_runner import ModelRunner, _get_graph_batch_size
+from vllm.worker.model_runner import (DecodeInputBuffers, ModelRunner,
+                                      _get_graph_batch_size)
 
 
 @pytest.mark.parametrize("batch_size", list(range(1, 257)))
@@ -190,3 +193,127 @@ def test_prepare_decode_cuda_graph(batch_size):
                             device=actual.device,
                             dtype=actual.dtype)
     torch.testing.assert_close(actual, expected)
+
+
+@pytest.mark.parametrize("preemption", ["recompute", "swap"])
+def test_prepare_decode_rebuilt_block_table(preemption):
+    """A sequence that decodes again after its block table was rebuilt, when
+    it was recomputed or swapped back in, gets its new block table."""
+    model_config = ModelConfig(
+        "facebook/opt-125m",
+        "facebook/opt-125m",
+        tokenizer_mode="auto",
+        trust_remote_code=False,
+        download_dir=None,
+        load_format="dummy",
+        seed=0,
+        dtype="float16",
+        revision=None,
+        enforce_eager=True,
+    )
+    model_runner = ModelRunner(model_config, None, None, None, None)
+    model_runner.set_block_size(16)
+
+    def create_seq_group_metadata(seq_len, block_table, is_prompt):
+        return SequenceGroupMetadata(
+            request_id="test_0",
+            is_prompt=is_prompt,
+            seq_data={0: SequenceData(list(range(seq_len)))},
+            sampling_params=SamplingParams(temperature=0),
+            block_tables={0: block_table},
+        )
+
+    model_runner._prepare_decode(
+        [create_seq_group_metadata(40, [0, 1, 2], is_prompt=False)])
+    if preemption == "recompute":
+        model_runner._prepare_prompt(
+            [create_seq_group_metadata(50, [5, 6, 7, 8], is_prompt=True)])
+    else:
+        # The worker runs no model in the step of the swap out.
+        model_runner.release_decode_rows()
+    _, _, attn_metadata, _, _, _ = model_runner._prepare_decode(
+        [create_seq_group_metadata(51, [5, 6, 7, 8], is_prompt=False)])
+    assert attn_metadata.block_tables.tolist() == [[5, 6, 7, 8]]
+    assert attn_metadata.slot_mapping.tolist() == [8 * 16 + 50 % 16]
+
+
+def test_decode_input_buffers_release_rows():
+    buffers = DecodeInputBuffers(16, None, pin_memory=False)
+    buffers.prepare([1], [[0, 1, 2]], [40], [0], 1, None)
+    inputs = buffers.prepare([1], [[0, 1, 2, 3]], [49], [0], 1, None)
+    assert inputs["block_tables"].tolist() == [[0, 1, 2, 3]]
+
+    # The block table is rebuilt while the sequence does not decode.
+    buffers.release_rows()
+    inputs = buffers.prepare([1], [[5, 6, 7, 8]], [50], [0], 1, None)
+    assert inputs["block_tables"].tolist() == [[5, 6, 7, 8]]
+    assert inputs["slot_mapping"].tolist() == [8 * 16 + 49 % 16]
+
+
+@pytest.mark.parametrize("sliding_window", [None, 64])
+def test_decode_input_buffers(sliding_window):
+    """The incrementally updated buffers match the inputs built from
+    scratch while sequences decode, fork, get preempted and finish."""
+    random.seed(0)
+    block_size = 16
+    buffers = DecodeInputBuffers(block_size, sliding_window, pin_memory=False)
+    block_tables = {}
+    seq_lens = {}
+    next_block = 0
+    for step in range(100):
+        for seq_id in list(block_tables):
+            if random.random() < 0.05:
+                # Finished or preempted.
+                del block_tables[seq_id], seq_lens[seq_id]
+                continue
+            seq_lens[seq_id] += 1
+            if (seq_lens[seq_id] - 1) // block_size == len(
+                    block_tables[seq_id]):
+                block_tables[seq_id].append(next_block)
+                next_block += 1
+            elif random.random() < 0.1:
+                # Copy on write of the last block.
+                block_tables[seq_id][-1] = next_block
+                next_block += 1
+        for i in range(random.randint(0, 4)):
+            seq_id = step * 10 + i
+            seq_lens[seq_id] = random.randint(1, 300)
+            num_blocks = (seq_lens[seq_id] - 1) // block_size + 1
+            block_tables[seq_id] = list(
+                range(next_block, next_block + num_blocks))
+            next_block += num_blocks
+        if not block_tables:
+            continue
+
+        seq_ids = list(block_tables)
+        random.shuffle(seq_ids)
+        batch_size = _get_graph_batch_size(len(seq_ids))
+        inputs = buffers.prepare(
+            seq_ids, [list(block_tables[seq_id]) for seq_id in seq_ids],
+            [seq_lens[seq_id] for seq_id in seq_ids],
+            [seq_lens[seq_id] * 2 for seq_id in seq_ids], batch_size, None)
+
+        expected_block_tables = []
+        for i, seq_id in enumerate(seq_ids):
+            seq_len = seq_lens[seq_id]
+            block_table = block_tables[seq_id]
+            position = seq_len - 1
+            assert inputs["input_tokens"][i] == seq_len * 2
+            assert inputs["input_positions"][i] == position
+            assert inputs["slot_mapping"][i] == (
+                block_table[position // block_size] * block_size +
+                position % block_size)
+            if sliding_window is not None:
+                seq_len = min(seq_len, sliding_window)
+                block_table = block_table[-(sliding_window // block_size):]
+            assert inputs["context_lens"][i] == seq_len
+            expected_block_tables.append(block_table)
+        max_len = max(len(table) for table in expected_block_tables)
+        expected_block_tables += [[]] * (batch_size - len(seq_ids))
+        expected_block_tables = [
+            table + [0] * (max_len - len(table))
+            for table in expected_block_tables
+        ]
+        assert inputs["block_tables"].tolist() == expected_block_tables
+        assert (inputs["slot_mapping"][len(seq_ids):] == -1).all()
+        assert (inputs["context_lens"][len(seq_ids):] == 1).all()
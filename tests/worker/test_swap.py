@@ -1,7 +1,11 @@
+import random
+
+import pytest
 import torch
 
 from vllm.engine.arg_utils import EngineArgs
 from vllm.utils import get_distributed_init_method, get_ip, get_open_port
+from vllm.worker.cache_engine import get_block_runs, swap_block_runs
 from vllm.worker.worker import Worker
 
 
@@ -49,8 +53,8 @@ def test_swap() -> None:
     allclose = lambda a, b: torch.allclose(
         a.cuda(), b.cuda(), rtol=0.0, atol=0.0)
 
-    # Test swap out.
-    blocks_to_swap_out = {3: 72, 56: 35, 84: 34}
+    # Test swap out, with a run of consecutive blocks.
+    blocks_to_swap_out = {3: 72, 56: 35, 84: 34, 85: 35, 86: 36}
     worker.execute_model(seq_group_metadata_list=[],
                          blocks_to_swap_in={},
                          blocks_to_swap_out=blocks_to_swap_out,
@@ -63,7 +67,7 @@ def test_swap() -> None:
             assert allclose(gpu_value_cache[src], cpu_value_cache[dst])
 
     # Test swap in.
-    blocks_to_swap_in = {19: 45, 67: 23, 12: 78, 40: 99, 1: 71}
+    blocks_to_swap_in = {19: 45, 67: 23, 12: 78, 40: 99, 1: 71, 2: 72}
     worker.execute_model(seq_group_metadata_list=[],
                          blocks_to_swap_in=blocks_to_swap_in,
                          blocks_to_swap_out={},
@@ -74,3 +78,54 @@ def test_swap() -> None:
         for src, dst in blocks_to_swap_in.items():
             assert allclose(gpu_key_cache[dst], cpu_key_cache[src])
             assert allclose(gpu_value_cache[dst], cpu_value_cache[src])
+
+
+def test_get_block_runs() -> None:
+    assert get_block_runs({}) == []
+    assert get_block_runs({
+        5: 1,
+        3: 9,
+        4: 10,
+        6: 2,
+        7: 4
+    }) == [
+        (3, 9, 2),
+        (5, 1, 2),
+        (7, 4, 1),
+    ]
+    # The blocks are allocated from the end of the free lists.
+    assert get_block_runs({99 - i: 49 - i
+                           for i in range(10)}) == [(90, 40, 10)]
+
+
+@pytest.mark.parametrize("seed", list(range(10)))
+def test_swap_block_runs(seed: int) -> None:
+    random.seed(seed)
+    torch.manual_seed(seed)
+    num_blocks = 64
+    src_kv_cache = torch.randn(2, num_blocks, 16)
+    dst_kv_cache = torch.randn(2, num_blocks, 16)
+    expected = dst_kv_cache.clone()
+
+    # A run of consecutive blocks, as the block manager allocates them, and
+    # scattered blocks.
+    src_blocks = random.sample(range(num_blocks), num_blocks)
+    dst_blocks = random.sample(range(num_blocks), num_blocks)
+    src_to_dst = dict(zip(src_blocks[:16], dst_blocks[:16]))
+    src_start = random.randrange(num_blocks - 16)
+    dst_start = random.randrange(num_blocks - 16)
+    for i in range(16):
+        src_to_dst.pop(src_start + i, None)
+        # A destination block is written once.
+        for src, dst in list(src_to_dst.items()):
+            if dst == dst_start + i:
+                del src_to_dst[src]
+        src_to_dst[src_start + i] = dst_start + i
+    for src, dst in src_to_dst.items():
+        expected[:, dst] = src_kv_cache[:, src]
+
+    runs = get_block_runs(src_to_dst)
+    assert sum(length for _, _, length in runs) == len(src_to_dst)
+    assert len(runs) <= len(src_to_dst) - 15
+    swap_block_runs(src_kv_cache, dst_kv_cache, runs)
+    assert torch.equal(dst_kv_cache, expected)
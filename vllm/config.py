@@ -1,4 +1,5 @@
 import enum
+import hashlib
 import json
 import os
 from dataclasses import dataclass, fields
@@ -20,6 +21,10 @@ logger = init_logger(__name__)
 
 _GB = 1 << 30
 
+# Version of the on-disk format of the persistent prefix cache. Bump it when
+# the KV cache layout or the block hashes change.
+_PREFIX_CACHE_VERSION = 1
+
 
 class ModelConfig:
     """Configuration for the model.
@@ -40,9 +45,11 @@ class ModelConfig:
             "pt" will load the weights in the pytorch bin format.
             "safetensors" will load the weights in the safetensors format.
             "npcache" will load the weights in pytorch format and store
-                a numpy cache to speed up the loading.
+                them in a memory-mapped cache to speed up the loading.
             "dummy" will initialize the weights with random values, which is
                 mainly for profiling.
+            "sharded" will load the weights of each tensor parallel worker
+                from a checkpoint saved by save_sharded_state().
         dtype: Data type for model weights and activations. The "auto" option
             will use FP16 precision for FP32 and FP16 models, and BF16 precision
             for BF16 models.
@@ -132,13 +139,14 @@ class ModelConfig:
     def _verify_load_format(self) -> None:
         load_format = self.load_format.lower()
         supported_load_format = [
-            "auto", "pt", "safetensors", "npcache", "dummy"
+            "auto", "pt", "safetensors", "npcache", "dummy", "sharded"
         ]
         rocm_not_supported_load_format = []
         if load_format not in supported_load_format:
             raise ValueError(
                 f"Unknown load format: {self.load_format}. Must be one of "
-                "'auto', 'pt', 'safetensors', 'npcache', or 'dummy'.")
+                "'auto', 'pt', 'safetensors', 'npcache', 'dummy', or "
+                "'sharded'.")
         if is_hip() and load_format in rocm_not_supported_load_format:
             rocm_supported_load_format = [
                 f for f in supported_load_format
@@ -329,6 +337,16 @@ class CacheConfig:
         cache_dtype: Data type for kv cache storage.
         forced_num_gpu_blocks: Number of GPU blocks to use. This overrides the
             profiled num_gpu_blocks if specified. Does nothing if None.
+        sliding_window: Sliding window size of the model, if any.
+        enable_prefix_caching: Whether to reuse the KV cache of blocks with
+            the same content across requests.
+        enable_cpu_prefix_caching: Whether to keep prefix cache blocks that
+            are evicted from GPU memory in the CPU swap space, so that a later
+            prefix hit can swap them back in instead of recomputing them.
+            Requires enable_prefix_caching.
+        prefix_cache_dir: Directory to persist the CPU prefix cache in, so
+            that it survives engine restarts. The CPU swap space is mapped
+            from a file in this directory. Requires enable_cpu_prefix_caching.
     """
 
     def __init__(
@@ -340,6 +358,8 @@ class CacheConfig:
         forced_num_gpu_blocks: Optional[int] = None,
         sliding_window: Optional[int] = None,
         enable_prefix_caching: bool = False,
+        enable_cpu_prefix_caching: bool = False,
+        prefix_cache_dir: Optional[str] = None,
     ) -> None:
         self.block_size = block_size
         self.gpu_memory_utilization = gpu_memory_utilization
@@ -348,12 +368,20 @@ class CacheConfig:
         self.cache_dtype = cache_dtype
         self.sliding_window = sliding_window
         self.enable_prefix_caching = enable_prefix_caching
+        self.enable_cpu_prefix_caching = enable_cpu_prefix_caching
+        self.prefix_cache_dir = prefix_cache_dir
+        # Subdirectory of prefix_cache_dir for the current model. Will be set
+        # by init_prefix_cache_path().
+        self.prefix_cache_path: Optional[str] = None
         self._verify_args()
         self._verify_cache_dtype()
 
         # Will be set after profiling.
         self.num_gpu_blocks = None
         self.num_cpu_blocks = None
+        # Size of a KV cache block of a worker in bytes. Will be set with the
+        # number of blocks by the executors that can swap blocks.
+        self.block_bytes: Optional[int] = None
 
     def metrics_info(self):
         # convert cache_config to dict(key: str, value: str) for prometheus
@@ -365,6 +393,14 @@ class CacheConfig:
             raise ValueError(
                 "GPU memory utilization must be less than 1.0. Got "
                 f"{self.gpu_memory_utilization}.")
+        if self.enable_cpu_prefix_caching and not self.enable_prefix_caching:
+            raise ValueError(
+                "CPU prefix caching requires prefix caching to be enabled.")
+        if (self.prefix_cache_dir is not None
+                and not self.enable_cpu_prefix_caching):
+            raise ValueError(
+                "A persistent prefix cache requires CPU prefix caching to be "
+                "enabled.")
 
     def _verify_cache_dtype(self) -> None:
         if self.cache_dtype == "auto":
@@ -391,6 +427,9 @@ class CacheConfig:
         self,
         parallel_config: "ParallelConfig",
     ) -> None:
+        if self.prefix_cache_dir is not None:
+            # The swap space is backed by a file and can be paged out.
+            return
         total_cpu_memory = get_cpu_memory()
         # FIXME(woosuk): Here, it is assumed that the GPUs in a tensor parallel
         # group are in the same node. However, the GPUs may span multiple nodes.
@@ -405,6 +444,36 @@ class CacheConfig:
         elif cpu_memory_usage > 0.4 * total_cpu_memory:
             logger.warning("Possibly too large swap space. " + msg)
 
+    def init_prefix_cache_path(
+        self,
+        model_config: ModelConfig,
+        parallel_config: "ParallelConfig",
+    ) -> None:
+        """Sets the directory of the persistent prefix cache.
+
+        The directory is named after a fingerprint of everything that
+        determines the content and the layout of the cached KV blocks, so
+        that blocks of another model, dtype or block size are never loaded.
+        """
+        if self.prefix_cache_dir is None:
+            return
+        fingerprint = {
+            "version": _PREFIX_CACHE_VERSION,
+            "model": model_config.model,
+            "revision": model_config.revision,
+            "hf_config": model_config.hf_config.to_json_string(),
+            "dtype": str(model_config.dtype),
+            "quantization": model_config.quantization,
+            "cache_dtype": self.cache_dtype,
+            "block_size": self.block_size,
+            "tensor_parallel_size": parallel_config.tensor_parallel_size,
+            "pipeline_parallel_size": parallel_config.pipeline_parallel_size,
+        }
+        digest = hashlib.sha256(
+            json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+        self.prefix_cache_path = os.path.join(self.prefix_cache_dir,
+                                              digest[:32])
+
 
 @dataclass
 class TokenizerPoolConfig:
@@ -541,7 +610,26 @@ class SchedulerConfig:
         delay_factor: Apply a delay (of delay factor multiplied by previous
             prompt latency) before scheduling next prompt.
         enable_chunked_prefill: If True, prefill requests can be chunked based
-            on the remaining max_num_batched_tokens.
+            on the remaining max_num_batched_tokens, and prefill chunks are
+            batched together with running decodes in the same step.
+        enable_pipelined_step: If True, the engine detokenizes the outputs of
+            a step and checks them for stop strings while the next step is
+            executed. A sequence stopped by a stop string then runs for one
+            more step, whose token is dropped.
+        policy: The scheduling policy. "fcfs" schedules the requests in
+            order of arrival. "priority" schedules them by the deadline given
+            when they are added, earliest first, then by priority.
+        priority_aging_period: With the priority policy, the seconds after
+            which the requests without a deadline are due, and the delay of
+            each priority level.
+        num_decode_steps: The number of decoding steps the workers run per
+            scheduling step, feeding the sampled tokens back to the model.
+            The scheduler reserves the slots of all the steps. Only applies
+            to the steps that are all decodes without beam search.
+        enable_cost_based_preemption: If True, the preempted sequences are
+            swapped out or recomputed, whichever the cost model measured on
+            the executed steps predicts is faster. Otherwise, they are
+            recomputed unless they have several sequences.
     """
 
     def __init__(
@@ -553,9 +641,19 @@ class SchedulerConfig:
         num_lookahead_slots: int = 0,
         delay_factor: float = 0.0,
         enable_chunked_prefill: bool = False,
+        enable_pipelined_step: bool = False,
+        policy: str = "fcfs",
+        priority_aging_period: float = 10.0,
+        num_decode_steps: int = 1,
+        enable_cost_based_preemption: bool = False,
     ) -> None:
         if max_num_batched_tokens is not None:
             self.max_num_batched_tokens = max_num_batched_tokens
+        elif enable_chunked_prefill:
+            # With chunked prefill, the token budget bounds the latency of
+            # every step that running decodes are batched into, so it should
+            # stay small even for long-context models.
+            self.max_num_batched_tokens = max(max_num_seqs, 512)
         else:
             # If max_model_len is too short, use 2048 as the default value for
             # higher throughput.
@@ -566,11 +664,17 @@ class SchedulerConfig:
         self.num_lookahead_slots = num_lookahead_slots
         self.delay_factor = delay_factor
         self.chunked_prefill_enabled = enable_chunked_prefill
+        self.pipelined_step_enabled = enable_pipelined_step
+        self.policy = policy
+        self.priority_aging_period = priority_aging_period
+        self.num_decode_steps = num_decode_steps
+        self.cost_based_preemption_enabled = enable_cost_based_preemption
 
         self._verify_args()
 
     def _verify_args(self) -> None:
-        if self.max_num_batched_tokens < self.max_model_len:
+        if (self.max_num_batched_tokens < self.max_model_len
+                and not self.chunked_prefill_enabled):
             raise ValueError(
                 f"max_num_batched_tokens ({self.max_num_batched_tokens}) is "
                 f"smaller than max_model_len ({self.max_model_len}). "
@@ -591,6 +695,47 @@ class SchedulerConfig:
                 f"({self.num_lookahead_slots}) must be greater than or "
                 "equal to 0.")
 
+        if self.pipelined_step_enabled and self.num_lookahead_slots > 0:
+            raise ValueError(
+                "Pipelined engine step is not supported with speculative "
+                "decoding yet.")
+
+        if self.num_decode_steps < 1:
+            raise ValueError(
+                f"num_decode_steps ({self.num_decode_steps}) must be greater "
+                "than or equal to 1.")
+
+        if self.num_decode_steps > 1:
+            if not self.use_v2_block_manager:
+                raise ValueError(
+                    "Multi-step decoding requires the v2 block manager, "
+                    "which allocates the slots of the later steps ahead.")
+            if self.pipelined_step_enabled:
+                raise ValueError("Multi-step decoding is not supported with "
+                                 "pipelined engine step.")
+            if self.num_lookahead_slots > 0:
+                raise ValueError("Multi-step decoding is not supported with "
+                                 "speculative decoding.")
+
+        if self.policy not in ("fcfs", "priority"):
+            raise ValueError(f"Unknown scheduling policy {self.policy!r}. "
+                             "Must be one of 'fcfs' and 'priority'.")
+        if self.priority_aging_period <= 0:
+            raise ValueError(
+                "priority_aging_period "
+                f"({self.priority_aging_period}) must be greater than 0.")
+
+    def verify_with_cache_config(self, cache_config: "CacheConfig") -> None:
+        if not self.chunked_prefill_enabled:
+            return
+        if cache_config.enable_prefix_caching:
+            raise ValueError(
+                "Chunked prefill cannot be used with prefix caching yet.")
+        if cache_config.sliding_window is not None:
+            raise ValueError(
+                "Chunked prefill is not supported with sliding window "
+                "attention yet.")
+
 
 class DeviceConfig:
 
@@ -810,6 +955,13 @@ class LoRAConfig:
             raise ValueError(
                 "LoRA is not supported with quantized models yet.")
 
+    def verify_with_cache_config(self, cache_config: CacheConfig):
+        if cache_config.prefix_cache_dir is not None:
+            # LoRA ids are only unique within a process, so blocks cached
+            # under them cannot be shared across restarts.
+            raise ValueError(
+                "LoRA is not supported with a persistent prefix cache.")
+
     def verify_with_scheduler_config(self, scheduler_config: SchedulerConfig):
         if scheduler_config.max_num_batched_tokens > 65528:
             raise ValueError(
@@ -1013,9 +1165,13 @@ class EngineConfig:
         """
         self.model_config.verify_with_parallel_config(self.parallel_config)
         self.cache_config.verify_with_parallel_config(self.parallel_config)
+        self.scheduler_config.verify_with_cache_config(self.cache_config)
+        self.cache_config.init_prefix_cache_path(self.model_config,
+                                                 self.parallel_config)
 
         if self.lora_config:
             self.lora_config.verify_with_model_config(self.model_config)
+            self.lora_config.verify_with_cache_config(self.cache_config)
             self.lora_config.verify_with_scheduler_config(
                 self.scheduler_config)
 
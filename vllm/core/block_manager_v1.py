@@ -1,8 +1,10 @@
 """A block manager that manages token blocks."""
+import json
+import os
 from abc import ABC, abstractmethod
 from itertools import count, takewhile
 from os.path import commonprefix
-from typing import Dict, List, Optional, Set
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 from vllm.block import BlockTable, PhysicalTokenBlock
 from vllm.core.evictor import EvictionPolicy, Evictor, make_evictor
@@ -61,11 +63,14 @@ class CachedBlockAllocator(BlockAllocatorBase):
     the reference count becomes zero, the block is added back to the free list.
     """
 
-    def __init__(self,
-                 device: Device,
-                 block_size: int,
-                 num_blocks: int,
-                 eviction_policy: EvictionPolicy = EvictionPolicy.LRU) -> None:
+    def __init__(
+        self,
+        device: Device,
+        block_size: int,
+        num_blocks: int,
+        eviction_policy: EvictionPolicy = EvictionPolicy.LRU,
+        on_evict: Optional[Callable[[PhysicalTokenBlock], None]] = None,
+    ) -> None:
         self.device = device
         self.block_size = block_size
         self.num_blocks = num_blocks
@@ -74,6 +79,9 @@ class CachedBlockAllocator(BlockAllocatorBase):
         self.cached_blocks: Dict[int, PhysicalTokenBlock] = {}
 
         self.evictor: Evictor = make_evictor(eviction_policy)
+        # Called with each evicted block before it is reused, while the block
+        # still describes its old content.
+        self.on_evict = on_evict
 
         self.default_hash_ctr = count()
 
@@ -81,6 +89,9 @@ class CachedBlockAllocator(BlockAllocatorBase):
                        num_hashed_tokens: int) -> PhysicalTokenBlock:
         if self.current_num_blocks == self.num_blocks:
             block = self.evictor.evict()
+            if self.on_evict is not None:
+                self.on_evict(block)
+            block.computed = False
             block.block_hash = block_hash
             block.num_hashed_tokens = num_hashed_tokens
             return block
@@ -139,6 +150,33 @@ class CachedBlockAllocator(BlockAllocatorBase):
         del self.cached_blocks[old_hash]
         self.cached_blocks[block_hash] = block
 
+    def restore_free_blocks(self, blocks: List[PhysicalTokenBlock]) -> None:
+        """Adds computed blocks of a previous run as free cached blocks.
+
+        Must be called before any block is allocated. The block numbers in
+        between are created as free blocks without content, which are
+        evicted first.
+        """
+        assert self.current_num_blocks == 0
+        blocks_by_number = {block.block_number: block for block in blocks}
+        num_blocks = max(blocks_by_number, default=-1) + 1
+        assert num_blocks <= self.num_blocks
+        for block_number in range(num_blocks):
+            block = blocks_by_number.get(block_number)
+            if block is None:
+                block = PhysicalTokenBlock(device=self.device,
+                                           block_number=block_number,
+                                           block_size=self.block_size,
+                                           block_hash=next(
+                                               self.default_hash_ctr),
+                                           num_hashed_tokens=0)
+            self.evictor.add(block)
+        self.current_num_blocks = num_blocks
+
+    def get_computed_free_blocks(self) -> List[PhysicalTokenBlock]:
+        """Returns the free blocks that hold computed KV cache."""
+        return [block for block in self.evictor if block.computed]
+
 
 class UncachedBlockAllocator(BlockAllocatorBase):
     """Manages free physical token blocks for a device.
@@ -207,6 +245,7 @@ class BlockSpaceManagerV1(BlockSpaceManager):
         watermark: float = 0.01,
         sliding_window: Optional[int] = None,
         enable_caching: bool = False,
+        enable_cpu_caching: bool = False,
     ) -> None:
         self.block_size = block_size
         self.num_total_gpu_blocks = num_gpu_blocks
@@ -215,6 +254,9 @@ class BlockSpaceManagerV1(BlockSpaceManager):
         if enable_caching and sliding_window is not None:
             raise NotImplementedError(
                 "Sliding window is not allowed with prefix caching enabled!")
+        if enable_cpu_caching and not enable_caching:
+            raise ValueError(
+                "CPU prefix caching requires prefix caching to be enabled.")
 
         self.block_sliding_window = None
         if sliding_window is not None:
@@ -226,13 +268,21 @@ class BlockSpaceManagerV1(BlockSpaceManager):
         assert watermark >= 0.0
 
         self.enable_caching = enable_caching
+        self.enable_cpu_caching = enable_cpu_caching
 
         self.watermark_blocks = int(watermark * num_gpu_blocks)
 
         if self.enable_caching:
             logger.info("Automatic prefix caching is enabled.")
-            self.gpu_allocator = CachedBlockAllocator(Device.GPU, block_size,
-                                                      num_gpu_blocks)
+            if self.enable_cpu_caching:
+                logger.info("Evicted prefix cache blocks are kept in CPU "
+                            "memory.")
+            self.gpu_allocator = CachedBlockAllocator(
+                Device.GPU,
+                block_size,
+                num_gpu_blocks,
+                on_evict=(self._demote_block
+                          if self.enable_cpu_caching else None))
             self.cpu_allocator = CachedBlockAllocator(Device.CPU, block_size,
                                                       num_cpu_blocks)
         else:
@@ -243,11 +293,22 @@ class BlockSpaceManagerV1(BlockSpaceManager):
         # Mapping: seq_id -> BlockTable.
         self.block_tables: Dict[int, BlockTable] = {}
 
+        # Copies between the GPU blocks and the CPU prefix cache that were
+        # planned since the last call to get_prefix_cache_swaps().
+        # CPU -> GPU block number.
+        self.prefix_blocks_to_swap_in: Dict[int, int] = {}
+        # GPU -> CPU block number.
+        self.prefix_blocks_to_swap_out: Dict[int, int] = {}
+        # CPU blocks that are read or written by the planned copies. They are
+        # referenced until the copies are handed to the scheduler, so that
+        # they cannot be evicted and reused in the same step.
+        self.pinned_cpu_blocks: List[PhysicalTokenBlock] = []
+
     def can_allocate(self, seq_group: SequenceGroup) -> AllocStatus:
         # FIXME(woosuk): Here we assume that all sequences in the group share
         # the same prompt. This may not be true for preempted sequences.
         seq = seq_group.get_seqs(status=SequenceStatus.WAITING)[0]
-        num_required_blocks = len(seq.logical_token_blocks)
+        num_required_blocks = seq.n_blocks
 
         if self.block_sliding_window is not None:
             num_required_blocks = min(num_required_blocks,
@@ -269,7 +330,7 @@ class BlockSpaceManagerV1(BlockSpaceManager):
         seq = seq_group.get_seqs(status=SequenceStatus.WAITING)[0]
 
         # Allocate new physical token blocks that will store the prompt tokens.
-        num_prompt_blocks = len(seq.logical_token_blocks)
+        num_prompt_blocks = seq.n_blocks
 
         block_table: BlockTable = []
         for logical_idx in range(num_prompt_blocks):
@@ -279,7 +340,7 @@ class BlockSpaceManagerV1(BlockSpaceManager):
                 # Set the reference counts of the token blocks.
                 block.ref_count = seq_group.num_seqs()
             elif self.enable_caching:
-                block = self.gpu_allocator.allocate(
+                block = self._allocate_cached_block(
                     seq.hash_of_block(logical_idx),
                     seq.num_hashed_tokens_of_block(logical_idx))
             else:
@@ -292,6 +353,144 @@ class BlockSpaceManagerV1(BlockSpaceManager):
         for seq in seq_group.get_seqs(status=SequenceStatus.WAITING):
             self.block_tables[seq.seq_id] = block_table.copy()
 
+    def _allocate_cached_block(self, block_hash: int,
+                               num_hashed_tokens: int) -> PhysicalTokenBlock:
+        # Blocks that are cached on the GPU, or not cached at all, are
+        # handled by the GPU allocator alone.
+        if (not self.enable_cpu_caching
+                or self.gpu_allocator.contains_block(block_hash)
+                or not self.cpu_allocator.contains_block(block_hash)):
+            return self.gpu_allocator.allocate(block_hash, num_hashed_tokens)
+
+        cpu_block = self.cpu_allocator.allocate(block_hash, num_hashed_tokens)
+        if not cpu_block.computed:
+            # The block was swapped out by a preempted sequence before its
+            # KV cache was computed.
+            self.cpu_allocator.free(cpu_block)
+            return self.gpu_allocator.allocate(block_hash, num_hashed_tokens)
+
+        # Promote the block: swap its KV cache back in instead of computing
+        # it again.
+        gpu_block = self.gpu_allocator.allocate(block_hash, num_hashed_tokens)
+        gpu_block.computed = True
+        self.prefix_blocks_to_swap_in[
+            cpu_block.block_number] = gpu_block.block_number
+        self.pinned_cpu_blocks.append(cpu_block)
+        return gpu_block
+
+    def _demote_block(self, gpu_block: PhysicalTokenBlock) -> None:
+        # Called by the GPU allocator when it evicts a block. Keep a copy of
+        # the block's KV cache in the CPU prefix cache if it is worth it.
+        if (not gpu_block.computed
+                or gpu_block.block_number in self.prefix_blocks_to_swap_out):
+            return
+        if self.cpu_allocator.contains_block(gpu_block.block_hash):
+            # The CPU already holds the same content.
+            return
+        if self.cpu_allocator.get_num_free_blocks() == 0:
+            return
+
+        # Evicts the least recently used block of the CPU prefix cache if
+        # there is no unused CPU block left.
+        cpu_block = self.cpu_allocator.allocate(gpu_block.block_hash,
+                                                gpu_block.num_hashed_tokens)
+        cpu_block.computed = True
+        cpu_block.last_accessed = gpu_block.last_accessed
+        self.prefix_blocks_to_swap_out[
+            gpu_block.block_number] = cpu_block.block_number
+        self.pinned_cpu_blocks.append(cpu_block)
+
+    def get_prefix_cache_swaps(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """Returns the copies between the GPU and the CPU prefix cache that
+        were planned since the last call, and releases the CPU blocks they
+        use.
+
+        The worker must perform the swap outs before the swap ins, because
+        a demoted GPU block may be reused as the destination of a swap in
+        in the same step.
+        """
+        blocks_to_swap_in = self.prefix_blocks_to_swap_in
+        blocks_to_swap_out = self.prefix_blocks_to_swap_out
+        self.prefix_blocks_to_swap_in = {}
+        self.prefix_blocks_to_swap_out = {}
+        for cpu_block in self.pinned_cpu_blocks:
+            self.cpu_allocator.free(cpu_block)
+        self.pinned_cpu_blocks = []
+        return blocks_to_swap_in, blocks_to_swap_out
+
+    def demote_all_blocks(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """Copies the computed GPU prefix cache blocks to the CPU prefix
+        cache, most recently used first, e.g. before the engine exits.
+
+        Returns the copies like get_prefix_cache_swaps().
+        """
+        assert self.enable_cpu_caching
+        gpu_blocks = list(self.gpu_allocator.cached_blocks.values())
+        gpu_blocks.extend(self.gpu_allocator.evictor)
+        gpu_blocks.sort(key=lambda block: block.last_accessed, reverse=True)
+        for gpu_block in gpu_blocks:
+            self._demote_block(gpu_block)
+        return self.get_prefix_cache_swaps()
+
+    def save_cpu_prefix_cache(self, path: str) -> None:
+        """Writes the index of the CPU prefix cache to `path`, so that a
+        later run can reuse the blocks from the persistent KV cache file.
+        """
+        assert self.enable_cpu_caching
+        blocks = self.cpu_allocator.get_computed_free_blocks()
+        index = {
+            "num_blocks":
+            self.num_total_cpu_blocks,
+            "block_size":
+            self.block_size,
+            "blocks": [[
+                block.block_number, block.block_hash, block.num_hashed_tokens,
+                block.last_accessed
+            ] for block in blocks],
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {len(blocks)} prefix cache blocks to {path}.")
+
+    def load_cpu_prefix_cache(self, path: str) -> None:
+        """Restores the CPU prefix cache from an index written by
+        save_cpu_prefix_cache(). Must be called before any allocation.
+
+        The index is removed once it is read: the KV cache file is modified
+        from now on, so the index is only valid again once it is rewritten
+        by a clean shutdown.
+        """
+        assert self.enable_cpu_caching
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                index = json.load(f)
+        finally:
+            os.remove(path)
+
+        if (index.get("num_blocks") != self.num_total_cpu_blocks
+                or index.get("block_size") != self.block_size):
+            logger.warning(
+                f"Ignoring the prefix cache index {path}, as it was written "
+                "for a CPU cache of a different size.")
+            return
+        blocks: List[PhysicalTokenBlock] = []
+        for (block_number, block_hash, num_hashed_tokens,
+             last_accessed) in index["blocks"]:
+            block = PhysicalTokenBlock(device=Device.CPU,
+                                       block_number=block_number,
+                                       block_size=self.block_size,
+                                       block_hash=block_hash,
+                                       num_hashed_tokens=num_hashed_tokens)
+            block.last_accessed = last_accessed
+            block.computed = True
+            blocks.append(block)
+        self.cpu_allocator.restore_free_blocks(blocks)
+        logger.info(f"Loaded {len(blocks)} prefix cache blocks from {path}.")
+
     def can_append_slots(self,
                          seq_group: SequenceGroup,
                          num_lookahead_slots: int = 0) -> bool:
@@ -313,7 +512,7 @@ class BlockSpaceManagerV1(BlockSpaceManager):
 
         # Compute a new hash for the block so that it can be shared by other
         # Sequences
-        new_hash = seq.hash_of_block(len(seq.logical_token_blocks) - 1)
+        new_hash = seq.hash_of_block(seq.n_blocks - 1)
 
         # if new_hash is already in the cached table, then free last_block
         # and return the cached version
@@ -328,7 +527,7 @@ class BlockSpaceManagerV1(BlockSpaceManager):
         self,
         seq: Sequence,
     ) -> bool:
-        token_ids_len = len(seq.data.get_token_ids())
+        token_ids_len = seq.get_len()
         return token_ids_len > 0 and token_ids_len % seq.block_size == 0
 
     def _maybe_promote_last_block(
@@ -354,9 +553,8 @@ class BlockSpaceManagerV1(BlockSpaceManager):
             return self.gpu_allocator.allocate()
         block_hash: Optional[int] = None
         if (self._is_last_block_full(seq)):
-            block_hash = seq.hash_of_block(len(seq.logical_token_blocks) - 1)
-        num_hashed_tokens = seq.num_hashed_tokens_of_block(
-            len(seq.logical_token_blocks) - 1)
+            block_hash = seq.hash_of_block(seq.n_blocks - 1)
+        num_hashed_tokens = seq.num_hashed_tokens_of_block(seq.n_blocks - 1)
 
         # num_hashed_tokens is used to compute future hashes
         # (e.g. in the hashing function, it is used to ask the sequence for
@@ -375,12 +573,12 @@ class BlockSpaceManagerV1(BlockSpaceManager):
         num_lookahead_slots: int = 0,
     ) -> Dict[int, List[int]]:
         """Allocate a physical slot for a new token."""
-        logical_blocks = seq.logical_token_blocks
+        n_blocks = seq.n_blocks
         block_table = self.block_tables[seq.seq_id]
         # If we need to allocate a new physical block
-        if len(block_table) < len(logical_blocks):
+        if len(block_table) < n_blocks:
             # Currently this code only supports adding one physical block
-            assert len(block_table) == len(logical_blocks) - 1
+            assert len(block_table) == n_blocks - 1
 
             if (self.block_sliding_window
                     and len(block_table) >= self.block_sliding_window):
@@ -475,7 +673,12 @@ class BlockSpaceManagerV1(BlockSpaceManager):
                     mapping[cpu_block] = gpu_block
                 new_block_table.append(gpu_block)
                 # Free the CPU block swapped in to GPU.
-                self.cpu_allocator.free(cpu_block)
+                if self.enable_cpu_caching:
+                    # The block stays in the CPU prefix cache, so it must
+                    # not be reused by a demotion before it is swapped in.
+                    self.pinned_cpu_blocks.append(cpu_block)
+                else:
+                    self.cpu_allocator.free(cpu_block)
             self.block_tables[seq.seq_id] = new_block_table
 
         block_number_mapping = {
@@ -503,6 +706,10 @@ class BlockSpaceManagerV1(BlockSpaceManager):
                     cpu_block = self.cpu_allocator.allocate(
                         gpu_block.block_hash, gpu_block.num_hashed_tokens)
                     mapping[gpu_block] = cpu_block
+                    if self.enable_cpu_caching and gpu_block.computed:
+                        # The swapped out KV cache can also serve prefix
+                        # cache hits while the sequence is swapped.
+                        cpu_block.computed = True
                 new_block_table.append(cpu_block)
                 # Free the GPU block swapped out to CPU.
                 self.gpu_allocator.free(gpu_block)
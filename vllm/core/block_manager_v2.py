@@ -1,5 +1,5 @@
 """A block manager that manages token blocks."""
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from vllm.core.block.block_table import BlockTable
 from vllm.core.block.cpu_gpu_block_allocator import CpuGpuBlockAllocator
@@ -59,6 +59,7 @@ class BlockSpaceManagerV2(BlockSpaceManager):
         watermark: float = 0.01,
         sliding_window: Optional[int] = None,
         enable_caching: bool = False,
+        enable_cpu_caching: bool = False,
     ) -> None:
         self.block_size = block_size
         self.num_total_gpu_blocks = num_gpu_blocks
@@ -73,6 +74,7 @@ class BlockSpaceManagerV2(BlockSpaceManager):
 
         assert not enable_caching, "Prefix caching not yet supported"
         self.enable_caching = enable_caching
+        assert not enable_cpu_caching, "CPU prefix caching not yet supported"
 
         self.watermark_blocks = int(watermark * num_gpu_blocks)
 
@@ -239,6 +241,9 @@ class BlockSpaceManagerV2(BlockSpaceManager):
     def swap_out(self, seq_group: SequenceGroup) -> Dict[int, int]:
         raise NotImplementedError
 
+    def get_prefix_cache_swaps(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+        return {}, {}
+
     def get_num_free_gpu_blocks(self) -> int:
         return self.block_allocator.get_num_free_blocks(Device.GPU)
 
@@ -1,6 +1,8 @@
 import enum
+import heapq
 from abc import ABC, abstractmethod, abstractproperty
-from typing import OrderedDict
+from itertools import count
+from typing import Dict, Iterator, List, Tuple
 
 from vllm.block import PhysicalTokenBlock
 
@@ -25,9 +27,17 @@ class Evictor(ABC):
     def __contains__(self, block_hash: int) -> bool:
         pass
 
+    @abstractmethod
+    def __iter__(self) -> Iterator[PhysicalTokenBlock]:
+        """Iterates over the blocks in the evictor in no particular order"""
+        pass
+
     @abstractmethod
     def evict(self) -> PhysicalTokenBlock:
-        """Runs the eviction algorithm and returns the evicted block"""
+        """Runs the eviction algorithm and returns the evicted block. The
+        block is returned as it was added, so the caller can still inspect
+        its contents (e.g. whether it was computed) before reusing it.
+        """
         pass
 
     @abstractmethod
@@ -55,44 +65,70 @@ class LRUEvictor(Evictor):
     the same last_accessed time, then the one with the largest num_hashed_tokens
     will be evicted. If two blocks each have the lowest last_accessed time and
     highest num_hashed_tokens value, then one will be chose arbitrarily
+
+    The candidates are kept in a min-heap ordered by eviction priority, so
+    `add` and `evict` take O(log n) time. `remove` only drops the block from
+    the free table in O(1) time, and the stale heap entry is skipped lazily
+    when it reaches the top of the heap. The heap is rebuilt once stale entries
+    outnumber live ones, which keeps its size bounded by a constant factor.
     """
 
+    # Rebuild the heap when it has this many entries per free block.
+    _COMPACTION_FACTOR = 2
+
     def __init__(self):
-        self.free_table: OrderedDict[int, PhysicalTokenBlock] = OrderedDict()
+        # block_hash -> (block, id of the heap entry that is live for it).
+        self.free_table: Dict[int, Tuple[PhysicalTokenBlock, int]] = {}
+        # (last_accessed, -num_hashed_tokens, entry_id, block_hash)
+        self._heap: List[Tuple[float, int, int, int]] = []
+        self._entry_counter = count()
 
     def __contains__(self, block_hash: int) -> bool:
         return block_hash in self.free_table
 
+    def __iter__(self) -> Iterator[PhysicalTokenBlock]:
+        for block, _ in self.free_table.values():
+            yield block
+
     def evict(self) -> PhysicalTokenBlock:
         if len(self.free_table) == 0:
             raise ValueError("No usable cache memory left")
 
-        evicted_block = next(iter(self.free_table.values()))
-        # The blocks with the lowest timestamps should be placed consecutively
-        # at the start of OrderedDict. Loop through all these blocks to
-        # find the one with maximum number of hashed tokens.
-        for _, block in self.free_table.items():
-            if evicted_block.last_accessed < block.last_accessed:
+        while True:
+            _, _, entry_id, block_hash = heapq.heappop(self._heap)
+            entry = self.free_table.get(block_hash)
+            # Skip the entries of blocks that were removed or re-added.
+            if entry is not None and entry[1] == entry_id:
                 break
-            if evicted_block.num_hashed_tokens < block.num_hashed_tokens:
-                evicted_block = block
-
-        self.free_table.pop(evicted_block.block_hash)
 
-        evicted_block.computed = False
-        return evicted_block
+        block, _ = self.free_table.pop(block_hash)
+        return block
 
     def add(self, block: PhysicalTokenBlock):
-        self.free_table[block.block_hash] = block
+        entry_id = next(self._entry_counter)
+        self.free_table[block.block_hash] = (block, entry_id)
+        heapq.heappush(self._heap,
+                       (block.last_accessed, -block.num_hashed_tokens,
+                        entry_id, block.block_hash))
+        self._maybe_compact()
 
     def remove(self, block_hash: int) -> PhysicalTokenBlock:
         if block_hash not in self.free_table:
             raise ValueError(
                 "Attempting to remove block that's not in the evictor")
-        block: PhysicalTokenBlock = self.free_table[block_hash]
-        self.free_table.pop(block_hash)
+        block, _ = self.free_table.pop(block_hash)
         return block
 
+    def _maybe_compact(self) -> None:
+        if len(self._heap) <= self._COMPACTION_FACTOR * max(
+                len(self.free_table), 1):
+            return
+        self._heap = [(block.last_accessed, -block.num_hashed_tokens, entry_id,
+                       block_hash)
+                      for block_hash, (block,
+                                       entry_id) in self.free_table.items()]
+        heapq.heapify(self._heap)
+
     @property
     def num_blocks(self) -> int:
         return len(self.free_table)
@@ -1,6 +1,6 @@
 import enum
 from abc import ABC, abstractmethod
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from vllm.sequence import Sequence, SequenceGroup
 
@@ -78,6 +78,13 @@ class BlockSpaceManager(ABC):
     def swap_out(self, seq_group: SequenceGroup) -> Dict[int, int]:
         pass
 
+    @abstractmethod
+    def get_prefix_cache_swaps(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """Returns the swap in and swap out block mappings that move prefix
+        cache blocks between GPU and CPU memory, planned since the last call.
+        """
+        pass
+
     @abstractmethod
     def free(self, seq: Sequence) -> None:
         pass
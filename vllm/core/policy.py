@@ -1,9 +1,87 @@
+import heapq
+import itertools
 from collections import deque
-from typing import Deque
+from typing import (Any, Callable, Deque, Dict, Iterable, Iterator, List, Set,
+                    Tuple, Union)
 
 from vllm.sequence import SequenceGroup
 
 
+class PriorityQueue:
+    """A queue of sequence groups, ordered by a key that does not change
+    while they are queued. The lowest key comes first, and ties are broken
+    by insertion order.
+
+    Implements the part of the deque interface that the scheduler uses for
+    its waiting and swapped queues, on top of a binary heap. Removed
+    sequence groups stay in the heap, marked as removed, until they reach
+    its top or until they make up half of it.
+
+    Args:
+        key: The key of a sequence group.
+    """
+
+    def __init__(self, key: Callable[[SequenceGroup], Any]) -> None:
+        self._key = key
+        self._heap: List[Tuple[Any, int, SequenceGroup]] = []
+        self._counter = itertools.count()
+        # The insertion counter of the queued sequence groups, by id.
+        self._entries: Dict[int, int] = {}
+        # The insertion counters of the removed entries still in the heap.
+        self._removed: Set[int] = set()
+
+    def append(self, seq_group: SequenceGroup) -> None:
+        count = next(self._counter)
+        self._entries[id(seq_group)] = count
+        heapq.heappush(self._heap, (self._key(seq_group), count, seq_group))
+
+    # The position of a sequence group only depends on its key.
+    appendleft = append
+
+    def extendleft(self, seq_groups: Iterable[SequenceGroup]) -> None:
+        for seq_group in seq_groups:
+            self.append(seq_group)
+
+    def popleft(self) -> SequenceGroup:
+        self._discard_removed_top()
+        seq_group = heapq.heappop(self._heap)[2]
+        del self._entries[id(seq_group)]
+        return seq_group
+
+    def remove(self, seq_group: SequenceGroup) -> None:
+        count = self._entries.pop(id(seq_group), None)
+        if count is None:
+            raise ValueError(f"{seq_group} is not in the queue.")
+        self._removed.add(count)
+        if len(self._removed) > len(self._heap) // 2:
+            self._heap = [
+                entry for entry in self._heap if entry[1] not in self._removed
+            ]
+            heapq.heapify(self._heap)
+            self._removed.clear()
+
+    def _discard_removed_top(self) -> None:
+        while self._heap and self._heap[0][1] in self._removed:
+            self._removed.remove(heapq.heappop(self._heap)[1])
+
+    def __getitem__(self, index: int) -> SequenceGroup:
+        if index != 0:
+            raise IndexError("Only the first sequence group can be accessed.")
+        self._discard_removed_top()
+        return self._heap[0][2]
+
+    def __iter__(self) -> Iterator[SequenceGroup]:
+        """Iterates over the sequence groups, in no particular order."""
+        return (entry[2] for entry in self._heap
+                if entry[1] not in self._removed)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+SequenceGroupQueue = Union[Deque[SequenceGroup], PriorityQueue]
+
+
 class Policy:
 
     def get_priority(
@@ -16,8 +94,8 @@ class Policy:
     def sort_by_priority(
         self,
         now: float,
-        seq_groups: Deque[SequenceGroup],
-    ) -> Deque[SequenceGroup]:
+        seq_groups: SequenceGroupQueue,
+    ) -> SequenceGroupQueue:
         return deque(
             sorted(
                 seq_groups,
@@ -25,6 +103,10 @@ class Policy:
                 reverse=True,
             ))
 
+    def create_queue(self) -> SequenceGroupQueue:
+        """Creates a queue for the waiting or swapped sequence groups."""
+        return deque()
+
 
 class FCFS(Policy):
 
@@ -36,10 +118,59 @@ class FCFS(Policy):
         return now - seq_group.metrics.arrival_time
 
 
+class PriorityPolicy(Policy):
+    """Schedules the requests by effective deadline, earliest first, then
+    by priority, then by arrival.
+
+    A request added with a deadline is due at its deadline. A request
+    without one is due aging_period seconds after it arrives, and each
+    priority level (lower is more urgent) delays this implicit deadline by
+    another aging_period. Since the effective deadline does not change, the
+    waiting and swapped queues are heaps. It also bounds starvation: a
+    request can only be overtaken by the requests due before it.
+
+    Args:
+        aging_period: The delay of each priority level in seconds.
+    """
+
+    def __init__(self, aging_period: float = 10.0) -> None:
+        self.aging_period = aging_period
+
+    def get_effective_deadline(self, seq_group: SequenceGroup) -> float:
+        if seq_group.deadline is not None:
+            return seq_group.deadline
+        return (seq_group.metrics.arrival_time +
+                (1 + seq_group.priority) * self.aging_period)
+
+    def get_sort_key(self, seq_group: SequenceGroup) -> Tuple[float, int]:
+        return self.get_effective_deadline(seq_group), seq_group.priority
+
+    def get_priority(
+        self,
+        now: float,
+        seq_group: SequenceGroup,
+    ) -> float:
+        return now - self.get_effective_deadline(seq_group)
+
+    def sort_by_priority(
+        self,
+        now: float,
+        seq_groups: SequenceGroupQueue,
+    ) -> SequenceGroupQueue:
+        if isinstance(seq_groups, PriorityQueue):
+            # Already in priority order.
+            return seq_groups
+        return deque(sorted(seq_groups, key=self.get_sort_key))
+
+    def create_queue(self) -> SequenceGroupQueue:
+        return PriorityQueue(key=self.get_sort_key)
+
+
 class PolicyFactory:
 
     _POLICY_REGISTRY = {
         'fcfs': FCFS,
+        'priority': PriorityPolicy,
     }
 
     @classmethod
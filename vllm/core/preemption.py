@@ -0,0 +1,117 @@
+"""A cost model to choose how the scheduler preempts a sequence group."""
+from typing import Optional
+
+from vllm.config import CacheConfig, ModelConfig, ParallelConfig
+
+# Used until the first step is measured. The FLOP/s are the effective ones
+# of a prefill, well below the peak of the GPU.
+_DEFAULT_FLOPS_PER_SEC = 1e14
+_DEFAULT_SWAP_BYTES_PER_SEC = 1e10
+
+
+class PreemptionCostModel:
+    """Estimates the time to recompute or to swap a preempted sequence.
+
+    Recomputing a sequence runs a prefill over all its tokens again, whose
+    cost is estimated from the FLOPs of the model. Swapping a sequence copies
+    its KV cache blocks to CPU memory and back. Both rates are measured on
+    the executed steps, and the first measurement replaces the default one.
+
+    Args:
+        num_params: The number of parameters of a transformer layer, times the
+            number of layers.
+        num_layers: The number of layers.
+        hidden_size: The hidden size.
+        block_bytes: The size of a KV cache block of a worker in bytes, as
+            set in CacheConfig.block_bytes by the executor.
+        smoothing: The weight of a new measurement in the moving average of
+            the rates.
+    """
+
+    def __init__(
+        self,
+        num_params: int,
+        num_layers: int,
+        hidden_size: int,
+        block_bytes: int,
+        smoothing: float = 0.1,
+    ) -> None:
+        self.num_params = num_params
+        self.num_layers = num_layers
+        self.hidden_size = hidden_size
+        self.block_bytes = block_bytes
+        self.smoothing = smoothing
+        self.flops_per_sec = _DEFAULT_FLOPS_PER_SEC
+        self.swap_bytes_per_sec = _DEFAULT_SWAP_BYTES_PER_SEC
+        self._flops_measured = False
+        self._swap_measured = False
+
+    @classmethod
+    def from_configs(
+        cls,
+        model_config: ModelConfig,
+        cache_config: CacheConfig,
+        parallel_config: ParallelConfig,
+    ) -> "PreemptionCostModel":
+        hidden_size = model_config.get_hidden_size()
+        num_layers = model_config.get_num_layers(parallel_config)
+        kv_size = (model_config.get_total_num_kv_heads() *
+                   model_config.get_head_size())
+        intermediate_size = getattr(model_config.hf_text_config,
+                                    "intermediate_size", 4 * hidden_size)
+        # The query and output projections, the key and value projections
+        # and a gated MLP. The embeddings are ignored.
+        num_params = num_layers * (2 * hidden_size * hidden_size +
+                                   2 * hidden_size * kv_size +
+                                   3 * hidden_size * intermediate_size)
+        assert cache_config.block_bytes is not None
+        return cls(num_params, num_layers, hidden_size,
+                   cache_config.block_bytes)
+
+    def get_flops(self, num_tokens: int, num_context_tokens: int = 0) -> int:
+        """Returns the FLOPs to compute num_tokens tokens that follow
+        num_context_tokens already computed ones."""
+        matmul_flops = 2 * self.num_params * num_tokens
+        # Each token attends to the context and to the previous new tokens.
+        attention_flops = (2 * self.num_layers * self.hidden_size *
+                           num_tokens * (2 * num_context_tokens + num_tokens))
+        return matmul_flops + attention_flops
+
+    def get_recompute_time(self, num_tokens: int) -> float:
+        """Returns the estimated time to recompute a sequence of num_tokens
+        tokens."""
+        return self.get_flops(num_tokens) / self.flops_per_sec
+
+    def get_swap_time(self, num_blocks: int) -> float:
+        """Returns the estimated time to swap num_blocks blocks out and back
+        in."""
+        return 2 * num_blocks * self.block_bytes / self.swap_bytes_per_sec
+
+    def observe_forward(self, flops: int, elapsed_time: float) -> None:
+        """Updates the FLOP/s with a forward pass of a prefill step."""
+        rate = self._get_rate(flops, elapsed_time)
+        if rate is None:
+            return
+        self.flops_per_sec = self._update(self.flops_per_sec, rate,
+                                          self._flops_measured)
+        self._flops_measured = True
+
+    def observe_swap(self, num_blocks: int, elapsed_time: float) -> None:
+        """Updates the swap bandwidth with the swaps of a step."""
+        rate = self._get_rate(num_blocks * self.block_bytes, elapsed_time)
+        if rate is None:
+            return
+        self.swap_bytes_per_sec = self._update(self.swap_bytes_per_sec, rate,
+                                               self._swap_measured)
+        self._swap_measured = True
+
+    @staticmethod
+    def _get_rate(amount: int, elapsed_time: float) -> Optional[float]:
+        if amount <= 0 or elapsed_time <= 0:
+            return None
+        return amount / elapsed_time
+
+    def _update(self, average: float, rate: float, measured: bool) -> float:
+        if not measured:
+            return rate
+        return (1 - self.smoothing) * average + self.smoothing * rate
@@ -1,4 +1,5 @@
 import enum
+import os
 import time
 from collections import deque
 from dataclasses import dataclass
@@ -6,7 +7,8 @@ from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 from vllm.config import CacheConfig, LoRAConfig, SchedulerConfig
 from vllm.core.interfaces import AllocStatus, BlockSpaceManager
-from vllm.core.policy import PolicyFactory
+from vllm.core.policy import PolicyFactory, SequenceGroupQueue
+from vllm.core.preemption import PreemptionCostModel
 from vllm.logger import init_logger
 from vllm.lora.request import LoRARequest
 from vllm.sequence import (Sequence, SequenceData, SequenceGroup,
@@ -53,14 +55,18 @@ class SchedulerOutputs:
         blocks_to_copy: Dict[int, List[int]],
         ignored_seq_groups: List[SequenceGroup],
         num_lookahead_slots: int,
+        num_prefill_groups: Optional[int] = None,
     ) -> None:
         """A list of sequence groups to be scheduled as a single batch.
 
         Args:
             scheduled_seq_groups: A tuple of scheduled sequence group and its
-                token chunk size.
+                token chunk size. Sequence groups in prefill phase always
+                come before the ones in decoding phase.
             prompt_run: True if all sequence groups are in prefill phase.
-                If False, all sequence groups are in decoding phase.
+                If False, the batch contains sequence groups in decoding
+                phase (and possibly chunked prefills, see
+                `num_prefill_groups`).
             num_batched_tokens: Total number of batched tokens.
             blocks_to_swap_in: Blocks to swap in. Dict of CPU -> GPU block
                 number.
@@ -68,6 +74,11 @@ class SchedulerOutputs:
                 number.
             blocks_to_copy: Blocks to copy. Source to a list of dest blocks.
             ignored_seq_groups: Sequence groups that are going to be ignored.
+            num_lookahead_slots: The number of slots to allocate per sequence
+                beyond the known token ids.
+            num_prefill_groups: The number of leading sequence groups in
+                `scheduled_seq_groups` that are in prefill phase. If None, it
+                is derived from `prompt_run`.
         """
         # A tuple of scheduled sequence group and its chunk size.
         self.scheduled_seq_groups: ScheduledSequenceGroup = scheduled_seq_groups
@@ -85,9 +96,22 @@ class SchedulerOutputs:
         # Sequence groups that are going to be ignored.
         self.ignored_seq_groups: List[SequenceGroup] = ignored_seq_groups
 
-        # Swap in and swap out should never happen at the same time.
-        assert not (blocks_to_swap_in and blocks_to_swap_out)
+        # The swaps of preempted sequences never go both ways in one step,
+        # but the copies of the CPU prefix cache may come with swaps in the
+        # other direction. The worker swaps out before it swaps in, so a
+        # swap in must not read a CPU block written in the same step.
+        assert not set(blocks_to_swap_in).intersection(
+            blocks_to_swap_out.values())
+        # The preemptions of the step, with the reason of their mode.
+        self.preemptions: List[Tuple[PreemptionMode, str]] = []
+        # The number of decoding steps the workers run for the batch.
+        self.num_decode_steps = 1
         self.num_lookahead_slots = num_lookahead_slots
+        # Number of leading sequence groups that are in prefill phase.
+        if num_prefill_groups is None:
+            num_prefill_groups = (len(scheduled_seq_groups)
+                                  if prompt_run else 0)
+        self.num_prefill_groups: int = num_prefill_groups
 
         self.num_loras: int = len(self.lora_requests)
         if self.num_loras > 0:
@@ -99,9 +123,14 @@ class SchedulerOutputs:
                 and not self.blocks_to_swap_out and not self.blocks_to_copy)
 
     def _sort_by_lora_ids(self) -> bool:
-        self.scheduled_seq_groups = sorted(
-            self.scheduled_seq_groups,
-            key=lambda g: (g.seq_group.lora_int_id, g.seq_group.request_id))
+        # Prefills must stay in front of decodes, so sort them separately.
+        def sort_key(g: ScheduledSequenceGroup):
+            return (g.seq_group.lora_int_id, g.seq_group.request_id)
+
+        prefills = self.scheduled_seq_groups[:self.num_prefill_groups]
+        decodes = self.scheduled_seq_groups[self.num_prefill_groups:]
+        self.scheduled_seq_groups = (sorted(prefills, key=sort_key) +
+                                     sorted(decodes, key=sort_key))
 
     @property
     def lora_requests(self) -> Set[LoRARequest]:
@@ -115,6 +144,7 @@ class Scheduler:
         scheduler_config: SchedulerConfig,
         cache_config: CacheConfig,
         lora_config: Optional[LoRAConfig],
+        preemption_cost_model: Optional[PreemptionCostModel] = None,
     ) -> None:
         self.scheduler_config = scheduler_config
         self.cache_config = cache_config
@@ -122,12 +152,27 @@ class Scheduler:
         # simple and NOT fair. It can lead to starvation of some
         # LoRAs. This should be improved in the future.
         self.lora_config = lora_config
-
-        self.prompt_limit = min(self.scheduler_config.max_model_len,
-                                self.scheduler_config.max_num_batched_tokens)
+        # If None, the sequence groups with a single sequence are always
+        # preempted by recomputation.
+        self.preemption_cost_model = preemption_cost_model
+        # The preemptions of the step being scheduled.
+        self._preemptions: List[Tuple[PreemptionMode, str]] = []
+
+        if self.scheduler_config.chunked_prefill_enabled:
+            # Prompts longer than the token budget are split into chunks.
+            self.prompt_limit = self.scheduler_config.max_model_len
+        else:
+            self.prompt_limit = min(
+                self.scheduler_config.max_model_len,
+                self.scheduler_config.max_num_batched_tokens)
 
         # Instantiate the scheduling policy.
-        self.policy = PolicyFactory.get_policy(policy_name="fcfs")
+        policy_kwargs = {}
+        if self.scheduler_config.policy == "priority":
+            policy_kwargs["aging_period"] = (
+                self.scheduler_config.priority_aging_period)
+        self.policy = PolicyFactory.get_policy(
+            policy_name=self.scheduler_config.policy, **policy_kwargs)
 
         BlockSpaceManagerImpl = BlockSpaceManager.get_block_space_manager_class(
             version="v2" if self.scheduler_config.
@@ -139,14 +184,18 @@ class Scheduler:
             num_gpu_blocks=self.cache_config.num_gpu_blocks,
             num_cpu_blocks=self.cache_config.num_cpu_blocks,
             sliding_window=self.cache_config.sliding_window,
-            enable_caching=self.cache_config.enable_prefix_caching)
+            enable_caching=self.cache_config.enable_prefix_caching,
+            enable_cpu_caching=self.cache_config.enable_cpu_prefix_caching)
+        if self.cache_config.prefix_cache_path is not None:
+            self.block_manager.load_cpu_prefix_cache(
+                self._prefix_cache_index_path)
 
         # Sequence groups in the WAITING state.
-        self.waiting: Deque[SequenceGroup] = deque()
+        self.waiting: SequenceGroupQueue = self.policy.create_queue()
         # Sequence groups in the RUNNING state.
         self.running: Deque[SequenceGroup] = deque()
         # Sequence groups in the SWAPPED state.
-        self.swapped: Deque[SequenceGroup] = deque()
+        self.swapped: SequenceGroupQueue = self.policy.create_queue()
 
         # Time at previous scheduling step
         self.prev_time = 0.0
@@ -159,6 +208,25 @@ class Scheduler:
     def lora_enabled(self) -> bool:
         return bool(self.lora_config)
 
+    @property
+    def _prefix_cache_index_path(self) -> str:
+        return os.path.join(self.cache_config.prefix_cache_path,
+                            "block_index.json")
+
+    def flush_prefix_cache(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """Moves the computed GPU prefix cache blocks to the persistent CPU
+        prefix cache.
+
+        Returns the blocks to swap in and out, which must be executed before
+        save_prefix_cache() is called.
+        """
+        return self.block_manager.demote_all_blocks()
+
+    def save_prefix_cache(self) -> None:
+        """Writes the index of the persistent CPU prefix cache."""
+        os.makedirs(self.cache_config.prefix_cache_path, exist_ok=True)
+        self.block_manager.save_cpu_prefix_cache(self._prefix_cache_index_path)
+
     def add_seq_group(self, seq_group: SequenceGroup) -> None:
         # Add sequence groups to the waiting queue.
         self.waiting.append(seq_group)
@@ -206,6 +274,42 @@ class Scheduler:
         return len(self.waiting) + len(self.running) + len(self.swapped)
 
     def _schedule(self) -> SchedulerOutputs:
+        self._preemptions = []
+        if self.scheduler_config.chunked_prefill_enabled:
+            scheduler_outputs = self._schedule_chunked_prefill()
+        else:
+            scheduler_outputs = self._schedule_default()
+        scheduler_outputs.preemptions = self._preemptions
+        scheduler_outputs.num_decode_steps = self._get_num_decode_steps(
+            scheduler_outputs)
+        return scheduler_outputs
+
+    def _add_prefix_cache_swaps(
+        self,
+        blocks_to_swap_in: Dict[int, int],
+        blocks_to_swap_out: Dict[int, int],
+    ) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """Merges the copies between the GPU and the CPU prefix cache planned
+        in this step into the swaps of the preempted sequences.
+
+        The prefix cache copy wins if both read the same GPU block: the block
+        was reallocated in this step, so the other copy has no valid content.
+        """
+        # Swap in and swap out of preempted sequences should never happen at
+        # the same time.
+        assert not (blocks_to_swap_in and blocks_to_swap_out)
+        prefix_swap_in, prefix_swap_out = (
+            self.block_manager.get_prefix_cache_swaps())
+        blocks_to_swap_in = {**blocks_to_swap_in, **prefix_swap_in}
+        blocks_to_swap_out = {**blocks_to_swap_out, **prefix_swap_out}
+        return blocks_to_swap_in, blocks_to_swap_out
+
+    def _schedule_default(self) -> SchedulerOutputs:
+        """Schedule either a batch of prompts or a batch of decodes.
+
+        Waiting prompts are only admitted if they fit entirely in the token
+        budget, and prefill and decode never share a step.
+        """
         # Blocks that need to be swapped or copied before model execution.
         blocks_to_swap_in: Dict[int, int] = {}
         blocks_to_swap_out: Dict[int, int] = {}
@@ -228,7 +332,8 @@ class Scheduler:
 
             # Optimization: We do not sort the waiting queue since the preempted
             # sequence groups are added to the front and the new sequence groups
-            # are added to the back.
+            # are added to the back. Policies that order the requests otherwise
+            # keep it as a priority queue.
             leftover_waiting_sequences = deque()
             num_batched_tokens = 0
             while self._passed_delay(now) and self.waiting:
@@ -303,6 +408,9 @@ class Scheduler:
 
             if scheduled or ignored_seq_groups:
                 self.prev_prompt = True
+                blocks_to_swap_in, blocks_to_swap_out = (
+                    self._add_prefix_cache_swaps(blocks_to_swap_in,
+                                                 blocks_to_swap_out))
                 scheduler_outputs = SchedulerOutputs(
                     scheduled_seq_groups=scheduled,
                     prompt_run=True,
@@ -397,6 +505,8 @@ class Scheduler:
             seq_group.num_seqs(status=SequenceStatus.RUNNING)
             for seq_group in self.running)
 
+        blocks_to_swap_in, blocks_to_swap_out = self._add_prefix_cache_swaps(
+            blocks_to_swap_in, blocks_to_swap_out)
         scheduler_outputs = SchedulerOutputs(
             scheduled_seq_groups=[
                 ScheduledSequenceGroup(seq_group=running_group,
@@ -414,6 +524,244 @@ class Scheduler:
         )
         return scheduler_outputs
 
+    def _schedule_chunked_prefill(self) -> SchedulerOutputs:
+        """Schedule decodes and (possibly chunked) prefills in the same step.
+
+        The token budget (`max_num_batched_tokens`) is spent in this order:
+
+        1. Running sequence groups in decoding phase. They take one token per
+           sequence and are never starved by prefills.
+        2. Running sequence groups whose prefill was chunked in a previous
+           step.
+        3. Swapped sequence groups, if nothing was preempted in this step.
+        4. Waiting sequence groups, if nothing is swapped out. A prompt that
+           does not fit in the remaining budget is chunked, and its remaining
+           tokens are scheduled in the following steps.
+
+        Scheduled prefills come before decodes in the output so that the
+        sampler can tell them apart.
+        """
+        # Blocks that need to be swapped or copied before model execution.
+        blocks_to_swap_in: Dict[int, int] = {}
+        blocks_to_swap_out: Dict[int, int] = {}
+        blocks_to_copy: Dict[int, List[int]] = {}
+        token_budget = self.scheduler_config.max_num_batched_tokens
+        num_batched_tokens = 0
+
+        # Fix the current time.
+        now = time.time()
+
+        self.running = self.policy.sort_by_priority(now, self.running)
+
+        # Reserve new token slots for the running sequence groups in decoding
+        # phase. Groups in prefill phase already have blocks for all of their
+        # prompt tokens allocated.
+        running: Deque[SequenceGroup] = deque()
+        preempted: List[SequenceGroup] = []
+        decode_seq_groups: List[ScheduledSequenceGroup] = []
+        running_prefills: List[SequenceGroup] = []
+        while self.running:
+            seq_group = self.running.popleft()
+            if seq_group.is_prefill():
+                running_prefills.append(seq_group)
+                running.append(seq_group)
+                continue
+            while not self._can_append_slots(seq_group):
+                if self.running:
+                    # Preempt the lowest-priority sequence groups.
+                    victim_seq_group = self.running.pop()
+                    self._preempt(victim_seq_group, blocks_to_swap_out)
+                    preempted.append(victim_seq_group)
+                else:
+                    # No other sequence groups can be preempted.
+                    # Preempt the current sequence group.
+                    self._preempt(seq_group, blocks_to_swap_out)
+                    preempted.append(seq_group)
+                    break
+            else:
+                # Append new slots to the sequence group.
+                self._append_slots(seq_group, blocks_to_copy)
+                running.append(seq_group)
+                num_decode_tokens = seq_group.num_seqs(
+                    status=SequenceStatus.RUNNING)
+                num_batched_tokens += num_decode_tokens
+                decode_seq_groups.append(
+                    ScheduledSequenceGroup(seq_group=seq_group,
+                                           token_chunk_size=1))
+        self.running = running
+
+        # Continue the prefills that were chunked in previous steps.
+        prefill_seq_groups: List[ScheduledSequenceGroup] = []
+        for seq_group in running_prefills:
+            token_chunk_size = self._get_prefill_chunk_size(
+                seq_group, token_budget - num_batched_tokens)
+            if token_chunk_size == 0:
+                continue
+            num_batched_tokens += token_chunk_size
+            prefill_seq_groups.append(
+                ScheduledSequenceGroup(seq_group=seq_group,
+                                       token_chunk_size=token_chunk_size))
+
+        num_curr_seqs = sum(seq_group.get_max_num_running_seqs()
+                            for seq_group in self.running)
+        curr_loras = set(
+            seq_group.lora_int_id
+            for seq_group in self.running) if self.lora_enabled else None
+
+        # Swap in the sequence groups in the SWAPPED state if possible.
+        self.swapped = self.policy.sort_by_priority(now, self.swapped)
+        if not preempted:
+            leftover_swapped = deque()
+            while self.swapped:
+                seq_group = self.swapped[0]
+                lora_int_id = 0
+                if self.lora_enabled:
+                    lora_int_id = seq_group.lora_int_id
+                    if (lora_int_id > 0 and lora_int_id not in curr_loras
+                            and len(curr_loras) >= self.lora_config.max_loras):
+                        # We don't have a space for another LoRA, so
+                        # we ignore this request for now.
+                        leftover_swapped.appendleft(seq_group)
+                        self.swapped.popleft()
+                        continue
+
+                # If the sequence group cannot be swapped in, stop.
+                if not self._can_swap_in(seq_group):
+                    break
+
+                # The total number of sequences in the RUNNING state should not
+                # exceed the maximum number of sequences.
+                num_new_seqs = seq_group.get_max_num_running_seqs()
+                if (num_curr_seqs + num_new_seqs >
+                        self.scheduler_config.max_num_seqs):
+                    break
+
+                # Swapped sequence groups are in decoding phase.
+                num_decode_tokens = seq_group.num_seqs(
+                    status=SequenceStatus.SWAPPED)
+                if num_batched_tokens + num_decode_tokens > token_budget:
+                    break
+
+                if lora_int_id > 0:
+                    curr_loras.add(lora_int_id)
+                self.swapped.popleft()
+                self._swap_in(seq_group, blocks_to_swap_in)
+                self._append_slots(seq_group, blocks_to_copy)
+                num_curr_seqs += num_new_seqs
+                num_batched_tokens += num_decode_tokens
+                self.running.append(seq_group)
+                decode_seq_groups.append(
+                    ScheduledSequenceGroup(seq_group=seq_group,
+                                           token_chunk_size=1))
+            self.swapped.extendleft(leftover_swapped)
+
+        # Join waiting sequences if possible.
+        ignored_seq_groups: List[SequenceGroup] = []
+        if not self.swapped and not preempted:
+            leftover_waiting_sequences = deque()
+            while (self._passed_delay(now) and self.waiting
+                   and num_batched_tokens < token_budget):
+                seq_group = self.waiting[0]
+                waiting_seqs = seq_group.get_seqs(
+                    status=SequenceStatus.WAITING)
+                assert len(waiting_seqs) == 1, (
+                    "Waiting sequence group should have only one prompt "
+                    "sequence.")
+                # get_len includes output tokens if the request has been
+                # preempted.
+                num_prefill_tokens = waiting_seqs[0].get_len()
+                if num_prefill_tokens > self.prompt_limit:
+                    logger.warning(
+                        f"Input prompt ({num_prefill_tokens} tokens) is too "
+                        f"long and exceeds limit of {self.prompt_limit}")
+                    for seq in waiting_seqs:
+                        seq.status = SequenceStatus.FINISHED_IGNORED
+                    ignored_seq_groups.append(seq_group)
+                    self.waiting.popleft()
+                    continue
+
+                # If the sequence group cannot be allocated, stop.
+                can_allocate = self.block_manager.can_allocate(seq_group)
+                if can_allocate == AllocStatus.LATER:
+                    break
+                elif can_allocate == AllocStatus.NEVER:
+                    logger.warning(
+                        f"Input prompt ({num_prefill_tokens} tokens) is too "
+                        f"long and exceeds the capacity of block_manager")
+                    for seq in waiting_seqs:
+                        seq.status = SequenceStatus.FINISHED_IGNORED
+                    ignored_seq_groups.append(seq_group)
+                    self.waiting.popleft()
+                    continue
+
+                lora_int_id = 0
+                if self.lora_enabled:
+                    lora_int_id = seq_group.lora_int_id
+                    if (lora_int_id > 0 and lora_int_id not in curr_loras
+                            and len(curr_loras) >= self.lora_config.max_loras):
+                        # We don't have a space for another LoRA, so
+                        # we ignore this request for now.
+                        leftover_waiting_sequences.appendleft(seq_group)
+                        self.waiting.popleft()
+                        continue
+
+                # If no chunk of the prompt fits in the budget, stop.
+                token_chunk_size = self._get_prefill_chunk_size(
+                    seq_group, token_budget - num_batched_tokens)
+                if token_chunk_size == 0:
+                    break
+
+                # The total number of sequences in the RUNNING state should not
+                # exceed the maximum number of sequences.
+                num_new_seqs = seq_group.get_max_num_running_seqs()
+                if (num_curr_seqs + num_new_seqs >
+                        self.scheduler_config.max_num_seqs):
+                    break
+
+                if lora_int_id > 0:
+                    curr_loras.add(lora_int_id)
+                self.waiting.popleft()
+                self._allocate(seq_group)
+                self.running.append(seq_group)
+                num_curr_seqs += num_new_seqs
+                num_batched_tokens += token_chunk_size
+                prefill_seq_groups.append(
+                    ScheduledSequenceGroup(seq_group=seq_group,
+                                           token_chunk_size=token_chunk_size))
+            self.waiting.extendleft(leftover_waiting_sequences)
+
+        if prefill_seq_groups:
+            self.prev_prompt = True
+
+        blocks_to_swap_in, blocks_to_swap_out = self._add_prefix_cache_swaps(
+            blocks_to_swap_in, blocks_to_swap_out)
+        return SchedulerOutputs(
+            scheduled_seq_groups=prefill_seq_groups + decode_seq_groups,
+            prompt_run=bool(prefill_seq_groups) and not decode_seq_groups,
+            num_batched_tokens=num_batched_tokens,
+            blocks_to_swap_in=blocks_to_swap_in,
+            blocks_to_swap_out=blocks_to_swap_out,
+            blocks_to_copy=blocks_to_copy,
+            ignored_seq_groups=ignored_seq_groups,
+            num_lookahead_slots=self._get_num_lookahead_slots(
+                is_prefill=not decode_seq_groups),
+            num_prefill_groups=len(prefill_seq_groups),
+        )
+
+    def _get_prefill_chunk_size(self, seq_group: SequenceGroup,
+                                remaining_token_budget: int) -> int:
+        """Return the number of prefill tokens of the sequence group to
+        schedule in this step, or 0 if it cannot be scheduled.
+        """
+        num_uncomputed_tokens = seq_group.get_num_uncomputed_tokens()
+        if num_uncomputed_tokens <= remaining_token_budget:
+            return num_uncomputed_tokens
+        # Prompt logprobs are computed over the whole prompt at once, so
+        # such prompts are never chunked.
+        if seq_group.sampling_params.prompt_logprobs is not None:
+            return 0
+        return max(remaining_token_budget, 0)
+
     def _can_append_slots(self, seq_group: SequenceGroup) -> bool:
         """Determine whether or not we have enough space in the KV cache to
         continue generation of the sequence group.
@@ -423,7 +771,8 @@ class Scheduler:
 
         return self.block_manager.can_append_slots(
             seq_group=seq_group,
-            num_lookahead_slots=self._get_num_lookahead_slots(is_prefill),
+            num_lookahead_slots=self._get_num_lookahead_slots(
+                is_prefill, seq_group),
         )
 
     def _can_swap_in(self, seq_group: SequenceGroup) -> bool:
@@ -432,7 +781,8 @@ class Scheduler:
 
         return self.block_manager.can_swap_in(
             seq_group=seq_group,
-            num_lookahead_slots=self._get_num_lookahead_slots(is_prefill),
+            num_lookahead_slots=self._get_num_lookahead_slots(
+                is_prefill, seq_group),
         )
 
     def schedule(self) -> Tuple[List[SequenceGroupMetadata], SchedulerOutputs]:
@@ -444,10 +794,13 @@ class Scheduler:
 
         # Create input data structures.
         seq_group_metadata_list: List[SequenceGroupMetadata] = []
-        for scheduled_seq_group in scheduler_outputs.scheduled_seq_groups:
+        for i, scheduled_seq_group in enumerate(
+                scheduler_outputs.scheduled_seq_groups):
             seq_group = scheduled_seq_group.seq_group
             token_chunk_size = scheduled_seq_group.token_chunk_size
+            is_prompt = i < scheduler_outputs.num_prefill_groups
             seq_group.maybe_set_first_scheduled_time(now)
+            seq_group.maybe_set_resumed_time(now)
 
             # seq_id -> SequenceData
             seq_data: Dict[int, SequenceData] = {}
@@ -466,7 +819,7 @@ class Scheduler:
 
             seq_group_metadata = SequenceGroupMetadata(
                 request_id=seq_group.request_id,
-                is_prompt=scheduler_outputs.prompt_run,
+                is_prompt=is_prompt,
                 seq_data=seq_data,
                 sampling_params=seq_group.sampling_params,
                 block_tables=block_tables,
@@ -479,7 +832,7 @@ class Scheduler:
                 # the subsequent comms can still use delta, but
                 # `multi_modal_data` will be None.
                 multi_modal_data=seq_group.multi_modal_data
-                if scheduler_outputs.prompt_run else None,
+                if is_prompt else None,
             )
             seq_group_metadata_list.append(seq_group_metadata)
 
@@ -524,7 +877,8 @@ class Scheduler:
                 dictionary is updated with the new source and destination block
                 indices for the appended slots.
         """
-        num_lookahead_slots = self._get_num_lookahead_slots(is_prefill=False)
+        num_lookahead_slots = self._get_num_lookahead_slots(
+            is_prefill=False, seq_group=seq_group)
 
         for seq in seq_group.get_seqs(status=SequenceStatus.RUNNING):
             cows = self.block_manager.append_slots(seq, num_lookahead_slots)
@@ -540,22 +894,13 @@ class Scheduler:
         blocks_to_swap_out: Dict[int, int],
         preemption_mode: Optional[PreemptionMode] = None,
     ) -> None:
-        # If preemption mode is not specified, we determine the mode as follows:
-        # We use recomputation by default since it incurs lower overhead than
-        # swapping. However, when the sequence group has multiple sequences
-        # (e.g., beam search), recomputation is not currently supported. In
-        # such a case, we use swapping instead.
-        # FIXME(woosuk): This makes our scheduling policy a bit bizarre.
-        # As swapped sequences are prioritized over waiting sequences,
-        # sequence groups with multiple sequences are implicitly prioritized
-        # over sequence groups with a single sequence.
-        # TODO(woosuk): Support recomputation for sequence groups with multiple
-        # sequences. This may require a more sophisticated CUDA kernel.
         if preemption_mode is None:
-            if seq_group.get_max_num_running_seqs() == 1:
-                preemption_mode = PreemptionMode.RECOMPUTE
-            else:
-                preemption_mode = PreemptionMode.SWAP
+            preemption_mode, reason = self._get_preemption_mode(seq_group)
+        else:
+            reason = "explicit"
+        self._preemptions.append((preemption_mode, reason))
+        seq_group.set_preempted_time(
+            time.time(), by_swap=preemption_mode == PreemptionMode.SWAP)
         if preemption_mode == PreemptionMode.RECOMPUTE:
             self._preempt_by_recompute(seq_group)
         elif preemption_mode == PreemptionMode.SWAP:
@@ -563,6 +908,38 @@ class Scheduler:
         else:
             raise AssertionError("Invalid preemption mode.")
 
+    def _get_preemption_mode(
+            self, seq_group: SequenceGroup) -> Tuple[PreemptionMode, str]:
+        """Chooses how to preempt the sequence group.
+
+        Returns the preemption mode and the reason it was chosen.
+        """
+        # When the sequence group has multiple sequences (e.g., beam search),
+        # recomputation is not currently supported. In such a case, we use
+        # swapping instead.
+        # FIXME(woosuk): This makes our scheduling policy a bit bizarre.
+        # As swapped sequences are prioritized over waiting sequences,
+        # sequence groups with multiple sequences are implicitly prioritized
+        # over sequence groups with a single sequence.
+        # TODO(woosuk): Support recomputation for sequence groups with multiple
+        # sequences. This may require a more sophisticated CUDA kernel.
+        if seq_group.get_max_num_running_seqs() > 1:
+            return PreemptionMode.SWAP, "multi_seq"
+        cost_model = self.preemption_cost_model
+        if cost_model is None:
+            # Recomputation incurs lower overhead than swapping for most
+            # sequences.
+            return PreemptionMode.RECOMPUTE, "default"
+        if not self.block_manager.can_swap_out(seq_group):
+            return PreemptionMode.RECOMPUTE, "no_swap_space"
+        seq = seq_group.get_seqs(status=SequenceStatus.RUNNING)[0]
+        recompute_time = cost_model.get_recompute_time(seq.get_len())
+        swap_time = cost_model.get_swap_time(
+            len(self.block_manager.get_block_table(seq)))
+        if swap_time < recompute_time:
+            return PreemptionMode.SWAP, "cost"
+        return PreemptionMode.RECOMPUTE, "cost"
+
     def _preempt_by_recompute(
         self,
         seq_group: SequenceGroup,
@@ -627,10 +1004,15 @@ class Scheduler:
             passed_delay = True
         return passed_delay
 
-    def _get_num_lookahead_slots(self, is_prefill: bool) -> int:
+    def _get_num_lookahead_slots(
+            self,
+            is_prefill: bool,
+            seq_group: Optional[SequenceGroup] = None) -> int:
         """The number of slots to allocate per sequence per step, beyond known
         token ids. Speculative decoding uses these slots to store KV activations
-        of tokens which may or may not be accepted.
+        of tokens which may or may not be accepted, and multi-step decoding
+        uses them for the tokens of the later steps of seq_group, if it can
+        run them.
 
         Speculative decoding does not yet support prefill, so we do not perform
         lookahead allocation for prefill.
@@ -638,4 +1020,30 @@ class Scheduler:
         if is_prefill:
             return 0
 
-        return self.scheduler_config.num_lookahead_slots
+        num_lookahead_slots = self.scheduler_config.num_lookahead_slots
+        if seq_group is not None and self._can_multi_step(seq_group):
+            num_lookahead_slots += self.scheduler_config.num_decode_steps - 1
+        return num_lookahead_slots
+
+    @staticmethod
+    def _can_multi_step(seq_group: SequenceGroup) -> bool:
+        """Beam search forks and frees sequences after every step, so it
+        runs a single step at a time."""
+        return not seq_group.sampling_params.use_beam_search
+
+    def _get_num_decode_steps(self,
+                              scheduler_outputs: SchedulerOutputs) -> int:
+        """The number of decoding steps the workers run for the batch.
+
+        The batches with prefills or with sequence groups that cannot run
+        several steps, see _can_multi_step(), run a single step.
+        """
+        num_decode_steps = self.scheduler_config.num_decode_steps
+        if (num_decode_steps == 1 or not scheduler_outputs.scheduled_seq_groups
+                or scheduler_outputs.num_prefill_groups > 0):
+            return 1
+        if not all(
+                self._can_multi_step(scheduled_seq_group.seq_group) for
+                scheduled_seq_group in scheduler_outputs.scheduled_seq_groups):
+            return 1
+        return num_decode_steps
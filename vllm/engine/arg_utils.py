@@ -29,6 +29,8 @@ class EngineArgs:
     max_parallel_loading_workers: Optional[int] = None
     block_size: int = 16
     enable_prefix_caching: bool = False
+    enable_cpu_prefix_caching: bool = False
+    prefix_cache_dir: Optional[str] = None
     use_v2_block_manager: bool = False
     swap_space: int = 4  # GiB
     gpu_memory_utilization: float = 0.90
@@ -56,6 +58,7 @@ class EngineArgs:
     ray_workers_use_nsight: bool = False
     forced_num_gpu_blocks: Optional[int] = None
     num_lookahead_slots: int = 0
+    num_decode_steps: int = 1
 
     # Related to Vision-language models such as llava
     image_input_type: Optional[str] = None
@@ -65,6 +68,10 @@ class EngineArgs:
 
     scheduler_delay_factor: float = 0.0
     enable_chunked_prefill: bool = False
+    enable_pipelined_step: bool = False
+    scheduling_policy: str = "fcfs"
+    priority_aging_period: float = 10.0
+    enable_cost_based_preemption: bool = False
 
     # Speculative decoding configuration.
     speculative_model: Optional[str] = None
@@ -134,7 +141,9 @@ class EngineArgs:
             '--load-format',
             type=str,
             default=EngineArgs.load_format,
-            choices=['auto', 'pt', 'safetensors', 'npcache', 'dummy'],
+            choices=[
+                'auto', 'pt', 'safetensors', 'npcache', 'dummy', 'sharded'
+            ],
             help='The format of the model weights to load. '
             '"auto" will try to load the weights in the safetensors format '
             'and fall back to the pytorch bin format if safetensors format '
@@ -142,9 +151,11 @@ class EngineArgs:
             '"pt" will load the weights in the pytorch bin format. '
             '"safetensors" will load the weights in the safetensors format. '
             '"npcache" will load the weights in pytorch format and store '
-            'a numpy cache to speed up the loading. '
+            'them in a memory-mapped cache to speed up the loading. '
             '"dummy" will initialize the weights with random values, '
-            'which is mainly for profiling.')
+            'which is mainly for profiling. '
+            '"sharded" will load the weights of each tensor parallel worker '
+            'from a checkpoint saved by save_sharded_state().')
         parser.add_argument(
             '--dtype',
             type=str,
@@ -205,6 +216,19 @@ class EngineArgs:
         parser.add_argument('--enable-prefix-caching',
                             action='store_true',
                             help='Enables automatic prefix caching')
+        parser.add_argument(
+            '--enable-cpu-prefix-caching',
+            action='store_true',
+            help='Keeps prefix cache blocks evicted from GPU memory in the '
+            'CPU swap space and swaps them back in on a prefix hit. '
+            'Requires --enable-prefix-caching.')
+        parser.add_argument(
+            '--prefix-cache-dir',
+            type=str,
+            default=EngineArgs.prefix_cache_dir,
+            help='Directory to persist the CPU prefix cache in across '
+            'restarts. Its size per GPU is set by --swap-space. '
+            'Requires --enable-cpu-prefix-caching.')
         parser.add_argument('--use-v2-block-manager',
                             action='store_true',
                             help='Use BlockSpaceMangerV2')
@@ -377,6 +401,43 @@ class EngineArgs:
             default=False,
             help='If True, the prefill requests can be chunked based on the '
             'max_num_batched_tokens')
+        parser.add_argument(
+            '--enable-pipelined-step',
+            action='store_true',
+            help='If set, the output processing of a step (detokenization, '
+            'stop string checks and request outputs) is overlapped with the '
+            'model execution of the next step.')
+        parser.add_argument(
+            '--scheduling-policy',
+            choices=['fcfs', 'priority'],
+            default=EngineArgs.scheduling_policy,
+            help='The scheduling policy. "fcfs" schedules the requests in '
+            'order of arrival. "priority" schedules them by the deadline they '
+            'are added with, earliest first, then by priority, and preempts '
+            'the least urgent ones first.')
+        parser.add_argument(
+            '--priority-aging-period',
+            type=float,
+            default=EngineArgs.priority_aging_period,
+            help='With the priority scheduling policy, the seconds after '
+            'which the requests without a deadline are due, and the delay of '
+            'each priority level.')
+        parser.add_argument(
+            '--num-decode-steps',
+            type=int,
+            default=EngineArgs.num_decode_steps,
+            help='The number of decoding steps run by the workers per '
+            'scheduling step. Larger values reduce the scheduling and output '
+            'processing overhead per token, but new requests wait for the '
+            'running steps and the tokens are streamed in bursts. Requires '
+            '--use-v2-block-manager.')
+        parser.add_argument(
+            '--enable-cost-based-preemption',
+            action='store_true',
+            help='If set, the preempted sequences are swapped out to the CPU '
+            'or recomputed, whichever the measured step and swap times '
+            'predict is faster. Otherwise, they are recomputed. Only applies '
+            'to the GPU executors.')
 
         parser.add_argument(
             '--speculative-model',
@@ -410,12 +471,11 @@ class EngineArgs:
             self.tokenizer_revision, self.max_model_len, self.quantization,
             self.enforce_eager, self.max_context_len_to_capture,
             self.max_logprobs)
-        cache_config = CacheConfig(self.block_size,
-                                   self.gpu_memory_utilization,
-                                   self.swap_space, self.kv_cache_dtype,
-                                   self.forced_num_gpu_blocks,
-                                   model_config.get_sliding_window(),
-                                   self.enable_prefix_caching)
+        cache_config = CacheConfig(
+            self.block_size, self.gpu_memory_utilization, self.swap_space,
+            self.kv_cache_dtype, self.forced_num_gpu_blocks,
+            model_config.get_sliding_window(), self.enable_prefix_caching,
+            self.enable_cpu_prefix_caching, self.prefix_cache_dir)
         parallel_config = ParallelConfig(
             self.pipeline_parallel_size, self.tensor_parallel_size,
             self.worker_use_ray, self.max_parallel_loading_workers,
@@ -444,6 +504,11 @@ class EngineArgs:
                                  speculative_config.num_lookahead_slots),
             delay_factor=self.scheduler_delay_factor,
             enable_chunked_prefill=self.enable_chunked_prefill,
+            enable_pipelined_step=self.enable_pipelined_step,
+            policy=self.scheduling_policy,
+            priority_aging_period=self.priority_aging_period,
+            num_decode_steps=self.num_decode_steps,
+            enable_cost_based_preemption=self.enable_cost_based_preemption,
         )
         lora_config = LoRAConfig(
             max_lora_rank=self.max_lora_rank,
@@ -8,6 +8,7 @@ from typing import (AsyncIterator, Callable, Dict, Iterable, List, Optional,
 from transformers import PreTrainedTokenizer
 
 from vllm.config import ModelConfig
+from vllm.core.scheduler import SchedulerOutputs
 from vllm.engine.arg_utils import AsyncEngineArgs
 from vllm.engine.llm_engine import LLMEngine
 from vllm.engine.ray_utils import initialize_ray_cluster, ray
@@ -15,7 +16,7 @@ from vllm.logger import init_logger
 from vllm.lora.request import LoRARequest
 from vllm.outputs import RequestOutput
 from vllm.sampling_params import SamplingParams
-from vllm.sequence import MultiModalData
+from vllm.sequence import MultiModalData, SequenceGroupMetadata
 from vllm.usage.usage_lib import UsageContext
 
 logger = init_logger(__name__)
@@ -206,19 +207,48 @@ class _AsyncLLMEngine(LLMEngine):
         and updates the scheduler with the model outputs. Finally, it decodes
         the sequences and returns the newly generated results.
         """
-        seq_group_metadata_list, scheduler_outputs = self.scheduler.schedule()
+        seq_group_metadata_list, scheduler_outputs = self._schedule()
+
+        if self.scheduler_config.pipelined_step_enabled:
+            return await self._pipelined_step_async(seq_group_metadata_list,
+                                                    scheduler_outputs)
 
         if not scheduler_outputs.is_empty():
             # Execute the model.
             output = await self.model_executor.execute_model_async(
                 seq_group_metadata_list, scheduler_outputs.blocks_to_swap_in,
                 scheduler_outputs.blocks_to_swap_out,
-                scheduler_outputs.blocks_to_copy)
+                scheduler_outputs.blocks_to_copy,
+                scheduler_outputs.num_decode_steps,
+                self._should_time_phases(scheduler_outputs))
         else:
             output = []
 
         return self._process_model_outputs(output, scheduler_outputs)
 
+    async def _pipelined_step_async(
+            self, seq_group_metadata_list: List[SequenceGroupMetadata],
+            scheduler_outputs: SchedulerOutputs) -> List[RequestOutput]:
+        """Async version of LLMEngine._pipelined_step()."""
+        output_task = None
+        if not scheduler_outputs.is_empty():
+            output_task = asyncio.ensure_future(
+                self.model_executor.execute_model_async(
+                    seq_group_metadata_list,
+                    scheduler_outputs.blocks_to_swap_in,
+                    scheduler_outputs.blocks_to_swap_out,
+                    scheduler_outputs.blocks_to_copy,
+                    time_phases=self._should_time_phases(scheduler_outputs)))
+            # Let the task hand the step over to the workers before the
+            # deferred outputs block the event loop.
+            await asyncio.sleep(0)
+
+        request_outputs = self._process_deferred_outputs()
+
+        output = await output_task if output_task is not None else []
+        self._append_model_outputs(output, scheduler_outputs)
+        return request_outputs
+
     async def encode_request_async(
         self,
         request_id: str,  # pylint: disable=unused-argument
@@ -243,6 +273,8 @@ class _AsyncLLMEngine(LLMEngine):
         arrival_time: Optional[float] = None,
         lora_request: Optional[LoRARequest] = None,
         multi_modal_data: Optional[MultiModalData] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
     ) -> None:
         if lora_request is not None and not self.lora_config:
             raise ValueError(f"Got lora_request {lora_request} but LoRA is "
@@ -261,7 +293,9 @@ class _AsyncLLMEngine(LLMEngine):
                                 sampling_params=sampling_params,
                                 arrival_time=arrival_time,
                                 lora_request=lora_request,
-                                multi_modal_data=multi_modal_data)
+                                multi_modal_data=multi_modal_data,
+                                priority=priority,
+                                deadline=deadline)
 
     async def check_health_async(self) -> None:
         self.model_executor.check_health()
@@ -457,7 +491,13 @@ class AsyncLLMEngine:
             self._request_tracker.process_request_output(
                 request_output, verbose=self.log_requests)
 
-        return len(request_outputs) > 0
+        if request_outputs:
+            return True
+        # A step may have no outputs while requests are in progress, e.g.
+        # for partially computed prompts or with pipelined steps.
+        if self.engine_use_ray:
+            return await self.engine.has_unfinished_requests.remote()
+        return self.engine.has_unfinished_requests()
 
     async def _engine_abort(self, request_ids: Iterable[str]):
         if self.engine_use_ray:
@@ -494,6 +534,8 @@ class AsyncLLMEngine:
         arrival_time: Optional[float] = None,
         lora_request: Optional[LoRARequest] = None,
         multi_modal_data: Optional[MultiModalData] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
     ) -> AsyncStream:
         if self.log_requests:
             shortened_prompt = prompt
@@ -544,6 +586,8 @@ class AsyncLLMEngine:
             arrival_time=arrival_time,
             lora_request=lora_request,
             multi_modal_data=multi_modal_data,
+            priority=priority,
+            deadline=deadline,
         )
 
         return stream
@@ -555,7 +599,9 @@ class AsyncLLMEngine:
         request_id: str,
         prompt_token_ids: Optional[List[int]] = None,
         lora_request: Optional[LoRARequest] = None,
-        multi_modal_data: Optional[MultiModalData] = None
+        multi_modal_data: Optional[MultiModalData] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
     ) -> AsyncIterator[RequestOutput]:
         """Generate outputs for a request.
 
@@ -572,6 +618,10 @@ class AsyncLLMEngine:
                 use the tokenizer to convert the prompts to token IDs.
             lora_request: LoRA request to use for generation, if any.
             multi_modal_data: Multi modal data per request.
+            priority: The priority of the request, lower is more urgent.
+                Requires the priority scheduling policy.
+            deadline: The time.time() by which the request should be
+                scheduled. Requires the priority scheduling policy.
 
         Yields:
             The output `RequestOutput` objects from the LLMEngine for the
@@ -632,6 +682,8 @@ class AsyncLLMEngine:
                 arrival_time=arrival_time,
                 lora_request=lora_request,
                 multi_modal_data=multi_modal_data,
+                priority=priority,
+                deadline=deadline,
             )
 
             async for request_output in stream:
@@ -1,5 +1,8 @@
+import atexit
+import os
 import time
-from typing import Iterable, List, Optional, Tuple, Type, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple, Type, Union
 
 from transformers import PreTrainedTokenizer
 
@@ -7,18 +10,20 @@ import vllm
 from vllm.config import (CacheConfig, DeviceConfig, LoRAConfig, ModelConfig,
                          ParallelConfig, SchedulerConfig, SpeculativeConfig,
                          VisionLanguageConfig)
+from vllm.core.preemption import PreemptionCostModel
 from vllm.core.scheduler import Scheduler, SchedulerOutputs
 from vllm.engine.arg_utils import EngineArgs
-from vllm.engine.metrics import StatLogger, Stats
+from vllm.engine.metrics import StatLogger, Stats, StepTracer
 from vllm.engine.ray_utils import initialize_ray_cluster
+from vllm.engine.stop_checker import StopChecker, get_stop_checker
 from vllm.executor.executor_base import ExecutorBase
 from vllm.logger import init_logger
 from vllm.lora.request import LoRARequest
 from vllm.outputs import RequestOutput
 from vllm.sampling_params import SamplingParams
-from vllm.sequence import (MultiModalData, SamplerOutput, Sequence,
-                           SequenceGroup, SequenceGroupOutput, SequenceOutput,
-                           SequenceStatus)
+from vllm.sequence import (MultiModalData, PromptLogprobs, SamplerOutput,
+                           Sequence, SequenceGroup, SequenceGroupMetadata,
+                           SequenceGroupOutput, SequenceOutput, SequenceStatus)
 from vllm.transformers_utils.detokenizer import Detokenizer
 from vllm.transformers_utils.tokenizer_group import (BaseTokenizerGroup,
                                                      get_tokenizer_group)
@@ -28,6 +33,13 @@ from vllm.utils import Counter
 
 logger = init_logger(__name__)
 _LOCAL_LOGGING_INTERVAL_SEC = 5
+# If set, the stats of every step are appended to this file as JSON lines.
+VLLM_STEP_TRACE_PATH = os.environ.get("VLLM_STEP_TRACE_PATH")
+
+# (seq_group, seqs that got a new token, prompt_logprobs) of a pipelined step
+# whose detokenization and stop string checks are deferred.
+_DeferredGroupOutput = Tuple[SequenceGroup, List[Sequence],
+                             Optional[PromptLogprobs]]
 
 
 class LLMEngine:
@@ -115,6 +127,20 @@ class LLMEngine:
         self.detokenizer = Detokenizer(self.tokenizer)
         self.seq_counter = Counter()
 
+        # With pipelined steps, the outputs of the previous step that are
+        # processed while the current step is executed.
+        self._deferred_outputs: Optional[Tuple[
+            SchedulerOutputs, List[_DeferredGroupOutput]]] = None
+        # Thread that executes the model while the engine processes the
+        # deferred outputs. Created on the first pipelined step.
+        self._step_executor: Optional[ThreadPoolExecutor] = None
+        # Seconds spent in the phases of the step, reported with its stats.
+        self._step_phase_times: Dict[str, float] = {}
+        # Number of tokens appended by the step if it is a multi-step decode,
+        # reported with its stats. The sequences that stop before its last
+        # step get fewer tokens.
+        self._multi_step_num_tokens: Optional[int] = None
+
         self.model_executor = executor_class(
             model_config=model_config,
             cache_config=cache_config,
@@ -168,7 +194,18 @@ class LLMEngine:
         # Create the scheduler.
         # NOTE: the cache_config here have been updated with the numbers of
         # GPU and CPU blocks, which are profiled in the distributed executor.
-        self.scheduler = Scheduler(scheduler_config, cache_config, lora_config)
+        # The preemption cost model is measured on the executed steps. It is
+        # only used if enabled, by the executors that can swap, which set the
+        # size of the blocks.
+        self.preemption_cost_model: Optional[PreemptionCostModel] = None
+        if (scheduler_config.cost_based_preemption_enabled
+                and cache_config.block_bytes is not None):
+            self.preemption_cost_model = PreemptionCostModel.from_configs(
+                model_config, cache_config, parallel_config)
+        self.scheduler = Scheduler(scheduler_config, cache_config, lora_config,
+                                   self.preemption_cost_model)
+        if cache_config.prefix_cache_path is not None:
+            atexit.register(self._save_prefix_cache)
 
         # Metric Logging.
         if self.log_stats:
@@ -176,6 +213,10 @@ class LLMEngine:
                 local_interval=_LOCAL_LOGGING_INTERVAL_SEC,
                 labels=dict(model_name=model_config.model))
             self.stat_logger.info("cache_config", self.cache_config)
+        self.step_tracer: Optional[StepTracer] = None
+        if VLLM_STEP_TRACE_PATH:
+            self.step_tracer = StepTracer(VLLM_STEP_TRACE_PATH)
+            atexit.register(self.step_tracer.close)
 
     @classmethod
     def from_engine_args(
@@ -213,6 +254,22 @@ class LLMEngine:
         )
         return engine
 
+    def _save_prefix_cache(self) -> None:
+        """Persists the prefix cache when the process exits."""
+        blocks_to_swap_in, blocks_to_swap_out = (
+            self.scheduler.flush_prefix_cache())
+        try:
+            self.model_executor.execute_model(
+                seq_group_metadata_list=[],
+                blocks_to_swap_in=blocks_to_swap_in,
+                blocks_to_swap_out=blocks_to_swap_out,
+                blocks_to_copy={})
+        except Exception as e:
+            # Without the copies, the index would not match the KV cache.
+            logger.warning(f"Failed to persist the prefix cache: {e}")
+            return
+        self.scheduler.save_prefix_cache()
+
     def __reduce__(self):
         # This is to ensure that the LLMEngine is not referenced in
         # the closure used to initialize Ray worker actors
@@ -269,6 +326,8 @@ class LLMEngine:
         arrival_time: Optional[float] = None,
         lora_request: Optional[LoRARequest] = None,
         multi_modal_data: Optional[MultiModalData] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
     ) -> None:
         """Add a request to the engine's request pool.
 
@@ -286,6 +345,10 @@ class LLMEngine:
             arrival_time: The arrival time of the request. If None, we use
                 the current monotonic time.
             multi_modal_data: Multi modal data per request.
+            priority: The priority of the request, lower is more urgent.
+                Requires the priority scheduling policy.
+            deadline: The time.time() by which the request should be
+                scheduled. Requires the priority scheduling policy.
 
         Details:
             - Set arrival_time to the current time if it is None.
@@ -321,6 +384,10 @@ class LLMEngine:
                     and sampling_params.prompt_logprobs > max_logprobs):
             raise ValueError(f"Cannot request more than "
                              f"{max_logprobs} logprobs.")
+        if ((priority != 0 or deadline is not None)
+                and self.scheduler_config.policy != "priority"):
+            raise ValueError("Got a request priority or deadline but the "
+                             "priority scheduling policy is not enabled!")
         if arrival_time is None:
             arrival_time = time.time()
         prompt_token_ids = self.encode_request(
@@ -334,8 +401,13 @@ class LLMEngine:
         seq_id = next(self.seq_counter)
         eos_token_id = self.tokenizer.get_lora_tokenizer(
             lora_request).eos_token_id
-        seq = Sequence(seq_id, prompt, prompt_token_ids, block_size,
-                       eos_token_id, lora_request)
+        seq = Sequence(seq_id,
+                       prompt,
+                       prompt_token_ids,
+                       block_size,
+                       eos_token_id,
+                       lora_request,
+                       record_logprobs=sampling_params.logprobs is not None)
 
         # Defensive copy of SamplingParams, which are used by the sampler,
         # this doesn't deep-copy LogitsProcessor objects
@@ -346,7 +418,9 @@ class LLMEngine:
 
         # Create the sequence group.
         seq_group = SequenceGroup(request_id, [seq], sampling_params,
-                                  arrival_time, lora_request, multi_modal_data)
+                                  arrival_time, lora_request, multi_modal_data,
+                                  StopChecker(sampling_params, eos_token_id),
+                                  priority, deadline)
 
         # Add the sequence group to the scheduler.
         self.scheduler.add_seq_group(seq_group)
@@ -369,6 +443,18 @@ class LLMEngine:
             >>> engine.abort_request(request_id)
         """
         self.scheduler.abort_seq_group(request_id)
+        if self._deferred_outputs is not None:
+            request_ids = ({request_id}
+                           if isinstance(request_id, str) else set(request_id))
+            scheduler_outputs, deferred = self._deferred_outputs
+            scheduler_outputs.ignored_seq_groups = [
+                seq_group for seq_group in scheduler_outputs.ignored_seq_groups
+                if seq_group.request_id not in request_ids
+            ]
+            deferred[:] = [
+                group_output for group_output in deferred
+                if group_output[0].request_id not in request_ids
+            ]
 
     def get_model_config(self) -> ModelConfig:
         """Gets the model configuration."""
@@ -380,7 +466,8 @@ class LLMEngine:
 
     def has_unfinished_requests(self) -> bool:
         """Returns True if there are unfinished requests."""
-        return self.scheduler.has_unfinished_seqs()
+        return (self.scheduler.has_unfinished_seqs()
+                or self._deferred_outputs is not None)
 
     def _check_beam_search_early_stopping(
         self,
@@ -426,26 +513,28 @@ class LLMEngine:
                         eos_token_id=best_running_seq.eos_token_id))
         return current_worst_score >= highest_attainable_score
 
-    def _process_sequence_group_outputs(self, seq_group: SequenceGroup,
-                                        outputs: SequenceGroupOutput) -> None:
+    def _append_samples(
+            self, seq_group: SequenceGroup,
+            samples: List[SequenceOutput]) -> List[Tuple[Sequence, Sequence]]:
+        """Appends the sampled tokens to the running sequences of the group.
 
-        # Process prompt logprobs
-        prompt_logprobs = outputs.prompt_logprobs
-        if prompt_logprobs is not None:
-            self.detokenizer.decode_prompt_logprobs_inplace(
-                seq_group, prompt_logprobs)
-            seq_group.prompt_logprobs = prompt_logprobs
+        A parent sequence with multiple samples is forked, and a parent
+        sequence without samples is removed from the group.
 
-        # Process samples
-        samples = outputs.samples
+        Returns:
+            A list of (child, parent) for the sequences that got a token.
+            A parent that is continued by its last sample is its own child.
+        """
         parent_seqs = seq_group.get_seqs(status=SequenceStatus.RUNNING)
-        existing_finished_seqs = seq_group.get_finished_seqs()
-        parent_child_dict = {
+        parent_child_dict: Dict[int, List[SequenceOutput]] = {
             parent_seq.seq_id: []
             for parent_seq in parent_seqs
         }
         for sample in samples:
-            parent_child_dict[sample.parent_seq_id].append(sample)
+            # With pipelined steps, a sequence may be stopped while a step
+            # that samples from it is in flight. Its samples are dropped.
+            if sample.parent_seq_id in parent_child_dict:
+                parent_child_dict[sample.parent_seq_id].append(sample)
         # List of (child, parent)
         child_seqs: List[Tuple[Sequence, Sequence]] = []
 
@@ -475,29 +564,46 @@ class LLMEngine:
             parent.append_token_id(last_child_sample.output_token,
                                    last_child_sample.logprobs)
             child_seqs.append((parent, parent))
+        return child_seqs
 
-        for seq, _ in child_seqs:
-            self.detokenizer.decode_sequence_inplace(seq,
-                                                     seq_group.sampling_params)
-            self._check_stop(seq, seq_group.sampling_params)
+    def _add_child_seqs(self, seq_group: SequenceGroup,
+                        child_seqs: List[Tuple[Sequence, Sequence]]) -> None:
+        """Adds the new child sequences of a non-beam search group to the
+        group, and frees the sequences that are finished."""
+        # For newly created child sequences, add them to the sequence group
+        # and fork them in block manager if they are not finished.
+        for seq, parent in child_seqs:
+            if seq is not parent:
+                seq_group.add(seq)
+                if not seq.is_finished():
+                    self.scheduler.fork_seq(parent, seq)
+
+        # Free the finished and selected parent sequences' memory in block
+        # manager. Keep them in the sequence group as candidate output.
+        # NOTE: we need to fork the new sequences before freeing the
+        # old sequences.
+        for seq, parent in child_seqs:
+            if seq is parent and seq.is_finished():
+                self.scheduler.free_seq(seq)
+
+    def _process_sequence_group_outputs(self, seq_group: SequenceGroup,
+                                        outputs: SequenceGroupOutput) -> None:
+
+        # Process prompt logprobs
+        prompt_logprobs = outputs.prompt_logprobs
+        if prompt_logprobs is not None:
+            self._decode_prompt_logprobs(seq_group, prompt_logprobs)
+
+        # Process samples
+        existing_finished_seqs = seq_group.get_finished_seqs()
+        child_seqs = self._append_samples(seq_group, outputs.samples)
+
+        self._decode_and_check_stop([(seq, seq_group)
+                                     for seq, _ in child_seqs])
 
         # Non-beam search case
         if not seq_group.sampling_params.use_beam_search:
-            # For newly created child sequences, add them to the sequence group
-            # and fork them in block manager if they are not finished.
-            for seq, parent in child_seqs:
-                if seq is not parent:
-                    seq_group.add(seq)
-                    if not seq.is_finished():
-                        self.scheduler.fork_seq(parent, seq)
-
-            # Free the finished and selected parent sequences' memory in block
-            # manager. Keep them in the sequence group as candidate output.
-            # NOTE: we need to fork the new sequences before freeing the
-            # old sequences.
-            for seq, parent in child_seqs:
-                if seq is parent and seq.is_finished():
-                    self.scheduler.free_seq(seq)
+            self._add_child_seqs(seq_group, child_seqs)
             return
 
         # Beam search case
@@ -600,25 +706,34 @@ class LLMEngine:
                 self.scheduler.free_seq(seq)
 
     def _process_model_outputs(
-            self, output: SamplerOutput,
+            self, output: Union[SamplerOutput, List[SamplerOutput]],
             scheduler_outputs: SchedulerOutputs) -> List[RequestOutput]:
-        now = time.time()
-        # Update the scheduled sequence groups with the model outputs.
-        scheduled_seq_groups = scheduler_outputs.scheduled_seq_groups
-
-        for scheduled_seq_group, outputs in zip(scheduled_seq_groups, output):
-            seq_group = scheduled_seq_group.seq_group
-            token_chunk_size = scheduled_seq_group.token_chunk_size
-            seq_group.update_num_computed_tokens(token_chunk_size)
-            self._process_sequence_group_outputs(seq_group, outputs)
+        """Updates the scheduled sequence groups with the model outputs and
+        creates the request outputs.
 
-        # Free the finished sequence groups.
-        self.scheduler.free_finished_seq_groups()
+        With multi-step decoding, output is the list of the outputs of the
+        steps run by the workers, which are processed in order. The tokens of
+        a sequence that are sampled after it is stopped are discarded.
+        """
+        process_start = time.perf_counter()
+        now = time.time()
+        if scheduler_outputs.num_decode_steps > 1:
+            # The workers stop early when all the sequences are stopped.
+            scheduler_outputs.num_decode_steps = len(output)
+            self._multi_step_num_tokens = sum(
+                self._process_step_output(step_output, scheduler_outputs)
+                for step_output in output)
+        else:
+            self._multi_step_num_tokens = None
+            self._process_step_output(output, scheduler_outputs)
 
         # Create the outputs.
         request_outputs: List[RequestOutput] = []
-        for scheduled_seq_group in scheduled_seq_groups:
+        for scheduled_seq_group in scheduler_outputs.scheduled_seq_groups:
             seq_group = scheduled_seq_group.seq_group
+            if seq_group.is_prefill():
+                # No new output until the whole prompt is computed.
+                continue
             seq_group.maybe_set_first_token_time(now)
             request_output = RequestOutput.from_seq_group(seq_group)
             request_outputs.append(request_output)
@@ -626,11 +741,56 @@ class LLMEngine:
             request_output = RequestOutput.from_seq_group(seq_group)
             request_outputs.append(request_output)
 
-        # Log stats.
-        if self.log_stats:
-            self.stat_logger.log(self._get_stats(scheduler_outputs))
+        self._record_phase_time("process_outputs", process_start)
+        self._log_step(scheduler_outputs)
         return request_outputs
 
+    def _process_step_output(self, output: SamplerOutput,
+                             scheduler_outputs: SchedulerOutputs) -> int:
+        """Appends the tokens sampled by a model step to the sequences, and
+        stops and frees the finished ones.
+
+        Returns the number of tokens appended to the sequences of the groups
+        that do not use beam search.
+        """
+        self._record_worker_phase_times(output, scheduler_outputs)
+        scheduled_seq_groups = scheduler_outputs.scheduled_seq_groups
+
+        # The new tokens of the non-beam search groups are detokenized in one
+        # batch. Beam search groups need their candidates detokenized before
+        # the beams are selected, so they are processed one by one.
+        batched: List[Tuple[SequenceGroup, List[Tuple[Sequence,
+                                                      Sequence]]]] = []
+        for scheduled_seq_group, outputs in zip(scheduled_seq_groups, output):
+            seq_group = scheduled_seq_group.seq_group
+            if seq_group.is_finished():
+                # Stopped by a previous step of a multi-step decode.
+                continue
+            token_chunk_size = scheduled_seq_group.token_chunk_size
+            seq_group.update_num_computed_tokens(token_chunk_size)
+            if seq_group.is_prefill():
+                # Only a chunk of the prompt was computed. The token sampled
+                # from it is discarded.
+                continue
+            if seq_group.sampling_params.use_beam_search:
+                self._process_sequence_group_outputs(seq_group, outputs)
+                continue
+            prompt_logprobs = outputs.prompt_logprobs
+            if prompt_logprobs is not None:
+                self._decode_prompt_logprobs(seq_group, prompt_logprobs)
+            batched.append(
+                (seq_group, self._append_samples(seq_group, outputs.samples)))
+
+        self._decode_and_check_stop([(seq, seq_group)
+                                     for seq_group, child_seqs in batched
+                                     for seq, _ in child_seqs])
+        for seq_group, child_seqs in batched:
+            self._add_child_seqs(seq_group, child_seqs)
+
+        # Free the finished sequence groups.
+        self.scheduler.free_finished_seq_groups()
+        return sum(len(child_seqs) for _, child_seqs in batched)
+
     def step(self) -> List[RequestOutput]:
         """Performs one decoding iteration and returns newly generated results.
 
@@ -682,18 +842,219 @@ class LLMEngine:
             >>>     if not (engine.has_unfinished_requests() or example_inputs):
             >>>         break
         """
-        seq_group_metadata_list, scheduler_outputs = self.scheduler.schedule()
+        seq_group_metadata_list, scheduler_outputs = self._schedule()
+
+        if self.scheduler_config.pipelined_step_enabled:
+            return self._pipelined_step(seq_group_metadata_list,
+                                        scheduler_outputs)
 
         if not scheduler_outputs.is_empty():
             output = self.model_executor.execute_model(
                 seq_group_metadata_list, scheduler_outputs.blocks_to_swap_in,
                 scheduler_outputs.blocks_to_swap_out,
-                scheduler_outputs.blocks_to_copy)
+                scheduler_outputs.blocks_to_copy,
+                scheduler_outputs.num_decode_steps,
+                self._should_time_phases(scheduler_outputs))
         else:
             output = []
 
         return self._process_model_outputs(output, scheduler_outputs)
 
+    def _pipelined_step(
+            self, seq_group_metadata_list: List[SequenceGroupMetadata],
+            scheduler_outputs: SchedulerOutputs) -> List[RequestOutput]:
+        """Executes the model for this step in a separate thread while the
+        outputs of the previous step are processed.
+
+        Returns the outputs of the previous step.
+        """
+        output_future = None
+        if not scheduler_outputs.is_empty():
+            if self._step_executor is None:
+                self._step_executor = ThreadPoolExecutor(max_workers=1)
+            output_future = self._step_executor.submit(
+                self.model_executor.execute_model,
+                seq_group_metadata_list,
+                scheduler_outputs.blocks_to_swap_in,
+                scheduler_outputs.blocks_to_swap_out,
+                scheduler_outputs.blocks_to_copy,
+                time_phases=self._should_time_phases(scheduler_outputs))
+
+        request_outputs = self._process_deferred_outputs()
+
+        output = output_future.result() if output_future is not None else []
+        self._append_model_outputs(output, scheduler_outputs)
+        return request_outputs
+
+    def _append_model_outputs(self, output: SamplerOutput,
+                              scheduler_outputs: SchedulerOutputs) -> None:
+        """Appends the sampled tokens of a pipelined step to the sequences.
+
+        This is all the next step needs to be scheduled. Stop conditions that
+        only depend on the token ids are checked right away, so that the
+        stopped sequences are not scheduled again. Detokenization and stop
+        string checks are deferred to _process_deferred_outputs(), which runs
+        while the next step is executed. A sequence stopped by a stop string
+        is then already scheduled for the next step, whose token for it is
+        dropped.
+        """
+        # Logged with the stats of the next step, when the outputs are done.
+        self._record_worker_phase_times(output, scheduler_outputs)
+        deferred: List[_DeferredGroupOutput] = []
+        for scheduled_seq_group, outputs in zip(
+                scheduler_outputs.scheduled_seq_groups, output):
+            seq_group = scheduled_seq_group.seq_group
+            if seq_group.is_finished():
+                # Stopped while this step was in flight.
+                continue
+            seq_group.update_num_computed_tokens(
+                scheduled_seq_group.token_chunk_size)
+            if seq_group.is_prefill():
+                # Only a chunk of the prompt was computed. The token sampled
+                # from it is discarded.
+                continue
+
+            if seq_group.sampling_params.use_beam_search:
+                # Beam search needs the detokenized candidates to select the
+                # beams of the next step.
+                self._process_sequence_group_outputs(seq_group, outputs)
+                deferred.append((seq_group, [], None))
+                continue
+
+            child_seqs = self._append_samples(seq_group, outputs.samples)
+            for seq, _ in child_seqs:
+                self._check_token_stop(seq, seq_group)
+            self._add_child_seqs(seq_group, child_seqs)
+            deferred.append((seq_group, [seq for seq, _ in child_seqs],
+                             outputs.prompt_logprobs))
+
+        # Free the finished sequence groups.
+        self.scheduler.free_finished_seq_groups()
+
+        if deferred or scheduler_outputs.ignored_seq_groups:
+            self._deferred_outputs = (scheduler_outputs, deferred)
+
+    def _process_deferred_outputs(self) -> List[RequestOutput]:
+        """Detokenizes the outputs of the previous pipelined step, checks the
+        stop strings and creates the request outputs."""
+        if self._deferred_outputs is None:
+            return []
+        scheduler_outputs, deferred = self._deferred_outputs
+        self._deferred_outputs = None
+
+        process_start = time.perf_counter()
+        now = time.time()
+        seqs_to_decode: List[Tuple[Sequence, SequenceGroup]] = []
+        for seq_group, seqs, prompt_logprobs in deferred:
+            if prompt_logprobs is not None:
+                self._decode_prompt_logprobs(seq_group, prompt_logprobs)
+            for seq in seqs:
+                if seq.status != SequenceStatus.FINISHED_ABORTED:
+                    seqs_to_decode.append((seq, seq_group))
+        was_finished = [seq.is_finished() for seq, _ in seqs_to_decode]
+        # Repeats the token id checks of _check_token_stop() so that the stop
+        # strings take precedence as usual.
+        self._decode_and_check_stop(seqs_to_decode)
+        for (seq, _), finished in zip(seqs_to_decode, was_finished):
+            if seq.is_finished() and not finished:
+                self.scheduler.free_seq(seq)
+
+        # Free the finished sequence groups.
+        self.scheduler.free_finished_seq_groups()
+
+        # Create the outputs.
+        request_outputs: List[RequestOutput] = []
+        for seq_group, _, _ in deferred:
+            seq_group.maybe_set_first_token_time(now)
+            request_outputs.append(RequestOutput.from_seq_group(seq_group))
+        for seq_group in scheduler_outputs.ignored_seq_groups:
+            request_outputs.append(RequestOutput.from_seq_group(seq_group))
+
+        self._record_phase_time("process_outputs", process_start)
+        self._log_step(scheduler_outputs)
+        return request_outputs
+
+    def _schedule(
+            self) -> Tuple[List[SequenceGroupMetadata], SchedulerOutputs]:
+        """Schedules the sequences of the step, timing the scheduler."""
+        schedule_start = time.perf_counter()
+        seq_group_metadata_list, scheduler_outputs = self.scheduler.schedule()
+        self._record_phase_time("schedule", schedule_start)
+        return seq_group_metadata_list, scheduler_outputs
+
+    def _should_time_phases(self, scheduler_outputs: SchedulerOutputs) -> bool:
+        """Returns whether the workers time the phases of the step.
+
+        Timing them on the device synchronizes with it, so the steps are
+        only timed when their stats are logged, or when they measure the
+        swaps or prefills that the preemption cost model is fed with.
+        """
+        if self.log_stats or self.step_tracer is not None:
+            return True
+        if self.preemption_cost_model is None:
+            return False
+        if (scheduler_outputs.blocks_to_swap_in
+                or scheduler_outputs.blocks_to_swap_out):
+            return True
+        scheduled_seq_groups = scheduler_outputs.scheduled_seq_groups
+        return bool(scheduled_seq_groups) and (
+            scheduler_outputs.num_prefill_groups == len(scheduled_seq_groups))
+
+    def _record_phase_time(self, phase: str, start: float) -> None:
+        """Adds the time since start to the phase of the current step."""
+        self._step_phase_times[phase] = (
+            self._step_phase_times.get(phase, 0.0) + time.perf_counter() -
+            start)
+
+    def _record_worker_phase_times(
+            self, output: SamplerOutput,
+            scheduler_outputs: SchedulerOutputs) -> None:
+        """Records the phase times measured by the driver worker, and feeds
+        the preemption cost model with them.
+
+        Must be called before the computed tokens of the step are updated.
+        """
+        if not isinstance(output, SamplerOutput) or not output.phase_times:
+            return
+        phase_times = output.phase_times
+        # A multi-step decode reports the phase times of each step.
+        for phase, phase_time in phase_times.items():
+            self._step_phase_times[phase] = (
+                self._step_phase_times.get(phase, 0.0) + phase_time)
+        if self.preemption_cost_model is None:
+            return
+
+        if "swap" in phase_times:
+            num_swapped_blocks = (len(scheduler_outputs.blocks_to_swap_in) +
+                                  len(scheduler_outputs.blocks_to_swap_out))
+            self.preemption_cost_model.observe_swap(num_swapped_blocks,
+                                                    phase_times["swap"])
+        # Decodes are bound by the memory bandwidth, so only the steps that
+        # are all prefills measure the FLOP/s of a recomputation.
+        scheduled_seq_groups = scheduler_outputs.scheduled_seq_groups
+        if (scheduled_seq_groups and "forward" in phase_times
+                and scheduler_outputs.num_prefill_groups
+                == len(scheduled_seq_groups)):
+            flops = 0
+            for scheduled_seq_group in scheduled_seq_groups:
+                for seq in scheduled_seq_group.seq_group.get_seqs(
+                        status=SequenceStatus.RUNNING):
+                    flops += self.preemption_cost_model.get_flops(
+                        scheduled_seq_group.token_chunk_size,
+                        seq.data.get_num_computed_tokens())
+            self.preemption_cost_model.observe_forward(flops,
+                                                       phase_times["forward"])
+
+    def _log_step(self, scheduler_outputs: SchedulerOutputs) -> None:
+        """Logs the stats of the step and starts timing the next one."""
+        if self.log_stats or self.step_tracer is not None:
+            stats = self._get_stats(scheduler_outputs)
+            if self.log_stats:
+                self.stat_logger.log(stats)
+            if self.step_tracer is not None:
+                self.step_tracer.trace(stats)
+        self._step_phase_times = {}
+
     def do_log_stats(self) -> None:
         """Forced log when no requests active."""
         if self.log_stats:
@@ -727,36 +1088,43 @@ class LLMEngine:
         time_to_first_tokens = []
         time_per_output_tokens = []
         time_e2e_requests = []
+        finished_request_metrics = []
         if scheduler_outputs is not None:
-            prompt_run = scheduler_outputs.prompt_run
-
-            # Number of Tokens.
-            if prompt_run:
-                num_prompt_tokens = sum(
-                    len(scheduled_seq_group.seq_group.prompt_token_ids)
-                    for scheduled_seq_group in
-                    scheduler_outputs.scheduled_seq_groups)
-                num_generation_tokens = sum(
-                    scheduled_seq_group.seq_group.num_seqs()
-                    for scheduled_seq_group in
-                    scheduler_outputs.scheduled_seq_groups)
-            else:
-                num_generation_tokens = scheduler_outputs.num_batched_tokens
-
-            # Latency Timings.
-            time_last_iters = []
-            for scheduled_seq_group in scheduler_outputs.scheduled_seq_groups:
+            num_prefill_groups = scheduler_outputs.num_prefill_groups
+            for idx, scheduled_seq_group in enumerate(
+                    scheduler_outputs.scheduled_seq_groups):
                 seq_group = scheduled_seq_group.seq_group
-                # Time since last token.
-                # (n.b. updates seq_group.metrics.last_token_time)
-                time_last_iters.append(seq_group.get_last_latency(now))
+                if idx < num_prefill_groups:
+                    # Number of Tokens.
+                    num_prompt_tokens += scheduled_seq_group.token_chunk_size
+                    if seq_group.is_prefill():
+                        # The prompt is chunked and not finished yet.
+                        continue
+                    num_generation_tokens += seq_group.num_seqs()
+                    # Latency Timings.
+                    # (n.b. updates seq_group.metrics.last_token_time)
+                    time_to_first_tokens.append(
+                        seq_group.get_last_latency(now))
+                else:
+                    # Multi-step decodes return the tokens of all the steps
+                    # at once.
+                    time_per_output_tokens.append(
+                        seq_group.get_last_latency(now) /
+                        scheduler_outputs.num_decode_steps)
                 # Time since arrival for all finished requests.
                 if seq_group.is_finished():
                     time_e2e_requests.append(now -
                                              seq_group.metrics.arrival_time)
-
-            time_to_first_tokens = time_last_iters if prompt_run else []
-            time_per_output_tokens = [] if prompt_run else time_last_iters
+                    finished_request_metrics.append(seq_group.metrics)
+            if self._multi_step_num_tokens is not None:
+                # Multi-step decodes have no prefills, and their sequences
+                # stop at different steps.
+                num_generation_tokens += self._multi_step_num_tokens
+            elif num_prefill_groups < len(
+                    scheduler_outputs.scheduled_seq_groups):
+                # Each sequence in decoding phase takes one token slot.
+                num_generation_tokens += (
+                    scheduler_outputs.num_batched_tokens - num_prompt_tokens)
 
         return Stats(
             now=now,
@@ -770,46 +1138,93 @@ class LLMEngine:
             time_to_first_tokens=time_to_first_tokens,
             time_per_output_tokens=time_per_output_tokens,
             time_e2e_requests=time_e2e_requests,
+            finished_request_metrics=finished_request_metrics,
+            step_phase_times=(self._step_phase_times
+                              if scheduler_outputs is not None else {}),
+            preemptions=([(mode.name.lower(), reason)
+                          for mode, reason in scheduler_outputs.preemptions]
+                         if scheduler_outputs is not None else []),
         )
 
-    def _check_stop(self, seq: Sequence,
-                    sampling_params: SamplingParams) -> None:
-        """Stop the finished sequences."""
-        # Check if the sequence has reached max_model_len.
-        if seq.get_len() > self.scheduler_config.max_model_len:
-            seq.status = SequenceStatus.FINISHED_LENGTH_CAPPED
-            return
-
-        # Check if the sequence has reached max_tokens.
-        if seq.get_output_len() == sampling_params.max_tokens:
+    def _decode_and_check_stop(
+            self, seqs: List[Tuple[Sequence, SequenceGroup]]) -> None:
+        """Detokenizes the new tokens of the sequences in one batch, then
+        stops the finished sequences."""
+        detokenize_start = time.perf_counter()
+        new_char_counts = self.detokenizer.decode_sequences_inplace([
+            (seq, seq_group.sampling_params) for seq, seq_group in seqs
+        ])
+        self._record_phase_time("detokenize", detokenize_start)
+        for (seq, seq_group), new_char_count in zip(seqs, new_char_counts):
+            self._check_stop(seq, seq_group, new_char_count)
+
+    def _decode_prompt_logprobs(self, seq_group: SequenceGroup,
+                                prompt_logprobs: PromptLogprobs) -> None:
+        detokenize_start = time.perf_counter()
+        self.detokenizer.decode_prompt_logprobs_inplace(
+            seq_group, prompt_logprobs)
+        self._record_phase_time("detokenize", detokenize_start)
+        seq_group.prompt_logprobs = prompt_logprobs
+
+    def _check_stop(self, seq: Sequence, seq_group: SequenceGroup,
+                    new_char_count: int) -> None:
+        """Stop the finished sequences.
+
+        The last new_char_count characters of the output text are new. Only
+        they are fed to the stop string matcher of the request, which
+        continues from the state it was left in by the previous steps.
+        """
+        sampling_params = seq_group.sampling_params
+        stop_checker = get_stop_checker(seq_group)
+        # Check if the sequence has reached max_model_len or max_tokens.
+        if stop_checker.is_length_capped(seq.data,
+                                         self.scheduler_config.max_model_len):
             seq.status = SequenceStatus.FINISHED_LENGTH_CAPPED
             return
 
+        matcher = stop_checker.stop_string_matcher
+        new_text_start = len(seq.output_text) - new_char_count
         # Check if the minimum number of tokens has been generated yet;
         # skip the stop string/token checks if not
         if seq.get_output_len() < sampling_params.min_tokens:
+            if matcher is not None:
+                seq.stop_state = matcher.advance(seq.stop_state,
+                                                 seq.output_text,
+                                                 new_text_start)
             return
 
-        for stop_str in sampling_params.stop:
-            if seq.output_text.endswith(stop_str):
-                self._finalize_sequence(seq, sampling_params, stop_str)
+        if matcher is not None and new_char_count > 0:
+            seq.stop_state, stop_index, stop_end = matcher.find(
+                seq.stop_state, seq.output_text, new_text_start)
+            if stop_index != -1:
+                stop_str = matcher.stop[stop_index]
+                if not sampling_params.include_stop_str_in_output:
+                    stop_end -= len(stop_str)
+                # Truncate the output text after the first stop string.
+                seq.output_text = seq.output_text[:stop_end]
                 seq.status = SequenceStatus.FINISHED_STOPPED
                 seq.stop_reason = stop_str
                 return
+
+        # Check if the sequence has generated a stop token or the EOS token.
         last_token_id = seq.get_last_token_id()
+        if last_token_id not in stop_checker.stop_token_ids:
+            return
         if last_token_id in sampling_params.stop_token_ids:
             stop_str = self.get_tokenizer_for_seq(seq).convert_ids_to_tokens(
                 last_token_id)
             self._finalize_sequence(seq, sampling_params, stop_str)
-            seq.status = SequenceStatus.FINISHED_STOPPED
             seq.stop_reason = last_token_id
-            return
+        seq.status = SequenceStatus.FINISHED_STOPPED
 
-        # Check if the sequence has generated the EOS token.
-        if ((not sampling_params.ignore_eos)
-                and seq.get_last_token_id() == seq.eos_token_id):
-            seq.status = SequenceStatus.FINISHED_STOPPED
-            return
+    def _check_token_stop(self, seq: Sequence,
+                          seq_group: SequenceGroup) -> None:
+        """Stop the finished sequences, except for the stop strings, which
+        need the detokenized text. Used with pipelined steps."""
+        status = get_stop_checker(seq_group).get_token_stop_status(
+            seq.data, self.scheduler_config.max_model_len)
+        if status is not None:
+            seq.status = status
 
     def _finalize_sequence(self, seq: Sequence,
                            sampling_params: SamplingParams,
@@ -831,5 +1246,10 @@ class LLMEngine:
     def list_loras(self) -> List[int]:
         return self.model_executor.list_loras()
 
+    def save_sharded_state(self, path: str) -> None:
+        """Saves the weights of the tensor parallel workers to a checkpoint
+        that is loaded with load_format="sharded"."""
+        self.model_executor.save_sharded_state(path)
+
     def check_health(self) -> None:
         self.model_executor.check_health()
@@ -1,12 +1,14 @@
+import json
 import time
-from dataclasses import dataclass
-from typing import Dict, List
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Tuple
 
 import numpy as np
 from prometheus_client import (REGISTRY, Counter, Gauge, Histogram, Info,
                                disable_created_metrics)
 
 from vllm.logger import init_logger
+from vllm.sequence import RequestMetrics
 
 logger = init_logger(__name__)
 
@@ -61,6 +63,11 @@ class Metrics:
             name="vllm:generation_tokens_total",
             documentation="Number of generation tokens processed.",
             labelnames=labelnames)
+        self.counter_preemptions = Counter(
+            name="vllm:num_preemptions_total",
+            documentation="Number of preempted sequence groups, by "
+            "preemption mode and the reason it was chosen.",
+            labelnames=labelnames + ["mode", "reason"])
         self.histogram_time_to_first_token = Histogram(
             name="vllm:time_to_first_token_seconds",
             documentation="Histogram of time to first token in seconds.",
@@ -82,6 +89,48 @@ class Metrics:
             documentation="Histogram of end to end request latency in seconds.",
             labelnames=labelnames,
             buckets=[1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 40.0, 50.0, 60.0])
+        self.histogram_num_preemptions_request = Histogram(
+            name="vllm:request_num_preemptions",
+            documentation="Histogram of the number of times the finished "
+            "requests were preempted, by preemption mode.",
+            labelnames=labelnames + ["mode"],
+            buckets=[0, 1, 2, 3, 5, 10, 20, 50])
+        self.histogram_time_in_waiting_request = Histogram(
+            name="vllm:request_time_in_waiting_seconds",
+            documentation="Histogram of the time the finished requests spent "
+            "in the waiting queue in seconds.",
+            labelnames=labelnames,
+            buckets=[
+                0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0,
+                60.0
+            ])
+        self.histogram_time_in_swapped_request = Histogram(
+            name="vllm:request_time_in_swapped_seconds",
+            documentation="Histogram of the time the finished requests spent "
+            "swapped out in seconds.",
+            labelnames=labelnames,
+            buckets=[
+                0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0,
+                30.0, 60.0
+            ])
+        self.histogram_prefill_time_request = Histogram(
+            name="vllm:request_prefill_time_seconds",
+            documentation="Histogram of the time from the first scheduling of "
+            "the finished requests to their first token in seconds.",
+            labelnames=labelnames,
+            buckets=[
+                0.001, 0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.25, 0.5,
+                0.75, 1.0, 2.5, 5.0, 7.5, 10.0
+            ])
+        self.histogram_step_phase_time = Histogram(
+            name="vllm:step_phase_time_seconds",
+            documentation="Histogram of the time spent in each phase of the "
+            "engine steps in seconds.",
+            labelnames=labelnames + ["phase"],
+            buckets=[
+                0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                0.05, 0.075, 0.1, 0.25, 0.5, 1.0, 2.5
+            ])
 
         # Legacy metrics
         self.gauge_avg_prompt_throughput = Gauge(
@@ -117,6 +166,16 @@ class Stats:
     time_to_first_tokens: List[float]
     time_per_output_tokens: List[float]
     time_e2e_requests: List[float]
+    # Metrics of the requests that finished in the last step.
+    finished_request_metrics: List[RequestMetrics]
+
+    # Seconds spent in each phase of the last step: "schedule", "swap",
+    # "prepare", "forward", "sample", "process_outputs" and "detokenize",
+    # which is part of the output processing.
+    step_phase_times: Dict[str, float] = field(default_factory=dict)
+    # The preemptions of the last step, as the preemption mode ("swap" or
+    # "recompute") and the reason it was chosen.
+    preemptions: List[Tuple[str, str]] = field(default_factory=list)
 
 
 class StatLogger:
@@ -164,6 +223,10 @@ class StatLogger:
             stats.num_prompt_tokens)
         self.metrics.counter_generation_tokens.labels(**self.labels).inc(
             stats.num_generation_tokens)
+        for mode, reason in stats.preemptions:
+            self.metrics.counter_preemptions.labels(**self.labels,
+                                                    mode=mode,
+                                                    reason=reason).inc()
 
         # Observe request level latencies in histograms.
         for ttft in stats.time_to_first_tokens:
@@ -176,6 +239,27 @@ class StatLogger:
             self.metrics.histogram_e2e_request_latency.labels(
                 **self.labels).observe(e2e)
 
+        # Observe the lifecycles of the finished requests.
+        for request_metrics in stats.finished_request_metrics:
+            self.metrics.histogram_num_preemptions_request.labels(
+                **self.labels, mode="swap").observe(request_metrics.num_swaps)
+            self.metrics.histogram_num_preemptions_request.labels(
+                **self.labels,
+                mode="recompute").observe(request_metrics.num_recomputes)
+            self.metrics.histogram_time_in_waiting_request.labels(
+                **self.labels).observe(request_metrics.time_in_waiting)
+            self.metrics.histogram_time_in_swapped_request.labels(
+                **self.labels).observe(request_metrics.time_in_swapped)
+            if request_metrics.prefill_time is not None:
+                self.metrics.histogram_prefill_time_request.labels(
+                    **self.labels).observe(request_metrics.prefill_time)
+
+        # Observe the phase times of the step.
+        for phase, phase_time in stats.step_phase_times.items():
+            self.metrics.histogram_step_phase_time.labels(**self.labels,
+                                                          phase=phase).observe(
+                                                              phase_time)
+
     def _log_prometheus_interval(self, prompt_throughput: float,
                                  generation_throughput: float) -> None:
         # Logs metrics to prometheus that are computed every logging_interval.
@@ -229,3 +313,27 @@ class StatLogger:
             self.num_prompt_tokens = []
             self.num_generation_tokens = []
             self.last_local_log = stats.now
+
+
+class StepTracer:
+    """Writes the stats of every step as a line of JSON, for offline
+    analysis of the step timings.
+
+    Args:
+        path: The file the trace is appended to.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # The file stays open until close(), and is not reopened every step.
+        self._file = open(path, "a")  # noqa: SIM115
+
+    def trace(self, stats: Stats) -> None:
+        if self._file.closed:
+            return
+        self._file.write(json.dumps(asdict(stats)) + "\n")
+        # Flushed, so that the trace is complete up to the last step.
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
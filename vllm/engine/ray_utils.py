@@ -55,6 +55,13 @@ try:
         def set_cuda_visible_devices(self, device_ids) -> None:
             set_cuda_visible_devices(device_ids)
 
+        def run_shm_loop(self, handle, rank: int) -> None:
+            """Serves the method calls of the driver from its shared memory
+            transport until it is closed. Used only when the shared memory
+            transport is enabled."""
+            from vllm.executor.shm_transport import run_worker_loop
+            run_worker_loop(handle, rank, self.execute_method)
+
         def execute_model_compiled_dag_remote(self, ignored):
             """Used only when compiled DAG is enabled."""
             import torch
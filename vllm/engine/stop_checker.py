@@ -0,0 +1,161 @@
+"""Compiled stop conditions of a request."""
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from vllm.sampling_params import SamplingParams
+from vllm.sequence import SequenceData, SequenceGroup, SequenceStatus
+
+
+class StopStringMatcher:
+    """Aho-Corasick automaton over the stop strings of a request.
+
+    The automaton consumes the output text of a sequence incrementally, and
+    the state it is left in is kept in the sequence between the steps. Every
+    character of the output text is looked at once, whatever the number of
+    stop strings.
+
+    Args:
+        stop: The stop strings.
+    """
+
+    def __init__(self, stop: Tuple[str, ...]) -> None:
+        self.stop = stop
+        # Index of the empty stop string, which matches right away.
+        self._empty_index = stop.index("") if "" in stop else -1
+        # Transitions of the trie of the stop strings.
+        self._goto: List[Dict[str, int]] = [{}]
+        # Failure links: the state of the longest proper suffix of the
+        # state's string that is a prefix of a stop string.
+        self._fail: List[int] = [0]
+        # Index of the stop string that ends at each state, or -1. If several
+        # do, the first one in the stop strings wins.
+        self._match: List[int] = [-1]
+
+        for index, stop_str in enumerate(stop):
+            state = 0
+            for char in stop_str:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._match.append(-1)
+                state = next_state
+            if state != 0 and self._match[state] == -1:
+                self._match[state] = index
+
+        # Breadth-first, so that the failure link of a state is complete
+        # before the state is visited.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            fail_match = self._match[self._fail[state]]
+            if fail_match != -1 and (self._match[state] == -1
+                                     or fail_match < self._match[state]):
+                self._match[state] = fail_match
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                queue.append(next_state)
+
+    def advance(self, state: int, text: str, start: int = 0) -> int:
+        """Consumes text[start:] without looking for matches.
+
+        Returns:
+            The state after the text.
+        """
+        goto, fail = self._goto, self._fail
+        for offset in range(start, len(text)):
+            char = text[offset]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+        return state
+
+    def find(self,
+             state: int,
+             text: str,
+             start: int = 0) -> Tuple[int, int, int]:
+        """Consumes text[start:] up to the end of the first stop string.
+
+        Returns:
+            A tuple of the state after the consumed text, the index of the
+            stop string that ends first or -1 if none does, and the offset
+            in text right after that stop string.
+        """
+        if self._empty_index != -1:
+            return state, self._empty_index, start
+        goto, fail, match = self._goto, self._fail, self._match
+        for offset in range(start, len(text)):
+            char = text[offset]
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if match[state] != -1:
+                return state, match[state], offset + 1
+        return state, -1, len(text)
+
+
+@lru_cache(maxsize=256)
+def get_stop_string_matcher(stop: Tuple[str, ...]) -> StopStringMatcher:
+    """Returns the matcher of the stop strings, shared by the requests that
+    use the same ones."""
+    return StopStringMatcher(stop)
+
+
+class StopChecker:
+    """The stop conditions of a request, compiled when it is added.
+
+    Args:
+        sampling_params: The sampling parameters of the request.
+        eos_token_id: The EOS token id of the request's tokenizer.
+    """
+
+    def __init__(self, sampling_params: SamplingParams,
+                 eos_token_id: Optional[int]) -> None:
+        self.stop_string_matcher: Optional[StopStringMatcher] = (
+            get_stop_string_matcher(tuple(sampling_params.stop))
+            if sampling_params.stop else None)
+        # The stop token ids and the EOS token, checked with one lookup.
+        stop_token_ids = set(sampling_params.stop_token_ids)
+        if not sampling_params.ignore_eos and eos_token_id is not None:
+            stop_token_ids.add(eos_token_id)
+        self.stop_token_ids: FrozenSet[int] = frozenset(stop_token_ids)
+        self.max_tokens = sampling_params.max_tokens
+        self.min_tokens = sampling_params.min_tokens
+
+    def is_length_capped(self, seq_data: SequenceData,
+                         max_model_len: int) -> bool:
+        """Whether the sequence reached max_model_len or max_tokens."""
+        return (seq_data.get_len() > max_model_len
+                or seq_data.get_output_len() == self.max_tokens)
+
+    def get_token_stop_status(self, seq_data: SequenceData,
+                              max_model_len: int) -> Optional[SequenceStatus]:
+        """Returns the status of the sequence if its length or its last
+        token stops it, and None otherwise. The stop strings, which need the
+        detokenized text, are not checked.
+
+        The engine and the workers that run several decoding steps in a row
+        use this to agree on the sequences that stop.
+        """
+        if self.is_length_capped(seq_data, max_model_len):
+            return SequenceStatus.FINISHED_LENGTH_CAPPED
+        if (seq_data.get_output_len() >= self.min_tokens
+                and seq_data.get_last_token_id() in self.stop_token_ids):
+            return SequenceStatus.FINISHED_STOPPED
+        return None
+
+
+def get_stop_checker(seq_group: SequenceGroup) -> StopChecker:
+    """Returns the stop checker of a sequence group. It is built on first use
+    for the groups that were not created by LLMEngine.add_request()."""
+    if seq_group.stop_checker is None:
+        seq = next(iter(seq_group.seqs_dict.values()))
+        seq_group.stop_checker = StopChecker(seq_group.sampling_params,
+                                             seq.eos_token_id)
+    return seq_group.stop_checker
@@ -159,9 +159,10 @@ if __name__ == "__main__":
     openai_serving_chat = OpenAIServingChat(engine, served_model,
                                             args.response_role,
                                             args.lora_modules,
-                                            args.chat_template)
+                                            args.chat_template,
+                                            args.return_request_metrics)
     openai_serving_completion = OpenAIServingCompletion(
-        engine, served_model, args.lora_modules)
+        engine, served_model, args.lora_modules, args.return_request_metrics)
 
     app.root_path = args.root_path
     uvicorn.run(app,
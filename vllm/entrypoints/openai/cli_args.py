@@ -78,6 +78,11 @@ def make_arg_parser():
                         default="assistant",
                         help="The role name to return if "
                         "`request.add_generation_prompt=true`.")
+    parser.add_argument(
+        "--return-request-metrics",
+        action="store_true",
+        help="Return the queueing, prefill and preemption metrics of the "
+        "requests in the `request_metrics` field of the usage.")
     parser.add_argument("--ssl-keyfile",
                         type=str,
                         default=None,
@@ -48,10 +48,23 @@ class ModelList(BaseModel):
     data: List[ModelCard] = Field(default_factory=list)
 
 
+class RequestMetricsInfo(BaseModel):
+    # Summed over the prompts of the request. Times are in seconds.
+    time_in_queue: float = 0.0
+    time_in_waiting: float = 0.0
+    time_in_swapped: float = 0.0
+    prefill_time: float = 0.0
+    num_preemptions: int = 0
+    num_swaps: int = 0
+    num_recomputes: int = 0
+
+
 class UsageInfo(BaseModel):
     prompt_tokens: int = 0
     total_tokens: int = 0
     completion_tokens: Optional[int] = 0
+    # Only set with --return-request-metrics.
+    request_metrics: Optional[RequestMetricsInfo] = None
 
 
 class ResponseFormat(BaseModel):
@@ -133,6 +146,12 @@ class ChatCompletionRequest(BaseModel):
         description=(
             "If specified, the output will follow the context free grammar."),
     )
+    # The priority of the request, lower is more urgent. Requires the
+    # priority scheduling policy.
+    priority: int = 0
+    # The Unix time by which the request should be scheduled. Requires the
+    # priority scheduling policy.
+    deadline: Optional[float] = None
 
     # doc: end-chat-completion-extra-params
 
@@ -264,6 +283,12 @@ class CompletionRequest(BaseModel):
         description=(
             "If specified, the output will follow the context free grammar."),
     )
+    # The priority of the request, lower is more urgent. Requires the
+    # priority scheduling policy.
+    priority: int = 0
+    # The Unix time by which the request should be scheduled. Requires the
+    # priority scheduling policy.
+    deadline: Optional[float] = None
 
     # doc: end-completion-extra-params
 
@@ -27,10 +27,12 @@ class OpenAIServingChat(OpenAIServing):
                  served_model: str,
                  response_role: str,
                  lora_modules: Optional[List[LoRA]] = None,
-                 chat_template=None):
+                 chat_template=None,
+                 return_request_metrics: bool = False):
         super().__init__(engine=engine,
                          served_model=served_model,
-                         lora_modules=lora_modules)
+                         lora_modules=lora_modules,
+                         return_request_metrics=return_request_metrics)
         self.response_role = response_role
         self._load_chat_template(chat_template)
 
@@ -78,9 +80,13 @@ class OpenAIServingChat(OpenAIServing):
         except ValueError as e:
             return self.create_error_response(str(e))
 
-        result_generator = self.engine.generate(prompt, sampling_params,
-                                                request_id, token_ids,
-                                                lora_request)
+        result_generator = self.engine.generate(prompt,
+                                                sampling_params,
+                                                request_id,
+                                                token_ids,
+                                                lora_request,
+                                                priority=request.priority,
+                                                deadline=request.deadline)
         # Streaming response
         if request.stream:
             return self.chat_completion_stream_generator(
@@ -216,6 +222,7 @@ class OpenAIServingChat(OpenAIServing):
                             total_tokens=prompt_tokens +
                             previous_num_tokens[i],
                         )
+                        self._maybe_add_request_metrics(final_usage, [res])
                         choice_data = ChatCompletionResponseStreamChoice(
                             index=i,
                             delta=DeltaMessage(content=delta_text),
@@ -303,6 +310,7 @@ class OpenAIServingChat(OpenAIServing):
             completion_tokens=num_generated_tokens,
             total_tokens=num_prompt_tokens + num_generated_tokens,
         )
+        self._maybe_add_request_metrics(usage, [final_res])
         response = ChatCompletionResponse(
             id=request_id,
             created=created_time,
@@ -90,10 +90,12 @@ class OpenAIServingCompletion(OpenAIServing):
     def __init__(self,
                  engine: AsyncLLMEngine,
                  served_model: str,
-                 lora_modules: Optional[List[LoRA]] = None):
+                 lora_modules: Optional[List[LoRA]] = None,
+                 return_request_metrics: bool = False):
         super().__init__(engine=engine,
                          served_model=served_model,
-                         lora_modules=lora_modules)
+                         lora_modules=lora_modules,
+                         return_request_metrics=return_request_metrics)
 
     async def create_completion(self, request: CompletionRequest,
                                 raw_request: Request):
@@ -147,7 +149,9 @@ class OpenAIServingCompletion(OpenAIServing):
                                          sampling_params,
                                          f"{request_id}-{i}",
                                          prompt_token_ids=input_ids,
-                                         lora_request=lora_request))
+                                         lora_request=lora_request,
+                                         priority=request.priority,
+                                         deadline=request.deadline))
         except ValueError as e:
             # TODO: Use a vllm-specific Validation Error
             return self.create_error_response(str(e))
@@ -272,6 +276,7 @@ class OpenAIServingCompletion(OpenAIServing):
                             completion_tokens=completion_tokens,
                             total_tokens=prompt_tokens + completion_tokens,
                         )
+                        self._maybe_add_request_metrics(final_usage, [res])
                     else:
                         final_usage = None
                     response_json = CompletionStreamResponse(
@@ -354,6 +359,7 @@ class OpenAIServingCompletion(OpenAIServing):
             completion_tokens=num_generated_tokens,
             total_tokens=num_prompt_tokens + num_generated_tokens,
         )
+        self._maybe_add_request_metrics(usage, final_res_batch)
 
         return CompletionResponse(
             id=request_id,
@@ -8,9 +8,11 @@ from vllm.engine.async_llm_engine import AsyncLLMEngine
 from vllm.entrypoints.openai.protocol import (ChatCompletionRequest,
                                               CompletionRequest, ErrorResponse,
                                               LogProbs, ModelCard, ModelList,
-                                              ModelPermission)
+                                              ModelPermission,
+                                              RequestMetricsInfo, UsageInfo)
 from vllm.logger import init_logger
 from vllm.lora.request import LoRARequest
+from vllm.outputs import RequestOutput
 from vllm.sequence import Logprob
 from vllm.transformers_utils.tokenizer import get_tokenizer
 
@@ -28,9 +30,11 @@ class OpenAIServing:
     def __init__(self,
                  engine: AsyncLLMEngine,
                  served_model: str,
-                 lora_modules=Optional[List[LoRA]]):
+                 lora_modules=Optional[List[LoRA]],
+                 return_request_metrics: bool = False):
         self.engine = engine
         self.served_model = served_model
+        self.return_request_metrics = return_request_metrics
         if lora_modules is None:
             self.lora_requests = []
         else:
@@ -84,6 +88,27 @@ class OpenAIServing:
         model_cards.extend(lora_cards)
         return ModelList(data=model_cards)
 
+    def _maybe_add_request_metrics(
+            self, usage: UsageInfo,
+            request_outputs: List[RequestOutput]) -> None:
+        """Adds the metrics of the requests to the usage, if they are
+        returned."""
+        if not self.return_request_metrics:
+            return
+        info = RequestMetricsInfo()
+        for request_output in request_outputs:
+            metrics = request_output.metrics
+            if metrics is None:
+                continue
+            info.time_in_queue += metrics.time_in_queue or 0.0
+            info.time_in_waiting += metrics.time_in_waiting
+            info.time_in_swapped += metrics.time_in_swapped
+            info.prefill_time += metrics.prefill_time or 0.0
+            info.num_preemptions += metrics.num_preemptions
+            info.num_swaps += metrics.num_swaps
+            info.num_recomputes += metrics.num_recomputes
+        usage.request_metrics = info
+
     def _create_logprobs(
         self,
         token_ids: List[int],
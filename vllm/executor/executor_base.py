@@ -35,8 +35,16 @@ class ExecutorBase(ABC):
                       seq_group_metadata_list: List[SequenceGroupMetadata],
                       blocks_to_swap_in: Dict[int, int],
                       blocks_to_swap_out: Dict[int, int],
-                      blocks_to_copy: Dict[int, List[int]]) -> SamplerOutput:
-        """Executes one model step on the given sequences."""
+                      blocks_to_copy: Dict[int, List[int]],
+                      num_steps: int = 1,
+                      time_phases: bool = False) -> SamplerOutput:
+        """Executes one model step on the given sequences.
+
+        With num_steps > 1, executes up to num_steps decoding steps and
+        returns the list of their outputs. With time_phases, the driver
+        worker times the phases of the steps on the device, which
+        synchronizes with it, and returns them in their outputs.
+        """
         raise NotImplementedError
 
     @abstractmethod
@@ -67,6 +75,8 @@ class ExecutorAsyncBase(ExecutorBase):
         blocks_to_swap_in: Dict[int, int],
         blocks_to_swap_out: Dict[int, int],
         blocks_to_copy: Dict[int, List[int]],
+        num_steps: int = 1,
+        time_phases: bool = False,
     ) -> SamplerOutput:
         """Executes one model step on the given sequences."""
         raise NotImplementedError
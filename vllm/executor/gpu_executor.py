@@ -104,6 +104,9 @@ class GPUExecutor(ExecutorBase):
 
         self.cache_config.num_gpu_blocks = num_gpu_blocks
         self.cache_config.num_cpu_blocks = num_cpu_blocks
+        self.cache_config.block_bytes = (
+            self.driver_worker.get_cache_block_size_bytes(
+                self.cache_config.block_size, self.cache_config.cache_dtype))
 
         # Initialize the cache.
         self.driver_worker.init_cache_engine(cache_config=self.cache_config)
@@ -115,12 +118,16 @@ class GPUExecutor(ExecutorBase):
                       seq_group_metadata_list: List[SequenceGroupMetadata],
                       blocks_to_swap_in: Dict[int, int],
                       blocks_to_swap_out: Dict[int, int],
-                      blocks_to_copy: Dict[int, List[int]]) -> SamplerOutput:
+                      blocks_to_copy: Dict[int, List[int]],
+                      num_steps: int = 1,
+                      time_phases: bool = False) -> SamplerOutput:
         output = self.driver_worker.execute_model(
             seq_group_metadata_list=seq_group_metadata_list,
             blocks_to_swap_in=blocks_to_swap_in,
             blocks_to_swap_out=blocks_to_swap_out,
             blocks_to_copy=blocks_to_copy,
+            num_steps=num_steps,
+            time_phases=time_phases,
         )
         return output
 
@@ -135,6 +142,9 @@ class GPUExecutor(ExecutorBase):
     def list_loras(self) -> List[int]:
         return self.driver_worker.list_loras()
 
+    def save_sharded_state(self, path: str) -> None:
+        self.driver_worker.save_sharded_state(path)
+
     def check_health(self) -> None:
         # GPUExecutor will always be healthy as long as
         # it's running.
@@ -149,12 +159,16 @@ class GPUExecutorAsync(GPUExecutor, ExecutorAsyncBase):
         blocks_to_swap_in: Dict[int, int],
         blocks_to_swap_out: Dict[int, int],
         blocks_to_copy: Dict[int, List[int]],
+        num_steps: int = 1,
+        time_phases: bool = False,
     ) -> SamplerOutput:
         output = await make_async(self.driver_worker.execute_model)(
             seq_group_metadata_list=seq_group_metadata_list,
             blocks_to_swap_in=blocks_to_swap_in,
             blocks_to_swap_out=blocks_to_swap_out,
-            blocks_to_copy=blocks_to_copy)
+            blocks_to_copy=blocks_to_copy,
+            num_steps=num_steps,
+            time_phases=time_phases)
         return output
 
     async def check_health_async(self) -> None:
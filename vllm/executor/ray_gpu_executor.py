@@ -10,6 +10,8 @@ from vllm.config import (CacheConfig, DeviceConfig, LoRAConfig, ModelConfig,
                          VisionLanguageConfig)
 from vllm.engine.ray_utils import RayWorkerVllm, ray
 from vllm.executor.executor_base import ExecutorAsyncBase, ExecutorBase
+from vllm.executor.shm_transport import (ShmTransport,
+                                         is_shm_transport_supported)
 from vllm.executor.utils import check_block_size_valid
 from vllm.logger import init_logger
 from vllm.lora.request import LoRARequest
@@ -29,6 +31,11 @@ logger = init_logger(__name__)
 # which optimizes the control plane overhead.
 # Run vLLM with VLLM_USE_RAY_COMPILED_DAG=1 to enable it.
 USE_RAY_COMPILED_DAG = bool(os.getenv("VLLM_USE_RAY_COMPILED_DAG", 0))
+# If the env var is set, the driver sends the method calls to the workers on
+# its node through shared memory, instead of Ray calls, which are only used
+# to start the workers and check their health.
+# Run vLLM with VLLM_USE_SHM_TRANSPORT=1 to enable it.
+USE_SHM_TRANSPORT = bool(os.getenv("VLLM_USE_SHM_TRANSPORT", 0))
 
 
 class RayGPUExecutor(ExecutorBase):
@@ -72,6 +79,10 @@ class RayGPUExecutor(ExecutorBase):
         if USE_RAY_COMPILED_DAG:
             self.forward_dag = self._compiled_ray_dag()
 
+        self.shm_transport: Optional[ShmTransport] = None
+        if USE_SHM_TRANSPORT and not USE_RAY_COMPILED_DAG:
+            self._init_shm_transport()
+
     def _init_workers_ray(self, placement_group: "PlacementGroup",
                           **ray_remote_kwargs):
         if self.parallel_config.tensor_parallel_size == 1:
@@ -249,6 +260,9 @@ class RayGPUExecutor(ExecutorBase):
 
         self.cache_config.num_gpu_blocks = num_gpu_blocks
         self.cache_config.num_cpu_blocks = num_cpu_blocks
+        self.cache_config.block_bytes = (
+            self.driver_worker.get_cache_block_size_bytes(
+                self.cache_config.block_size, self.cache_config.cache_dtype))
 
         # Initialize the cache.
         self._run_workers("init_cache_engine", cache_config=self.cache_config)
@@ -260,7 +274,9 @@ class RayGPUExecutor(ExecutorBase):
                       seq_group_metadata_list: List[SequenceGroupMetadata],
                       blocks_to_swap_in: Dict[int, int],
                       blocks_to_swap_out: Dict[int, int],
-                      blocks_to_copy: Dict[int, List[int]]) -> SamplerOutput:
+                      blocks_to_copy: Dict[int, List[int]],
+                      num_steps: int = 1,
+                      time_phases: bool = False) -> SamplerOutput:
         all_outputs = self._run_workers(
             "execute_model",
             driver_kwargs={
@@ -268,6 +284,8 @@ class RayGPUExecutor(ExecutorBase):
                 "blocks_to_swap_in": blocks_to_swap_in,
                 "blocks_to_swap_out": blocks_to_swap_out,
                 "blocks_to_copy": blocks_to_copy,
+                "num_steps": num_steps,
+                "time_phases": time_phases,
             },
             use_ray_compiled_dag=USE_RAY_COMPILED_DAG)
 
@@ -292,6 +310,9 @@ class RayGPUExecutor(ExecutorBase):
     def list_loras(self) -> List[int]:
         return self._run_workers("list_loras")
 
+    def save_sharded_state(self, path: str) -> None:
+        self._run_workers("save_sharded_state", path=path)
+
     def _run_workers(
         self,
         method: str,
@@ -312,6 +333,9 @@ class RayGPUExecutor(ExecutorBase):
             # Right now, compiled DAG can only accept a single
             # input. TODO(sang): Fix it.
             output_channels = self.forward_dag.execute(1)
+        elif self.shm_transport is not None:
+            call_id = self.shm_transport.send(method, args, kwargs,
+                                              self._check_shm_worker_loops)
         else:
             # Start the ray workers first.
             ray_worker_outputs = [
@@ -340,6 +364,9 @@ class RayGPUExecutor(ExecutorBase):
                     # Has to call end_read in order to reuse the DAG.
                     for chan in output_channels:
                         chan.end_read()
+            elif self.shm_transport is not None:
+                ray_worker_outputs = self.shm_transport.recv(
+                    call_id, self._check_shm_worker_loops)
             else:
                 ray_worker_outputs = ray.get(ray_worker_outputs)
 
@@ -365,9 +392,44 @@ class RayGPUExecutor(ExecutorBase):
             ])
         return forward_dag.experimental_compile()
 
+    def _init_shm_transport(self) -> None:
+        if not self.workers:
+            return
+        if not is_shm_transport_supported():
+            logger.warning("The shared memory transport is disabled, because "
+                           "it is only supported on x86_64.")
+            return
+        driver_ip = get_ip()
+        worker_ips = ray.get(
+            [worker.get_node_ip.remote() for worker in self.workers])
+        if any(worker_ip != driver_ip for worker_ip in worker_ips):
+            logger.warning("The shared memory transport is disabled, because "
+                           "some workers are not on the driver node.")
+            return
+        self.shm_transport = ShmTransport(len(self.workers))
+        handle = self.shm_transport.handle
+        # The workers are busy serving the transport from now on, and do not
+        # take other Ray calls.
+        self.shm_worker_loops = [
+            worker.run_shm_loop.remote(handle, rank)
+            for rank, worker in enumerate(self.workers)
+        ]
+
+    def _check_shm_worker_loops(self) -> None:
+        """Raises an error if a worker stopped serving the shared memory
+        transport."""
+        ready, _ = ray.wait(self.shm_worker_loops, timeout=0)
+        if ready:
+            # Raises the error of the worker, if any.
+            ray.get(ready)
+            raise RuntimeError("A worker stopped serving the shared memory "
+                               "transport.")
+
     def check_health(self) -> None:
         """Raises an error if engine is unhealthy."""
         self._check_if_any_actor_is_dead()
+        if self.shm_transport is not None:
+            self._check_shm_worker_loops()
 
     def _check_if_any_actor_is_dead(self):
         if not self.workers:
@@ -401,10 +463,21 @@ class RayGPUExecutorAsync(RayGPUExecutor, ExecutorAsyncBase):
         if driver_kwargs is None:
             driver_kwargs = kwargs
 
+        if self.shm_transport is not None:
+            call_id = self.shm_transport.send(method, args, kwargs,
+                                              self._check_shm_worker_loops)
+
         # Run the driver worker asynchronously.
         driver_executor = make_async(getattr(self.driver_worker, method))
         coros.append(driver_executor(*driver_args, **driver_kwargs))
 
+        if self.shm_transport is not None:
+            coros.append(
+                make_async(self.shm_transport.recv)(
+                    call_id, self._check_shm_worker_loops))
+            driver_output, worker_outputs = await asyncio.gather(*coros)
+            return [driver_output] + worker_outputs
+
         # Run the ray workers asynchronously.
         for worker in self.workers:
             coros.append(worker.execute_method.remote(method, *args, **kwargs))
@@ -418,6 +491,8 @@ class RayGPUExecutorAsync(RayGPUExecutor, ExecutorAsyncBase):
         blocks_to_swap_in: Dict[int, int],
         blocks_to_swap_out: Dict[int, int],
         blocks_to_copy: Dict[int, List[int]],
+        num_steps: int = 1,
+        time_phases: bool = False,
     ) -> SamplerOutput:
         all_outputs = await self._run_workers_async(
             "execute_model",
@@ -426,6 +501,8 @@ class RayGPUExecutorAsync(RayGPUExecutor, ExecutorAsyncBase):
                 "blocks_to_swap_in": blocks_to_swap_in,
                 "blocks_to_swap_out": blocks_to_swap_out,
                 "blocks_to_copy": blocks_to_copy,
+                "num_steps": num_steps,
+                "time_phases": time_phases,
             })
 
         # Only the driver worker returns the sampling results.
@@ -434,4 +511,4 @@ class RayGPUExecutorAsync(RayGPUExecutor, ExecutorAsyncBase):
 
     async def check_health_async(self) -> None:
         """Raises an error if engine is unhealthy."""
-        self._check_if_any_actor_is_dead()
+        self.check_health()
@@ -0,0 +1,340 @@
+"""A transport for the method calls of the driver to the workers on its node,
+through ring buffers in shared memory."""
+import contextlib
+import ctypes
+import pickle
+import platform
+import struct
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from vllm.logger import init_logger
+
+logger = init_logger(__name__)
+
+
+def is_shm_transport_supported() -> bool:
+    """Returns whether the transport can be used on this machine.
+
+    The counters and the slots are read and written without barriers, which
+    relies on the stores of a process being seen in order by the others, as
+    on x86_64 (TSO). Weaker memory models, e.g. aarch64's, would need fences.
+    """
+    return platform.machine() == "x86_64"
+
+
+# The futex syscall, used to sleep until a counter in shared memory changes.
+_SYS_FUTEX = 202
+_FUTEX_WAIT = 0
+_FUTEX_WAKE = 1
+_INT_MAX = 2**31 - 1
+
+if is_shm_transport_supported() and sys.platform.startswith("linux"):
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.syscall.restype = ctypes.c_long
+else:
+    _libc = None
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+# The counters in the header of the ring buffers.
+_COUNTER = struct.Struct("<Q")
+# The header of the chunks in the slots: the length of the chunk and whether
+# it is the last chunk of its message.
+_CHUNK = struct.Struct("<II")
+
+# Interval at which blocked calls check that the other side is alive.
+_CHECK_INTERVAL = 1.0
+# Sleep time between the polls when the futex syscall is not available.
+_POLL_INTERVAL = 1e-4
+
+
+class ShmRingBufferHandle(NamedTuple):
+    name: str
+    num_readers: int
+    num_slots: int
+    slot_size: int
+
+
+class ShmRingBuffer:
+    """A ring buffer in shared memory with one writer and num_readers
+    readers, which all read every message.
+
+    The buffer starts with a header of counters: the number of chunks
+    written, then the number of chunks read by each reader. The chunks are
+    written in num_slots slots of slot_size bytes, and messages larger than
+    a slot are split into several chunks. A slot is only overwritten once all
+    the readers read it.
+
+    Blocked readers spin for spin_time seconds, and then sleep on the futex
+    of the write counter, which the writer wakes after every chunk. The
+    memory is unlinked when the ring buffer that created it is closed.
+    """
+
+    def __init__(
+        self,
+        num_readers: int,
+        num_slots: int = 8,
+        slot_size: int = 1 << 16,
+        name: Optional[str] = None,
+        spin_time: float = 1e-4,
+    ) -> None:
+        assert is_shm_transport_supported(), "Requires x86_64."
+        assert num_slots > 0 and slot_size > _CHUNK.size
+        self.num_readers = num_readers
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.spin_time = spin_time
+        # Keep the slots cache line aligned.
+        self._header_size = (_COUNTER.size * (1 + num_readers) + 63) // 64 * 64
+        size = self._header_size + num_slots * slot_size
+        self.is_creator = name is None
+        if self.is_creator:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:self._header_size] = bytes(self._header_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # The creator unlinks the memory. Otherwise, the resource tracker
+            # of this process would unlink it when the process exits.
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.buf = self.shm.buf
+        # The address of the low 32 bits of the write counter.
+        self._futex_address = (ctypes.addressof(
+            ctypes.c_uint32.from_buffer(self.buf)) if _libc else None)
+
+    @property
+    def handle(self) -> ShmRingBufferHandle:
+        return ShmRingBufferHandle(self.shm.name, self.num_readers,
+                                   self.num_slots, self.slot_size)
+
+    @classmethod
+    def attach(cls, handle: ShmRingBufferHandle) -> "ShmRingBuffer":
+        return cls(handle.num_readers,
+                   handle.num_slots,
+                   handle.slot_size,
+                   name=handle.name)
+
+    def close(self) -> None:
+        if self.buf is None:
+            return
+        self.buf = None
+        self.shm.close()
+        if self.is_creator:
+            self.shm.unlink()
+
+    def _load(self, index: int) -> int:
+        return _COUNTER.unpack_from(self.buf, index * _COUNTER.size)[0]
+
+    def _store(self, index: int, value: int) -> None:
+        _COUNTER.pack_into(self.buf, index * _COUNTER.size, value)
+
+    def _get_slot(self, seq: int) -> int:
+        return self._header_size + (seq % self.num_slots) * self.slot_size
+
+    def write(self,
+              data: bytes,
+              check_alive: Optional[Callable[[], None]] = None) -> None:
+        """Writes a message. check_alive is called while waiting for the
+        readers to free a slot, and may raise to stop waiting."""
+        data = memoryview(data)
+        chunk_size = self.slot_size - _CHUNK.size
+        seq = self._load(0)
+        start = 0
+        while True:
+            chunk = data[start:start + chunk_size]
+            start += len(chunk)
+            self._wait_for_slot(seq, check_alive)
+            offset = self._get_slot(seq)
+            _CHUNK.pack_into(self.buf, offset, len(chunk), start >= len(data))
+            offset += _CHUNK.size
+            self.buf[offset:offset + len(chunk)] = chunk
+            seq += 1
+            self._store(0, seq)
+            if self._futex_address is not None:
+                _libc.syscall(_SYS_FUTEX, ctypes.c_void_p(self._futex_address),
+                              _FUTEX_WAKE, _INT_MAX, None, None, 0)
+            if start >= len(data):
+                return
+
+    def _wait_for_slot(self, seq: int,
+                       check_alive: Optional[Callable[[], None]]) -> None:
+        # The slot of seq was last used by the chunk seq - num_slots.
+        min_read = seq - self.num_slots + 1
+        last_check = time.perf_counter()
+        while min(
+                self._load(1 + reader)
+                for reader in range(self.num_readers)) < min_read:
+            # The readers free the slots without waking the writer, which
+            # only waits when they lag behind.
+            time.sleep(_POLL_INTERVAL)
+            if (check_alive is not None
+                    and time.perf_counter() - last_check > _CHECK_INTERVAL):
+                check_alive()
+                last_check = time.perf_counter()
+
+    def read(self,
+             reader: int,
+             check_alive: Optional[Callable[[], None]] = None) -> bytes:
+        """Reads the next message of a reader. check_alive is called while
+        waiting for the writer, and may raise to stop waiting."""
+        chunks = []
+        seq = self._load(1 + reader)
+        while True:
+            if self._load(0) <= seq:
+                self._wait_for_chunk(seq, check_alive)
+            offset = self._get_slot(seq)
+            length, is_last = _CHUNK.unpack_from(self.buf, offset)
+            offset += _CHUNK.size
+            chunks.append(bytes(self.buf[offset:offset + length]))
+            seq += 1
+            self._store(1 + reader, seq)
+            if is_last:
+                return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+    def _wait_for_chunk(self, seq: int,
+                        check_alive: Optional[Callable[[], None]]) -> None:
+        start = time.perf_counter()
+        last_check = start
+        while self._load(0) <= seq:
+            now = time.perf_counter()
+            if now - start < self.spin_time:
+                continue
+            if check_alive is not None and now - last_check > _CHECK_INTERVAL:
+                check_alive()
+                last_check = now
+            if self._futex_address is None:
+                time.sleep(_POLL_INTERVAL)
+                continue
+            # Sleeps unless the write counter, which can only be seq while
+            # the chunk is missing, changed.
+            timeout = _Timespec(int(_CHECK_INTERVAL),
+                                int(_CHECK_INTERVAL % 1 * 1e9))
+            _libc.syscall(_SYS_FUTEX, ctypes.c_void_p(self._futex_address),
+                          _FUTEX_WAIT, ctypes.c_uint32(seq & 0xFFFFFFFF),
+                          ctypes.byref(timeout), None, 0)
+
+
+class ShmTransportHandle(NamedTuple):
+    requests: ShmRingBufferHandle
+    responses: List[ShmRingBufferHandle]
+
+
+class ShmTransport:
+    """Sends the method calls of the driver to the workers on its node, and
+    their results back, through ring buffers in shared memory.
+
+    The calls are written to a ring buffer that all the workers read, and
+    each worker writes its results to its own ring buffer. The workers serve
+    the calls with run_worker_loop() until the transport is closed.
+
+    The calls may be sent from several threads. Their results are returned
+    in the order they were sent, which is the order the workers run them.
+    """
+
+    def __init__(self, num_workers: int, **kwargs) -> None:
+        self.num_workers = num_workers
+        self.requests = ShmRingBuffer(num_workers, **kwargs)
+        self.responses = [
+            ShmRingBuffer(1, **kwargs) for _ in range(num_workers)
+        ]
+        self._send_lock = threading.Lock()
+        self._recv_lock = threading.Lock()
+        self._num_sent = 0
+        self._num_received = 0
+        # Results received before they were waited for, by call.
+        self._results: Dict[int, List[Any]] = {}
+
+    @property
+    def handle(self) -> ShmTransportHandle:
+        return ShmTransportHandle(self.requests.handle,
+                                  [ring.handle for ring in self.responses])
+
+    def send(
+        self,
+        method: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        check_alive: Optional[Callable[[], None]] = None,
+    ) -> int:
+        """Sends a method call to the workers and returns its id."""
+        data = pickle.dumps((method, args, kwargs),
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        with self._send_lock:
+            self.requests.write(data, check_alive)
+            call_id = self._num_sent
+            self._num_sent += 1
+        return call_id
+
+    def recv(self,
+             call_id: int,
+             check_alive: Optional[Callable[[], None]] = None) -> List[Any]:
+        """Waits for the results of a call on all the workers, and returns
+        them. Raises the first exception raised by the workers."""
+        with self._recv_lock:
+            while call_id not in self._results:
+                self._results[self._num_received] = [
+                    pickle.loads(ring.read(0, check_alive))
+                    for ring in self.responses
+                ]
+                self._num_received += 1
+            results = self._results.pop(call_id)
+        outputs = []
+        for is_error, output in results:
+            if is_error:
+                raise output
+            outputs.append(output)
+        return outputs
+
+    def close(self) -> None:
+        """Stops the worker loops and frees the shared memory."""
+        if self.requests.buf is None:
+            return
+
+        def stop_waiting() -> None:
+            raise TimeoutError
+
+        with self._send_lock:
+            try:
+                self.requests.write(pickle.dumps(None), stop_waiting)
+            except TimeoutError:
+                logger.warning("The workers did not read the calls of the "
+                               "shared memory transport before it closed.")
+        self.requests.close()
+        for ring in self.responses:
+            ring.close()
+
+    def __del__(self):
+        with contextlib.suppress(Exception):
+            self.close()
+
+
+def run_worker_loop(handle: ShmTransportHandle, rank: int,
+                    execute_method: Callable[..., Any]) -> None:
+    """Serves the method calls of a ShmTransport on its rank-th worker until
+    the transport is closed."""
+    requests = ShmRingBuffer.attach(handle.requests)
+    responses = ShmRingBuffer.attach(handle.responses[rank])
+    try:
+        while True:
+            request = pickle.loads(requests.read(rank))
+            if request is None:
+                return
+            method, args, kwargs = request
+            try:
+                result = (False, execute_method(method, *args, **kwargs))
+                data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as e:  # pylint: disable=broad-except
+                try:
+                    data = pickle.dumps((True, e))
+                except Exception:  # pylint: disable=broad-except
+                    data = pickle.dumps((True, RuntimeError(repr(e))))
+            responses.write(data)
+    finally:
+        requests.close()
+        responses.close()
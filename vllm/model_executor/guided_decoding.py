@@ -1,20 +1,30 @@
 import asyncio
 import concurrent.futures
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 from copy import copy
 from enum import Enum
 from functools import lru_cache
 from json import dumps as json_dumps
 from re import escape as regex_escape
-from typing import Tuple, Union
+from typing import Dict, Optional, Set, Tuple, Union
 
+import numpy as np
+from prometheus_client import Counter, Gauge, Histogram
 from pydantic import BaseModel
 from transformers import PreTrainedTokenizerBase
 
 from vllm.entrypoints.openai.protocol import (ChatCompletionRequest,
                                               CompletionRequest)
-from vllm.model_executor.guided_logits_processors import (CFGLogitsProcessor,
-                                                          JSONLogitsProcessor,
-                                                          RegexLogitsProcessor)
+from vllm.logger import init_logger
+from vllm.model_executor.guided_logits_processors import (
+    BaseLogitsProcessor, CFGLogitsProcessor, IndexedRegexLogitsProcessor,
+    JSONLogitsProcessor, RegexLogitsProcessor)
+
+logger = init_logger(__name__)
 
 
 class GuidedDecodingMode(Enum):
@@ -51,7 +61,19 @@ pair   : UNESCAPED_STRING ":" value
 %ignore WS
 """
 
-global_thread_pool = None  # used for generating logits processor fsm
+# Budget for the estimated memory used by the cached compiled guides.
+VLLM_GUIDED_DECODING_CACHE_SIZE_MB = int(
+    os.environ.get("VLLM_GUIDED_DECODING_CACHE_SIZE_MB", "1024"))
+# Directory to persist the compiled regex FSM indexes in, if set.
+VLLM_GUIDED_DECODING_CACHE_DIR = os.environ.get(
+    "VLLM_GUIDED_DECODING_CACHE_DIR")
+
+# Estimated memory used by an entry of the index of a compiled regex FSM,
+# which maps a state and an allowed token to the next state.
+_FSM_INDEX_ENTRY_BYTES = 100
+
+global_guide_cache = None  # used for generating logits processor fsm
+global_guided_decoding_metrics = None
 
 
 async def get_guided_decoding_logits_processor(
@@ -63,19 +85,17 @@ async def get_guided_decoding_logits_processor(
     We cache logit processors by (guide, tokenizer), and on cache hit
     we make a shallow copy to reuse the same underlying FSM.
     """
-    global global_thread_pool
+    global global_guide_cache
     guide, mode = _get_guide_and_mode(request)
     if not guide:
         return None
 
-    if global_thread_pool is None:
-        global_thread_pool = concurrent.futures.ThreadPoolExecutor(
-            max_workers=2)
-    loop = asyncio.get_running_loop()
+    if global_guide_cache is None:
+        global_guide_cache = CompiledGuideCache(
+            max_bytes=VLLM_GUIDED_DECODING_CACHE_SIZE_MB * 2**20,
+            cache_dir=VLLM_GUIDED_DECODING_CACHE_DIR)
 
-    result = await loop.run_in_executor(global_thread_pool,
-                                        _get_cached_logits_processor, guide,
-                                        tokenizer, mode)
+    result = await global_guide_cache.get(guide, tokenizer, mode)
 
     logits_processor = copy(result)
     # reset logits processor's internal state
@@ -83,6 +103,231 @@ async def get_guided_decoding_logits_processor(
     return logits_processor
 
 
+class _GuidedDecodingMetrics:
+
+    def __init__(self):
+        self.counter_cache_hits = Counter(
+            name="vllm:guided_decoding_cache_hits_total",
+            documentation="Number of guided decoding requests whose guide "
+            "was compiled already or being compiled.")
+        self.counter_cache_misses = Counter(
+            name="vllm:guided_decoding_cache_misses_total",
+            documentation="Number of guided decoding requests whose guide "
+            "had to be compiled or loaded from disk.")
+        self.histogram_compile_time = Histogram(
+            name="vllm:guided_decoding_compile_time_seconds",
+            documentation="Histogram of the time to compile a guide, or to "
+            "load it from disk, in seconds.",
+            buckets=[
+                0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                120.0
+            ])
+        self.gauge_cache_bytes = Gauge(
+            name="vllm:guided_decoding_cache_bytes",
+            documentation="Estimated memory used by the cached compiled "
+            "guides.")
+
+
+def _get_guided_decoding_metrics() -> _GuidedDecodingMetrics:
+    # Created on first use rather than on import, since the engine
+    # unregisters the vLLM metrics that exist when it starts.
+    global global_guided_decoding_metrics
+    if global_guided_decoding_metrics is None:
+        global_guided_decoding_metrics = _GuidedDecodingMetrics()
+    return global_guided_decoding_metrics
+
+
+class CompiledGuideCache:
+    """Cache of the logits processors compiled from the guides.
+
+    The guides are compiled in a thread pool. Concurrent requests for the
+    same guide wait for the same compilation. The least recently used guides
+    are evicted once the estimated memory of the cached FSMs exceeds
+    max_bytes. If cache_dir is set, the indexes of the compiled regex FSMs
+    are also saved there and loaded instead of compiling them again, e.g.
+    after a restart. The indexes are saved as arrays of integers, so that
+    loading a file never runs code, and the directory is created private
+    to the user.
+
+    Args:
+        max_bytes: Budget for the estimated memory of the cached guides.
+        cache_dir: Directory to persist the compiled regex FSM indexes in.
+        max_workers: Number of threads that compile the guides.
+    """
+
+    def __init__(self,
+                 max_bytes: int,
+                 cache_dir: Optional[str] = None,
+                 max_workers: int = 2) -> None:
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers)
+        # Guarded by the lock, since the guides are added by the threads
+        # that compile them.
+        self._lock = threading.Lock()
+        # (guide, tokenizer, mode) -> (logits processor, estimated bytes).
+        self._entries: OrderedDict[Tuple, Tuple[BaseLogitsProcessor,
+                                                int]] = OrderedDict()
+        self._in_flight: Dict[Tuple, concurrent.futures.Future] = {}
+        self.num_bytes = 0
+        self.num_hits = 0
+        self.num_misses = 0
+        self._metrics = _get_guided_decoding_metrics()
+
+    async def get(self, guide: str, tokenizer: PreTrainedTokenizerBase,
+                  mode: GuidedDecodingMode) -> BaseLogitsProcessor:
+        key = (guide, tokenizer, mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._record_hit()
+                return entry[0]
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._record_hit()
+            else:
+                self.num_misses += 1
+                self._metrics.counter_cache_misses.inc()
+                future = self._executor.submit(self._compile, key)
+                self._in_flight[key] = future
+        return await asyncio.wrap_future(future)
+
+    def _record_hit(self) -> None:
+        self.num_hits += 1
+        self._metrics.counter_cache_hits.inc()
+
+    def _compile(self, key: Tuple) -> BaseLogitsProcessor:
+        guide, tokenizer, mode = key
+        start_time = time.perf_counter()
+        try:
+            logits_processor = self._load(guide, tokenizer, mode)
+            if logits_processor is None:
+                logits_processor = _get_logits_processor(
+                    guide, tokenizer, mode)
+                self._save(guide, tokenizer, mode, logits_processor)
+        except BaseException:
+            with self._lock:
+                del self._in_flight[key]
+            raise
+        self._metrics.histogram_compile_time.observe(time.perf_counter() -
+                                                     start_time)
+
+        num_bytes = _estimate_num_bytes(logits_processor)
+        with self._lock:
+            del self._in_flight[key]
+            self._entries[key] = (logits_processor, num_bytes)
+            self.num_bytes += num_bytes
+            # Keep the new guide even if it alone exceeds the budget.
+            while self.num_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_bytes
+            self._metrics.gauge_cache_bytes.set(self.num_bytes)
+        return logits_processor
+
+    def _get_path(self, guide: str, tokenizer: PreTrainedTokenizerBase,
+                  mode: GuidedDecodingMode) -> Optional[str]:
+        if self.cache_dir is None or mode == GuidedDecodingMode.GRAMMAR:
+            # Only the regex FSMs are compiled ahead of time.
+            return None
+        key = hashlib.sha256()
+        key.update(_get_tokenizer_fingerprint(tokenizer).encode())
+        key.update(mode.value.encode())
+        key.update(guide.encode())
+        return os.path.join(self.cache_dir, f"{key.hexdigest()}.npz")
+
+    def _load(self, guide: str, tokenizer: PreTrainedTokenizerBase,
+              mode: GuidedDecodingMode) -> Optional[BaseLogitsProcessor]:
+        path = self._get_path(guide, tokenizer, mode)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            fsm_index = _load_fsm_index(path)
+        except Exception as e:
+            logger.warning(f"Failed to load the compiled guide from {path}, "
+                           f"compiling it again: {e}")
+            return None
+        return IndexedRegexLogitsProcessor(fsm_index, tokenizer)
+
+    def _save(self, guide: str, tokenizer: PreTrainedTokenizerBase,
+              mode: GuidedDecodingMode,
+              logits_processor: BaseLogitsProcessor) -> None:
+        path = self._get_path(guide, tokenizer, mode)
+        if path is None:
+            return
+        # Write to a temporary file first, so that a concurrent load never
+        # sees a partial file.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                _save_fsm_index(f, logits_processor.get_fsm_index())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to save the compiled guide to {path}: {e}")
+
+
+def _save_fsm_index(
+        f, fsm_index: Tuple[Dict[int, Dict[int, int]], Set[int]]) -> None:
+    """Saves the index of a regex FSM as flat arrays: the states, the number
+    of allowed tokens of each state, then the allowed tokens and their next
+    states, state by state."""
+    states_to_token_maps, empty_token_ids = fsm_index
+    token_maps = list(states_to_token_maps.values())
+    np.savez(f,
+             states=np.array(list(states_to_token_maps), dtype=np.int64),
+             num_tokens=np.array([len(m) for m in token_maps], dtype=np.int64),
+             token_ids=np.array([t for m in token_maps for t in m],
+                                dtype=np.int64),
+             next_states=np.array([s for m in token_maps for s in m.values()],
+                                  dtype=np.int64),
+             empty_token_ids=np.array(sorted(empty_token_ids), dtype=np.int64))
+
+
+def _load_fsm_index(path: str) -> Tuple[Dict[int, Dict[int, int]], Set[int]]:
+    """Loads an index saved by _save_fsm_index()."""
+    with np.load(path, allow_pickle=False) as data:
+        states = data["states"].tolist()
+        num_tokens = data["num_tokens"].tolist()
+        token_ids = data["token_ids"].tolist()
+        next_states = data["next_states"].tolist()
+        empty_token_ids = set(data["empty_token_ids"].tolist())
+    if len(num_tokens) != len(states) or not (
+            len(token_ids) == len(next_states) == sum(num_tokens)):
+        raise ValueError("The FSM index is corrupted.")
+    states_to_token_maps: Dict[int, Dict[int, int]] = {}
+    start = 0
+    for state, num in zip(states, num_tokens):
+        end = start + num
+        states_to_token_maps[state] = dict(
+            zip(token_ids[start:end], next_states[start:end]))
+        start = end
+    return states_to_token_maps, empty_token_ids
+
+
+def _estimate_num_bytes(logits_processor: BaseLogitsProcessor) -> int:
+    """Estimates the memory used by the FSM of a logits processor."""
+    fsm = logits_processor.fsm
+    # The FSMs keep a list of the token ids of the vocabulary.
+    num_bytes = 8 * len(getattr(fsm, "vocabulary", ()))
+    states_to_token_maps = getattr(fsm, "states_to_token_maps", None)
+    if states_to_token_maps is not None:
+        num_bytes += _FSM_INDEX_ENTRY_BYTES * sum(
+            len(token_map) for token_map in states_to_token_maps.values())
+    return num_bytes
+
+
+@lru_cache(maxsize=None)
+def _get_tokenizer_fingerprint(tokenizer: PreTrainedTokenizerBase) -> str:
+    """Identifies the vocabulary of a tokenizer, which the compiled FSMs
+    depend on."""
+    vocab = sorted(tokenizer.get_vocab().items())
+    return hashlib.sha256(
+        json_dumps([tokenizer.eos_token_id, vocab]).encode()).hexdigest()
+
+
 def _get_guide_and_mode(
     request: Union[CompletionRequest, ChatCompletionRequest]
 ) -> Tuple[str, GuidedDecodingMode]:
@@ -115,10 +360,8 @@ def _get_guide_and_mode(
         return None, None
 
 
-@lru_cache(maxsize=32)
-def _get_cached_logits_processor(guide: str,
-                                 tokenizer: PreTrainedTokenizerBase,
-                                 mode: GuidedDecodingMode):
+def _get_logits_processor(guide: str, tokenizer: PreTrainedTokenizerBase,
+                          mode: GuidedDecodingMode) -> BaseLogitsProcessor:
     if mode == GuidedDecodingMode.JSON:
         return JSONLogitsProcessor(guide, tokenizer)
     elif mode == GuidedDecodingMode.REGEX or mode == GuidedDecodingMode.CHOICE:
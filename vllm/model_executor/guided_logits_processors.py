@@ -13,10 +13,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import itertools
 import json
-import math
 from collections import defaultdict
-from typing import Callable, DefaultDict, Dict, List, Optional, Union
+from typing import (Callable, DefaultDict, Dict, Hashable, List, Optional, Set,
+                    Tuple, Union)
 
 import torch
 from outlines.fsm.fsm import CFGFSM, RegexFSM
@@ -24,9 +25,49 @@ from outlines.fsm.json_schema import build_regex_from_schema
 from pydantic import BaseModel
 from transformers import PreTrainedTokenizerBase
 
+from vllm.model_executor.layers.logits_processor import (apply_token_bitmasks_,
+                                                         make_token_bitmask)
+from vllm.utils import LRUCache
+
+# Bytes of allowed token bitmasks cached for all the FSMs together.
+_BITMASK_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class TokenBitmaskCache(LRUCache[torch.Tensor]):
+    """An LRU cache of token bitmasks, bounded by the total bytes of the
+    bitmasks rather than by their number."""
+
+    def __init__(self, capacity_bytes: int):
+        super().__init__(capacity_bytes)
+        self.num_bytes = 0
+
+    def put(self, key: Hashable, value: torch.Tensor) -> None:
+        self.pop(key)
+        self.num_bytes += value.numel() * value.element_size()
+        super().put(key, value)
+
+    def _on_remove(self, key: Hashable, value: torch.Tensor):
+        self.num_bytes -= value.numel() * value.element_size()
+
+    def _remove_old_if_needed(self) -> None:
+        while self.num_bytes > self.capacity:
+            self.remove_oldest()
+
+
+# The allowed token bitmasks of the FSM states, on the device of the logits,
+# shared by all the logits processors whose allowed tokens are a function of
+# the FSM state.
+_bitmask_cache = TokenBitmaskCache(_BITMASK_CACHE_BYTES)
+_fsm_keys = itertools.count()
+
 
 class BaseLogitsProcessor:
 
+    # Identifies the FSM in the bitmask cache, or None if the allowed tokens
+    # are not a function of the state. Shared by the copies of the logits
+    # processor, which share the FSM.
+    _fsm_key: Optional[int] = None
+
     def adapt_tokenizer(self, tokenizer: PreTrainedTokenizerBase):
         """Adapt vLLM's tokenizer to use to compile the FSM.
 
@@ -75,10 +116,9 @@ class BaseLogitsProcessor:
         """Initialize the FSM states."""
         self.fsm_state: DefaultDict[int, int] = defaultdict(int)
 
-    def __call__(self, input_ids: List[int],
-                 scores: torch.Tensor) -> torch.Tensor:
-        """Use the FSM to bias the logits before sampling the next token."""
-
+    def _advance_fsm(self, input_ids: List[int]) -> int:
+        """Advances the FSM with the last generated token, and returns the
+        FSM state after the generated tokens."""
         seq_id = hash(tuple(input_ids))
 
         if len(input_ids) == 0:
@@ -89,13 +129,35 @@ class BaseLogitsProcessor:
             self.fsm_state[seq_id] = self.fsm.next_state(
                 self.fsm_state[last_seq_id], last_token)
 
-        allowed_tokens = self.fsm.allowed_token_ids(self.fsm_state[seq_id])
+        return self.fsm_state[seq_id]
 
-        mask = torch.full((scores.shape[-1], ),
-                          -math.inf,
-                          device=scores.device)
-        mask[allowed_tokens] = 0
-        scores.add_(mask)
+    def get_allowed_token_bitmask(self, input_ids: List[int], vocab_size: int,
+                                  device: torch.device) -> torch.Tensor:
+        """Returns the bitmask of the tokens the FSM allows after the
+        generated tokens, as made by make_token_bitmask().
+
+        The bitmasks are cached by FSM state, so that the allowed tokens of
+        a state are only listed and packed the first time it is reached.
+        """
+        state = self._advance_fsm(input_ids)
+        key = (self._fsm_key, state, vocab_size, device)
+        if self._fsm_key is not None:
+            bitmask = _bitmask_cache.get(key)
+            if bitmask is not None:
+                return bitmask
+
+        allowed_tokens = self.fsm.allowed_token_ids(state)
+        bitmask = make_token_bitmask(allowed_tokens, vocab_size).to(device)
+        if self._fsm_key is not None:
+            _bitmask_cache.put(key, bitmask)
+        return bitmask
+
+    def __call__(self, input_ids: List[int],
+                 scores: torch.Tensor) -> torch.Tensor:
+        """Use the FSM to bias the logits before sampling the next token."""
+        bitmask = self.get_allowed_token_bitmask(input_ids, scores.shape[-1],
+                                                 scores.device)
+        apply_token_bitmasks_(scores.unsqueeze(0), [0], bitmask.unsqueeze(0))
 
         return scores
 
@@ -116,6 +178,72 @@ class RegexLogitsProcessor(BaseLogitsProcessor):
         tokenizer = self.adapt_tokenizer(tokenizer)
         fsm = RegexFSM(regex_string, tokenizer)
         self.fsm = fsm
+        # The allowed tokens of a regex FSM only depend on the state.
+        self._fsm_key = next(_fsm_keys)
+
+    def get_fsm_index(self) -> Tuple[Dict[int, Dict[int, int]], Set[int]]:
+        """Returns the index that maps the FSM states to the allowed tokens
+        and their next states, which is what compiling the regex builds."""
+        return self.fsm.states_to_token_maps, self.fsm.empty_token_ids
+
+
+class IndexedRegexFSM:
+    """The FSM of a regex, driven by an index returned by
+    RegexLogitsProcessor.get_fsm_index() instead of compiling the regex.
+
+    It follows the interface of outlines' RegexFSM, which can only be built
+    by compiling the regex.
+    """
+    first_state = 0
+    final_state = -1
+
+    def __init__(self, states_to_token_maps: Dict[int, Dict[int, int]],
+                 empty_token_ids: Set[int],
+                 tokenizer: PreTrainedTokenizerBase) -> None:
+        self.states_to_token_maps = states_to_token_maps
+        self.empty_token_ids = empty_token_ids
+        self.vocabulary = list(tokenizer.vocabulary.values())
+        self.eos_token_id = tokenizer.eos_token_id
+
+    def allowed_token_ids(self, state: int) -> List[int]:
+        next_tokens_to_end_states = self.states_to_token_maps.get(state)
+        if next_tokens_to_end_states is None:
+            return [self.eos_token_id]
+        return list(next_tokens_to_end_states.keys())
+
+    def next_state(self, state: int, token_id: int) -> int:
+        if token_id == self.eos_token_id:
+            return self.final_state
+        last_token_to_end_state = self.states_to_token_maps[state]
+        next_state = last_token_to_end_state.get(token_id)
+        if next_state is None:
+            return self.final_state
+        return next_state
+
+    def copy(self) -> "IndexedRegexFSM":
+        return self
+
+
+class IndexedRegexLogitsProcessor(RegexLogitsProcessor):
+
+    def __init__(self, fsm_index: Tuple[Dict[int, Dict[int, int]], Set[int]],
+                 tokenizer: PreTrainedTokenizerBase):
+        """Create the logits processor of a regex from an index returned by
+        get_fsm_index(), without compiling the regex again.
+
+        Parameters
+        ----------
+        fsm_index
+            The FSM index, for the same tokenizer
+        tokenizer
+            The model's tokenizer
+
+        """
+        tokenizer = self.adapt_tokenizer(tokenizer)
+        states_to_token_maps, empty_token_ids = fsm_index
+        self.fsm = IndexedRegexFSM(states_to_token_maps, empty_token_ids,
+                                   tokenizer)
+        self._fsm_key = next(_fsm_keys)
 
 
 class JSONLogitsProcessor(RegexLogitsProcessor):
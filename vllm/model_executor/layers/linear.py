@@ -44,6 +44,21 @@ class LinearMethodBase(ABC):
         """Apply the weights to the input tensor."""
         raise NotImplementedError
 
+    def get_weights_state(self, weights: Dict[str, Any]) -> Dict[str, str]:
+        """Returns the state of the weights that is not stored in their
+        tensors, e.g. whether they were repacked after they were loaded."""
+        return {}
+
+    def set_weights_state(self, weights: Dict[str, Any],
+                          state: Dict[str, str]) -> None:
+        """Restores the state returned by get_weights_state() on weights
+        that hold the same tensors. The weights have no such state by
+        default."""
+        if state:
+            raise ValueError(
+                f"Unexpected state of the weights of {type(self).__name__}: "
+                f"{state}")
+
 
 class UnquantizedLinearMethod(LinearMethodBase):
     """Linear method without quantization.
@@ -1,6 +1,8 @@
 """A layer that compute logits from hidden_stats."""
-from typing import Optional
+import math
+from typing import List, Optional
 
+import numpy as np
 import torch
 import torch.nn as nn
 
@@ -86,19 +88,70 @@ def _apply_logits_processors(
 ) -> torch.Tensor:
     logits_row_idx = 0
     found_logits_processors = False
+    # The logits processors that restrict the next token to a set of allowed
+    # tokens (e.g. for guided decoding) provide a get_allowed_token_bitmask()
+    # method. When such a processor is the last one of a sequence, its
+    # bitmask is applied together with the ones of the other sequences.
+    bitmask_rows: List[int] = []
+    bitmasks: List[torch.Tensor] = []
     for seq_ids, sampling_params in sampling_metadata.seq_groups:
         logits_processors = sampling_params.logits_processors
         if logits_processors:
             found_logits_processors = True
+            get_allowed_token_bitmask = getattr(logits_processors[-1],
+                                                "get_allowed_token_bitmask",
+                                                None)
+            if get_allowed_token_bitmask is not None:
+                logits_processors = logits_processors[:-1]
             for seq_id in seq_ids:
                 logits_row = logits[logits_row_idx]
                 token_ids = sampling_metadata.seq_data[seq_id].output_token_ids
                 for logits_processor in logits_processors:
                     logits_row = logits_processor(token_ids, logits_row)
                 logits[logits_row_idx] = logits_row
+                if get_allowed_token_bitmask is not None:
+                    bitmask_rows.append(logits_row_idx)
+                    bitmasks.append(
+                        get_allowed_token_bitmask(token_ids, logits.shape[-1],
+                                                  logits.device))
                 logits_row_idx += 1
         else:
             logits_row_idx += len(seq_ids)
     if found_logits_processors:
         assert logits_row_idx == logits.shape[0]
+    if bitmasks:
+        apply_token_bitmasks_(logits, bitmask_rows, torch.stack(bitmasks))
     return logits
+
+
+def make_token_bitmask(allowed_token_ids: List[int],
+                       vocab_size: int) -> torch.Tensor:
+    """Packs the allowed tokens into a bitmask of int32 words. Token i is
+    allowed if bit i % 32 of word i // 32 is set."""
+    num_words = (vocab_size + 31) // 32
+    allowed = np.zeros(num_words * 32, dtype=bool)
+    allowed[allowed_token_ids] = True
+    return torch.from_numpy(
+        np.packbits(allowed, bitorder="little").view(np.int32))
+
+
+def apply_token_bitmasks_(logits: torch.Tensor, rows: List[int],
+                          bitmasks: torch.Tensor) -> None:
+    """Sets the logits of the tokens that are not allowed by the bitmasks to
+    -inf, in place.
+
+    Args:
+        logits: The logits, of shape (num_rows, vocab_size).
+        rows: The logits rows to mask.
+        bitmasks: One bitmask per row to mask, as made by
+            make_token_bitmask(), on the device of the logits.
+    """
+    # Unpack the bits of each byte, the bitmasks being little-endian.
+    shifts = torch.arange(8, dtype=torch.uint8, device=logits.device)
+    bits = (bitmasks.view(torch.uint8).unsqueeze(-1) >> shifts) & 1
+    disallowed = (bits == 0).flatten(start_dim=1)[:, :logits.shape[-1]]
+    if len(rows) == logits.shape[0]:
+        logits.masked_fill_(disallowed, -math.inf)
+        return
+    index = torch.tensor(rows, dtype=torch.long, device=logits.device)
+    logits[index] = logits[index].masked_fill(disallowed, -math.inf)
@@ -197,12 +197,7 @@ class GPTQLinearMethod(LinearMethodBase):
         # exllama needs to shuffle the weight after the weight is loaded
         # here we do the shuffle on first forward pass
         if weights["exllama_state"] == ExllamaState.UNINITIALIZED:
-            if self.quant_config.desc_act:
-                weights["g_idx"] = torch.argsort(weights["g_idx"]).to(
-                    torch.int)
-            else:
-                weights["g_idx"] = torch.empty((1, 1), device="meta")
-            weights["exllama_state"] = ExllamaState.READY
+            self._set_exllama_ready(weights)
             ops.gptq_shuffle(weights["qweight"], weights["g_idx"],
                              self.quant_config.weight_bits)
         output = ops.gptq_gemm(reshaped_x, weights["qweight"],
@@ -213,3 +208,20 @@ class GPTQLinearMethod(LinearMethodBase):
         if bias is not None:
             output = output + bias
         return output.reshape(out_shape)
+
+    def get_weights_state(self, weights: Dict[str, Any]) -> Dict[str, str]:
+        return {"exllama_state": weights["exllama_state"].name}
+
+    def set_weights_state(self, weights: Dict[str, Any],
+                          state: Dict[str, str]) -> None:
+        # The qweight was already shuffled before it was saved.
+        if (weights["exllama_state"] == ExllamaState.UNINITIALIZED
+                and state["exllama_state"] == ExllamaState.READY.name):
+            self._set_exllama_ready(weights)
+
+    def _set_exllama_ready(self, weights: Dict[str, Any]) -> None:
+        if self.quant_config.desc_act:
+            weights["g_idx"] = torch.argsort(weights["g_idx"]).to(torch.int)
+        else:
+            weights["g_idx"] = torch.empty((1, 1), device="meta")
+        weights["exllama_state"] = ExllamaState.READY
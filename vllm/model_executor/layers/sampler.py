@@ -7,11 +7,12 @@ import torch.nn as nn
 
 from vllm.model_executor.layers.ops.sample import sample as sample_triton
 from vllm.model_executor.sampling_metadata import (SamplingMetadata,
-                                                   SamplingTensors)
+                                                   SamplingTensors,
+                                                   SamplingTensorsCache)
 from vllm.sampling_params import SamplingParams, SamplingType
-from vllm.sequence import (Logprob, PromptLogprobs, SampleLogprobs,
-                           SamplerOutput, SequenceData, SequenceGroupOutput,
-                           SequenceOutput)
+from vllm.sequence import (Logprob, PromptLogprobs, SamplerOutput,
+                           SequenceData, SequenceGroupOutput, SequenceOutput,
+                           StepLogprobs)
 
 
 class Sampler(nn.Module):
@@ -29,6 +30,11 @@ class Sampler(nn.Module):
     parameters (e.g., sampling method, temperature, top-p, top-k, etc.).
     """
 
+    def __init__(self):
+        super().__init__()
+        # Keeps the sampling tensors of the running sequences across steps.
+        self._sampling_tensors_cache = SamplingTensorsCache()
+
     def forward(
         self,
         logits: torch.Tensor,
@@ -43,13 +49,14 @@ class Sampler(nn.Module):
 
         # Prepare sampling tensors with pinned memory to avoid blocking.
         (sampling_tensors, do_penalties, do_top_p_top_k,
-         do_min_p) = SamplingTensors.from_sampling_metadata(
+         do_min_p) = self._sampling_tensors_cache.get_sampling_tensors(
              sampling_metadata, vocab_size, logits.device, logits.dtype)
 
         # Apply presence and frequency penalties.
         if do_penalties:
-            logits = _apply_penalties(logits, sampling_tensors.prompt_tokens,
-                                      sampling_tensors.output_tokens,
+            prompt_mask, output_bin_counts = _get_penalty_counts(
+                sampling_tensors, vocab_size)
+            logits = _apply_penalties(logits, prompt_mask, output_bin_counts,
                                       sampling_tensors.presence_penalties,
                                       sampling_tensors.frequency_penalties,
                                       sampling_tensors.repetition_penalties)
@@ -135,16 +142,28 @@ def _apply_min_tokens_penalty(
     return logits
 
 
-def _apply_penalties(logits: torch.Tensor, prompt_tokens_tensor: torch.Tensor,
-                     output_tokens_tensor: torch.Tensor,
+def _get_penalty_counts(sampling_tensors: SamplingTensors,
+                        vocab_size: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns the mask of the prompt tokens and the bin counts of the output
+    tokens of each sequence."""
+    if sampling_tensors.output_bin_counts is not None:
+        # Kept up to date across steps by the SamplingTensorsCache.
+        return sampling_tensors.prompt_mask, sampling_tensors.output_bin_counts
+    num_seqs = sampling_tensors.prompt_tokens.shape[0]
+    _, prompt_mask = _get_bin_counts_and_mask(sampling_tensors.prompt_tokens,
+                                              vocab_size, num_seqs)
+    output_bin_counts, _ = _get_bin_counts_and_mask(
+        sampling_tensors.output_tokens, vocab_size, num_seqs)
+    return prompt_mask, output_bin_counts
+
+
+def _apply_penalties(logits: torch.Tensor, prompt_mask: torch.Tensor,
+                     output_bin_counts: torch.Tensor,
                      presence_penalties: torch.Tensor,
                      frequency_penalties: torch.Tensor,
                      repetition_penalties: torch.Tensor) -> torch.Tensor:
-    num_seqs, vocab_size = logits.shape
-    _, prompt_mask = _get_bin_counts_and_mask(prompt_tokens_tensor, vocab_size,
-                                              num_seqs)
-    output_bin_counts, output_mask = _get_bin_counts_and_mask(
-        output_tokens_tensor, vocab_size, num_seqs)
+    _, vocab_size = logits.shape
+    output_mask = output_bin_counts > 0
 
     repetition_penalties = repetition_penalties[:, None].repeat(1, vocab_size)
     repetition_penalties[~(prompt_mask | output_mask)] = 1.0
@@ -529,13 +548,21 @@ def _get_logprobs(
     logprobs: torch.Tensor,
     sampling_metadata: SamplingMetadata,
     sample_results: List[Tuple[List[int], List[int]]],
-) -> Tuple[List[Optional[List[Optional[Dict[int, float]]]]], List[List[Dict[
-        int, float]]]]:
+) -> Tuple[List[Optional[PromptLogprobs]], List[List[StepLogprobs]]]:
+    """Gets the logprobs of the prompt tokens and of the sampled tokens.
+
+    The logprob of every sampled token is needed for the cumulative logprob
+    of its sequence, but the ranks and top logprobs are only computed for
+    the sequence groups that request them, and are returned as plain values
+    in a StepLogprobs per sampled token.
+    """
     # Prepare query indices
     batched_logprobs_query_seq_indices: List[int] = []
     batched_logprobs_query_token_indices: List[int] = []
-    # at least get one logprob for each token
-    largest_num_logprobs = 1
+    # The queries of the sequence groups that request logprobs, whose ranks
+    # are computed.
+    batched_ranks_query_indices: List[int] = []
+    largest_num_logprobs = 0
     sample_idx = 0
     for i, (seq_group, sample_result) in enumerate(
             zip(sampling_metadata.seq_groups, sample_results)):
@@ -549,17 +576,22 @@ def _get_logprobs(
             prompt_len = sampling_metadata.prompt_lens[i]
             prompt_tokens = sampling_metadata.seq_data[
                 seq_ids[0]].prompt_token_ids
+            query_idx = len(batched_logprobs_query_seq_indices)
+            batched_ranks_query_indices.extend(
+                range(query_idx, query_idx + prompt_len - 1))
             batched_logprobs_query_seq_indices.extend(
                 sample_idx + j for j in range(prompt_len - 1))
-            batched_logprobs_query_token_indices.extend(
-                token_id for token_id in prompt_tokens[1:])
+            batched_logprobs_query_token_indices.extend(prompt_tokens[1:])
             sample_idx += prompt_len - 1
-        batched_logprobs_query_seq_indices.extend(
-            [sample_idx + parent_id for parent_id in parent_ids])
-        batched_logprobs_query_token_indices.extend(next_token_ids)
         if sampling_params.logprobs is not None:
             largest_num_logprobs = max(largest_num_logprobs,
                                        sampling_params.logprobs)
+            query_idx = len(batched_logprobs_query_seq_indices)
+            batched_ranks_query_indices.extend(
+                range(query_idx, query_idx + len(next_token_ids)))
+        batched_logprobs_query_seq_indices.extend(
+            [sample_idx + parent_id for parent_id in parent_ids])
+        batched_logprobs_query_token_indices.extend(next_token_ids)
         sample_idx += num_parent_seqs
     assert sample_idx == logprobs.size(0)
 
@@ -574,9 +606,20 @@ def _get_logprobs(
         batched_logprobs_query_token_indices_gpu
     ]]
 
-    batched_ranks_query_result = _get_ranks(
-        logprobs[batched_logprobs_query_seq_indices_gpu],
-        batched_logprobs_query_token_indices_gpu)
+    # Batched query for the ranks of the selected tokens
+    batched_ranks: List[
+        Optional[int]] = [None] * len(batched_logprobs_query_seq_indices)
+    if batched_ranks_query_indices:
+        batched_ranks_query_indices_gpu = torch.tensor(
+            batched_ranks_query_indices, device=logprobs.device)
+        batched_ranks_query_result = _get_ranks(
+            logprobs[batched_logprobs_query_seq_indices_gpu[
+                batched_ranks_query_indices_gpu]],
+            batched_logprobs_query_token_indices_gpu[
+                batched_ranks_query_indices_gpu])
+        for query_idx, rank in zip(batched_ranks_query_indices,
+                                   batched_ranks_query_result.tolist()):
+            batched_ranks[query_idx] = rank
 
     # Batched query for logprobs of topk tokens
     if largest_num_logprobs > 0:
@@ -588,12 +631,11 @@ def _get_logprobs(
     else:
         top_logprobs, top_token_ids = None, None
 
-    batched_logprobs_query_result = batched_logprobs_query_result.cpu()
-    batched_ranks_query_result = batched_ranks_query_result.cpu()
+    batched_logprobs = batched_logprobs_query_result.tolist()
 
     # Gather results
     result_prompt_logprobs: List[Optional[PromptLogprobs]] = []
-    result_sample_logprobs: List[SampleLogprobs] = []
+    result_sample_logprobs: List[List[StepLogprobs]] = []
     sample_idx = 0
     query_result_idx = 0
     for i, (seq_group, sample_result) in enumerate(
@@ -610,9 +652,8 @@ def _get_logprobs(
             group_prompt_logprobs: PromptLogprobs = [None]
             for token_id in prompt_tokens[1:]:
                 prompt_logprobs_dict = {
-                    token_id:
-                    (batched_logprobs_query_result[query_result_idx].item(),
-                     batched_ranks_query_result[query_result_idx].item())
+                    token_id: (batched_logprobs[query_result_idx],
+                               batched_ranks[query_result_idx])
                 }
                 if num_logprobs > 0:
                     prompt_logprobs_dict.update(
@@ -634,29 +675,22 @@ def _get_logprobs(
 
         # Sample logprobs
         num_logprobs = sampling_params.logprobs
-        if num_logprobs is None:
-            num_logprobs = 0
-        group_sample_logprobs: SampleLogprobs = []
+        group_sample_logprobs: List[StepLogprobs] = []
         for next_token_id, parent_id in zip(next_token_ids, parent_ids):
-            sample_logprobs_dict = {
-                next_token_id:
-                (batched_logprobs_query_result[query_result_idx].item(),
-                 batched_ranks_query_result[query_result_idx].item())
-            }
+            if num_logprobs:
+                step_logprobs = StepLogprobs(
+                    next_token_id, batched_logprobs[query_result_idx],
+                    batched_ranks[query_result_idx],
+                    top_token_ids[sample_idx +
+                                  parent_id, :num_logprobs].tolist(),
+                    top_logprobs[sample_idx +
+                                 parent_id, :num_logprobs].tolist())
+            else:
+                step_logprobs = StepLogprobs(
+                    next_token_id, batched_logprobs[query_result_idx],
+                    batched_ranks[query_result_idx])
             query_result_idx += 1
-            if num_logprobs >= 0:
-                sample_logprobs_dict.update(
-                    zip(
-                        top_token_ids[sample_idx +
-                                      parent_id, :num_logprobs].tolist(),
-                        zip(
-                            top_logprobs[sample_idx +
-                                         parent_id, :num_logprobs].tolist(),
-                            range(1, num_logprobs + 1))))
-            group_sample_logprobs.append({
-                token_id: Logprob(*logprob_rank)
-                for token_id, logprob_rank in sample_logprobs_dict.items()
-            })
+            group_sample_logprobs.append(step_logprobs)
         result_sample_logprobs.append(group_sample_logprobs)
         sample_idx += len(seq_ids)
 
@@ -667,7 +701,7 @@ def _build_sampler_output(
     sample_results: List[Tuple[List[int], List[int]]],
     sampling_metadata: SamplingMetadata,
     prompt_logprobs: List[Optional[PromptLogprobs]],
-    sample_logprobs: List[SampleLogprobs],
+    sample_logprobs: List[List[StepLogprobs]],
 ) -> SamplerOutput:
     sampler_output = []
     for (seq_group, sample_result, group_prompt_logprobs,
@@ -1,6 +1,8 @@
 """Utilities for selecting and loading models."""
 import contextlib
-from typing import Tuple, Type
+import json
+import os
+from typing import Dict, Set, Tuple, Type
 
 import torch
 import torch.nn as nn
@@ -8,13 +10,20 @@ import torch.nn as nn
 from vllm.config import DeviceConfig, ModelConfig
 from vllm.model_executor.models import ModelRegistry
 from vllm.model_executor.models.llava import LlavaForConditionalGeneration
+from vllm.model_executor.parallel_utils.parallel_state import (
+    get_tensor_model_parallel_rank, get_tensor_model_parallel_world_size)
 from vllm.model_executor.weight_utils import (get_quant_config,
-                                              initialize_dummy_weights)
+                                              initialize_dummy_weights,
+                                              load_safetensors_file,
+                                              save_safetensors_file)
 
 _VISION_MODEL_CLASSES = [
     LlavaForConditionalGeneration,
 ]
 
+# The file of a tensor parallel worker in a sharded checkpoint.
+_SHARDED_STATE_FILE = "model-rank-{rank}-of-{world_size}.safetensors"
+
 
 @contextlib.contextmanager
 def _set_default_torch_dtype(dtype: torch.dtype):
@@ -96,8 +105,86 @@ def get_model(model_config: ModelConfig, device_config: DeviceConfig,
             # NOTE(woosuk): For accurate performance evaluation, we assign
             # random values to the weights.
             initialize_dummy_weights(model)
+        elif model_config.load_format == "sharded":
+            _load_sharded_state(model, model_config.model)
         else:
             # Load the weights from the cached or downloaded files.
             model.load_weights(model_config.model, model_config.download_dir,
                                model_config.load_format, model_config.revision)
     return model.eval()
+
+
+def save_sharded_state(model: nn.Module, path: str) -> None:
+    """Saves the weights of the tensor parallel worker to a sharded
+    checkpoint, which is loaded with load_format="sharded".
+
+    The weights are saved as they are used by the worker: renamed, fused,
+    sharded and repacked by the quantization method. Each worker writes a
+    single file, which is memory-mapped and copied into the parameters when
+    it is loaded.
+    """
+    tensors = _get_sharded_state_dict(model)
+    # The state of the weights that is not stored in their tensors, e.g. the
+    # GPTQ weights that were shuffled for the exllama kernels.
+    metadata: Dict[str, str] = {}
+    for name, module in model.named_modules():
+        if hasattr(module, "linear_weights"):
+            state = module.linear_method.get_weights_state(
+                module.linear_weights)
+            if state:
+                metadata[name] = json.dumps(state)
+    os.makedirs(path, exist_ok=True)
+    save_safetensors_file(tensors, os.path.join(path, _get_sharded_file()),
+                          metadata)
+
+
+def _load_sharded_state(model: nn.Module, path: str) -> None:
+    if not os.path.isdir(path):
+        raise ValueError(
+            f"Cannot find the sharded checkpoint {path}. The sharded format "
+            "is only supported for local directories.")
+    st_file = os.path.join(path, _get_sharded_file())
+    if not os.path.exists(st_file):
+        raise ValueError(
+            f"Cannot find {st_file}. The checkpoint may have been saved with "
+            "another tensor parallel size.")
+    loaded_tensors, metadata = load_safetensors_file(st_file)
+    state_dict = _get_sharded_state_dict(model)
+    if loaded_tensors.keys() != state_dict.keys():
+        missing = sorted(state_dict.keys() - loaded_tensors.keys())
+        unexpected = sorted(loaded_tensors.keys() - state_dict.keys())
+        raise ValueError(
+            f"The sharded checkpoint {path} does not match the model. "
+            f"Missing weights: {missing}. Unexpected weights: {unexpected}.")
+    for name, param in state_dict.items():
+        loaded_weight = loaded_tensors[name]
+        if param.shape != loaded_weight.shape:
+            raise ValueError(
+                f"The shape of {name} in the sharded checkpoint is "
+                f"{tuple(loaded_weight.shape)}, but the model expects "
+                f"{tuple(param.shape)}.")
+        param.copy_(loaded_weight)
+    for name, module in model.named_modules():
+        if name in metadata:
+            module.linear_method.set_weights_state(module.linear_weights,
+                                                   json.loads(metadata[name]))
+
+
+def _get_sharded_file() -> str:
+    return _SHARDED_STATE_FILE.format(
+        rank=get_tensor_model_parallel_rank(),
+        world_size=get_tensor_model_parallel_world_size())
+
+
+def _get_sharded_state_dict(model: nn.Module) -> Dict[str, torch.Tensor]:
+    """Returns the state dict of the model without the tensors that share
+    their memory with a previous one, e.g. tied embeddings."""
+    state_dict: Dict[str, torch.Tensor] = {}
+    seen: Set[Tuple[int, torch.Size, torch.dtype]] = set()
+    for name, tensor in model.state_dict().items():
+        key = (tensor.data_ptr(), tensor.shape, tensor.dtype)
+        if tensor.numel() > 0 and key in seen:
+            continue
+        seen.add(key)
+        state_dict[name] = tensor
+    return state_dict
@@ -153,6 +153,9 @@ def broadcast_tensor_dict(
     if world_size == 1:
         return tensor_dict
 
+    # The tensors are on CUDA with NCCL, and on CPU with the other backends.
+    device = ("cuda"
+              if torch.distributed.get_backend(group) == "nccl" else "cpu")
     rank = torch.distributed.get_rank()
     if rank == src:
         assert isinstance(
@@ -161,9 +164,9 @@ def broadcast_tensor_dict(
         metadata_list = []
         for key, value in tensor_dict.items():
             if isinstance(value, torch.Tensor):
-                assert value.is_cuda, (
-                    f"Tensor {key}: {value} is not on cuda. Currently we only "
-                    f"support broadcasting tensors on cuda.")
+                assert value.device.type == device, (
+                    f"Tensor {key}: {value} is not on {device}. The "
+                    f"tensors must be on the device of the backend.")
                 metadata_list.append(
                     (key, TensorMetadata(value.dtype, value.size())))
             else:
@@ -187,7 +190,7 @@ def broadcast_tensor_dict(
             if isinstance(value, TensorMetadata):
                 tensor = torch.empty(value.size,
                                      dtype=value.dtype,
-                                     device="cuda")
+                                     device=device)
                 async_handle = torch.distributed.broadcast(tensor,
                                                            src=src,
                                                            async_op=True,
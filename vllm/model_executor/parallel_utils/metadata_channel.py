@@ -0,0 +1,439 @@
+"""A binary channel for the metadata that the driver worker broadcasts to the
+other workers on every step."""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.distributed import ProcessGroup
+
+# Tags of the values in the header.
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_STR = 4
+_INT_LIST = 5
+_INT_DICT = 6
+_INT_LIST_DICT = 7
+_EMPTY_SET = 8
+# An integer tensor in the payload.
+_TENSOR = 9
+# A table in the payload.
+_TABLE = 10
+# A table patched from the previous table of its key.
+_TABLE_DELTA = 11
+# A tensor that is not an integer tensor, broadcast on its own.
+_RAW_TENSOR = 12
+# Any other value, pickled with the other objects of the step.
+_OBJECT = 13
+
+# The kinds of the values sent in the header, by their exact type. The
+# subclasses, e.g. enums deriving from int, are pickled instead.
+_HOST_KINDS = {
+    bool: "bool",
+    int: "int",
+    str: "str",
+    list: "list",
+    dict: "dict",
+    set: "set",
+}
+
+_DTYPES = [
+    torch.int64, torch.int32, torch.int16, torch.int8, torch.uint8, torch.bool,
+    torch.float64, torch.float32, torch.float16, torch.bfloat16
+]
+_DTYPE_CODES = {dtype: code for code, dtype in enumerate(_DTYPES)}
+_INT_DTYPES = {
+    torch.int64, torch.int32, torch.int16, torch.int8, torch.uint8, torch.bool
+}
+
+# The header fields before the values: the length of the header, the total
+# length of the message, the schema of the keys and whether objects follow.
+_HEADER_FIELDS = 4
+# Number of elements copied to the host before the length of the header is
+# known.
+_HEADER_PREFETCH = 512
+
+
+def _is_int_list(value: Any) -> bool:
+    return all(_HOST_KINDS.get(type(v)) == "int" for v in value)
+
+
+def _is_int_dict(value: Dict[Any, Any]) -> bool:
+    return _is_int_list(value) and _is_int_list(value.values())
+
+
+def _is_int_list_dict(value: Dict[Any, Any]) -> bool:
+    return _is_int_list(value) and all(
+        _HOST_KINDS.get(type(v)) == "list" and _is_int_list(v)
+        for v in value.values())
+
+
+class MetadataChannel:
+    """Broadcasts the metadata of the steps from the source worker.
+
+    The metadata of a step is a dictionary whose values are mostly integers,
+    integer lists and dictionaries and small integer tensors. Instead of
+    pickling the dictionary and broadcasting every tensor on its own, the
+    source worker packs the metadata into a preallocated flat int64 buffer,
+    i.e. a header with the tags and the host values, followed by the tensors,
+    which is sent with a single broadcast. Messages larger than the capacity
+    of the buffer are completed with a second broadcast.
+
+    The keys of the dictionaries are sent once per schema, i.e. set of keys.
+    Values of other types, e.g. LoRA requests, are pickled and sent with
+    broadcast_object_list, which is skipped when a step has none of them.
+
+    The 2D host tables of delta_keys, e.g. the block tables of decoding
+    batches, are sent as a delta from the previous table of the key, which
+    all the workers hold: each row is gathered from a previous row, matched
+    by its first entry, and the entries that differ are patched. The rows of
+    the decoding sequences keep their first block, and only their last
+    blocks change. The tables of delta_keys that are device tensors are sent
+    like the other tensors.
+
+    The tensors are received on the device of the backend of the group, i.e.
+    CUDA for NCCL and CPU otherwise. Every call must be matched by a call on
+    all the workers of the group, and the source worker must use the same
+    channel for all its messages.
+    """
+
+    def __init__(
+        self,
+        delta_keys: Sequence[str] = (),
+        capacity: int = 4096,
+        src: int = 0,
+        group: Optional[ProcessGroup] = None,
+    ) -> None:
+        assert capacity > _HEADER_FIELDS
+        self.delta_keys = frozenset(delta_keys)
+        self.capacity = capacity
+        self.src = src
+        self.group = group
+
+        # Allocated on the first broadcast, once the group is initialized.
+        self._device: Optional[torch.device] = None
+        self._buffer: Optional[torch.Tensor] = None
+        # Host buffer for the header, and the whole message on the source
+        # worker. Same as the buffer on CPU.
+        self._host_buffer: Optional[torch.Tensor] = None
+        self._host_array: Optional[np.ndarray] = None
+        # Event recorded after the copy of the host buffer to the device,
+        # which must be done before it is overwritten.
+        self._copy_done: Optional[torch.cuda.Event] = None
+
+        self._schemas: List[Tuple[str, ...]] = []
+        self._schema_ids: Dict[Tuple[str, ...], int] = {}
+        # The previous table of each of the delta_keys, on the host on the
+        # source worker and on the device on the other workers.
+        self._tables: Dict[str, Any] = {}
+
+    def _init_buffers(self) -> None:
+        group = self.group or torch.distributed.group.WORLD
+        if torch.distributed.get_backend(group) == "nccl":
+            self._device = torch.device("cuda", torch.cuda.current_device())
+        else:
+            self._device = torch.device("cpu")
+        self._reserve(self.capacity)
+
+    def _reserve(self, size: int) -> None:
+        """Grows the buffers to hold size elements, keeping their
+        content."""
+        if self._buffer is not None and self._buffer.numel() >= size:
+            return
+        if self._buffer is not None:
+            size = max(size, 2 * self._buffer.numel())
+        buffer = torch.zeros(size, dtype=torch.int64, device=self._device)
+        if self._device.type == "cpu":
+            host_buffer = buffer
+        else:
+            host_buffer = torch.zeros(size, dtype=torch.int64, pin_memory=True)
+        if self._buffer is not None:
+            buffer[:self._buffer.numel()].copy_(self._buffer)
+            host_buffer[:self._host_buffer.numel()].copy_(self._host_buffer)
+        self._buffer = buffer
+        self._host_buffer = host_buffer
+        self._host_array = host_buffer.numpy()
+
+    def broadcast(self,
+                  data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Broadcasts data from the source worker and returns it.
+
+        The tensors returned to the other workers are not views of the buffer
+        and may be kept. The source worker gets back its data.
+        """
+        group = self.group or torch.distributed.group.WORLD
+        # Bypass the channel if we are using only 1 GPU.
+        if torch.distributed.get_world_size(group=group) == 1:
+            return data
+        if self._buffer is None:
+            self._init_buffers()
+        if torch.distributed.get_rank() == self.src:
+            assert isinstance(data, dict), (f"Expecting a dictionary, got "
+                                            f"{type(data)}")
+            self._send(data, group)
+            return data
+        return self._recv(group)
+
+    def _send(self, data: Dict[str, Any], group: ProcessGroup) -> None:
+        keys = tuple(data)
+        schema_id = self._schema_ids.get(keys)
+        objects: List[Any] = []
+        if schema_id is None:
+            schema_id = len(self._schemas)
+            self._schemas.append(keys)
+            self._schema_ids[keys] = schema_id
+            objects.append(keys)
+
+        header = [0, 0, schema_id, 0]
+        # The payloads, with their offsets from the end of the header.
+        payloads: List[Tuple[int, Any]] = []
+        payload_len = 0
+        raw_tensors: List[torch.Tensor] = []
+
+        def add_payload(value: Any) -> int:
+            nonlocal payload_len
+            offset = payload_len
+            payloads.append((offset, value))
+            payload_len += value.numel() if isinstance(
+                value, torch.Tensor) else value.size
+            return offset
+
+        for key, value in data.items():
+            kind = _HOST_KINDS.get(type(value))
+            if value is None:
+                header.append(_NONE)
+            elif kind == "bool":
+                header.append(_TRUE if value else _FALSE)
+            elif kind == "int":
+                header += (_INT, value)
+            elif kind == "str":
+                encoded = value.encode()
+                header += (_STR, len(encoded))
+                header += encoded
+            elif kind == "list" and _is_int_list(value):
+                header += (_INT_LIST, len(value))
+                header += value
+            elif kind == "dict" and _is_int_dict(value):
+                header += (_INT_DICT, len(value))
+                for item in value.items():
+                    header += item
+            elif kind == "dict" and _is_int_list_dict(value):
+                header += (_INT_LIST_DICT, len(value))
+                for k, v in value.items():
+                    header += (k, len(v))
+                    header += v
+            elif kind == "set" and not value:
+                header.append(_EMPTY_SET)
+            elif isinstance(value, (np.ndarray, torch.Tensor)):
+                if isinstance(value, np.ndarray):
+                    value = torch.from_numpy(value)
+                dtype_code = _DTYPE_CODES[value.dtype]
+                if value.dtype not in _INT_DTYPES:
+                    header += (_RAW_TENSOR, dtype_code, value.dim())
+                    header += value.shape
+                    raw_tensors.append(value)
+                elif (key in self.delta_keys and value.dim() == 2
+                      and not value.is_cuda):
+                    table = value.numpy()
+                    delta = _diff_table(self._tables.get(key), table)
+                    rows, cols = table.shape
+                    if delta is None:
+                        offset = add_payload(table)
+                        header += (_TABLE, dtype_code, offset, rows, cols)
+                    else:
+                        src_rows, positions, values = delta
+                        offset = add_payload(src_rows)
+                        add_payload(positions)
+                        add_payload(values)
+                        header += (_TABLE_DELTA, dtype_code, offset, rows,
+                                   cols, positions.size)
+                    self._tables[key] = table.copy()
+                else:
+                    offset = add_payload(value)
+                    header += (_TENSOR, dtype_code, offset, value.dim())
+                    header += value.shape
+            else:
+                header.append(_OBJECT)
+                objects.append(value)
+
+        header_len = len(header)
+        total_len = header_len + payload_len
+        header[0] = header_len
+        header[1] = total_len
+        header[3] = int(bool(objects))
+
+        if self._copy_done is not None:
+            self._copy_done.synchronize()
+            self._copy_done = None
+        self._reserve(total_len)
+        host_array = self._host_array
+        host_array[:header_len] = header
+        device_payloads = []
+        for offset, value in payloads:
+            start = header_len + offset
+            if isinstance(value, torch.Tensor) and value.is_cuda:
+                device_payloads.append((start, value))
+                continue
+            if isinstance(value, torch.Tensor):
+                value = value.numpy()
+            host_array[start:start + value.size] = value.ravel()
+
+        buffer = self._buffer
+        if self._device.type != "cpu":
+            buffer[:total_len].copy_(self._host_buffer[:total_len],
+                                     non_blocking=True)
+            self._copy_done = torch.cuda.Event()
+            self._copy_done.record()
+        for start, value in device_payloads:
+            buffer[start:start + value.numel()].copy_(value.reshape(-1))
+
+        torch.distributed.broadcast(buffer[:self.capacity],
+                                    src=self.src,
+                                    group=group)
+        if total_len > self.capacity:
+            torch.distributed.broadcast(buffer[self.capacity:total_len],
+                                        src=self.src,
+                                        group=group)
+        if objects:
+            torch.distributed.broadcast_object_list([objects],
+                                                    src=self.src,
+                                                    group=group)
+        for tensor in raw_tensors:
+            torch.distributed.broadcast(tensor.to(self._device),
+                                        src=self.src,
+                                        group=group)
+
+    def _read_host(self, start: int, end: int) -> np.ndarray:
+        if self._device.type != "cpu":
+            self._host_buffer[start:end].copy_(self._buffer[start:end])
+        return self._host_array[start:end]
+
+    def _recv(self, group: ProcessGroup) -> Dict[str, Any]:
+        capacity = self.capacity
+        torch.distributed.broadcast(self._buffer[:capacity],
+                                    src=self.src,
+                                    group=group)
+        prefix = self._read_host(0, min(_HEADER_PREFETCH, capacity))
+        header_len, total_len, schema_id, has_objects = (
+            int(v) for v in prefix[:_HEADER_FIELDS])
+        if total_len > capacity:
+            self._reserve(total_len)
+            torch.distributed.broadcast(self._buffer[capacity:total_len],
+                                        src=self.src,
+                                        group=group)
+        if header_len > len(prefix):
+            self._read_host(len(prefix), header_len)
+        header = self._host_array[:header_len].tolist()
+
+        objects: List[Any] = []
+        if has_objects:
+            recv_objects = [None]
+            torch.distributed.broadcast_object_list(recv_objects,
+                                                    src=self.src,
+                                                    group=group)
+            objects = recv_objects[0]
+        if schema_id == len(self._schemas):
+            self._schemas.append(objects[0])
+            objects = objects[1:]
+        keys = self._schemas[schema_id]
+        objects.reverse()
+
+        buffer = self._buffer
+        data: Dict[str, Any] = {}
+        pos = _HEADER_FIELDS
+        for key in keys:
+            tag = header[pos]
+            pos += 1
+            if tag == _NONE:
+                value = None
+            elif tag in (_FALSE, _TRUE):
+                value = tag == _TRUE
+            elif tag == _INT:
+                value = header[pos]
+                pos += 1
+            elif tag == _STR:
+                length = header[pos]
+                value = bytes(header[pos + 1:pos + 1 + length]).decode()
+                pos += 1 + length
+            elif tag == _INT_LIST:
+                length = header[pos]
+                value = header[pos + 1:pos + 1 + length]
+                pos += 1 + length
+            elif tag == _INT_DICT:
+                length = header[pos]
+                items = header[pos + 1:pos + 1 + 2 * length]
+                value = dict(zip(items[::2], items[1::2]))
+                pos += 1 + 2 * length
+            elif tag == _INT_LIST_DICT:
+                length = header[pos]
+                pos += 1
+                value = {}
+                for _ in range(length):
+                    k, num_items = header[pos], header[pos + 1]
+                    value[k] = header[pos + 2:pos + 2 + num_items]
+                    pos += 2 + num_items
+            elif tag == _EMPTY_SET:
+                value = set()
+            elif tag == _TENSOR:
+                dtype = _DTYPES[header[pos]]
+                start = header_len + header[pos + 1]
+                ndim = header[pos + 2]
+                shape = header[pos + 3:pos + 3 + ndim]
+                pos += 3 + ndim
+                numel = int(np.prod(shape))
+                value = buffer[start:start + numel].view(shape).to(dtype,
+                                                                   copy=True)
+            elif tag in (_TABLE, _TABLE_DELTA):
+                dtype = _DTYPES[header[pos]]
+                start = header_len + header[pos + 1]
+                rows, cols = header[pos + 2], header[pos + 3]
+                pos += 4
+                if tag == _TABLE:
+                    value = buffer[start:start + rows * cols].view(
+                        rows, cols).to(dtype, copy=True)
+                else:
+                    num_patches = header[pos]
+                    pos += 1
+                    src_rows = buffer[start:start + rows]
+                    start += rows
+                    positions = buffer[start:start + num_patches]
+                    values = buffer[start + num_patches:start +
+                                    2 * num_patches]
+                    value = self._tables[key].index_select(0, src_rows)
+                    value.view(-1).index_copy_(0, positions, values.to(dtype))
+                self._tables[key] = value
+            elif tag == _RAW_TENSOR:
+                dtype = _DTYPES[header[pos]]
+                ndim = header[pos + 1]
+                shape = header[pos + 2:pos + 2 + ndim]
+                pos += 2 + ndim
+                value = torch.empty(shape, dtype=dtype, device=self._device)
+                torch.distributed.broadcast(value, src=self.src, group=group)
+            else:
+                assert tag == _OBJECT, f"Invalid tag {tag}"
+                value = objects.pop()
+            data[key] = value
+        return data
+
+
+def _diff_table(
+        base: Optional[np.ndarray], table: np.ndarray
+) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Returns the rows of base to gather, and the positions and values of
+    the entries to patch to get table, or None if sending table is
+    cheaper."""
+    rows, cols = table.shape
+    if (base is None or base.shape[1] != cols or base.dtype != table.dtype
+            or len(base) == 0 or rows == 0 or cols == 0):
+        return None
+    # Match the rows by their first entry. Rows without a match are gathered
+    # from any row and patched.
+    base_first = base[:, 0]
+    order = np.argsort(base_first, kind="stable")
+    index = np.searchsorted(base_first[order], table[:, 0])
+    src_rows = order[np.minimum(index, len(base) - 1)]
+    positions = np.flatnonzero(base[src_rows] != table)
+    if rows + 2 * positions.size >= rows * cols:
+        return None
+    return src_rows, positions, table.ravel()[positions]
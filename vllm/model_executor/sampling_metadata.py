@@ -73,8 +73,13 @@ class SamplingTensors:
     sampling_seeds: torch.Tensor
     sample_indices: torch.Tensor
     extra_seeds: Optional[torch.Tensor]
-    prompt_tokens: torch.Tensor
-    output_tokens: torch.Tensor
+    # Padded with vocab_size. None if the penalty counts below are given.
+    prompt_tokens: Optional[torch.Tensor]
+    output_tokens: Optional[torch.Tensor]
+    # [batch_size, vocab_size] mask of the prompt tokens and bin counts of
+    # the output tokens, if kept across steps.
+    prompt_mask: Optional[torch.Tensor] = None
+    output_bin_counts: Optional[torch.Tensor] = None
 
     @classmethod
     def from_sampling_metadata(
@@ -354,3 +359,313 @@ class SamplingTensors:
             # For the kernel, seed == 0 means greedy decoding.
             seq_seeds = [0] * seeds_to_generate
         return seq_seeds
+
+
+def _do_penalties(sampling_params: SamplingParams) -> bool:
+    return (abs(sampling_params.presence_penalty) >= _SAMPLING_EPS
+            or abs(sampling_params.frequency_penalty) >= _SAMPLING_EPS
+            or abs(sampling_params.repetition_penalty - 1.0) >= _SAMPLING_EPS)
+
+
+@dataclass
+class _SequenceSamplingState:
+    """Rows of a sequence in the SamplingTensorsCache."""
+    row: int
+    # The values of the sampling parameters written in the row.
+    params: Tuple[float, ...]
+    # Row of the penalty counts. 0 (all zeros) without penalties.
+    counts_row: int = 0
+    # Number of output tokens counted in the counts row.
+    num_output_tokens: int = 0
+
+
+class SamplingTensorsCache:
+    """Builds the SamplingTensors incrementally across steps.
+
+    The sampling parameters of the sequences are kept on the device, with
+    one row per sequence that is written when the sequence joins the batch
+    or the values of its sampling parameters change. For the sequences with
+    penalties, the mask of the prompt tokens and the bin counts of the
+    output tokens are kept on the device as well, and only the new output
+    tokens are counted at every step. So the penalties cost
+    O(batch_size * vocab_size) per step, regardless of the sequence lengths.
+    A step copies the rows of every sequence in the batch to the device
+    (unless the batch is unchanged) and gathers the SamplingTensors from the
+    rows.
+
+    A sequence that is not in the batch of a step gives up its rows. Batches
+    with prompt logprobs and batches that sample a sequence twice are built
+    from scratch with SamplingTensors.from_sampling_metadata().
+    """
+
+    # Columns of the float parameters.
+    _TEMPERATURE, _TOP_P, _MIN_P, _PRESENCE, _FREQUENCY, _REPETITION = range(6)
+
+    def __init__(self) -> None:
+        self.seq_states: Dict[int, _SequenceSamplingState] = {}
+        self.free_rows: List[int] = []
+        self.free_counts_rows: List[int] = []
+        self.vocab_size: Optional[int] = None
+        self.device: Optional[torch.device] = None
+        self.dtype: Optional[torch.dtype] = None
+
+        self.params: Optional[torch.Tensor] = None
+        self.top_ks: Optional[torch.Tensor] = None
+        # Only allocated for the sequences with penalties. Row 0 stays zero
+        # for the sequences without penalties.
+        self.prompt_mask: Optional[torch.Tensor] = None
+        self.output_bin_counts: Optional[torch.Tensor] = None
+
+        # Rows of the last batch and their device tensor.
+        self._rows: List[int] = []
+        self._rows_t: Optional[torch.Tensor] = None
+
+    def _reset(self, vocab_size: int, device: torch.device,
+               dtype: torch.dtype) -> None:
+        self.seq_states.clear()
+        self.free_rows.clear()
+        self.free_counts_rows.clear()
+        self.vocab_size = vocab_size
+        self.device = device
+        self.dtype = dtype
+        self.params = torch.empty((0, 6), dtype=dtype, device=device)
+        self.top_ks = torch.empty(0, dtype=torch.int, device=device)
+        self.prompt_mask = torch.zeros((1, vocab_size),
+                                       dtype=torch.bool,
+                                       device=device)
+        self.output_bin_counts = torch.zeros((1, vocab_size),
+                                             dtype=torch.int,
+                                             device=device)
+        self._rows = []
+        self._rows_t = None
+
+    @staticmethod
+    def _grow(tensor: torch.Tensor, num_rows: int) -> torch.Tensor:
+        grown = torch.zeros((num_rows, ) + tuple(tensor.shape[1:]),
+                            dtype=tensor.dtype,
+                            device=tensor.device)
+        grown[:tensor.shape[0]] = tensor
+        return grown
+
+    def _grow_rows(self, num_rows: int) -> None:
+        old_rows = self.params.shape[0]
+        if num_rows <= old_rows:
+            return
+        num_rows = max(num_rows, 2 * old_rows)
+        self.params = self._grow(self.params, num_rows)
+        self.top_ks = self._grow(self.top_ks, num_rows)
+        self.free_rows.extend(range(num_rows - 1, old_rows - 1, -1))
+
+    def _grow_counts_rows(self, num_rows: int) -> None:
+        """Grows the counts to at least num_rows allocatable rows.
+
+        The counts are vocab-sized, so they are grown to the rows needed by
+        the batch rather than doubled. The profiling run of the model runner
+        samples its batch with penalties, so the rows of max_num_seqs
+        sequences are allocated before the KV cache is sized.
+        """
+        # Row 0 is not allocated.
+        old_rows = self.output_bin_counts.shape[0]
+        if num_rows + 1 <= old_rows:
+            return
+        num_rows += 1
+        self.prompt_mask = self._grow(self.prompt_mask, num_rows)
+        self.output_bin_counts = self._grow(self.output_bin_counts, num_rows)
+        self.free_counts_rows.extend(range(num_rows - 1, old_rows - 1, -1))
+
+    def get_sampling_tensors(
+        self,
+        sampling_metadata: "SamplingMetadata",
+        vocab_size: int,
+        device: torch.device,
+        dtype: torch.dtype,
+    ) -> Tuple["SamplingTensors", bool, bool, bool]:
+        """Same as SamplingTensors.from_sampling_metadata(), reusing the
+        state of the previous steps."""
+        seq_groups = sampling_metadata.seq_groups
+        num_prompts = sampling_metadata.num_prompts
+        seq_ids = [
+            seq_id for seq_group_ids, _ in seq_groups
+            for seq_id in seq_group_ids
+        ]
+        active = set(seq_ids)
+        if len(active) != len(seq_ids) or any(
+                sampling_params.prompt_logprobs is not None
+                for _, sampling_params in seq_groups[:num_prompts]):
+            return SamplingTensors.from_sampling_metadata(
+                sampling_metadata, vocab_size, device, dtype)
+
+        if (vocab_size, device, dtype) != (self.vocab_size, self.device,
+                                           self.dtype):
+            self._reset(vocab_size, device, dtype)
+        for seq_id in [s for s in self.seq_states if s not in active]:
+            state = self.seq_states.pop(seq_id)
+            self.free_rows.append(state.row)
+            if state.counts_row:
+                self.free_counts_rows.append(state.counts_row)
+        self._grow_rows(len(active))
+        self._grow_counts_rows(
+            sum(
+                len(seq_group_ids)
+                for seq_group_ids, sampling_params in seq_groups
+                if _do_penalties(sampling_params)))
+
+        pin_memory = is_pin_memory_available()
+        seeds_to_generate = get_num_triton_sampler_splits(vocab_size)
+        rows: List[int] = []
+        counts_rows: List[int] = []
+        new_rows: List[int] = []
+        new_params: List[List[float]] = []
+        new_top_ks: List[int] = []
+        new_counts_rows: List[int] = []
+        # Flattened (counts row, token id) of the tokens to add to the
+        # prompt mask and the output bin counts.
+        prompt_rows: List[int] = []
+        prompt_token_ids: List[int] = []
+        output_rows: List[int] = []
+        output_token_ids: List[int] = []
+        sampling_seeds: List[List[int]] = []
+        sample_indices: List[int] = []
+        do_penalties = False
+        do_top_p_top_k = False
+        do_min_p = False
+
+        sample_indices_start_idx = 0
+        for seq_group_ids, sampling_params in seq_groups:
+            is_greedy = sampling_params.sampling_type == SamplingType.GREEDY
+            top_k = min(sampling_params.top_k, vocab_size)
+            top_k = vocab_size if top_k == -1 else top_k
+            if (sampling_params.top_p < 1.0 - _SAMPLING_EPS
+                    or top_k != vocab_size):
+                do_top_p_top_k = True
+            if sampling_params.min_p > _SAMPLING_EPS:
+                do_min_p = True
+            group_do_penalties = _do_penalties(sampling_params)
+            do_penalties |= group_do_penalties
+            temperature = sampling_params.temperature
+            if temperature < _SAMPLING_EPS:
+                # NOTE: Zero temperature means deterministic sampling
+                # (i.e., greedy sampling or beam search).
+                # Set the temperature to 1 to avoid division by zero.
+                temperature = 1.0
+            # The rows are matched by value, so that they are rewritten even
+            # if the parameters of a sequence are changed in place.
+            group_params = (temperature, sampling_params.top_p,
+                            sampling_params.min_p,
+                            sampling_params.presence_penalty,
+                            sampling_params.frequency_penalty,
+                            sampling_params.repetition_penalty, top_k)
+
+            for seq_id in seq_group_ids:
+                seq_data = sampling_metadata.seq_data[seq_id]
+                state = self.seq_states.get(seq_id)
+                if state is None or state.params != group_params:
+                    if state is None:
+                        state = _SequenceSamplingState(self.free_rows.pop(),
+                                                       group_params)
+                        self.seq_states[seq_id] = state
+                    else:
+                        state.params = group_params
+                        state.num_output_tokens = 0
+                    new_rows.append(state.row)
+                    new_params.append(group_params[:6])
+                    new_top_ks.append(top_k)
+                    if group_do_penalties and not state.counts_row:
+                        if not self.free_counts_rows:
+                            # The rows of the sequences that drop their
+                            # penalties in this step are not freed yet.
+                            self._grow_counts_rows(
+                                self.output_bin_counts.shape[0])
+                        state.counts_row = self.free_counts_rows.pop()
+                    elif not group_do_penalties and state.counts_row:
+                        self.free_counts_rows.append(state.counts_row)
+                        state.counts_row = 0
+                    if state.counts_row:
+                        new_counts_rows.append(state.counts_row)
+                        prompt_rows.extend([state.counts_row] *
+                                           seq_data.get_prompt_len())
+                        prompt_token_ids.extend(seq_data.prompt_token_ids)
+                if state.counts_row:
+                    num_output_tokens = seq_data.get_output_len()
+                    if num_output_tokens > state.num_output_tokens:
+                        output_rows.extend(
+                            [state.counts_row] *
+                            (num_output_tokens - state.num_output_tokens))
+                        output_token_ids.extend(
+                            seq_data.output_token_ids[state.
+                                                      num_output_tokens:])
+                        state.num_output_tokens = num_output_tokens
+                rows.append(state.row)
+                counts_rows.append(state.counts_row)
+                sampling_seeds.append(
+                    SamplingTensors._get_sequence_seeds(
+                        sampling_params.seed,
+                        seq_data.get_len(),
+                        seq_id,
+                        seeds_to_generate=seeds_to_generate,
+                        is_greedy=is_greedy))
+                sample_indices.append(sample_indices_start_idx)
+                sample_indices_start_idx += 1
+
+        def to_device(data: list, data_type: torch.dtype) -> torch.Tensor:
+            return torch.tensor(data,
+                                dtype=data_type,
+                                device="cpu",
+                                pin_memory=pin_memory).to(device=device,
+                                                          non_blocking=True)
+
+        # Write the rows of the new sequences, and count the new tokens.
+        if new_rows:
+            new_rows_t = to_device(new_rows, torch.long)
+            self.params[new_rows_t] = to_device(new_params, dtype)
+            self.top_ks[new_rows_t] = to_device(new_top_ks, torch.int)
+        if new_counts_rows:
+            new_counts_rows_t = to_device(new_counts_rows, torch.long)
+            self.prompt_mask[new_counts_rows_t] = False
+            self.output_bin_counts[new_counts_rows_t] = 0
+        if prompt_rows:
+            prompt_t = to_device([prompt_rows, prompt_token_ids], torch.long)
+            self.prompt_mask[prompt_t[0], prompt_t[1]] = True
+        if output_rows:
+            output_t = to_device([output_rows, output_token_ids], torch.long)
+            self.output_bin_counts.index_put_((output_t[0], output_t[1]),
+                                              torch.ones_like(output_t[1],
+                                                              dtype=torch.int),
+                                              accumulate=True)
+
+        if rows + counts_rows != self._rows:
+            self._rows = rows + counts_rows
+            self._rows_t = to_device([rows, counts_rows], torch.long)
+        rows_t, counts_rows_t = self._rows_t
+
+        params = self.params.index_select(0, rows_t).t().contiguous()
+        if do_penalties:
+            prompt_mask = self.prompt_mask.index_select(0, counts_rows_t)
+            output_bin_counts = self.output_bin_counts.index_select(
+                0, counts_rows_t)
+        else:
+            prompt_mask = None
+            output_bin_counts = None
+        # [batch_size, n_seeds] -> [n_seeds, batch_size]
+        sampling_seeds_t = torch.tensor(sampling_seeds,
+                                        device="cpu",
+                                        dtype=torch.long,
+                                        pin_memory=pin_memory).T.contiguous()
+        sampling_tensors = SamplingTensors(
+            temperatures=params[self._TEMPERATURE],
+            top_ps=params[self._TOP_P],
+            top_ks=self.top_ks.index_select(0, rows_t),
+            min_ps=params[self._MIN_P],
+            presence_penalties=params[self._PRESENCE],
+            frequency_penalties=params[self._FREQUENCY],
+            repetition_penalties=params[self._REPETITION],
+            sampling_seeds=sampling_seeds_t.to(device=device,
+                                               non_blocking=True),
+            sample_indices=to_device(sample_indices, torch.long),
+            extra_seeds=None,
+            prompt_tokens=None,
+            output_tokens=None,
+            prompt_mask=prompt_mask,
+            output_bin_counts=output_bin_counts,
+        )
+        return sampling_tensors, do_penalties, do_top_p_top_k, do_min_p
@@ -2,16 +2,20 @@
 import fnmatch
 import glob
 import hashlib
+import itertools
 import json
+import math
+import mmap
 import os
-from collections import defaultdict
-from typing import Any, Iterator, List, Optional, Tuple
+import struct
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
 
 import filelock
-import numpy as np
 import torch
 from huggingface_hub import HfFileSystem, snapshot_download
-from safetensors.torch import load_file, safe_open, save_file
+from safetensors.torch import load_file, save_file
 from tqdm.auto import tqdm
 
 from vllm.config import ModelConfig
@@ -28,6 +32,30 @@ logger = init_logger(__name__)
 temp_dir = os.environ.get('TMPDIR') or os.environ.get(
     'TEMP') or os.environ.get('TMP') or "/tmp/"
 
+# The dtypes of the safetensors format.
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "F8_E4M3": torch.float8_e4m3fn,
+    "F8_E5M2": torch.float8_e5m2,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+_SAFETENSORS_DTYPE_NAMES = {
+    dtype: name
+    for name, dtype in _SAFETENSORS_DTYPES.items()
+}
+
+# The files of the npcache store, in the np folder of the model.
+_NPCACHE_DATA_FILE = "weights.data"
+_NPCACHE_INDEX_FILE = "weights.json"
+
 
 class Disabledtqdm(tqdm):
 
@@ -220,6 +248,7 @@ def hf_model_weights_iterator(
     load_format: str = "auto",
     revision: Optional[str] = None,
     fall_back_to_pt: Optional[bool] = True,
+    max_workers: int = 4,
 ) -> Iterator[Tuple[str, torch.Tensor]]:
     hf_folder, hf_weights_files, use_safetensors = prepare_hf_model_weights(
         model_name_or_path,
@@ -232,40 +261,19 @@ def hf_model_weights_iterator(
         # Currently np_cache only support *.bin checkpoints
         assert use_safetensors is False
 
-        # Convert the model weights from torch tensors to numpy arrays for
-        # faster loading.
+        # Convert the model weights to a single memory-mapped file, which
+        # is shared by the workers of a node.
         np_folder = os.path.join(hf_folder, "np")
         os.makedirs(np_folder, exist_ok=True)
-        weight_names_file = os.path.join(np_folder, "weight_names.json")
+        index_file = os.path.join(np_folder, _NPCACHE_INDEX_FILE)
         # Use file lock to prevent multiple processes from
-        # dumping the same model weights to numpy at the same time.
+        # dumping the same model weights at the same time.
         with get_lock(model_name_or_path, cache_dir):
-            if not os.path.exists(weight_names_file):
-                weight_names = []
-                for bin_file in hf_weights_files:
-                    state = torch.load(bin_file, map_location="cpu")
-                    for name, param in state.items():
-                        param_path = os.path.join(np_folder, name)
-                        with open(param_path, "wb") as f:
-                            np.save(f, param.cpu().detach().numpy())
-                        weight_names.append(name)
-                with open(weight_names_file, "w") as f:
-                    json.dump(weight_names, f)
-
-        with open(weight_names_file, "r") as f:
-            weight_names = json.load(f)
-
-        for name in weight_names:
-            param_path = os.path.join(np_folder, name)
-            with open(param_path, "rb") as f:
-                param = np.load(f)
-            yield name, torch.from_numpy(param)
+            if not os.path.exists(index_file):
+                _save_npcache(hf_weights_files, np_folder)
+        yield from _npcache_weights_iterator(np_folder)
     elif use_safetensors:
-        for st_file in hf_weights_files:
-            with safe_open(st_file, framework="pt") as f:
-                for name in f.keys():  # noqa: SIM118
-                    param = f.get_tensor(name)
-                    yield name, param
+        yield from _safetensors_weights_iterator(hf_weights_files, max_workers)
     else:
         for bin_file in hf_weights_files:
             state = torch.load(bin_file, map_location="cpu")
@@ -275,6 +283,187 @@ def hf_model_weights_iterator(
             torch.cuda.empty_cache()
 
 
+def _save_npcache(hf_weights_files: List[str], np_folder: str) -> None:
+    """Writes the tensors of pytorch bin files to a single data file. Each
+    tensor starts at a page, so that it can be mapped on its own."""
+    index: Dict[str, Dict[str, Any]] = {}
+    data_file = os.path.join(np_folder, _NPCACHE_DATA_FILE)
+    with open(data_file + ".tmp", "wb") as f:
+        for bin_file in hf_weights_files:
+            state = torch.load(bin_file, map_location="cpu")
+            for name, param in state.items():
+                f.write(b"\0" * (-f.tell() % mmap.ALLOCATIONGRANULARITY))
+                index[name] = {
+                    "dtype": _SAFETENSORS_DTYPE_NAMES[param.dtype],
+                    "shape": list(param.shape),
+                    "offset": f.tell(),
+                }
+                f.write(_get_tensor_bytes(param))
+            del state
+    os.replace(data_file + ".tmp", data_file)
+    # The index is written last, since the store is complete once it exists.
+    index_file = os.path.join(np_folder, _NPCACHE_INDEX_FILE)
+    with open(index_file + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_file + ".tmp", index_file)
+
+
+def _npcache_weights_iterator(
+        np_folder: str) -> Iterator[Tuple[str, torch.Tensor]]:
+    """Iterates over the tensors of the npcache store.
+
+    Each tensor is a view of its own mapping of the data file, so that its
+    pages are unmapped as soon as it is freed.
+    """
+    with open(os.path.join(np_folder, _NPCACHE_INDEX_FILE), "r") as f:
+        index = json.load(f)
+    with open(os.path.join(np_folder, _NPCACHE_DATA_FILE), "rb") as f:
+        for name, info in index.items():
+            dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+            shape = info["shape"]
+            nbytes = math.prod(shape) * _get_element_size(dtype)
+            if nbytes == 0:
+                yield name, torch.empty(shape, dtype=dtype)
+                continue
+            mm = mmap.mmap(f.fileno(),
+                           nbytes,
+                           offset=info["offset"],
+                           access=mmap.ACCESS_COPY)
+            yield name, _get_mmap_tensor(mm, 0, nbytes, dtype, shape)
+
+
+def _open_safetensors_file(
+        st_file: str) -> Tuple[mmap.mmap, int, Dict[str, Any]]:
+    """Memory-maps a safetensors file and reads its header.
+
+    The data of the file is read ahead into the page cache, which is shared
+    by the workers of a node. It is only read into the memory of the process
+    when the tensors are accessed.
+    """
+    with open(st_file, "rb") as f:
+        header_size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        data_offset = 8 + header_size
+        file_size = os.fstat(f.fileno()).st_size
+        if hasattr(os, "posix_fadvise") and file_size > data_offset:
+            os.posix_fadvise(f.fileno(), data_offset, file_size - data_offset,
+                             os.POSIX_FADV_WILLNEED)
+        # A private mapping, so that the weights can be modified in place.
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return mm, data_offset, header
+
+
+def _get_safetensors_tensor(mm: mmap.mmap, data_offset: int,
+                            info: Dict[str, Any]) -> torch.Tensor:
+    """Returns a tensor of a memory-mapped safetensors file without copying
+    it."""
+    start, end = info["data_offsets"]
+    return _get_mmap_tensor(mm, data_offset + start, end - start,
+                            _SAFETENSORS_DTYPES[info["dtype"]], info["shape"])
+
+
+def _get_mmap_tensor(mm: mmap.mmap, offset: int, nbytes: int,
+                     dtype: torch.dtype, shape: List[int]) -> torch.Tensor:
+    if nbytes == 0:
+        return torch.empty(shape, dtype=dtype)
+    data = torch.frombuffer(mm, dtype=torch.uint8, count=nbytes, offset=offset)
+    if offset % _get_element_size(dtype) != 0:
+        # The tensors of the files written by old versions of safetensors
+        # may not be aligned.
+        data = data.clone()
+    return data.view(dtype).view(shape)
+
+
+def _get_element_size(dtype: torch.dtype) -> int:
+    return torch.empty(0, dtype=dtype).element_size()
+
+
+def _get_tensor_bytes(tensor: torch.Tensor) -> memoryview:
+    tensor = tensor.detach().contiguous().reshape(-1)
+    return tensor.view(torch.uint8).cpu().numpy().data
+
+
+def _safetensors_weights_iterator(
+    hf_weights_files: List[str],
+    max_workers: int,
+) -> Iterator[Tuple[str, torch.Tensor]]:
+    """Iterates over the tensors of safetensors files.
+
+    The tensors are views of the memory-mapped files. When a tensor parallel
+    worker slices its shard out of a weight, only the pages of the shard are
+    read. The next max_workers files are opened and read ahead by a thread
+    pool while the tensors of the current one are loaded.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        files = iter(hf_weights_files)
+        futures: Deque[Future] = deque(
+            executor.submit(_open_safetensors_file, st_file)
+            for st_file in itertools.islice(files, max_workers))
+        while futures:
+            mm, data_offset, header = futures.popleft().result()
+            header.pop("__metadata__", None)
+            st_file = next(files, None)
+            if st_file is not None:
+                futures.append(executor.submit(_open_safetensors_file,
+                                               st_file))
+            # Read the tensors in the order of the file.
+            for name, info in sorted(header.items(),
+                                     key=lambda x: x[1]["data_offsets"]):
+                yield name, _get_safetensors_tensor(mm, data_offset, info)
+            # The mapping is closed when its last tensor is freed.
+            del mm
+
+
+def load_safetensors_file(
+        st_file: str) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """Returns the tensors and the metadata of a safetensors file. The
+    tensors are views of the memory-mapped file."""
+    mm, data_offset, header = _open_safetensors_file(st_file)
+    metadata = header.pop("__metadata__", {})
+    tensors = {
+        name: _get_safetensors_tensor(mm, data_offset, info)
+        for name, info in header.items()
+    }
+    return tensors, metadata
+
+
+def save_safetensors_file(
+    tensors: Dict[str, torch.Tensor],
+    st_file: str,
+    metadata: Optional[Dict[str, str]] = None,
+) -> None:
+    """Writes tensors to a safetensors file.
+
+    Unlike safetensors.torch.save_file, the tensors are copied to the CPU and
+    written one at a time, so that the file does not have to fit in the host
+    memory.
+    """
+    # Write the largest dtypes first to keep the tensors aligned.
+    names = sorted(tensors,
+                   key=lambda name: (-tensors[name].element_size(), name))
+    header: Dict[str, Any] = {}
+    if metadata:
+        header["__metadata__"] = metadata
+    offset = 0
+    for name in names:
+        tensor = tensors[name]
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {
+            "dtype": _SAFETENSORS_DTYPE_NAMES[tensor.dtype],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + size],
+        }
+        offset += size
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    # The data starts at a multiple of 8 bytes.
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(st_file, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name in names:
+            f.write(_get_tensor_bytes(tensors[name]))
+
+
 def convert_pyslice_to_tensor(x: Any) -> torch.Tensor:
     """convert PySafeSlice object from safetensors to torch.Tensor
 
@@ -3,7 +3,7 @@ from typing import List, Optional, Union
 
 from vllm.lora.request import LoRARequest
 from vllm.sequence import (PromptLogprobs, RequestMetrics, SampleLogprobs,
-                           SequenceGroup, SequenceStatus)
+                           SequenceGroup, SequenceLogprobs, SequenceStatus)
 
 
 class CompletionOutput:
@@ -16,7 +16,9 @@ class CompletionOutput:
         cumulative_logprob: The cumulative log probability of the generated
             output text.
         logprobs: The log probabilities of the top probability words at each
-            position if the logprobs are requested.
+            position if the logprobs are requested. The engine returns them
+            as a SequenceLogprobs, which creates the dicts and decodes the
+            top tokens when they are accessed.
         finish_reason: The reason why the sequence is finished.
         stop_reason: The stop string or token id that caused the completion
             to stop, None if the completion finished for some other reason
@@ -30,7 +32,7 @@ class CompletionOutput:
         text: str,
         token_ids: List[int],
         cumulative_logprob: float,
-        logprobs: Optional[SampleLogprobs],
+        logprobs: Optional[Union[SampleLogprobs, SequenceLogprobs]],
         finish_reason: Optional[str] = None,
         stop_reason: Union[int, str, None] = None,
         lora_request: Optional[LoRARequest] = None,
@@ -107,14 +109,15 @@ class RequestOutput:
             sorted_seqs = sorted(seqs, key=sorting_key, reverse=True)
             top_n_seqs = sorted_seqs[:n]
 
-        # Create the outputs.
-        # NOTE: We need omit logprobs here explicitly because the sequence
-        # always has the logprobs of the sampled tokens even if the
-        # logprobs are not requested.
+        # Create the outputs. The token ids are copied to lists, since the
+        # views of the sequences are not JSON serializable.
+        # NOTE: We need omit logprobs here explicitly because the sequences
+        # created outside of the engine always record the logprobs of the
+        # sampled tokens even if the logprobs are not requested.
         include_logprobs = seq_group.sampling_params.logprobs is not None
         outputs = [
             CompletionOutput(seqs.index(seq), seq.output_text,
-                             seq.get_output_token_ids(),
+                             seq.get_output_token_ids().tolist(),
                              seq.get_cumulative_logprob(),
                              seq.output_logprobs if include_logprobs else None,
                              SequenceStatus.get_finished_reason(seq.status),
@@ -123,7 +126,7 @@ class RequestOutput:
 
         # Every sequence in the sequence group should have the same prompt.
         prompt = seq_group.prompt
-        prompt_token_ids = seq_group.prompt_token_ids
+        prompt_token_ids = seq_group.prompt_token_ids.tolist()
         prompt_logprobs = seq_group.prompt_logprobs
         finished = seq_group.is_finished()
         finished_time = time.time() if finished else None
@@ -1,31 +1,54 @@
 """Sequence and its related classes."""
+import collections.abc
 import copy
 import enum
+from array import array
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Dict, List, Optional, Union
+from typing import (TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List,
+                    Optional, Tuple, Union)
 
-from vllm.block import LogicalTokenBlock
 from vllm.lora.request import LoRARequest
 from vllm.sampling_params import SamplingParams
 
 if TYPE_CHECKING:
     import torch
 
+    from vllm.engine.stop_checker import StopChecker
     from vllm.spec_decode.metrics import SpecDecodeWorkerMetrics
 
 
-@dataclass
 class Logprob:
     """Infos for supporting OpenAI compatible logprobs and token ranks.
 
+    There is at least one per generated token, so it uses __slots__ instead
+    of being a dataclass.
+
     Attributes:
         logprob: The logprob of chosen token
         rank: The vocab rank of chosen token (>=1)
         decoded_token: The decoded chosen token index
     """
-    logprob: float
-    rank: Optional[int] = None
-    decoded_token: Optional[str] = None
+    __slots__ = ("logprob", "rank", "decoded_token")
+
+    def __init__(
+        self,
+        logprob: float,
+        rank: Optional[int] = None,
+        decoded_token: Optional[str] = None,
+    ) -> None:
+        self.logprob = logprob
+        self.rank = rank
+        self.decoded_token = decoded_token
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Logprob):
+            return NotImplemented
+        return (self.logprob == other.logprob and self.rank == other.rank
+                and self.decoded_token == other.decoded_token)
+
+    def __repr__(self) -> str:
+        return (f"Logprob(logprob={self.logprob}, rank={self.rank}, "
+                f"decoded_token={self.decoded_token!r})")
 
 
 PromptLogprobs = List[Optional[Dict[int, Logprob]]]
@@ -69,6 +92,11 @@ class SequenceStatus(enum.Enum):
         return finish_reason
 
 
+class SequenceStage(enum.Enum):
+    PREFILL = enum.auto()
+    DECODE = enum.auto()
+
+
 @dataclass
 class RequestMetrics:
     """Metrics associated with a request.
@@ -79,6 +107,14 @@ class RequestMetrics:
         first_token_time: The time when the first token was generated.
         time_in_queue: The time the request spent in the queue.
         finished_time: The time when the request was finished.
+        num_swaps: The number of times the request was preempted by swapping
+            its KV cache out to the CPU.
+        num_recomputes: The number of times the request was preempted by
+            freeing its KV cache, to be recomputed when it is rescheduled.
+        time_in_waiting: The time the request spent in the waiting queue,
+            both before it was first scheduled and after being preempted by
+            recomputation.
+        time_in_swapped: The time the request spent swapped out.
     """
     arrival_time: float
     last_token_time: float
@@ -86,11 +122,92 @@ class RequestMetrics:
     first_token_time: Optional[float]
     time_in_queue: Optional[float]
     finished_time: Optional[float] = None
+    num_swaps: int = 0
+    num_recomputes: int = 0
+    time_in_waiting: float = 0.0
+    time_in_swapped: float = 0.0
+
+    @property
+    def num_preemptions(self) -> int:
+        return self.num_swaps + self.num_recomputes
+
+    @property
+    def prefill_time(self) -> Optional[float]:
+        """The time from the first scheduling of the request to its first
+        token."""
+        if self.first_token_time is None or self.first_scheduled_time is None:
+            return None
+        return self.first_token_time - self.first_scheduled_time
+
+
+# The type of the arrays that store the token ids.
+_TOKEN_IDS_TYPECODE = "i"
+
+
+class TokenIds(collections.abc.Sequence):
+    """A read-only view of a range of the token ids of a sequence.
+
+    The token ids of a sequence are stored in an array and only appended,
+    so a view keeps the token ids it was created with, without copying
+    them. It can be used in place of a list of the token ids: it compares
+    equal to the list or tuple, and slicing or concatenating it returns a
+    list. The outputs of the engine copy it to a list with tolist().
+    """
+    __slots__ = ("_token_ids", "_start", "_stop")
+
+    def __init__(self, token_ids: array, start: int, stop: int) -> None:
+        self._token_ids = token_ids
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(self._start, self._stop)[index]
+            if indices.step == 1:
+                return self._token_ids[indices.start:indices.stop].tolist()
+            return [self._token_ids[i] for i in indices]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("token index out of range")
+        return self._token_ids[self._start + index]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._token_ids[self._start:self._stop])
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, tuple, TokenIds)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    def __add__(self, other: Iterable[int]) -> List[int]:
+        if isinstance(other, (list, TokenIds)):
+            return self.tolist() + list(other)
+        return NotImplemented
+
+    def __radd__(self, other: Iterable[int]) -> List[int]:
+        if isinstance(other, list):
+            return other + self.tolist()
+        return NotImplemented
+
+    def tolist(self) -> List[int]:
+        return self._token_ids[self._start:self._stop].tolist()
+
+    def __repr__(self) -> str:
+        return repr(self.tolist())
 
 
 class SequenceData:
     """Data associated with a sequence.
 
+    The prompt and output token ids are stored in a single array, which
+    takes a few bytes per token instead of a Python int object and a list
+    entry. The token ids are returned as TokenIds views of the array, and a
+    copy of the sequence data has its own array.
+
     Args:
         prompt_token_ids: The token IDs of the prompt.
         output_token_ids: The token IDs of the output. Set to an empty list if
@@ -98,47 +215,79 @@ class SequenceData:
 
     Attributes:
         prompt_token_ids: The token IDs of the prompt.
-        output_token_ids: The token IDs of the output.
+        output_token_ids: The token IDs of the output. Setting them copies
+            the prompt token IDs to a new array.
         cumulative_logprob: The cumulative log probability of the output.
     """
+    __slots__ = ("_token_ids", "_prompt_len", "cumulative_logprob",
+                 "_num_computed_tokens", "_stage")
 
     def __init__(
         self,
-        prompt_token_ids: List[int],
-        output_token_ids: Optional[List[int]] = None,
+        prompt_token_ids: Iterable[int],
+        output_token_ids: Optional[Iterable[int]] = None,
     ) -> None:
-        if output_token_ids is None:
-            output_token_ids = []
-
-        self.prompt_token_ids = prompt_token_ids
-        self.output_token_ids = output_token_ids
+        self._token_ids = array(_TOKEN_IDS_TYPECODE, prompt_token_ids)
+        self._prompt_len = len(self._token_ids)
+        if output_token_ids is not None:
+            self._token_ids.extend(output_token_ids)
         self.cumulative_logprob = 0.0
         # The number of tokens that are computed (that run against the model).
         self._num_computed_tokens = 0
+        self._stage: SequenceStage = SequenceStage.PREFILL
+
+    @property
+    def prompt_token_ids(self) -> TokenIds:
+        return TokenIds(self._token_ids, 0, self._prompt_len)
+
+    @property
+    def output_token_ids(self) -> TokenIds:
+        return TokenIds(self._token_ids, self._prompt_len,
+                        len(self._token_ids))
+
+    @output_token_ids.setter
+    def output_token_ids(self, output_token_ids: Iterable[int]) -> None:
+        token_ids = self._token_ids[:self._prompt_len]
+        token_ids.extend(output_token_ids)
+        self._token_ids = token_ids
+
+    def __copy__(self) -> "SequenceData":
+        # The tokens are appended to the array in place, so the copy cannot
+        # share it.
+        new_seq_data = SequenceData.__new__(SequenceData)
+        for name in self.__slots__:
+            setattr(new_seq_data, name, getattr(self, name))
+        new_seq_data._token_ids = self._token_ids[:]
+        return new_seq_data
 
     def append_token_id(self, token_id: int, logprob: float) -> None:
-        self.output_token_ids.append(token_id)
+        self._token_ids.append(token_id)
         self.cumulative_logprob += logprob
 
     def get_len(self) -> int:
-        return len(self.output_token_ids) + len(self.prompt_token_ids)
+        return len(self._token_ids)
 
     def get_prompt_len(self) -> int:
-        return len(self.prompt_token_ids)
+        return self._prompt_len
 
     def get_output_len(self) -> int:
-        return len(self.output_token_ids)
+        return len(self._token_ids) - self._prompt_len
 
-    def get_token_ids(self) -> List[int]:
-        return self.prompt_token_ids + self.output_token_ids
+    def get_token_ids(self) -> TokenIds:
+        return TokenIds(self._token_ids, 0, len(self._token_ids))
 
     def get_num_computed_tokens(self) -> int:
         """Return the number of prefill tokens that are already computed."""
         return self._num_computed_tokens
 
-    def update_num_computed_tokens(self, num_new_computed_tokens: int) -> int:
+    def update_num_computed_tokens(self, num_new_computed_tokens: int):
         """Update number of tokens computed so far."""
         self._num_computed_tokens += num_new_computed_tokens
+        assert self._num_computed_tokens <= self.get_len(), (
+            self._num_computed_tokens, self.get_len())
+        # If all tokens are computed, it means it is in decoding phase.
+        if self.get_num_uncomputed_tokens() == 0:
+            self._stage = SequenceStage.DECODE
 
     def reset_num_computed_tokens(self) -> None:
         """Reset the number of computed tokens from this sequence. It is
@@ -146,6 +295,7 @@ class SequenceData:
         the beginning again (e.g., sequence is preempted).
         """
         self._num_computed_tokens = 0
+        self._stage = SequenceStage.PREFILL
 
     def get_num_uncomputed_tokens(self) -> int:
         """Return the number of prefil tokens that are not computed."""
@@ -155,16 +305,18 @@ class SequenceData:
         return self.get_len() - self.get_num_computed_tokens()
 
     def get_last_token_id(self) -> int:
-        if not self.output_token_ids:
-            return self.prompt_token_ids[-1]
-        return self.output_token_ids[-1]
+        return self._token_ids[-1]
 
-    def get_prompt_token_ids(self) -> int:
+    def get_prompt_token_ids(self) -> TokenIds:
         return self.prompt_token_ids
 
-    def get_output_token_ids(self) -> int:
+    def get_output_token_ids(self) -> TokenIds:
         return self.output_token_ids
 
+    @property
+    def stage(self) -> SequenceStage:
+        return self._stage
+
     def __repr__(self) -> str:
         return (f"SequenceData("
                 f"prompt_token_ids={self.prompt_token_ids}, "
@@ -172,6 +324,249 @@ class SequenceData:
                 f"cumulative_logprob={self.cumulative_logprob})")
 
 
+class StepLogprobs(collections.abc.Mapping):
+    """The logprobs of a sampled token, as returned by the sampler.
+
+    It maps the token ids to their Logprob like a dict, but keeps the
+    logprob and rank of the sampled token and the top logprobs of the step
+    as plain values, and only creates the Logprob objects when accessed.
+
+    Args:
+        token_id: The sampled token ID.
+        logprob: The logprob of the sampled token.
+        rank: The rank of the sampled token, if requested.
+        top_token_ids: The top token IDs, from rank 1, if requested.
+        top_logprobs: The logprobs of the top tokens.
+    """
+    __slots__ = ("token_id", "logprob", "rank", "top_token_ids",
+                 "top_logprobs")
+
+    def __init__(
+        self,
+        token_id: int,
+        logprob: float,
+        rank: Optional[int] = None,
+        top_token_ids: Optional[List[int]] = None,
+        top_logprobs: Optional[List[float]] = None,
+    ) -> None:
+        self.token_id = token_id
+        self.logprob = logprob
+        self.rank = rank
+        self.top_token_ids = top_token_ids or []
+        self.top_logprobs = top_logprobs or []
+
+    def __getitem__(self, token_id: int) -> Logprob:
+        if token_id == self.token_id:
+            return Logprob(self.logprob, self.rank)
+        for rank, top_token_id in enumerate(self.top_token_ids, 1):
+            if top_token_id == token_id:
+                return Logprob(self.top_logprobs[rank - 1], rank)
+        raise KeyError(token_id)
+
+    def __contains__(self, token_id: object) -> bool:
+        return token_id == self.token_id or token_id in self.top_token_ids
+
+    def __iter__(self) -> Iterator[int]:
+        yield self.token_id
+        for top_token_id in self.top_token_ids:
+            if top_token_id != self.token_id:
+                yield top_token_id
+
+    def __len__(self) -> int:
+        return (len(self.top_token_ids) + 1 -
+                (self.token_id in self.top_token_ids))
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+# Decodes the tokens of logprobs in place of the sampled tokens, see
+# SequenceLogprobs.set_decoding().
+LogprobsDecoder = Callable[[List[Tuple[List[int], int, List[int]]]],
+                           List[List[Optional[str]]]]
+
+
+class SequenceLogprobs(collections.abc.Sequence):
+    """The logprobs of the generated tokens of a sequence, which can be used
+    in place of a list of dicts of Logprob per token.
+
+    The token ids, logprobs and ranks of the steps are appended to arrays,
+    and only turned into dicts when accessed, e.g. when the API server
+    returns them. The tokens other than the sampled ones are also only
+    decoded then, in a batch, from the decoding windows recorded by the
+    detokenizer. The dicts are kept once built, since the API server returns
+    the logprobs of the new tokens at every step, and the output processors
+    can index them again. It is pickled as a list of dicts.
+    """
+    __slots__ = ("_token_ids", "_logprobs", "_ranks", "_offsets",
+                 "_decoded_tokens", "_window_token_ids", "_window_offsets",
+                 "_prefix_lens", "_steps", "decoder")
+
+    def __init__(self) -> None:
+        # The entries of the steps. The first entry of a step is the sampled
+        # token, and a rank of 0 is unknown.
+        self._token_ids = array(_TOKEN_IDS_TYPECODE)
+        self._logprobs = array("d")
+        self._ranks = array("i")
+        # The first entry of each step, and the end of the last one.
+        self._offsets = array("i", [0])
+        # The decoded sampled token of each step.
+        self._decoded_tokens: List[Optional[str]] = []
+        # The decoding window of each step, and the length of its prefix, or
+        # -1 if the step was not decoded.
+        self._window_token_ids = array(_TOKEN_IDS_TYPECODE)
+        self._window_offsets = array("i", [0])
+        self._prefix_lens = array("i")
+        # The dict of each step, once built.
+        self._steps: List[Optional[Dict[int, Logprob]]] = []
+        self.decoder: Optional[LogprobsDecoder] = None
+
+    def append(self, token_id: int, logprobs: Dict[int, Logprob]) -> None:
+        """Appends the logprobs of a step, in which token_id was sampled."""
+        if isinstance(logprobs, StepLogprobs):
+            self._append_entry(token_id, logprobs.logprob, logprobs.rank)
+            for rank, (top_token_id, top_logprob) in enumerate(
+                    zip(logprobs.top_token_ids, logprobs.top_logprobs), 1):
+                if top_token_id != token_id:
+                    self._append_entry(top_token_id, top_logprob, rank)
+            decoded_token = None
+        else:
+            sample_logprob = logprobs[token_id]
+            self._append_entry(token_id, sample_logprob.logprob,
+                               sample_logprob.rank)
+            for other_token_id, other_logprob in logprobs.items():
+                if other_token_id != token_id:
+                    self._append_entry(other_token_id, other_logprob.logprob,
+                                       other_logprob.rank)
+            decoded_token = sample_logprob.decoded_token
+        self._offsets.append(len(self._token_ids))
+        self._decoded_tokens.append(decoded_token)
+        self._window_offsets.append(self._window_offsets[-1])
+        self._prefix_lens.append(-1)
+        self._steps.append(None)
+
+    def _append_entry(self, token_id: int, logprob: float,
+                      rank: Optional[int]) -> None:
+        self._token_ids.append(token_id)
+        self._logprobs.append(logprob)
+        self._ranks.append(rank or 0)
+
+    def set_decoding(self, decoded_token: str, window: List[int],
+                     prefix_len: int) -> None:
+        """Sets how the sampled token of the last step was decoded: its text,
+        and the token ids it was decoded after. The other tokens of the step
+        are decoded by the decoder from the window with each of them
+        appended, as the text after the decoded prefix of the window."""
+        self._decoded_tokens[-1] = decoded_token
+        self._window_token_ids.extend(window)
+        self._window_offsets[-1] = len(self._window_token_ids)
+        self._prefix_lens[-1] = prefix_len
+        self._steps[-1] = None
+
+    def _get_steps(self, steps: range) -> List[Dict[int, Logprob]]:
+        new_steps = [step for step in steps if self._steps[step] is None]
+        if new_steps:
+            for step, step_logprobs in zip(new_steps,
+                                           self._build_steps(new_steps)):
+                self._steps[step] = step_logprobs
+        return [self._steps[step] for step in steps]
+
+    def _build_steps(self, steps: List[int]) -> List[Dict[int, Logprob]]:
+        decoded_tokens = self._decode(steps)
+        step_logprobs_list: List[Dict[int, Logprob]] = []
+        for step, step_decoded_tokens in zip(steps, decoded_tokens):
+            start = self._offsets[step]
+            step_logprobs = {
+                self._token_ids[start]:
+                Logprob(self._logprobs[start], self._ranks[start] or None,
+                        self._decoded_tokens[step])
+            }
+            for i, decoded_token in enumerate(step_decoded_tokens, start + 1):
+                step_logprobs[self._token_ids[i]] = Logprob(
+                    self._logprobs[i], self._ranks[i] or None, decoded_token)
+            step_logprobs_list.append(step_logprobs)
+        return step_logprobs_list
+
+    def _decode(self, steps: List[int]) -> List[List[Optional[str]]]:
+        """Decodes the tokens of the steps other than the sampled ones."""
+        decoded_tokens: List[List[Optional[str]]] = [
+            [None] * (self._offsets[step + 1] - self._offsets[step] - 1)
+            for step in steps
+        ]
+        requests: List[Tuple[List[int], int, List[int]]] = []
+        decoded_steps: List[int] = []
+        for i, step in enumerate(steps):
+            if not decoded_tokens[i] or self._prefix_lens[step] < 0:
+                continue
+            window = self._window_token_ids[self._window_offsets[step]:self.
+                                            _window_offsets[step + 1]]
+            requests.append(
+                (window.tolist(), self._prefix_lens[step],
+                 self._token_ids[self._offsets[step] +
+                                 1:self._offsets[step + 1]].tolist()))
+            decoded_steps.append(i)
+        if requests and self.decoder is not None:
+            for i, step_decoded_tokens in zip(decoded_steps,
+                                              self.decoder(requests)):
+                decoded_tokens[i] = step_decoded_tokens
+        return decoded_tokens
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._get_steps(range(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("step index out of range")
+        return self._get_steps(range(index, index + 1))[0]
+
+    def __iter__(self) -> Iterator[Dict[int, Logprob]]:
+        return iter(self[:])
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, SequenceLogprobs)):
+            return self[:] == list(other)
+        return NotImplemented
+
+    def __add__(self, other: Iterable[Dict[int, Logprob]]) -> list:
+        if isinstance(other, (list, SequenceLogprobs)):
+            return self[:] + list(other)
+        return NotImplemented
+
+    def __radd__(self, other: Iterable[Dict[int, Logprob]]) -> list:
+        if isinstance(other, list):
+            return other + self[:]
+        return NotImplemented
+
+    def __reduce__(self):
+        return list, (self[:], )
+
+    def __copy__(self) -> "SequenceLogprobs":
+        new_logprobs = SequenceLogprobs.__new__(SequenceLogprobs)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            # The decoder holds the tokenizer, which is shared.
+            if name == "_steps":
+                value = [
+                    None
+                    if step_logprobs is None else copy.deepcopy(step_logprobs)
+                    for step_logprobs in value
+                ]
+            elif name != "decoder":
+                value = copy.copy(value)
+            setattr(new_logprobs, name, value)
+        return new_logprobs
+
+    def __deepcopy__(self, memo) -> "SequenceLogprobs":
+        return self.__copy__()
+
+    def __repr__(self) -> str:
+        return repr(self[:])
+
+
 class Sequence:
     """Stores the data, status, and block information of a sequence.
 
@@ -182,7 +577,13 @@ class Sequence:
         block_size: The block size of the sequence. Should be the same as the
             block size used by the block manager and cache engine.
         lora_request: LoRA request.
+        record_logprobs: Whether to record the logprobs of the generated
+            tokens in output_logprobs, e.g. if they are requested.
     """
+    __slots__ = ("seq_id", "prompt", "block_size", "eos_token_id",
+                 "lora_request", "data", "record_logprobs", "output_logprobs",
+                 "output_text", "status", "stop_reason", "stop_state",
+                 "prefix_offset", "read_offset", "tokens")
 
     def __init__(
         self,
@@ -192,6 +593,7 @@ class Sequence:
         block_size: int,
         eos_token_id: Optional[int] = None,
         lora_request: Optional[LoRARequest] = None,
+        record_logprobs: bool = True,
     ) -> None:
         self.seq_id = seq_id
         self.prompt = prompt
@@ -200,21 +602,27 @@ class Sequence:
         self.lora_request = lora_request
 
         self.data = SequenceData(prompt_token_ids)
-        self.output_logprobs: SampleLogprobs = []
+        self.record_logprobs = record_logprobs
+        self.output_logprobs = SequenceLogprobs()
         self.output_text = ""
 
-        self.logical_token_blocks: List[LogicalTokenBlock] = []
-        # Initialize the logical token blocks with the prompt token ids.
-        self._append_tokens_to_blocks(prompt_token_ids)
         self.status = SequenceStatus.WAITING
         self.stop_reason: Union[int, str, None] = None
+        # State of the stop string matcher after the output text.
+        self.stop_state = 0
 
-        # Used for incremental detokenization
+        # Used for incremental detokenization. The offsets index the token
+        # ids with a fast tokenizer, and the tokens below otherwise.
         self.prefix_offset = 0
         self.read_offset = 0
-        # Input + output tokens
+        # Input + output tokens. Only used with a slow tokenizer.
         self.tokens: Optional[List[str]] = None
 
+    @property
+    def n_blocks(self) -> int:
+        """The number of blocks of the tokens of the sequence."""
+        return (self.get_len() + self.block_size - 1) // self.block_size
+
     @property
     def lora_int_id(self) -> int:
         return self.lora_request.lora_int_id if self.lora_request else 0
@@ -236,37 +644,14 @@ class Sequence:
         """Reset the sequence states for recomputation."""
         self.data.reset_num_computed_tokens()
 
-    def _append_logical_block(self) -> None:
-        block = LogicalTokenBlock(
-            block_number=len(self.logical_token_blocks),
-            block_size=self.block_size,
-        )
-        self.logical_token_blocks.append(block)
-
-    def _append_tokens_to_blocks(self, token_ids: List[int]) -> None:
-        cursor = 0
-        while cursor < len(token_ids):
-            if not self.logical_token_blocks:
-                self._append_logical_block()
-
-            last_block = self.logical_token_blocks[-1]
-            if last_block.is_full():
-                self._append_logical_block()
-                last_block = self.logical_token_blocks[-1]
-
-            num_empty_slots = last_block.get_num_empty_slots()
-            last_block.append_tokens(token_ids[cursor:cursor +
-                                               num_empty_slots])
-            cursor += num_empty_slots
-
     def append_token_id(
         self,
         token_id: int,
         logprobs: Dict[int, Logprob],
     ) -> None:
         assert token_id in logprobs
-        self._append_tokens_to_blocks([token_id])
-        self.output_logprobs.append(logprobs)
+        if self.record_logprobs:
+            self.output_logprobs.append(token_id, logprobs)
         self.data.append_token_id(token_id, logprobs[token_id].logprob)
 
     def get_len(self) -> int:
@@ -278,16 +663,16 @@ class Sequence:
     def get_output_len(self) -> int:
         return self.data.get_output_len()
 
-    def get_token_ids(self) -> List[int]:
+    def get_token_ids(self) -> TokenIds:
         return self.data.get_token_ids()
 
-    def get_prompt_token_ids(self) -> List[int]:
+    def get_prompt_token_ids(self) -> TokenIds:
         return self.data.get_prompt_token_ids()
 
     def get_last_token_id(self) -> int:
         return self.data.get_last_token_id()
 
-    def get_output_token_ids(self) -> List[int]:
+    def get_output_token_ids(self) -> TokenIds:
         return self.data.output_token_ids
 
     def get_cumulative_logprob(self) -> float:
@@ -315,6 +700,9 @@ class Sequence:
     def is_finished(self) -> bool:
         return SequenceStatus.is_finished(self.status)
 
+    def is_prefill(self) -> bool:
+        return self.data.stage == SequenceStage.PREFILL
+
     def fork(self, new_seq_id: int) -> "Sequence":
         new_seq = copy.deepcopy(self)
         new_seq.seq_id = new_seq_id
@@ -323,7 +711,7 @@ class Sequence:
     def __repr__(self) -> str:
         return (f"Sequence(seq_id={self.seq_id}, "
                 f"status={self.status.name}, "
-                f"num_blocks={len(self.logical_token_blocks)})")
+                f"num_blocks={self.n_blocks})")
 
 
 @dataclass
@@ -363,6 +751,12 @@ class SequenceGroup:
         arrival_time: The arrival time of the request.
         lora_request: LoRA request.
         multi_modal_data: Multi modal data associated with the request.
+        stop_checker: The compiled stop conditions of the request. If None,
+            they are compiled on first use, see get_stop_checker().
+        priority: The priority of the request, lower is more urgent. Only
+            used by the priority scheduling policy.
+        deadline: The time by which the request should be scheduled. Only
+            used by the priority scheduling policy.
     """
 
     def __init__(
@@ -373,6 +767,9 @@ class SequenceGroup:
         arrival_time: float,
         lora_request: Optional[LoRARequest] = None,
         multi_modal_data: Optional[MultiModalData] = None,
+        stop_checker: Optional["StopChecker"] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
     ) -> None:
         self.request_id = request_id
         self.seqs_dict = {seq.seq_id: seq for seq in seqs}
@@ -386,6 +783,13 @@ class SequenceGroup:
         self.prompt_logprobs: Optional[PromptLogprobs] = None
         self.state = SequenceGroupState()
         self.multi_modal_data = multi_modal_data
+        self.stop_checker = stop_checker
+        self.priority = priority
+        self.deadline = deadline
+        # When the group was last preempted and whether it was swapped out,
+        # until it is scheduled again.
+        self.preempted_time: Optional[float] = None
+        self.preempted_by_swap = False
 
     @property
     def prompt(self) -> str:
@@ -394,7 +798,7 @@ class SequenceGroup:
         return next(iter(self.seqs_dict.values())).prompt
 
     @property
-    def prompt_token_ids(self) -> List[int]:
+    def prompt_token_ids(self) -> TokenIds:
         # All sequences in the group should have the same prompt.
         # We use the prompt of an arbitrary sequence.
         return next(iter(self.seqs_dict.values())).data.prompt_token_ids
@@ -420,6 +824,27 @@ class SequenceGroup:
         if self.metrics.first_scheduled_time is None:
             self.metrics.first_scheduled_time = time
             self.metrics.time_in_queue = time - self.metrics.arrival_time
+            self.metrics.time_in_waiting += self.metrics.time_in_queue
+
+    def set_preempted_time(self, time: float, by_swap: bool) -> None:
+        """Counts a preemption of the request for Request level timings."""
+        if by_swap:
+            self.metrics.num_swaps += 1
+        else:
+            self.metrics.num_recomputes += 1
+        self.preempted_time = time
+        self.preempted_by_swap = by_swap
+
+    def maybe_set_resumed_time(self, time: float) -> None:
+        """Adds the time since the last preemption, if any, to the time
+        spent swapped out or waiting for Request level timings."""
+        if self.preempted_time is None:
+            return
+        if self.preempted_by_swap:
+            self.metrics.time_in_swapped += time - self.preempted_time
+        else:
+            self.metrics.time_in_waiting += time - self.preempted_time
+        self.preempted_time = None
 
     def set_finished_time(self, time: Optional[float]) -> None:
         """Sets the finished time for Request level timings."""
@@ -497,6 +922,10 @@ class SequenceGroup:
     def is_finished(self) -> bool:
         return all(seq.is_finished() for seq in self.get_seqs())
 
+    def is_prefill(self) -> bool:
+        # Every sequence in the group should be in the same stage.
+        return next(iter(self.seqs_dict.values())).is_prefill()
+
     def __repr__(self) -> str:
         return (f"SequenceGroup(request_id={self.request_id}, "
                 f"sampling_params={self.sampling_params}, "
@@ -575,7 +1004,7 @@ class SequenceOutput:
         self,
         parent_seq_id: int,
         output_token: int,
-        logprobs: Dict[int, Logprob],
+        logprobs: Union[Dict[int, Logprob], StepLogprobs],
     ) -> None:
         self.parent_seq_id = parent_seq_id
         self.output_token = output_token
@@ -637,6 +1066,10 @@ class SamplerOutput:
     # Spec decode metrics populated by workers.
     spec_decode_worker_metrics: Optional["SpecDecodeWorkerMetrics"] = None
 
+    # Seconds spent by the driver worker in the phases of the step
+    # ("prepare", "forward" and "sample"), populated by the model runner.
+    phase_times: Optional[Dict[str, float]] = None
+
     def __getitem__(self, idx: int):
         return self.outputs[idx]
 
@@ -1,3 +1,4 @@
+import functools
 from typing import Dict, List, Optional, Tuple, Union
 
 from transformers import PreTrainedTokenizer, PreTrainedTokenizerFast
@@ -87,16 +88,100 @@ class Detokenizer:
                 prev_tokens.extend(next_iter_tokens)
 
     def decode_sequence_inplace(self, seq: Sequence,
-                                prms: SamplingParams) -> None:
+                                prms: SamplingParams) -> int:
         """Decodes the new token for a sequence. In-place operation.
 
         Args:
             seq: The sequence to decode.
             prms: The sampling parameters used to generate the sequence.
+
+        Returns:
+            The number of characters added to the output text.
         """
+        return self.decode_sequences_inplace([(seq, prms)])[0]
+
+    def decode_sequences_inplace(
+            self, seqs: List[Tuple[Sequence, SamplingParams]]) -> List[int]:
+        """Decodes the new tokens for a batch of sequences. In-place
+        operation.
+
+        The sequences with a fast tokenizer are decoded incrementally from
+        windows of their token ids, and the windows of all the sequences are
+        decoded with one batched call into the tokenizers library, which runs
+        without the GIL on its own thread pool. The sequences with a slow
+        tokenizer are decoded one by one.
+
+        Args:
+            seqs: The sequences to decode, with the sampling parameters used
+                to generate them.
+
+        Returns:
+            The number of characters added to the output text of each
+            sequence.
+        """
+        new_char_counts = [0] * len(seqs)
+        # (tokenizer, skip_special_tokens) -> token id windows to decode.
+        batches: Dict[Tuple[int, bool], List[List[int]]] = {}
+        tokenizers: Dict[int, "PreTrainedTokenizerFast"] = {}
+        # (index, batch key, index of the first window) of the sequences
+        # decoded in batches.
+        pending: List[Tuple[int, Tuple[int, bool], int]] = []
+        for i, (seq, prms) in enumerate(seqs):
+            tokenizer = self.get_tokenizer_for_seq(seq)
+            if not tokenizer.is_fast:
+                new_char_counts[i] = self._decode_sequence_slow(
+                    seq, prms, tokenizer)
+                continue
+            key = (id(tokenizer), prms.skip_special_tokens)
+            tokenizers[key[0]] = tokenizer
+            windows = batches.setdefault(key, [])
+            pending.append((i, key, len(windows)))
+
+            all_input_ids = seq.get_token_ids()
+            if seq.read_offset == 0:
+                # First decoding. Start from the end of the prompt.
+                seq.read_offset = len(all_input_ids) - 1
+                seq.prefix_offset = max(
+                    seq.read_offset -
+                    INITIAL_INCREMENTAL_DETOKENIZATION_OFFSET, 0)
+            prefix_ids = all_input_ids[seq.prefix_offset:seq.read_offset]
+            windows.append(prefix_ids)
+            windows.append(all_input_ids[seq.prefix_offset:])
+
+        texts = {
+            key: _decode_batch(tokenizers[key[0]], windows, key[1])
+            for key, windows in batches.items()
+        }
+
+        for i, key, start in pending:
+            seq, prms = seqs[i]
+            batch_texts = texts[key]
+            new_text = _get_new_text(batch_texts[start],
+                                     batch_texts[start + 1])
+
+            if seq.record_logprobs:
+                # The other tokens of the logprobs are only decoded if they
+                # are returned.
+                seq.output_logprobs.set_decoding(
+                    new_text,
+                    seq.get_token_ids()[seq.prefix_offset:-1],
+                    seq.read_offset - seq.prefix_offset)
+                if seq.output_logprobs.decoder is None:
+                    seq.output_logprobs.decoder = functools.partial(
+                        _decode_logprob_tokens, tokenizers[key[0]], key[1],
+                        prms.spaces_between_special_tokens)
+
+            if new_text:
+                seq.prefix_offset = seq.read_offset
+                seq.read_offset = seq.get_len()
+                seq.output_text += new_text
+            new_char_counts[i] = len(new_text)
+        return new_char_counts
+
+    def _decode_sequence_slow(self, seq: Sequence, prms: SamplingParams,
+                              tokenizer: "PreTrainedTokenizer") -> int:
+        """Decodes the new token for a sequence with a slow tokenizer."""
         all_input_ids = seq.get_token_ids()
-        token_id_generated_this_iteration = all_input_ids[-1]
-        tokenizer = self.get_tokenizer_for_seq(seq)
 
         # Convert prompt token IDs to tokens if necessary.
         # Do it here so that we don't have to repeat this
@@ -120,36 +205,115 @@ class Detokenizer:
              spaces_between_special_tokens=prms.spaces_between_special_tokens,
          )
 
-        # Decode logprobs
-        logprobs = seq.output_logprobs[-1]
-        if logprobs:
-            previous_tokens = all_input_ids[:-1]
-            for token_id, sample_logprob in logprobs.items():
-                # If the token was generated this iteration,
-                # use the provided text.
-                if token_id == token_id_generated_this_iteration:
-                    sample_logprob.decoded_token = new_decoded_token_text
-                    continue
-
-                if (sample_logprob.decoded_token is None
-                        and token_id != INVALID_TOKEN_ID):
-                    all_input_ids_with_logprob = previous_tokens + [token_id]
-                    (_, new_text, _, _) = detokenize_incrementally(
-                        tokenizer=tokenizer,
-                        all_input_ids=all_input_ids_with_logprob,
-                        prev_tokens=seq.tokens,
-                        prefix_offset=seq.prefix_offset,
-                        read_offset=seq.read_offset,
-                        skip_special_tokens=prms.skip_special_tokens,
-                        spaces_between_special_tokens=prms.
-                        spaces_between_special_tokens,
-                    )
-                    sample_logprob.decoded_token = new_text
+        if seq.record_logprobs:
+            # The offsets index the tokens here, so the other tokens of the
+            # logprobs are decoded after the last token ids instead.
+            window = all_input_ids[-INITIAL_INCREMENTAL_DETOKENIZATION_OFFSET -
+                                   1:-1]
+            seq.output_logprobs.set_decoding(new_decoded_token_text, window,
+                                             len(window))
+            if seq.output_logprobs.decoder is None:
+                seq.output_logprobs.decoder = functools.partial(
+                    _decode_logprob_tokens, tokenizer,
+                    prms.skip_special_tokens,
+                    prms.spaces_between_special_tokens)
 
         seq.tokens.extend(new_tokens)
         seq.prefix_offset = prefix_offset
         seq.read_offset = read_offset
         seq.output_text += new_decoded_token_text
+        return len(new_decoded_token_text)
+
+
+def _decode_batch(tokenizer: PreTrainedTokenizerFast, windows: List[List[int]],
+                  skip_special_tokens: bool) -> List[str]:
+    """Decodes token id windows with the backend of a fast tokenizer."""
+    # Token ids out of the vocab (e.g. from a padded LM head) decode to "".
+    # The special tokens are skipped here, as convert_ids_to_tokens() does,
+    # since the backend has its own notion of special tokens.
+    vocab_size = len(tokenizer)
+    skipped_ids = (set(tokenizer.all_special_ids)
+                   if skip_special_tokens else set())
+    windows = [
+        window if
+        (not window
+         or max(window) < vocab_size and skipped_ids.isdisjoint(window)) else [
+             token_id for token_id in window
+             if token_id < vocab_size and token_id not in skipped_ids
+         ] for window in windows
+    ]
+    return tokenizer.backend_tokenizer.decode_batch(windows,
+                                                    skip_special_tokens=False)
+
+
+def _decode_logprob_tokens(
+    tokenizer: Union[PreTrainedTokenizer, PreTrainedTokenizerFast],
+    skip_special_tokens: bool,
+    spaces_between_special_tokens: bool,
+    requests: List[Tuple[List[int], int, List[int]]],
+) -> List[List[Optional[str]]]:
+    """Decodes the tokens of the logprobs of a sequence other than the
+    sampled ones, as if they were sampled instead.
+
+    Each request has the decoding window of a step, the length of its prefix
+    and the tokens to decode after it. The windows of all the requests are
+    decoded in one batch with a fast tokenizer, and like
+    detokenize_incrementally() does with a slow one. See
+    SequenceLogprobs.set_decoding().
+    """
+    windows: List[List[int]] = []
+    for window, prefix_len, token_ids in requests:
+        windows.append(window[:prefix_len])
+        windows.extend(window + [token_id] for token_id in token_ids
+                       if token_id != INVALID_TOKEN_ID)
+    if tokenizer.is_fast:
+        texts = _decode_batch(tokenizer, windows, skip_special_tokens)
+    else:
+        texts = [
+            _decode_slow(tokenizer, window, skip_special_tokens,
+                         spaces_between_special_tokens) for window in windows
+        ]
+
+    text_iter = iter(texts)
+    decoded_tokens: List[List[Optional[str]]] = []
+    for _, _, token_ids in requests:
+        prefix_text = next(text_iter)
+        decoded_tokens.append([
+            None if token_id == INVALID_TOKEN_ID else _get_new_text(
+                prefix_text, next(text_iter)) for token_id in token_ids
+        ])
+    return decoded_tokens
+
+
+def _decode_slow(tokenizer: PreTrainedTokenizer, window: List[int],
+                 skip_special_tokens: bool,
+                 spaces_between_special_tokens: bool) -> str:
+    """Decodes a token id window with a slow tokenizer, the same way as
+    detokenize_incrementally()."""
+    vocab_size = len(tokenizer)
+    tokens = tokenizer.convert_ids_to_tokens(
+        [token_id for token_id in window if token_id < vocab_size],
+        skip_special_tokens=skip_special_tokens)
+    if not tokenizer.get_added_vocab():
+        return tokenizer.convert_tokens_to_string(tokens)
+    return _convert_tokens_to_string_with_added_encoders(
+        tokenizer,
+        tokens,
+        skip_special_tokens=skip_special_tokens,
+        spaces_between_special_tokens=spaces_between_special_tokens,
+    )
+
+
+def _get_new_text(prefix_text: str, text: str) -> str:
+    """Returns the text decoded after the prefix text of an incremental
+    decoding window, or "" if it is not complete yet."""
+    if len(text) <= len(prefix_text) or text.endswith("�"):
+        # utf-8 char at the end means it's a potential unfinished byte sequence
+        # from byte fallback tokenization.
+        # If it's in the middle, it's probably a real invalid id generated
+        # by the model
+        return ""
+    return text[len(prefix_text):]
 
 
 def _convert_tokens_to_string_with_added_encoders(
@@ -4,6 +4,7 @@ import gc
 import os
 import socket
 import subprocess
+import time
 import uuid
 import warnings
 from collections import OrderedDict
@@ -448,3 +449,24 @@ def maybe_expand_dim(tensor: torch.Tensor,
     if tensor.ndim < target_dims:
         tensor = tensor.view(-1, *([size] * (target_dims - tensor.ndim)))
     return tensor
+
+
+def get_device_timestamp(
+        device: torch.device) -> Union[float, torch.cuda.Event]:
+    """Returns the current time of the device. On CUDA, this is an event
+    recorded on the current stream, so that the kernels are timed when they
+    run rather than when they are launched."""
+    if device.type == "cuda":
+        event = torch.cuda.Event(enable_timing=True)
+        event.record()
+        return event
+    return time.perf_counter()
+
+
+def get_elapsed_time(start: Union[float, torch.cuda.Event],
+                     end: Union[float, torch.cuda.Event]) -> float:
+    """Returns the seconds between two timestamps of get_device_timestamp()."""
+    if isinstance(start, float):
+        return end - start
+    end.synchronize()
+    return start.elapsed_time(end) / 1000
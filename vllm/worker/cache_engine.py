@@ -1,11 +1,16 @@
 """CacheEngine class for managing the KV cache."""
-from typing import Dict, List
+import fcntl
+import math
+import os
+from typing import Dict, List, Tuple
 
 import torch
 
 from vllm.attention import get_attn_backend
 from vllm.config import CacheConfig, ModelConfig, ParallelConfig
 from vllm.logger import init_logger
+from vllm.model_executor.parallel_utils.parallel_state import (
+    get_tensor_model_parallel_rank)
 from vllm.utils import STR_DTYPE_TO_TORCH_DTYPE, is_pin_memory_available
 
 logger = init_logger(__name__)
@@ -47,7 +52,11 @@ class CacheEngine:
 
         # Initialize the cache.
         self.gpu_cache = self._allocate_kv_cache(self.num_gpu_blocks, "cuda")
-        self.cpu_cache = self._allocate_kv_cache(self.num_cpu_blocks, "cpu")
+        if cache_config.prefix_cache_path is not None:
+            self.cpu_cache = self._map_kv_cache(self.num_cpu_blocks)
+        else:
+            self.cpu_cache = self._allocate_kv_cache(self.num_cpu_blocks,
+                                                     "cpu")
 
     def _allocate_kv_cache(
         self,
@@ -67,15 +76,74 @@ class CacheEngine:
                             device=device))
         return kv_cache
 
+    def _map_kv_cache(self, num_blocks: int) -> List[torch.Tensor]:
+        """Maps the CPU KV cache from a file of the persistent prefix cache.
+
+        The file keeps the blocks of the previous run. Which of them are
+        valid is recorded by the block manager, not here.
+        """
+        kv_cache_shape = self.attn_backend.get_kv_cache_shape(
+            num_blocks, self.block_size, self.num_heads, self.head_size)
+        numel = self.num_layers * math.prod(kv_cache_shape)
+        if numel == 0:
+            return self._allocate_kv_cache(num_blocks, "cpu")
+
+        os.makedirs(self.cache_config.prefix_cache_path, exist_ok=True)
+        path = os.path.join(
+            self.cache_config.prefix_cache_path,
+            f"kv_cache_rank{get_tensor_model_parallel_rank()}.bin")
+        # The file stays locked for the lifetime of the process, so that two
+        # engines never write to the same file.
+        self._kv_cache_fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._kv_cache_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as e:
+            raise RuntimeError(
+                f"The prefix cache file {path} is in use by another "
+                "process.") from e
+        # Also resizes the files of a run with a different swap space.
+        os.ftruncate(self._kv_cache_fd, numel * _get_dtype_size(self.dtype))
+        logger.info(f"Mapping the CPU KV cache from {path}.")
+        kv_cache = torch.from_file(path,
+                                   shared=True,
+                                   size=numel,
+                                   dtype=self.dtype)
+        return list(kv_cache.view(self.num_layers, *kv_cache_shape).unbind(0))
+
     def swap_in(self, src_to_dst: Dict[int, int]) -> None:
-        for i in range(self.num_layers):
-            self.attn_backend.swap_blocks(self.cpu_cache[i], self.gpu_cache[i],
-                                          src_to_dst)
+        self._swap(self.cpu_cache, self.gpu_cache, src_to_dst)
 
     def swap_out(self, src_to_dst: Dict[int, int]) -> None:
+        self._swap(self.gpu_cache, self.cpu_cache, src_to_dst)
+
+    def _swap(
+        self,
+        src_cache: List[torch.Tensor],
+        dst_cache: List[torch.Tensor],
+        src_to_dst: Dict[int, int],
+    ) -> None:
+        # Runs of consecutive blocks are copied with one transfer each. The
+        # remaining blocks are left to the kernel of the attention backend,
+        # which copies them in one call per layer.
+        runs = get_block_runs(src_to_dst)
+        single_blocks = {src: dst for src, dst, length in runs if length == 1}
+        runs = [run for run in runs if run[2] > 1]
+
+        # The copies are issued on the current stream, in order with the
+        # kernels of the model: the swapped in blocks are read by this step,
+        # and the swapped out ones may be reallocated to its sequences.
         for i in range(self.num_layers):
-            self.attn_backend.swap_blocks(self.gpu_cache[i], self.cpu_cache[i],
-                                          src_to_dst)
+            if single_blocks:
+                self.attn_backend.swap_blocks(src_cache[i], dst_cache[i],
+                                              single_blocks)
+            if runs:
+                swap_block_runs(src_cache[i], dst_cache[i], runs)
+
+    def synchronize(self) -> None:
+        """Waits until the swaps are done, e.g. before the CPU cache is
+        read by the host. The copies from pinned memory do not block the
+        host."""
+        torch.cuda.current_stream().synchronize()
 
     def copy(self, src_to_dsts: Dict[int, List[int]]) -> None:
         self.attn_backend.copy_blocks(self.gpu_cache, src_to_dsts)
@@ -102,5 +170,42 @@ class CacheEngine:
         return dtype_size * total
 
 
+def get_block_runs(src_to_dst: Dict[int, int]) -> List[Tuple[int, int, int]]:
+    """Coalesces a mapping of source to destination blocks into runs of
+    blocks that are consecutive in both caches.
+
+    Returns a list of (first source block, first destination block, number
+    of blocks), sorted by source block.
+    """
+    runs: List[Tuple[int, int, int]] = []
+    for src, dst in sorted(src_to_dst.items()):
+        if runs:
+            run_src, run_dst, length = runs[-1]
+            if src == run_src + length and dst == run_dst + length:
+                runs[-1] = (run_src, run_dst, length + 1)
+                continue
+        runs.append((src, dst, 1))
+    return runs
+
+
+def swap_block_runs(
+    src_kv_cache: torch.Tensor,
+    dst_kv_cache: torch.Tensor,
+    runs: List[Tuple[int, int, int]],
+) -> None:
+    """Copies runs of blocks, as returned by get_block_runs(), between the
+    KV caches of a layer. The caches have the (2, num_blocks, ...) layout of
+    PagedAttention, so a run is contiguous in the keys and in the values.
+
+    Works with caches on any device, and does not block the host when the
+    CPU cache is pinned.
+    """
+    for src, dst, length in runs:
+        for i in range(2):
+            dst_kv_cache[i, dst:dst + length].copy_(src_kv_cache[i, src:src +
+                                                                 length],
+                                                    non_blocking=True)
+
+
 def _get_dtype_size(dtype: torch.dtype) -> int:
     return torch.tensor([], dtype=dtype).element_size()
@@ -1,6 +1,6 @@
 import contextlib
 import time
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import numpy as np
 import torch
@@ -14,16 +14,16 @@ from vllm.lora.layers import LoRAMapping
 from vllm.lora.request import LoRARequest
 from vllm.lora.worker_manager import LRUCacheWorkerLoRAManager
 from vllm.model_executor import SamplingMetadata
-from vllm.model_executor.model_loader import get_model
+from vllm.model_executor.model_loader import get_model, save_sharded_state
 from vllm.model_executor.parallel_utils import custom_all_reduce, pynccl_utils
-from vllm.model_executor.parallel_utils.communication_op import (
-    broadcast_tensor_dict)
+from vllm.model_executor.parallel_utils.metadata_channel import MetadataChannel
 from vllm.model_executor.parallel_utils.parallel_state import (
     with_pynccl_for_all_reduce)
 from vllm.sampling_params import SamplingParams, SamplingType
 from vllm.sequence import (MultiModalData, SamplerOutput, SequenceData,
                            SequenceGroupMetadata)
 from vllm.utils import (CudaMemoryProfiler, async_tensor_h2d,
+                        get_device_timestamp, get_elapsed_time,
                         is_pin_memory_available, make_tensor_with_pad,
                         maybe_expand_dim)
 
@@ -84,6 +84,12 @@ class ModelRunner:
         # (max batch size to capture, max context len to capture / block size).
         self.graph_block_tables = None  # Set after initial profiling.
         self.pin_memory = is_pin_memory_available()
+        # Persistent host buffers for the decoding inputs. Created on the
+        # first decoding step.
+        self.decode_buffers: Optional[DecodeInputBuffers] = None
+        # Broadcasts the inputs to the other workers. The block tables of the
+        # decoding batches are sent as a delta from the previous batch.
+        self.metadata_channel = MetadataChannel(delta_keys=["block_tables"])
         self.kv_cache_dtype = kv_cache_dtype
         self.vision_language_config = vision_language_config
 
@@ -138,6 +144,13 @@ class ModelRunner:
                List[int], List[int], List[int], Set[LoRARequest],
                torch.Tensor]:
         assert len(seq_group_metadata_list) > 0
+        # The sequences that do not decode in this step may have their block
+        # tables rebuilt before they decode again.
+        self.release_decode_rows(
+            seq_id for seq_group_metadata in seq_group_metadata_list
+            if not seq_group_metadata.is_prompt
+            for seq_id in seq_group_metadata.seq_data)
+
         input_tokens: List[int] = []
         input_positions: List[int] = []
         slot_mapping: List[int] = []
@@ -145,14 +158,30 @@ class ModelRunner:
         lora_prompt_mapping: List[int] = []
         lora_requests: Set[LoRARequest] = set()
 
+        # The sequence lengths of the prompts. Only prompts are included, so
+        # that it can be used to build the sampling metadata.
         prompt_lens: List[int] = []
+        # The sequence lengths of all the sequences that are attended,
+        # including the decodes that are batched with chunked prefills.
+        attn_prompt_lens: List[int] = []
         context_lens: List[int] = []
         subquery_lens: List[int] = []
         prefix_block_tables: List[List[int]] = []
         multi_modal_input_list: List[torch.Tensor] = []
 
         for seq_group_metadata in seq_group_metadata_list:
-            assert seq_group_metadata.is_prompt
+            if not seq_group_metadata.is_prompt:
+                # A decode batched together with chunked prefills. It is
+                # computed as a one-token prefill on top of its cached
+                # context.
+                assert self.scheduler_config.chunked_prefill_enabled
+                self._add_decode_to_prompt_batch(
+                    seq_group_metadata, input_tokens, input_positions,
+                    slot_mapping, lora_index_mapping, lora_prompt_mapping,
+                    lora_requests, context_lens, subquery_lens,
+                    prefix_block_tables, attn_prompt_lens)
+                continue
+
             seq_ids = list(seq_group_metadata.seq_data.keys())
             assert len(seq_ids) == 1
             seq_id = seq_ids[0]
@@ -160,7 +189,7 @@ class ModelRunner:
             computed_block_nums = seq_group_metadata.computed_block_nums
             if (self.scheduler_config is not None
                     and self.scheduler_config.chunked_prefill_enabled
-                    and computed_block_nums is not None):
+                    and computed_block_nums):
                 raise RuntimeError(
                     "chunked prefill cannot be used with prefix caching "
                     "now.")
@@ -172,14 +201,13 @@ class ModelRunner:
             # it contains output tokens.
             prefill_end = min(seq_data.get_len(),
                               computed_len + token_chunk_size)
-            # TODO(sang): Rename it after chunked prefill is introduced.
+            # The prompt tokens of this chunk. If the prefill is not chunked,
+            # it is the whole prompt.
             prompt_tokens = seq_data.get_token_ids()[computed_len:prefill_end]
-            prompt_len = len(prompt_tokens)
-            # Right now, the prefill_end is always same as the length of
-            # sequence. However, once chunked prefill is introduced, this
-            # assumption can be changed.
-            assert prefill_end == seq_data.get_len()
+            # The sequence length after this chunk is computed.
+            prompt_len = prefill_end
             prompt_lens.append(prompt_len)
+            attn_prompt_lens.append(prompt_len)
 
             # NOTE: This only works for oooooooxxx style attention.
             if computed_block_nums is not None and len(
@@ -188,11 +216,13 @@ class ModelRunner:
                 computed_len = len(computed_block_nums) * self.block_size
                 prompt_tokens = prompt_tokens[computed_len:]
                 prefix_block_tables.append(computed_block_nums)
+            elif computed_len > 0:
+                # The earlier chunks of the prompt are already in the KV
+                # cache.
+                prefix_block_tables.append(
+                    seq_group_metadata.block_tables[seq_id])
             else:
                 prefix_block_tables.append([])
-                # Right now, prefill start is always 0. However, this
-                # assumption can be changed once chunked prefill is introduced.
-                assert computed_len == 0
 
             # actual prompt lens
             context_lens.append(computed_len)
@@ -221,7 +251,7 @@ class ModelRunner:
             if seq_group_metadata.block_tables is None:
                 # During memory profiling, the block tables are not initialized
                 # yet. In this case, we just use a dummy slot mapping.
-                slot_mapping.extend([_PAD_SLOT_ID] * prompt_len)
+                slot_mapping.extend([_PAD_SLOT_ID] * len(prompt_tokens))
                 continue
 
             # Compute the slot mapping.
@@ -249,7 +279,7 @@ class ModelRunner:
                 slot_mapping.append(slot)
 
         max_subquery_len = max(subquery_lens)
-        max_prompt_len = max(prompt_lens)
+        max_prompt_len = max(attn_prompt_lens)
         num_prompt_tokens = len(input_tokens)
         assert max_subquery_len > 0
 
@@ -296,7 +326,7 @@ class ModelRunner:
                                          dtype=torch.int32,
                                          device=self.device)
 
-        prompt_lens_tensor = torch.tensor(prompt_lens,
+        prompt_lens_tensor = torch.tensor(attn_prompt_lens,
                                           dtype=torch.long,
                                           device=self.device)
         seq_start_loc = torch.zeros(prompt_lens_tensor.shape[0] + 1,
@@ -316,7 +346,7 @@ class ModelRunner:
         attn_metadata = self.attn_backend.make_metadata(
             is_prompt=True,
             slot_mapping=slot_mapping,
-            prompt_lens=prompt_lens,
+            prompt_lens=attn_prompt_lens,
             prompt_lens_tensor=prompt_lens_tensor,
             num_prompt_tokens=num_prompt_tokens,
             num_generation_tokens=0,
@@ -334,16 +364,62 @@ class ModelRunner:
                 subquery_lens, lora_index_mapping, lora_prompt_mapping,
                 lora_requests, multi_modal_input)
 
+    def _add_decode_to_prompt_batch(
+        self,
+        seq_group_metadata: SequenceGroupMetadata,
+        input_tokens: List[int],
+        input_positions: List[int],
+        slot_mapping: List[int],
+        lora_index_mapping: List[int],
+        lora_prompt_mapping: List[int],
+        lora_requests: Set[LoRARequest],
+        context_lens: List[int],
+        subquery_lens: List[int],
+        prefix_block_tables: List[List[int]],
+        attn_prompt_lens: List[int],
+    ) -> None:
+        """Add the sequences of a decoding sequence group to a prompt batch.
+
+        Every sequence contributes its last token as a subquery of length 1
+        that attends to the rest of the sequence in the KV cache.
+        """
+        lora_id = seq_group_metadata.lora_int_id
+        if lora_id > 0:
+            lora_requests.add(seq_group_metadata.lora_request)
+
+        for seq_id, seq_data in seq_group_metadata.seq_data.items():
+            seq_len = seq_data.get_len()
+            position = seq_len - 1
+            input_tokens.append(seq_data.get_last_token_id())
+            input_positions.append(position)
+
+            block_table = seq_group_metadata.block_tables[seq_id]
+            block_number = block_table[position // self.block_size]
+            block_offset = position % self.block_size
+            slot_mapping.append(block_number * self.block_size + block_offset)
+
+            context_lens.append(position)
+            subquery_lens.append(1)
+            attn_prompt_lens.append(seq_len)
+            prefix_block_tables.append(block_table)
+            lora_index_mapping.append(lora_id)
+            lora_prompt_mapping.append(lora_id)
+
+    def release_decode_rows(self, keep: Iterable[int] = ()) -> None:
+        """Frees the rows of the decode input buffers of the sequences that
+        are not in keep, for the steps that do not prepare a decode batch."""
+        if self.decode_buffers is not None:
+            self.decode_buffers.release_rows(keep)
+
     def _prepare_decode(
         self,
         seq_group_metadata_list: List[SequenceGroupMetadata],
     ) -> Tuple[torch.Tensor, torch.Tensor, AttentionMetadata, List[int],
                List[int], Set[LoRARequest]]:
         assert len(seq_group_metadata_list) > 0
-        input_tokens: List[int] = []
-        input_positions: List[int] = []
-        slot_mapping: List[int] = []
-        context_lens: List[int] = []
+        seq_ids: List[int] = []
+        seq_lens: List[int] = []
+        last_token_ids: List[int] = []
         block_tables: List[List[int]] = []
         lora_index_mapping: List[int] = []
         lora_prompt_mapping: List[int] = []
@@ -353,44 +429,26 @@ class ModelRunner:
             assert not seq_group_metadata.is_prompt
             assert seq_group_metadata.token_chunk_size == 1
 
-            seq_ids = list(seq_group_metadata.seq_data.keys())
             lora_id = seq_group_metadata.lora_int_id
 
             if lora_id > 0:
                 lora_requests.add(seq_group_metadata.lora_request)
 
-            for seq_id in seq_ids:
-                seq_data = seq_group_metadata.seq_data[seq_id]
-                generation_token = seq_data.get_last_token_id()
-                input_tokens.append(generation_token)
-
-                seq_len = seq_data.get_len()
-                position = seq_len - 1
-                input_positions.append(position)
-
-                context_len = seq_len if self.sliding_window is None else min(
-                    seq_len, self.sliding_window)
-                context_lens.append(context_len)
-
-                block_table = seq_group_metadata.block_tables[seq_id]
-                block_number = block_table[position // self.block_size]
-                block_offset = position % self.block_size
-                slot = block_number * self.block_size + block_offset
-                slot_mapping.append(slot)
+            for seq_id, seq_data in seq_group_metadata.seq_data.items():
+                seq_ids.append(seq_id)
+                seq_lens.append(seq_data.get_len())
+                last_token_ids.append(seq_data.get_last_token_id())
+                block_tables.append(seq_group_metadata.block_tables[seq_id])
                 lora_index_mapping.append(lora_id)
                 lora_prompt_mapping.append(lora_id)
 
-                if self.sliding_window is not None:
-                    sliding_window_blocks = (self.sliding_window //
-                                             self.block_size)
-                    block_table = block_table[-sliding_window_blocks:]
-                block_tables.append(block_table)
-
         # vLLM uses cuda graph only for decoding requests.
         # See `capture_model` API for more details.
         # For decoding requests, batch_size == input_tokens.
-        batch_size = len(input_tokens)
-        max_context_len = max(context_lens)
+        batch_size = len(seq_ids)
+        max_context_len = max(seq_lens)
+        if self.sliding_window is not None:
+            max_context_len = min(max_context_len, self.sliding_window)
         use_captured_graph = (
             not self.model_config.enforce_eager
             and batch_size <= _BATCH_SIZES_TO_CAPTURE[-1]
@@ -398,52 +456,29 @@ class ModelRunner:
         if use_captured_graph:
             graph_batch_size = _get_graph_batch_size(batch_size)
             assert graph_batch_size >= batch_size
-            for _ in range(graph_batch_size - batch_size):
-                input_tokens.append(0)
-                input_positions.append(0)
-                slot_mapping.append(_PAD_SLOT_ID)
-                context_lens.append(1)
-                block_tables.append([])
-                lora_index_mapping.append(0)
+            lora_index_mapping.extend([0] * (graph_batch_size - batch_size))
             batch_size = graph_batch_size
 
-        input_tokens = torch.tensor(input_tokens,
-                                    dtype=torch.long,
-                                    device=self.device)
-        input_positions = torch.tensor(input_positions,
-                                       dtype=torch.long,
-                                       device=self.device)
-        slot_mapping = torch.tensor(slot_mapping,
-                                    dtype=torch.long,
-                                    device=self.device)
-        context_lens = torch.tensor(context_lens,
-                                    dtype=torch.int,
-                                    device=self.device)
-
-        if use_captured_graph:
-            # When using cuda-graph all these tensors should be
-            # padded.
-            assert context_lens.shape[0] == input_tokens.shape[0]
-            assert context_lens.shape[0] == input_positions.shape[0]
-            assert context_lens.shape[0] == slot_mapping.shape[0]
-
-            # The shape of graph_block_tables is
-            # [max batch size, max context len // block size].
-            input_block_tables = self.graph_block_tables[:batch_size]
-            for i, block_table in enumerate(block_tables):
-                if block_table:
-                    input_block_tables[i, :len(block_table)] = block_table
-            block_tables = torch.tensor(input_block_tables, device=self.device)
-        else:
-            max_block_table_len = max(
-                len(block_table) for block_table in block_tables)
-            block_tables = make_tensor_with_pad(
-                block_tables,
-                max_len=max_block_table_len,
-                pad=0,
-                dtype=torch.int,
-                device=self.device,
-            )
+        # When using cuda-graph all the tensors are padded to the captured
+        # batch size, and the block tables to max_context_len_to_capture.
+        if self.decode_buffers is None:
+            self.decode_buffers = DecodeInputBuffers(self.block_size,
+                                                     self.sliding_window,
+                                                     self.pin_memory)
+        buffers = self.decode_buffers.prepare(
+            seq_ids,
+            block_tables,
+            seq_lens,
+            last_token_ids,
+            batch_size,
+            block_table_width=(self.get_max_block_per_batch()
+                               if use_captured_graph else None))
+        tensors = self.decode_buffers.to_device(buffers, self.device)
+        input_tokens = tensors["input_tokens"]
+        input_positions = tensors["input_positions"]
+        slot_mapping = tensors["slot_mapping"]
+        context_lens = tensors["context_lens"]
+        block_tables = tensors["block_tables"]
 
         attn_metadata = self.attn_backend.make_metadata(
             is_prompt=False,
@@ -570,7 +605,9 @@ class ModelRunner:
                Set[int], LoRAMapping, torch.Tensor]:
         if self.is_driver_worker:
             # NOTE: We assume that all sequences in the group are all prompts or
-            # all decodes.
+            # all decodes, unless chunked prefill is enabled. In that case, the
+            # prompts come first and the decodes are batched into the prompt
+            # run.
             is_prompt = seq_group_metadata_list[0].is_prompt
             # Prepare input tensors.
             if is_prompt:
@@ -608,9 +645,14 @@ class ModelRunner:
                 "multi_modal_input": multi_modal_input,
             }
             metadata_dict.update(attn_metadata.asdict_zerocopy())
-            broadcast_tensor_dict(metadata_dict, src=0)
+            if not is_prompt:
+                # Send the host buffers of the decoding inputs instead of
+                # their device copies, which lets the channel send the block
+                # tables as a delta.
+                metadata_dict.update(self.decode_buffers.host_inputs)
+            self.metadata_channel.broadcast(metadata_dict)
         else:
-            metadata_dict = broadcast_tensor_dict(src=0)
+            metadata_dict = self.metadata_channel.broadcast()
             input_tokens = metadata_dict.pop("input_tokens")
             input_positions = metadata_dict.pop("input_positions")
             selected_token_indices = metadata_dict.pop(
@@ -638,10 +680,18 @@ class ModelRunner:
         self,
         seq_group_metadata_list: Optional[List[SequenceGroupMetadata]],
         kv_caches: List[torch.Tensor],
+        time_phases: bool = False,
     ) -> Optional[SamplerOutput]:
+        prepare_start = time.perf_counter()
         (input_tokens, input_positions, attn_metadata, sampling_metadata,
          lora_requests, lora_mapping, multi_modal_input
          ) = self.prepare_input_tensors(seq_group_metadata_list)
+        prepare_time = time.perf_counter() - prepare_start
+        # Only the driver worker reports the phase times. Timing them on the
+        # device synchronizes with it, so it is only done when asked for.
+        time_phases = time_phases and sampling_metadata.perform_sampling
+        if time_phases:
+            forward_start = get_device_timestamp(self.device)
 
         if self.lora_config:
             self.set_active_loras(lora_requests, lora_mapping)
@@ -668,18 +718,31 @@ class ModelRunner:
         # Only perform sampling in the driver worker.
         if not sampling_metadata.perform_sampling:
             return None
+        if time_phases:
+            forward_end = get_device_timestamp(self.device)
 
         # Sample the next token.
         output = self.model.sample(
             logits=logits,
             sampling_metadata=sampling_metadata,
         )
+        output.phase_times = {"prepare": prepare_time}
+        if time_phases:
+            sample_end = get_device_timestamp(self.device)
+            output.phase_times["forward"] = get_elapsed_time(
+                forward_start, forward_end)
+            output.phase_times["sample"] = get_elapsed_time(
+                forward_end, sample_end)
         return output
 
     @torch.inference_mode()
     def profile_run(self) -> None:
-        # Enable top-k sampling to reflect the accurate memory usage.
-        sampling_params = SamplingParams(top_p=0.99, top_k=self.vocab_size - 1)
+        # Enable top-k sampling and penalties to reflect the accurate memory
+        # usage. With penalties, the sampler keeps vocab-sized token counts
+        # on the device for each sequence.
+        sampling_params = SamplingParams(top_p=0.99,
+                                         top_k=self.vocab_size - 1,
+                                         repetition_penalty=1.1)
         max_num_batched_tokens = self.scheduler_config.max_num_batched_tokens
         max_num_seqs = self.scheduler_config.max_num_seqs
 
@@ -769,6 +832,13 @@ class ModelRunner:
             raise RuntimeError("LoRA is not enabled.")
         return self.lora_manager.list_loras()
 
+    def save_sharded_state(self, path: str) -> None:
+        if self.lora_manager:
+            # The LoRA layers wrap the layers of the model.
+            raise RuntimeError(
+                "Cannot save a sharded checkpoint when LoRA is enabled.")
+        save_sharded_state(self.model, path)
+
     @torch.inference_mode()
     def capture_model(self, kv_caches: List[torch.Tensor]) -> None:
         """Cuda graph capture a model.
@@ -979,6 +1049,205 @@ def _maybe_pynccl():
         yield
 
 
+class DecodeInputBuffers:
+    """Persistent host buffers for the inputs of decoding steps.
+
+    The block tables of the running sequences are mirrored in a 2D array
+    with one row per sequence, which stays assigned to the sequence for as
+    long as it keeps decoding. While a sequence decodes, its block table only
+    changes by appending tokens, i.e. the last block may be replaced (copy on
+    write) and new blocks are appended. So each step only writes the entries
+    from the previous last block on, and the batch is gathered from the rows
+    with numpy.
+
+    A sequence that misses a decoding step gives up its row and is written
+    from scratch when it decodes again, since its block table may have been
+    rebuilt in between, e.g. when it was preempted and recomputed or swapped
+    back in. prepare() frees the rows of the sequences missing from its
+    batch, and the steps that do not go through prepare() must call
+    release_rows() for the sequences that do not decode in them.
+
+    The batch inputs are staged in pinned buffers that are reused across
+    steps and copied to the device with non-blocking copies.
+    """
+
+    def __init__(self, block_size: int, sliding_window: Optional[int],
+                 pin_memory: bool):
+        self.block_size = block_size
+        self.sliding_window_blocks = (sliding_window // block_size
+                                      if sliding_window is not None else None)
+        self.sliding_window = sliding_window
+        self.pin_memory = pin_memory
+
+        # Mirrored block tables. Entries past the length of a row are stale.
+        self.rows = np.zeros((0, 0), dtype=np.int32)
+        self.row_lens: List[int] = []
+        self.seq_rows: Dict[int, int] = {}
+        self.free_rows: List[int] = []
+
+        # Staging buffers, as (tensor, numpy view) pairs.
+        self._staging: Dict[str, Tuple[torch.Tensor, np.ndarray]] = {}
+        # The numpy views of the staging buffers of the last batch.
+        self.host_inputs: Dict[str, np.ndarray] = {}
+        # Event recorded after the copies of the staging buffers, which must
+        # be done before they are overwritten.
+        self._copy_done: Optional[torch.cuda.Event] = None
+
+    def _grow_rows(self, num_rows: int, num_cols: int) -> None:
+        old_rows, old_cols = self.rows.shape
+        num_rows = max(num_rows, old_rows)
+        num_cols = max(num_cols, old_cols)
+        rows = np.zeros((num_rows, num_cols), dtype=np.int32)
+        rows[:old_rows, :old_cols] = self.rows
+        self.rows = rows
+        self.row_lens.extend([0] * (num_rows - old_rows))
+        self.free_rows.extend(range(num_rows - 1, old_rows - 1, -1))
+
+    def release_rows(self, keep: Iterable[int] = ()) -> None:
+        """Frees the rows of all the sequences except those in keep."""
+        keep = set(keep)
+        for seq_id in [s for s in self.seq_rows if s not in keep]:
+            self.free_rows.append(self.seq_rows.pop(seq_id))
+
+    def update_block_tables(self, seq_ids: List[int],
+                            block_tables: List[List[int]]) -> List[int]:
+        """Updates the mirrored block tables and returns the row of each
+        sequence."""
+        active = set(seq_ids)
+        self.release_rows(keep=active)
+
+        num_new_seqs = len(active) - len(self.seq_rows)
+        max_len = max(len(block_table) for block_table in block_tables)
+        if (len(self.free_rows) < num_new_seqs
+                or max_len > self.rows.shape[1]):
+            self._grow_rows(max(2 * self.rows.shape[0], len(active)),
+                            max(2 * self.rows.shape[1], max_len))
+
+        rows = self.rows
+        row_lens = self.row_lens
+        row_ids: List[int] = []
+        for seq_id, block_table in zip(seq_ids, block_tables):
+            num_blocks = len(block_table)
+            row = self.seq_rows.get(seq_id)
+            if row is None:
+                row = self.free_rows.pop()
+                self.seq_rows[seq_id] = row
+                start = 0
+            else:
+                start = max(row_lens[row] - 1, 0)
+            if num_blocks - start == 1:
+                rows[row, start] = block_table[start]
+            elif num_blocks > start:
+                rows[row, start:num_blocks] = block_table[start:]
+            row_lens[row] = num_blocks
+            row_ids.append(row)
+        return row_ids
+
+    def _get_staging(self, name: str, shape: Tuple[int, ...],
+                     dtype: torch.dtype) -> np.ndarray:
+        """Returns a zero-filled, contiguous numpy view of a staging
+        buffer."""
+        numel = int(np.prod(shape))
+        tensor, array = self._staging.get(name, (None, None))
+        if tensor is None or tensor.numel() < numel:
+            capacity = numel if tensor is None else max(
+                numel, 2 * tensor.numel())
+            tensor = torch.empty(capacity,
+                                 dtype=dtype,
+                                 pin_memory=self.pin_memory)
+            array = tensor.numpy()
+            self._staging[name] = (tensor, array)
+        view = array[:numel].reshape(shape)
+        view.fill(0)
+        return view
+
+    def prepare(
+        self,
+        seq_ids: List[int],
+        block_tables: List[List[int]],
+        seq_lens: List[int],
+        last_token_ids: List[int],
+        batch_size: int,
+        block_table_width: Optional[int],
+    ) -> Dict[str, np.ndarray]:
+        """Writes the inputs of a decoding batch into the staging buffers.
+
+        The batch is padded to batch_size. The block tables are padded to
+        block_table_width, or to the longest block table if None.
+
+        Returns:
+            The numpy views of the staging buffers.
+        """
+        if self._copy_done is not None:
+            self._copy_done.synchronize()
+            self._copy_done = None
+
+        num_seqs = len(seq_ids)
+        row_ids = np.asarray(self.update_block_tables(seq_ids, block_tables),
+                             dtype=np.int64)
+        seq_lens_np = np.asarray(seq_lens, dtype=np.int64)
+        positions = seq_lens_np - 1
+        row_lens = np.asarray([len(table) for table in block_tables],
+                              dtype=np.int64)
+
+        # Block tables of the batch, with only the last blocks within the
+        # sliding window.
+        if self.sliding_window_blocks is not None:
+            starts = np.maximum(row_lens - self.sliding_window_blocks, 0)
+        else:
+            starts = np.zeros(num_seqs, dtype=np.int64)
+        lens = row_lens - starts
+        if block_table_width is None:
+            block_table_width = int(lens.max())
+        cols = starts[:, None] + np.arange(block_table_width)[None, :]
+        in_table = cols < (starts + lens)[:, None]
+        np.minimum(cols, self.rows.shape[1] - 1, out=cols)
+
+        buffers = {
+            "input_tokens":
+            self._get_staging("input_tokens", (batch_size, ), torch.long),
+            "input_positions":
+            self._get_staging("input_positions", (batch_size, ), torch.long),
+            "slot_mapping":
+            self._get_staging("slot_mapping", (batch_size, ), torch.long),
+            "context_lens":
+            self._get_staging("context_lens", (batch_size, ), torch.int),
+            "block_tables":
+            self._get_staging("block_tables", (batch_size, block_table_width),
+                              torch.int),
+        }
+        buffers["input_tokens"][:num_seqs] = last_token_ids
+        buffers["input_positions"][:num_seqs] = positions
+        block_numbers = self.rows[row_ids, positions // self.block_size]
+        buffers["slot_mapping"][:num_seqs] = (block_numbers * self.block_size +
+                                              positions % self.block_size)
+        buffers["slot_mapping"][num_seqs:] = _PAD_SLOT_ID
+        context_lens = (seq_lens_np if self.sliding_window is None else
+                        np.minimum(seq_lens_np, self.sliding_window))
+        buffers["context_lens"][:num_seqs] = context_lens
+        buffers["context_lens"][num_seqs:] = 1
+        np.copyto(buffers["block_tables"][:num_seqs],
+                  self.rows[row_ids[:, None], cols],
+                  where=in_table)
+        self.host_inputs = buffers
+        return buffers
+
+    def to_device(self, buffers: Dict[str, np.ndarray],
+                  device: torch.device) -> Dict[str, torch.Tensor]:
+        """Copies the staging buffers returned by prepare() to the device."""
+        tensors = {}
+        for name, array in buffers.items():
+            src = torch.from_numpy(array)
+            tensors[name] = torch.empty(src.shape,
+                                        dtype=src.dtype,
+                                        device=device).copy_(src,
+                                                             non_blocking=True)
+        if torch.device(device).type == "cuda":
+            self._copy_done = torch.cuda.Event()
+            self._copy_done.record()
+        return tensors
+
+
 def _get_graph_batch_size(batch_size: int) -> int:
     """Returns the padded batch size given actual batch size.
 
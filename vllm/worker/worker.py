@@ -1,22 +1,25 @@
 """A GPU worker class."""
+import copy
 import gc
 import os
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import torch
 import torch.distributed
 
 from vllm.config import (CacheConfig, DeviceConfig, LoRAConfig, ModelConfig,
                          ParallelConfig, SchedulerConfig, VisionLanguageConfig)
+from vllm.engine.stop_checker import StopChecker
 from vllm.lora.request import LoRARequest
 from vllm.model_executor import set_random_seed
 from vllm.model_executor.parallel_utils import pynccl_utils
-from vllm.model_executor.parallel_utils.communication_op import (
-    broadcast_tensor_dict)
 from vllm.model_executor.parallel_utils.custom_all_reduce import init_custom_ar
+from vllm.model_executor.parallel_utils.metadata_channel import MetadataChannel
 from vllm.model_executor.parallel_utils.parallel_state import (
     ensure_model_parallel_initialized)
-from vllm.sequence import SamplerOutput, SequenceGroupMetadata
+from vllm.sequence import (SamplerOutput, SequenceGroupMetadata,
+                           SequenceGroupOutput)
+from vllm.utils import get_device_timestamp, get_elapsed_time
 from vllm.worker.cache_engine import CacheEngine
 from vllm.worker.model_runner import ModelRunner
 
@@ -69,6 +72,8 @@ class Worker:
             kv_cache_dtype=kv_cache_dtype,
             is_driver_worker=is_driver_worker,
             vision_language_config=vision_language_config)
+        # Broadcasts the swaps and copies of the steps to the other workers.
+        self.metadata_channel = MetadataChannel()
         # Uninitialized cache engine. Will be initialized by
         # self.init_cache_engine().
         self.cache_config = None
@@ -176,11 +181,13 @@ class Worker:
         blocks_to_copy: Dict[int, List[int]],
     ) -> None:
         # Issue cache operations.
-        # TODO(woosuk): Profile swapping overhead and optimize if needed.
-        if blocks_to_swap_in:
-            self.cache_engine.swap_in(blocks_to_swap_in)
+        # NOTE: Swap out before swapping in. With CPU prefix caching, a GPU
+        # block that is copied to CPU memory may be overwritten by a swap in
+        # in the same step.
         if blocks_to_swap_out:
             self.cache_engine.swap_out(blocks_to_swap_out)
+        if blocks_to_swap_in:
+            self.cache_engine.swap_in(blocks_to_swap_in)
         if blocks_to_copy:
             self.cache_engine.copy(blocks_to_copy)
 
@@ -191,7 +198,17 @@ class Worker:
         blocks_to_swap_in: Optional[Dict[int, int]] = None,
         blocks_to_swap_out: Optional[Dict[int, int]] = None,
         blocks_to_copy: Optional[Dict[int, List[int]]] = None,
-    ) -> Optional[SamplerOutput]:
+        num_steps: int = 1,
+        time_phases: bool = False,
+    ) -> Optional[Union[SamplerOutput, List[SamplerOutput]]]:
+        """Executes the model on the sequence groups.
+
+        With num_steps > 1, the sequence groups must all be decoding, and
+        have enough slots for the tokens of every step. Returns the outputs
+        of each step, see _execute_model_multi_step(). With time_phases,
+        the phases of the steps are timed on the device, see
+        ModelRunner.execute_model().
+        """
         if self.is_driver_worker:
             assert seq_group_metadata_list is not None
             num_seq_groups = len(seq_group_metadata_list)
@@ -203,24 +220,142 @@ class Worker:
                 "blocks_to_swap_in": blocks_to_swap_in,
                 "blocks_to_swap_out": blocks_to_swap_out,
                 "blocks_to_copy": blocks_to_copy,
+                "num_steps": num_steps,
             }
-            broadcast_tensor_dict(data, src=0)
+            self.metadata_channel.broadcast(data)
         else:
-            data = broadcast_tensor_dict(src=0)
+            data = self.metadata_channel.broadcast()
             num_seq_groups = data["num_seq_groups"]
             blocks_to_swap_in = data["blocks_to_swap_in"]
             blocks_to_swap_out = data["blocks_to_swap_out"]
             blocks_to_copy = data["blocks_to_copy"]
-
+            num_steps = data["num_steps"]
+
+        # The swap time is reported to the scheduler, which uses it to choose
+        # between swapping and recomputing the preempted sequences. Only the
+        # driver worker, which is asked to time the phases, reports it.
+        time_swap = time_phases and bool(blocks_to_swap_in
+                                         or blocks_to_swap_out)
+        if time_swap:
+            swap_start = get_device_timestamp(self.device)
         self.cache_swap(blocks_to_swap_in, blocks_to_swap_out, blocks_to_copy)
+        if time_swap:
+            swap_end = get_device_timestamp(self.device)
 
         # If there is no input, we don't need to execute the model.
         if num_seq_groups == 0:
+            # No sequence decodes in this step, e.g. when all the running
+            # sequences are swapped out, so none keeps its decode buffer row.
+            self.model_runner.release_decode_rows()
+            # Otherwise, the outputs synchronize with the swaps.
+            self.cache_engine.synchronize()
             return {}
 
-        output = self.model_runner.execute_model(seq_group_metadata_list,
-                                                 self.gpu_cache)
-        return output
+        if num_steps > 1:
+            outputs = self._execute_model_multi_step(seq_group_metadata_list,
+                                                     num_steps, time_phases)
+            output = outputs[0] if outputs else None
+        else:
+            output = self.model_runner.execute_model(seq_group_metadata_list,
+                                                     self.gpu_cache,
+                                                     time_phases)
+            outputs = output
+        if (time_swap and output is not None
+                and output.phase_times is not None):
+            output.phase_times["swap"] = get_elapsed_time(swap_start, swap_end)
+        return outputs
+
+    def _execute_model_multi_step(
+        self,
+        seq_group_metadata_list: Optional[List[SequenceGroupMetadata]],
+        num_steps: int,
+        time_phases: bool = False,
+    ) -> List[SamplerOutput]:
+        """Runs up to num_steps decoding steps, feeding the tokens sampled by
+        a step to the next one, without returning to the engine.
+
+        The sequence groups whose sequences are all stopped by their length
+        or their last token, as checked by the engine with
+        StopChecker.get_token_stop_status(), are not run in the next steps,
+        and the loop exits early once they are all stopped. The output of a
+        step has an entry per sequence group, which is empty for the groups
+        that were not run. The engine discards the tokens sampled after the
+        stops it detects itself, e.g. stop strings.
+
+        Returns the outputs of the steps on the driver worker, and an empty
+        list on the other workers.
+        """
+        if self.is_driver_worker:
+            assert seq_group_metadata_list is not None
+            # The engine owns the sequence data, which it updates itself.
+            seq_group_metadata_list = _copy_seq_group_metadata_list(
+                seq_group_metadata_list)
+            stop_checkers = [
+                StopChecker(seq_group_metadata.sampling_params,
+                            seq_group_metadata.sampling_params.eos_token_id)
+                for seq_group_metadata in seq_group_metadata_list
+            ]
+            active = list(range(len(seq_group_metadata_list)))
+        outputs: List[SamplerOutput] = []
+        for step in range(num_steps):
+            if step > 0:
+                # Tell the other workers whether to run the next step.
+                if self.is_driver_worker:
+                    self.metadata_channel.broadcast(
+                        {"num_seq_groups": len(active)})
+                    num_active = len(active)
+                else:
+                    data = self.metadata_channel.broadcast()
+                    num_active = data["num_seq_groups"]
+                if num_active == 0:
+                    break
+
+            if not self.is_driver_worker:
+                self.model_runner.execute_model(None, self.gpu_cache)
+                continue
+            output = self.model_runner.execute_model(
+                [seq_group_metadata_list[i] for i in active], self.gpu_cache,
+                time_phases)
+            active = self._append_step_output(seq_group_metadata_list,
+                                              stop_checkers, active, output)
+            outputs.append(output)
+        return outputs
+
+    def _append_step_output(
+        self,
+        seq_group_metadata_list: List[SequenceGroupMetadata],
+        stop_checkers: List[StopChecker],
+        active: List[int],
+        output: SamplerOutput,
+    ) -> List[int]:
+        """Appends the tokens sampled by a step of the active sequence groups
+        to their sequences, and expands the output to all sequence groups.
+
+        Returns the sequence groups to run in the next step.
+        """
+        group_outputs = [
+            SequenceGroupOutput(samples=[], prompt_logprobs=None)
+            for _ in seq_group_metadata_list
+        ]
+        next_active: List[int] = []
+        for i, group_output in zip(active, output.outputs):
+            group_outputs[i] = group_output
+            seq_group_metadata = seq_group_metadata_list[i]
+            is_stopped = True
+            # Beam search is not supported, so each sequence is continued by
+            # its own sample.
+            for sample in group_output.samples:
+                seq_data = seq_group_metadata.seq_data[sample.parent_seq_id]
+                token_id = sample.output_token
+                seq_data.append_token_id(token_id,
+                                         sample.logprobs[token_id].logprob)
+                if stop_checkers[i].get_token_stop_status(
+                        seq_data, self.model_config.max_model_len) is None:
+                    is_stopped = False
+            if not is_stopped:
+                next_active.append(i)
+        output.outputs = group_outputs
+        return next_active
 
     def add_lora(self, lora_request: LoRARequest) -> bool:
         return self.model_runner.add_lora(lora_request)
@@ -231,6 +366,9 @@ class Worker:
     def list_loras(self) -> Set[int]:
         return self.model_runner.list_loras()
 
+    def save_sharded_state(self, path: str) -> None:
+        self.model_runner.save_sharded_state(path)
+
     @property
     def max_model_len(self) -> int:
         return self.model_config.max_model_len
@@ -248,6 +386,23 @@ class Worker:
                                                 self.parallel_config)
 
 
+def _copy_seq_group_metadata_list(
+    seq_group_metadata_list: List[SequenceGroupMetadata]
+) -> List[SequenceGroupMetadata]:
+    """Copies the sequence group metadata and their sequence data, so that
+    tokens can be appended without side effects. A copy of the sequence data
+    has its own token ids."""
+    new_seq_group_metadata_list: List[SequenceGroupMetadata] = []
+    for seq_group_metadata in seq_group_metadata_list:
+        seq_group_metadata = copy.copy(seq_group_metadata)
+        seq_group_metadata.seq_data = {
+            seq_id: copy.copy(seq_data)
+            for seq_id, seq_data in seq_group_metadata.seq_data.items()
+        }
+        new_seq_group_metadata_list.append(seq_group_metadata)
+    return new_seq_group_metadata_list
+
+
 def init_distributed_environment(
     parallel_config: ParallelConfig,
     rank: int,